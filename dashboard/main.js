@@ -1,6 +1,38 @@
-var json_file = "web_summary.json";
-var alldata = {};
+// Task summaries are sharded (see StatsParser.make_dashboard):
+//   data/version.json        polled, tiny
+//   data/index.json          general info (progress) for every task
+//   data/tasks/<id>.json     details, only fetched when a task is expanded
+//   data/history/<id>.json   history, only fetched for the chart
+// each with a pre-gzipped .gz copy next to it.
+var data_dir = "data/";
+var legacy_json_file = "web_summary.json";
+var poll_interval_ms = 2*60*1000;
+
+var alldata = {"tasks": []};
+var currentVersion = null;
 var detailsVisible = false;
+var darkMode = false;
+var adminMode = false;
+var colorTheme = 0;
+
+// per task id
+var details = {};
+var histories = {};
+var expanded = {};
+var heights = {};
+
+// list virtualization: only the tasks in (or near) the viewport are in the DOM
+var visibleTasks = [];
+var offsets = [];
+var totalHeight = 0;
+var rowHeightEstimate = 25;
+var detailsHeightEstimate = 300;
+var overscan = 15;
+var renderPending = false;
+
+var sortWhich = null;
+var sortReverse = false;
+var badgeFilter = null;
 
 google.charts.load('current', {'packages':['corechart']});
 google.charts.setOnLoadCallback(function() {console.log("google loaded!");});
@@ -9,15 +41,6 @@ function getEscapedTaskID(dsname, tag) {
     return dsname.replace(/\//g,"_")+"_"+tag.replace(/\ /g,"_").replace(/\./g,"p");
 }
 
-Array.prototype.sum2 = function (prop, prop2) {
-    // So you can do array.sum(keyname)
-    var total = 0;
-    for ( var i = 0, _len = this.length; i < _len; i++ ) {
-        total += this[i][prop][prop2];
-    }
-    return total;
-}
-
 function getProgress(general) {
     var type = general["type"];
     var stat = general["status"];
@@ -49,209 +72,354 @@ function syntaxHighlight(json) {
         } else if (/null/.test(match)) {
             cls = 'null';
         }
-        return '<span class="has-dark ' + cls + '">' + match + '</span>';
+        return '<span class="has-dark ' + (darkMode ? 'dark ' : '') + cls + '">' + match + '</span>';
     });
 }
 
+function checkOK(response) {
+    if (!response.ok) throw new Error(response.status+" for "+response.url);
+    return response;
+}
+
+function fetchJSON(path) {
+    // "no-cache" makes the browser revalidate (ETag/If-Modified-Since), so
+    // unchanged files cost a 304 instead of a transfer
+    var opts = {cache: "no-cache"};
+    var fetchPlain = function() {
+        return fetch(path, opts).then(checkOK).then(function(r) { return r.json(); });
+    };
+    if (typeof DecompressionStream === "undefined") return fetchPlain();
+    return fetch(path+".gz", opts).then(checkOK).then(function(r) {
+        // the web server may have sent it with Content-Encoding: gzip, in which case the browser already decoded it
+        if (r.headers.get("Content-Encoding") == "gzip") return r.json();
+        return new Response(r.body.pipeThrough(new DecompressionStream("gzip"))).json();
+    }).catch(fetchPlain);
+}
+
 function loadJSON() {
-    $.getJSON(json_file, function(data) { 
-        if(!("tasks" in alldata) || (data["tasks"].length != alldata["tasks"].length)) {
-            console.log(data);
-            setUpDOM(data);
-        }
-        fillDOM(data); 
+    fetchJSON(data_dir+"version.json").then(function(ver) {
+        if (ver["version"] === currentVersion) return;
+        return fetchJSON(data_dir+"index.json").then(function(index) {
+            currentVersion = index["version"];
+            updateIndex(index);
+        });
+    }).catch(function(err) {
+        // no sharded summaries (older metis), so use the monolithic JSON
+        console.log(err);
+        $.getJSON(legacy_json_file, function(data) {
+            var tasks = [];
+            var shards = {"details": {}, "histories": {}};
+            for(var i = 0; i < data["tasks"].length; i++) {
+                var task = data["tasks"][i];
+                var id = getEscapedTaskID(task["general"]["dataset"], task["general"]["tag"]);
+                var task_details = $.extend(true, {}, task);
+                delete task_details["history"];
+                shards.details[id] = task_details;
+                shards.histories[id] = task["history"] || {};
+                tasks.push({"id": id, "general": task["general"], "digest": JSON.stringify(task_details)});
+            }
+            updateIndex({"tasks": tasks, "last_updated": data["last_updated"]}, shards);
+        });
     });
 }
 
-function setUpDOM(data) {
-    var container = $("#tasks-container");
-    container.empty(); // clear the section
-
-    for(var i = 0; i < data["tasks"].length; i++) {
-        var sample = data["tasks"][i];
-        var general = data["tasks"][i]["general"];
-        var id = getEscapedTaskID(general["dataset"],general["tag"]);
-        // console.log(id);
-
-        var sample_toshow = $.extend(true, {}, sample);
-        delete sample_toshow["history"];
-        var jsStr = syntaxHighlight(JSON.stringify(sample_toshow, undefined, 4));
-
-        // turn dataset into a DIS link
-        var link =  "http://uaf-7.t2.ucsd.edu/~namin/dis2/?type=basic&short=true&query="+general["dataset"];
-        var link_handler =  "http://uaf-7.t2.ucsd.edu:50010/dis/serve?type=basic&short=true&query="+general["dataset"];
-        jsStr = jsStr.replace("\"dataset\":", 
-            ` <a href="${link}" style="text-decoration: underline" title="<iframe src='${link_handler}' style='background-color: #fff; width:650px;'></iframe>" data-html="true" data-toggle="tooltip">dataset</a>: `
-        );
-        var typenotask = general["type"].replace("Task","");
-
-        var typebadge = "badge-primary";
-        if (Math.floor(getProgress(general).pct) < 100) {
-            typebadge = "badge-danger";
+function updateIndex(index, shards) {
+    var old_digests = {};
+    for(var i = 0; i < alldata["tasks"].length; i++) {
+        old_digests[alldata["tasks"][i]["id"]] = alldata["tasks"][i]["digest"];
+    }
+    for(var i = 0; i < index["tasks"].length; i++) {
+        var id = index["tasks"][i]["id"];
+        // drop shards of tasks that changed, they get re-fetched if they are needed again
+        if (old_digests[id] != index["tasks"][i]["digest"]) {
+            delete details[id];
+            delete histories[id];
         }
-        var content = `
-            <div id="${id}" data-type="${typenotask}" data-tag="${general['tag']}" class="task">
-                <div class="row task-text-row">
-                    <a href="#" data-which="type" class="badge task-badge has-dark ${typebadge}">${typenotask}</a>
-                    <a href="#" data-which="tag" class="badge task-badge badge-secondary">${general["tag"]}</a>
-                    <div class="progress has-dark">
-                        <div class="progress-bar" role="progressbar" aria-valuenow="0" aria-valuemin="0" aria-valuemax="100" style="width: 0%;">
-                        </div>
-                        <span class="progress-type"></span>
-                        <span title="" data-toggle="tooltip" class="progress-completed">0%</span>
-                    </div>
-                    <a href="#!" class="dataset-label badge badge-light has-dark">${general["dataset"]}</a>
-                </div>
-                <div class="row details has-dark" style="display:none;">${jsStr}</div>
-            </div>
-            `;
-        // console.log(content);
-        container.append(content);
-
     }
+    if (shards) {
+        $.extend(details, shards.details);
+        $.extend(histories, shards.histories);
+    }
+    alldata = index;
+    console.log("loaded "+index["tasks"].length+" tasks (version "+index["version"]+")");
+    fillDOM(alldata);
+    if ($('#chart').is(":visible")) doHistory();
+}
+
+function loadDetails(id) {
+    if (id in details) return Promise.resolve(details[id]);
+    return fetchJSON(data_dir+"tasks/"+id+".json").then(function(task) {
+        details[id] = task;
+        return task;
+    });
+}
 
+function loadHistory(id) {
+    if (id in histories) return Promise.resolve(histories[id]);
+    return fetchJSON(data_dir+"history/"+id+".json").then(function(history) {
+        histories[id] = history;
+        return history;
+    });
+}
 
+function isExpanded(id) {
+    return (id in expanded) ? expanded[id] : detailsVisible;
 }
 
-function fillDOM(data, theme=0) {
-    alldata = data;
-    // console.log("here: "+alldata);
+function getColor(general, theme) {
+    var pct = Math.floor(getProgress(general).pct);
+    var h = Math.round(pct*1.35,2);
+    var s = Math.round(75-0.01*pct*10 + 15.0*Math.max(1.0-(pct-33)*(pct-33)/4500.0, 0.0),0);
+    var v = Math.round(58-0.01*pct*14,0);
+    var color = `hsl(${h},${s}%,${v}%)`;
 
-    var date = new Date(data["last_updated"]*1000); // ms to s
-    var hours = date.getHours();
-    var minutes = "0" + date.getMinutes();
-    var seconds = "0" + date.getSeconds();
-    var formattedTime = hours + ':' + minutes.substr(-2) + ':' + seconds.substr(-2);
-    $("#last_updated").text("Last updated at " + date.toLocaleTimeString() + " on " + date.toLocaleDateString());
+    if (general["open_dataset"]) {
+        color = "#ffaa3b";
+    }
 
-    for(var i = 0; i < data["tasks"].length; i++) {
-
-        var sample = data["tasks"][i];
-        var bad = data["tasks"][i]["bad"] || {};
-        var general = data["tasks"][i]["general"];
-        var id = getEscapedTaskID(general["dataset"],general["tag"]);
-
-        var progress = getProgress(general);
-        var pct = Math.floor(progress.pct);
-        var pdiv = $("#"+id+" > .task-text-row > .progress")
-        var pbar = pdiv.find(".progress-bar");
-        var pleft = pdiv.find(".progress-type");
-        var pright = pdiv.find(".progress-completed");
-        var h = Math.round(pct*1.35,2);
-        var s = Math.round(75-0.01*pct*10 + 15.0*Math.max(1.0-(pct-33)*(pct-33)/4500.0, 0.0),0);
-        var v = Math.round(58-0.01*pct*14,0);
-        var color = `hsl(${h},${s}%,${v}%)`;
-
-        $("#"+id).attr("data-pct",progress.pct);
-        $("#"+id).attr("data-tag",general["tag"]);
-
-        if (general["open_dataset"]) {
-            color = "#ffaa3b";
-        }
-        // console.log(color);
-
-        if (theme == 1) {
-            // BLUE
-            if (pct > 6.0/7*100) color = "#039BE5";
-            else if (pct > 5.0/7*100) color = "#03A9F4";
-            else if (pct > 4.0/7*100) color = "#29B6F6";
-            else if (pct > 3.0/7*100) color = "#4FC3F7";
-            else if (pct > 2.0/7*100) color = "#81D4FA";
-            else if (pct > 1.0/7*100) color = "#B3E5FC";
-            else if (pct > 0.0/7*100) color = "#E1F5FE";
-        }
+    if (theme == 1) {
+        // BLUE
+        if (pct > 6.0/7*100) color = "#039BE5";
+        else if (pct > 5.0/7*100) color = "#03A9F4";
+        else if (pct > 4.0/7*100) color = "#29B6F6";
+        else if (pct > 3.0/7*100) color = "#4FC3F7";
+        else if (pct > 2.0/7*100) color = "#81D4FA";
+        else if (pct > 1.0/7*100) color = "#B3E5FC";
+        else if (pct > 0.0/7*100) color = "#E1F5FE";
+    }
 
-        if (theme == 2) {
-            // ORANGE
-            if      (pct > 9.0/10*100) color = "#FF6F00";
-            else if (pct > 8.0/10*100) color = "#FF8F00";
-            else if (pct > 7.0/10*100) color = "#FFA000";
-            else if (pct > 6.0/10*100) color = "#FFB300";
-            else if (pct > 5.0/10*100) color = "#FFC107";
-            else if (pct > 4.0/10*100) color = "#FFCA28";
-            else if (pct > 3.0/10*100) color = "#FFD54F";
-            else if (pct > 2.0/10*100) color = "#FFE082";
-            else if (pct > 1.0/10*100) color = "#FFECB3";
-            else if (pct > 0.0/10*100) color = "#FFF8E1";
-        }
+    if (theme == 2) {
+        // ORANGE
+        if      (pct > 9.0/10*100) color = "#FF6F00";
+        else if (pct > 8.0/10*100) color = "#FF8F00";
+        else if (pct > 7.0/10*100) color = "#FFA000";
+        else if (pct > 6.0/10*100) color = "#FFB300";
+        else if (pct > 5.0/10*100) color = "#FFC107";
+        else if (pct > 4.0/10*100) color = "#FFCA28";
+        else if (pct > 3.0/10*100) color = "#FFD54F";
+        else if (pct > 2.0/10*100) color = "#FFE082";
+        else if (pct > 1.0/10*100) color = "#FFECB3";
+        else if (pct > 0.0/10*100) color = "#FFF8E1";
+    }
+    return color;
+}
 
-        // console.log(color);
+function getDetailsHTML(id, general) {
+    if (!(id in details)) {
+        loadDetails(id).catch(function(err) {
+            // don't try again on every render
+            details[id] = {"error": "could not load "+data_dir+"tasks/"+id+".json"};
+        }).then(scheduleRender);
+        return "loading...";
+    }
+    var jsStr = syntaxHighlight(JSON.stringify(details[id], undefined, 4));
+
+    // turn dataset into a DIS link
+    var link =  "http://uaf-7.t2.ucsd.edu/~namin/dis2/?type=basic&short=true&query="+general["dataset"];
+    var link_handler =  "http://uaf-7.t2.ucsd.edu:50010/dis/serve?type=basic&short=true&query="+general["dataset"];
+    jsStr = jsStr.replace("\"dataset\":",
+        ` <a href="${link}" style="text-decoration: underline" title="<iframe src='${link_handler}' style='background-color: #fff; width:650px;'></iframe>" data-html="true" data-toggle="tooltip">dataset</a>: `
+    );
+    return jsStr;
+}
 
-        pbar.attr("aria-valuenow",pct);
-        if (general["open_dataset"]) {
-            pbar.addClass("progress-bar-striped");
-            // pbar.addClass("progress-bar-animated");
+function getTaskHTML(task, top) {
+    var id = task["id"];
+    var general = task["general"];
+    var dark = darkMode ? " dark" : "";
+    var typenotask = general["type"].replace("Task","");
+
+    var progress = getProgress(general);
+    var pct = Math.floor(progress.pct);
+    var typebadge = "badge-primary";
+    if (pct < 100) {
+        typebadge = "badge-danger";
+    }
+    var lightbadge = darkMode ? "badge-dark" : "badge-light";
+    var color = getColor(general, colorTheme);
+    var striped = general["open_dataset"] ? "progress-bar-striped" : "";
+
+    var rate = "";
+    if (adminMode) {
+        rate = "🛑✉️✂️";
+    } else if ("event_rate" in general && general["event_rate"] > 0) {
+        if (general["event_rate"] > 200) {
+            rate = "<small>"+Math.round(general["nevents_done"]/1.0e5)/10 + "M @ " + Math.round(general["event_rate"]/10,2)/100+" kHz"+"</small>";
+        } else {
+            rate = "<small>"+Math.round(general["nevents_done"]/1.0e5)/10 + "M @ " + general["event_rate"]+" Hz"+"</small>";
         }
-        // https://stackoverflow.com/questions/7069167/css-transition-not-firing
-        pbar.css('width');
-        pbar.css({
-            "width":pct+"%",
-            "background-color":color,
+    }
+    var completed = general["open_dataset"] ? "<small>open</small> "+pct+"%" : pct+"%";
+
+    var detailsDiv = "";
+    if (isExpanded(id)) {
+        detailsDiv = `<div class="row details has-dark${dark}">${getDetailsHTML(id, general)}</div>`;
+    }
+
+    return `
+        <div data-id="${id}" data-type="${typenotask}" data-tag="${general['tag']}" data-pct="${progress.pct}" class="task" style="top: ${top}px;">
+            <div class="row task-text-row">
+                <a href="#!" data-which="type" class="badge task-badge has-dark${dark} ${typebadge}">${typenotask}</a>
+                <a href="#!" data-which="tag" class="badge task-badge badge-secondary">${general["tag"]}</a>
+                <div class="progress has-dark${dark}">
+                    <div class="progress-bar ${striped}" role="progressbar" aria-valuenow="${pct}" aria-valuemin="0" aria-valuemax="100" style="width: ${pct}%; background-color: ${color};">
+                    </div>
+                    <span class="progress-type">${rate}</span>
+                    <span title="${progress.done}/${progress.total}" data-toggle="tooltip" class="progress-completed">${completed}</span>
+                </div>
+                <a href="#!" class="dataset-label badge ${lightbadge} has-dark${dark}">${general["dataset"]}</a>
+            </div>
+            ${detailsDiv}
+        </div>
+        `;
+}
+
+function compareTasks(a, b) {
+    var ka, kb;
+    if (sortWhich == "az") {
+        ka = a["id"]; kb = b["id"];
+    } else if (sortWhich == "pct") {
+        ka = getProgress(a["general"]).pct; kb = getProgress(b["general"]).pct;
+    } else if (sortWhich == "tag") {
+        ka = a["general"]["tag"]; kb = b["general"]["tag"];
+    } else if (sortWhich == "era") {
+        ka = a["id"].split("_Run")[1] || ""; kb = b["id"].split("_Run")[1] || "";
+    } else {
+        return 0;
+    }
+    return ka < kb ? -1 : (ka > kb ? 1 : 0);
+}
+
+function relayout() {
+    var tasks = alldata["tasks"].slice();
+    if (badgeFilter) {
+        tasks = tasks.filter(function(task) {
+            var general = task["general"];
+            var val = (badgeFilter.which == "type") ? general["type"].replace("Task","") : general["tag"];
+            return val == badgeFilter.val;
         });
-        if ("event_rate" in general && general["event_rate"] > 0) {
-            if (general["event_rate"] > 200) {
-                pleft.html("<small>"+Math.round(general["nevents_done"]/1.0e5)/10 + "M @ " + Math.round(general["event_rate"]/10,2)/100+" kHz"+"</small>");
-            } else {
-                // pleft.text(general["event_rate"]+" Hz"); 
-                pleft.html("<small>"+Math.round(general["nevents_done"]/1.0e5)/10 + "M @ " + general["event_rate"]+" Hz"+"</small>"); 
-            }
-        }
-        // pleft.css({
-        //     "color": "#fff",
-        // });
-        // pright.css({
-        //     "color": "#ffff",
-        // });
-        if (general["open_dataset"]) {
-            pright.html("<small>open</small> "+pct+"%");
+    }
+    if (sortWhich) tasks.sort(compareTasks);
+    if (sortReverse) tasks.reverse();
+    visibleTasks = tasks;
+
+    offsets = [];
+    var top = 0;
+    for(var i = 0; i < visibleTasks.length; i++) {
+        var id = visibleTasks[i]["id"];
+        offsets.push(top);
+        var measured = heights[id];
+        if (measured && measured.expanded === isExpanded(id)) {
+            top += measured.height;
         } else {
-            // pright.text(pct+"%");
-            pright.text(pct+"%");
+            top += rowHeightEstimate + (isExpanded(id) ? detailsHeightEstimate : 0);
         }
-        pright.attr({"title":progress.done + "/" + progress.total});
+    }
+    totalHeight = top;
+    $("#tasks-container").css("height", totalHeight+"px");
+
+    var ntasks = alldata["tasks"].length;
+    var nvis = visibleTasks.length;
+    if (nvis != ntasks) {
+        $("#nav-taskbadgefilter").text(`${ntasks-nvis} tasks hidden`);
+        $("#nav-taskbadgefilter").show();
+    } else {
+        $("#nav-taskbadgefilter").hide();
+    }
+    $("#nav-summary-ntasks").text(` (${nvis})`);
 
+    render();
+}
+
+function scheduleRender() {
+    if (renderPending) return;
+    renderPending = true;
+    window.requestAnimationFrame(function() {
+        renderPending = false;
+        render();
+    });
+}
+
+function render() {
+    var container = $("#tasks-container");
+    var viewTop = $(window).scrollTop() - container.offset().top;
+    var viewBottom = viewTop + $(window).height();
+
+    // binary search for the first task that reaches into the viewport
+    var lo = 0, hi = offsets.length;
+    while (lo < hi) {
+        var mid = (lo+hi) >> 1;
+        var bottom = (mid+1 < offsets.length) ? offsets[mid+1] : totalHeight;
+        if (bottom < viewTop) lo = mid+1;
+        else hi = mid;
     }
+    var first = Math.max(lo-overscan, 0);
+    var last = lo;
+    while (last < offsets.length && offsets[last] < viewBottom) last++;
+    last = Math.min(last+overscan, offsets.length);
+
+    var buff = "";
+    for(var i = first; i < last; i++) {
+        buff += getTaskHTML(visibleTasks[i], offsets[i]);
+    }
+    container.html(buff);
+
+    // measure what was rendered and fix up the layout if the estimates were off
+    var changed = false;
+    container.children(".task").each(function() {
+        var id = $(this).attr("data-id");
+        var idx = $(this).index();
+        var height = $(this).outerHeight(true);
+        var assumed = ((first+idx+1 < offsets.length) ? offsets[first+idx+1] : totalHeight) - offsets[first+idx];
+        if (Math.abs(assumed - height) > 1) changed = true;
+        heights[id] = {height: height, expanded: isExpanded(id)};
+    });
+    afterRender();
+    if (changed) relayout();
+}
 
-    showAllTasks();
-    updateSummary(data);
-    afterFillDOM();
+function fillDOM(data, theme) {
+    if (theme !== undefined) colorTheme = theme;
+
+    var date = new Date(data["last_updated"]*1000); // ms to s
+    $("#last_updated").text("Last updated at " + date.toLocaleTimeString() + " on " + date.toLocaleDateString());
 
+    relayout();
+    updateSummary(data);
 }
 
-function afterFillDOM() {
+function afterRender() {
 
     // enable tooltips
-    $('[data-toggle="tooltip"]').tooltip();
+    $('#tasks-container [data-toggle="tooltip"]').tooltip();
 
     // clicking on the dataset name toggles the corresponding details panel
     $('.dataset-label').unbind().click(function() {
-        $(this).parent().parent().find(".details").slideToggle(100);
+        var id = $(this).parent().parent().attr("data-id");
+        expanded[id] = !isExpanded(id);
+        relayout();
     });
 
     // clicking on a task badge (right now, either the task type or task tag)
     // will show only tasks with the same type or tag. click again to revert.
     $(".task-badge").unbind().click(function() {
         var which = $(this).data("which");
-        var val = $(this).text().replace(/\./g,"\\.");
-        $(`.task[data-${which}!=${val}]`).toggle();
-        var nvis = $.unique($(".task-badge:visible").parent()).length;
-        var ntasks = $(".task").length;
-        if (nvis != ntasks) {
-            $("#nav-taskbadgefilter").text(`${ntasks-nvis} tasks hidden`);
-            $("#nav-taskbadgefilter").show();
+        var val = $(this).text();
+        if (badgeFilter && badgeFilter.which == which && badgeFilter.val == val) {
+            badgeFilter = null;
         } else {
-            $("#nav-taskbadgefilter").hide();
+            badgeFilter = {which: which, val: val};
         }
-        $("#nav-summary-ntasks").text(` (${nvis})`);
+        relayout();
+        updateSummary(alldata);
     });
 
 }
 
 function showAllTasks() {
-    $(".task").show();
-    $("#nav-taskbadgefilter").hide();
-    var nvis = $.unique($(".task-badge:visible").parent()).length;
-    $("#nav-summary-ntasks").text(` (${nvis})`);
+    badgeFilter = null;
+    relayout();
+    updateSummary(alldata);
 }
 
 function updateSummary(data) {
@@ -259,28 +427,17 @@ function updateSummary(data) {
     var nevents_done = 0;
     var njobs_done = 0;
     var njobs_total = 0;
-    for(var i = 0; i < data["tasks"].length; i++) {
-        var sample = data["tasks"][i];
-        var general = sample["general"];
-        var id = getEscapedTaskID(general["dataset"], general["tag"]);
-
-        if ($(`#${id}`).is(":hidden")) continue;
+    for(var i = 0; i < visibleTasks.length; i++) {
+        var general = visibleTasks[i]["general"];
         nevents_total += general["nevents_total"];
         nevents_done += general["nevents_done"];
         njobs_total += general["njobs_total"];
         njobs_done += general["njobs_done"];
-
     }
 
-    // var nevents_total = data["tasks"].sum2("general","nevents_total");
-    // var nevents_done = data["tasks"].sum2("general","nevents_done");
-    // var njobs_done = data["tasks"].sum2("general","njobs_done");
-    // var njobs_total = data["tasks"].sum2("general","njobs_total");
-
     var pct_events = Math.round(100.0*100.0*nevents_done/nevents_total)/100;
     var pct_jobs = Math.round(100.0*100.0*njobs_done/njobs_total)/100;
 
-    // var buff = `<table>
     var buff = `<table class="table table-sm" style="width: 30%; font-size: 75%;">
                     <tbody>
                 <tr><th align='left' style="padding-top:0px; padding-bottom:0px;">Nevents (total)  </th> <td align='right' style="padding-top:0px;padding-bottom:0px;">${nevents_total.toLocaleString()}             </td></tr>
@@ -298,30 +455,52 @@ function updateSummary(data) {
 }
 
 function doHistory() {
+    // fetch the history shards of the shown tasks, a few at a time
+    var ids = visibleTasks.map(function(task) { return task["id"]; });
+    var queue = ids.slice();
+    var workers = [];
+    var next = function() {
+        if (!queue.length) return Promise.resolve();
+        return loadHistory(queue.shift()).catch(function(err) { console.log(err); }).then(next);
+    };
+    for (var i = 0; i < 8; i++) workers.push(next());
+    Promise.all(workers).then(function() {
+        drawChart(sumHistories(ids.map(function(id) { return histories[id] || {}; })));
+    });
+}
+
+function sumHistories(task_histories, npoints=500) {
+    // Each task history has its own (rolled up and downsampled) timestamps,
+    // so sum the tasks on a common time grid, carrying each task's last value forward
+    var tmin = Infinity, tmax = -Infinity;
+    task_histories.forEach(function(history) {
+        var ts = history["timestamps"] || [];
+        if (!ts.length) return;
+        tmin = Math.min(tmin, ts[0]);
+        tmax = Math.max(tmax, ts[ts.length-1]);
+    });
     var tot_history = {};
-    console.log(alldata);
-    for(var i = 0; i < alldata["tasks"].length; i++) {
-        var history = alldata["tasks"][i]["history"] || {};
-        // Don't consider things in the chart if they are hidden
-        var general = alldata["tasks"][i]["general"];
-        var id = getEscapedTaskID(general["dataset"],general["tag"]);
-        if ($('#'+id).is(":hidden")) {
-            continue;
-        }
-        if (!("timestamps" in history)) continue;
-        for(var j = 0; j < history["timestamps"].length; j++) {
-            var ts = history["timestamps"][j];
-            for (k in history) {
+    if (tmin > tmax) return tot_history;
+    var step = Math.max((tmax-tmin)/(npoints-1), 1);
+    var grid = [];
+    for (var t = tmin; t < tmax; t += step) grid.push(Math.round(t));
+    grid.push(tmax);
+    grid.forEach(function(ts) { tot_history[ts] = {}; });
+
+    task_histories.forEach(function(history) {
+        var ts = history["timestamps"] || [];
+        if (!ts.length) return;
+        var j = -1;
+        grid.forEach(function(t) {
+            while (j+1 < ts.length && ts[j+1] <= t) j++;
+            if (j < 0) return;
+            for (var k in history) {
                 if (k == "timestamps") continue;
-                var val = history[k][j];
-                if (!(ts in tot_history)) tot_history[ts] = {};
-                if (!(k in tot_history[ts])) tot_history[ts][k] = 0;
-                tot_history[ts][k] += val;
+                tot_history[t][k] = (tot_history[t][k] || 0) + history[k][j];
             }
-        }
-    }
-    console.log(tot_history);
-    drawChart(tot_history);
+        });
+    });
+    return tot_history;
 }
 
 function drawChart(history) {
@@ -331,34 +510,27 @@ function drawChart(history) {
         'jobs completed ',
         'jobs left',
         'jobs total',
-        // 'events completed ',
-        // 'events total',
     ] ];
-        
-    // for (var itd = 0; itd < history["time_stats"].length; itd++) {
+
     for (ts in history) {
         var td = history[ts];
+        if (!("njobs_total" in td)) continue;
 
         data_table.push( [
             new Date(ts*1000), // to ms
             td["njobs_done"] ,
             td["njobs_total"]-td["njobs_done"],
             td["njobs_total"],
-            // td["nevents_done"] ,
-            // td["nevents_total"],
         ] );
     }
 
-    console.log(data_table);
     var data = google.visualization.arrayToDataTable(data_table);
     var options_stacked = {
         height: 450,
         width: 850,
         legend: {position: 'right'},
-        // vAxis: {minValue: 0, title: "jobs"},
         vAxis: {title: "jobs"},
         hAxis: {slantedText:true, gridlines:{count:-1}},
-        // vAxis: {logScale: true},
     };
     var chart = new google.visualization.AreaChart(document.getElementById('chart'));
     // The select handler. Call the chart's getSelection() method
@@ -367,14 +539,12 @@ function drawChart(history) {
         if (selectedItem == null) {
             console.log("you probably clicked on the legend, so making y-axis logscale");
         }
-        console.log(selectedItem);
         options_stacked.vAxis.logScale ^= true;
         chart.draw(data, options_stacked);
     }
     // Listen for the 'select' event, and call my function selectHandler() when
     // the user selects something on the chart.
     google.visualization.events.addListener(chart, 'select', selectHandler);
-    // console.log(chart);
     chart.draw(data, options_stacked);
 }
 
@@ -383,16 +553,16 @@ function toggleSummary() {
     if ($('#summary').is(":hidden")) {
         updateSummary(alldata);
     }
-    $("#summary").slideToggle(150);
+    $("#summary").slideToggle(150, scheduleRender);
     $("#nav-summary").toggleClass("active");
 }
 
 function toggleChart() {
     if ($('#chart').is(":hidden")) {
-        doHistory(alldata);
+        doHistory();
     }
     $("#nav-chart").toggleClass("active");
-    $("#chart").slideToggle(150);
+    $("#chart").slideToggle(150, scheduleRender);
 }
 
 function toggleExpand() {
@@ -404,36 +574,19 @@ function toggleExpand() {
         $("#nav-expand").text("Collapse");
         $("#nav-expand").addClass("active");
     }
-    $(".details").toggle();
     detailsVisible = !detailsVisible;
+    expanded = {};
+    relayout();
 }
 
 function sortSamples(which) {
-    var divs = $(".task");
-    if (which == "az") {
-        var ordered = divs.sort(function (a, b) {
-            return $(a).attr('id') < $(b).attr('id') ? -1 : 1;
-        });
-        $("#tasks-container").html(ordered);
-    } else if (which == "pct") {
-        var ordered = divs.sort(function (a, b) {
-            return $(a).data('pct') < $(b).data('pct') ? -1 : 1;
-        });
-        $("#tasks-container").html(ordered);
-    } else if (which == "tag") {
-        var ordered = divs.sort(function (a, b) {
-            return $(a).data('tag') < $(b).data('tag') ? -1 : 1;
-        });
-        $("#tasks-container").html(ordered);
-    } else if (which == "rev") {
-        $("#tasks-container").html(divs.get().reverse());
-    } else if (which == "era") {
-        var ordered = divs.sort(function (a, b) {
-            return $(a).attr('id').split("_Run")[1] < $(b).attr('id').split("_Run")[1] ? -1 : 1;
-        });
-        $("#tasks-container").html(ordered);
+    if (which == "rev") {
+        sortReverse = !sortReverse;
+    } else {
+        sortWhich = which;
+        sortReverse = false;
     }
-    afterFillDOM();
+    relayout();
 }
 
 function toggleSort(which) {
@@ -442,17 +595,31 @@ function toggleSort(which) {
 
 function toggleAdmin() {
     $("#nav-admin").toggleClass("active");
-    $(".progress-type").text("🛑✉️✂️");
+    adminMode = !adminMode;
+    render();
 }
 
 function toggleDarkMode() {
-    $(".has-dark").toggleClass("dark");
-    $(".has-dark.badge").toggleClass("badge-light").toggleClass("badge-dark")
-    console.log($(".has-dark > .badge-light"));
+    darkMode = !darkMode;
+    $("body").toggleClass("dark");
     $("#nav-dark").toggleClass("active");
+    render();
+}
+
+
+function listenForEvents() {
+    // when served by metis' StatusServer, updates are pushed as server-sent events.
+    // with static hosting there's no such endpoint, so this just gives up and we keep polling.
+    if (!window.EventSource) return;
+    var events = new EventSource("events");
+    events.addEventListener("update", loadJSON);
+    events.onerror = function() { events.close(); };
 }
 
 
 $(function() {
     loadJSON();
+    setInterval(loadJSON, poll_interval_ms);
+    listenForEvents();
+    $(window).on("scroll resize", scheduleRender);
 });
@@ -5,8 +5,7 @@ import traceback
 
 from metis.Sample import DBSSample
 from metis.CMSSWTask import CMSSWTask
-from metis.StatsParser import StatsParser
-from metis.Utils import send_email
+from metis.CampaignRunner import CampaignRunner
 
 
 def get_tasks():
@@ -179,20 +178,10 @@ def get_tasks():
 
 if __name__ == "__main__":
 
-    for i in range(10000):
-        total_summary = {}
-        total_counts = {}
-        tasks = []
-        tasks.extend(get_tasks())
-        for task in tasks:
-            dsname = task.get_sample().get_datasetname()
-            try:
-                if not task.complete():
-                    task.process()
-            except:
-                traceback_string = traceback.format_exc()
-                print "Runtime error:\n{0}".format(traceback_string)
-                send_email(subject="metis error", body=traceback_string)
-            total_summary[dsname] = task.get_task_summary()
-        StatsParser(data=total_summary, webdir="~/public_html/dump/metis/", make_plots=False).do()
-        time.sleep(1.*3600)
+    # tasks are re-made at every iteration, and processed 16 at a time
+    CampaignRunner(
+            get_tasks=get_tasks,
+            nthreads=16,
+            sleep_seconds=1.*3600,
+            statsparser_kwargs=dict(webdir="~/public_html/dump/metis/", make_plots=False),
+            ).run(niterations=10000)
@@ -8,7 +8,7 @@ import logging
 from pprint import pprint
 import datetime
 
-from metis.LogParser import log_parser
+from metis.LogParser import cached_log_parser, commit_digests
 import metis.Utils as Utils
 from tqdm import tqdm
 
@@ -49,7 +49,7 @@ class StatsParser(object):
                         outlog = condor_jobs[i]["logfile_out"]
                         errlog = condor_jobs[i]["logfile_err"]
                         try:
-                            parsed = log_parser(errlog,do_header=True,do_error=False,do_rate=True)
+                            parsed = cached_log_parser(errlog,do_header=True,do_error=False,do_rate=True)
                             rate = parsed.get("event_rate",-1)
                             site = parsed.get("site","")
                             ts = int(parsed["args"]["time"])
@@ -81,6 +81,8 @@ class StatsParser(object):
                             site,
                         ])
 
+        commit_digests()
+
         print np.array(arr)
         arr = np.rec.fromarrays(np.array(arr).T, 
                 dtype=zip(('ts', 'fail', 'retries', 'retry', 'rate', 'site'), (np.int, np.int, np.int, np.int, np.float, '|S15'))
@@ -4,6 +4,7 @@ import json
 from metis.CondorTask import CondorTask
 from metis.Constants import Constants
 import metis.Utils as Utils
+import metis.Profiling as Profiling
 import traceback
 
 class CMSSWTask(CondorTask):
@@ -15,6 +16,11 @@ class CMSSWTask(CondorTask):
         :kwarg other_outputs: list of other output files to copy back (in addition to output_name)
         :kwarg publish_to_dis: publish the sample information to DIS upon completion
         :kwarg report_every: MessageLogger reporting every N events
+        :kwarg validation: how the job checks its output, one of "none", "entries", "sampled",
+            "baskets" (default, reads all baskets back) or "full" (reads all events back)
+        :kwarg cmssw_cache: reuse the CMSSW area built by earlier jobs of the task on the same
+            node (True, for a directory in /tmp, or the path of a node-local directory). The
+            cache keeps the most recently used areas ($METIS_CMSSW_CACHE_MAX on the node, default 4)
         """
 
         self.pset = kwargs.get("pset", None)
@@ -25,6 +31,10 @@ class CMSSWTask(CondorTask):
         self.other_outputs = kwargs.get("other_outputs", [])
         self.output_is_tree = kwargs.get("is_tree_output", True)
         self.dont_check_tree = kwargs.get("dont_check_tree", False)
+        self.validation = kwargs.get("validation", None)
+        if self.validation not in [None, "none", "entries", "sampled", "baskets", "full"]:
+            raise Exception("Unknown validation level: {0}".format(self.validation))
+        self.cmssw_cache = kwargs.get("cmssw_cache", False)
         self.dont_edit_pset = kwargs.get("dont_edit_pset", False)
         self.publish_to_dis = kwargs.get("publish_to_dis", False)
         self.report_every = kwargs.get("report_every", 1000)
@@ -37,7 +47,7 @@ class CMSSWTask(CondorTask):
         # DIS query each time. Would be smarter to remove need to back up
         # and put maybe a caching decorator for the config query in the
         # SamplesDBS class!
-        if not self.read_only:
+        if not self.read_only and not self.marked_complete:
             if not self.global_tag:
                 self.global_tag = self.sample.get_globaltag()
 
@@ -46,7 +56,8 @@ class CMSSWTask(CondorTask):
         # Declare which variables we want to backup to avoid recalculation
         return ["io_mapping", "executable_path", "pset_path",
                 "package_path", "prepared_inputs",
-                "job_submission_history", "global_tag", "queried_nevents"]
+                "job_submission_history", "global_tag", "queried_nevents",
+                "mapped_complete_sample", "auto_chunks_per_job"]
 
     def handle_done_output(self, out):
         out.set_status(Constants.DONE)
@@ -74,7 +85,8 @@ class CMSSWTask(CondorTask):
             self.update_dis(d_metadata)
 
 
-    def submit_multiple_condor_jobs(self, v_ins, v_out, fake=False, optimizer=None):
+    @Profiling.profiled()
+    def get_condor_submit_kwargs(self, v_ins, v_out, fake=False, optimizer=None):
         outdir = self.output_dir
         outname_noext = self.output_name.rsplit(".", 1)[0]
         v_inputs_commasep = [",".join(map(lambda x: x.get_name(), ins)) for ins in v_ins]
@@ -132,10 +144,16 @@ class CMSSWTask(CondorTask):
         package_full = os.path.abspath(self.package_path)
         input_files = [package_full, pset_full] if self.tarfile else [pset_full]
         input_files += self.additional_input_files
-        extra = self.kwargs.get("condor_submit_params", {})
+        input_files += self.get_executable_helpers()
+        extra = dict(self.kwargs.get("condor_submit_params", {}))
         if self.dont_check_tree:
             extra["classads"] = extra.get("classads",[]) + [["metis_dontchecktree",1]]
-        return Utils.condor_submit(
+        if self.validation:
+            extra["classads"] = extra.get("classads",[]) + [["metis_validation",self.validation]]
+        if self.cmssw_cache:
+            cache = 1 if self.cmssw_cache is True else self.cmssw_cache
+            extra["classads"] = extra.get("classads",[]) + [["metis_cmssw_cache",cache]]
+        return dict(
                     executable=executable, arguments=v_arguments,
                     inputfiles=input_files, logdir=logdir_full,
                     selection_pairs=v_selection_pairs,
@@ -187,6 +205,7 @@ class CMSSWTask(CondorTask):
     #            )
 
 
+    @Profiling.profiled()
     def prepare_inputs(self):
 
         # need to take care of executable, tarfile, and pset
@@ -0,0 +1,200 @@
+"""
+Run a campaign (a list of tasks) in a loop, processing the tasks of each
+iteration concurrently. Replaces the usual
+
+    for i in range(10000):
+        total_summary = {}
+        for task in get_tasks():
+            try:
+                if not task.complete(): task.process()
+            except:
+                send_email(...)
+            total_summary[dsname] = task.get_task_summary()
+        StatsParser(data=total_summary, webdir=...).do()
+        time.sleep(3600)
+
+with
+
+    CampaignRunner(get_tasks=get_tasks, nthreads=16, statsparser_kwargs=dict(webdir=...)).run()
+
+If `get_tasks` returns (task class, kwargs) pairs instead of tasks, incomplete tasks
+are kept alive across iterations instead of being re-made (unpickling the backup,
+updating the mapping, ...) every time. Complete tasks are still re-made, which is
+cheap thanks to their completion marker (see `CondorTask.load`), so they don't pile up.
+
+With a `SubmissionBroker`, the jobs the tasks want to submit are submitted together
+at the end of the processing, in a few clusters, instead of one per task.
+
+Processing a task is mostly waiting on the schedd, DIS, hadoop and subprocesses,
+so a thread pool is enough for an iteration to take about as long as its slowest
+task. Threads (rather than processes) also keep the task objects (and their
+state, like submission histories) in this process.
+"""
+
+import time
+import logging
+import traceback
+from multiprocessing.pool import ThreadPool
+
+from metis.StatsParser import StatsParser
+from metis.CondorTask import CondorTask
+from metis.Task import get_config_digest
+import metis.Utils as Utils
+import metis.Profiling as Profiling
+
+class CampaignRunner(object):
+
+    def __init__(self, tasks=[], get_tasks=None, nthreads=8, sleep_seconds=3600,
+            process_kwargs={}, statsparser_kwargs={}, show_progress_bar=True, send_emails=True, broker=None):
+        """
+        - `tasks` is a fixed list of tasks, or `get_tasks` a function returning the tasks,
+          called at every iteration (so that the campaign can change while it runs)
+        - `nthreads` tasks are processed at the same time
+        - iterations start every `sleep_seconds` (or right after the previous one, if it took longer)
+        - `process_kwargs` are passed to `task.process()` (e.g., `optimizer`)
+        - `statsparser_kwargs` are passed to `StatsParser` (e.g., `webdir`). Set it to None to skip the summary
+        - if `send_emails`, the traceback of a failing task is emailed with `Utils.send_email`
+        - `broker` is a `SubmissionBroker` to coalesce the submissions of the `CondorTask`s
+        """
+        self.tasks = tasks
+        self.get_tasks_function = get_tasks
+        self.nthreads = max(1, nthreads)
+        self.sleep_seconds = sleep_seconds
+        self.process_kwargs = process_kwargs
+        self.statsparser_kwargs = statsparser_kwargs
+        self.show_progress_bar = show_progress_bar
+        self.send_emails = send_emails
+        self.broker = broker
+        self.iteration = 0
+        # (class name, config digest) -> incomplete task, see `get_tasks`
+        self.alive_tasks = {}
+        # ids of the tasks of this iteration that were kept from the previous one
+        self.reused_task_ids = set()
+
+        self.logger = logging.getLogger(Utils.setup_logger())
+
+    def get_tasks(self):
+        items = self.get_tasks_function() if self.get_tasks_function else self.tasks
+        tasks = []
+        alive_tasks = {}
+        self.reused_task_ids = set()
+        for item in items:
+            if isinstance(item, tuple):
+                cls, kwargs = item
+                key = (cls.__name__, get_config_digest(cls.__name__, kwargs))
+                task = self.alive_tasks.get(key)
+                if task is None:
+                    task = cls(**kwargs)
+                else:
+                    self.reused_task_ids.add(id(task))
+                alive_tasks[key] = task
+                item = task
+            tasks.append(item)
+        self.alive_tasks = alive_tasks
+        return tasks
+
+    def handle_error(self, task, what):
+        traceback_string = traceback.format_exc()
+        self.logger.error("Error while {0} {1}:\n{2}".format(what, task, traceback_string))
+        if self.send_emails:
+            Utils.send_email(subject="metis error", body=traceback_string)
+
+    def process_task(self, task, summarize=True):
+        """
+        Process one task (if not complete) and return (dataset name, task summary or None).
+        The summary is skipped (None) if `summarize` is False.
+        Exceptions are logged (and emailed), but don't propagate, so one bad task
+        doesn't stop the others.
+        """
+        dsname = task.get_sample().get_datasetname()
+        with Profiling.span("CampaignRunner.process_task", dataset=dsname):
+            try:
+                # a re-made task would have picked up new files of an open dataset
+                if id(task) in self.reused_task_ids and getattr(task, "open_dataset", False):
+                    task.update_mapping()
+                if not task.complete():
+                    if self.broker is not None and isinstance(task, CondorTask):
+                        task.process(broker=self.broker, **self.process_kwargs)
+                    else:
+                        task.process(**self.process_kwargs)
+            except:
+                self.handle_error(task, "processing")
+            if not summarize:
+                return dsname, None
+            return self.summarize_task(task)
+
+    def summarize_task(self, task):
+        """
+        Return (dataset name, task summary or None)
+        """
+        dsname = task.get_sample().get_datasetname()
+        try:
+            return dsname, task.get_task_summary()
+        except:
+            self.handle_error(task, "summarizing")
+            return dsname, None
+
+    def map_tasks(self, func, tasks):
+        """
+        Return the list of `func(task)` over `tasks`, using up to `nthreads` threads
+        """
+        nthreads = min(self.nthreads, len(tasks))
+        if nthreads <= 1:
+            return map(func, tasks)
+        pool = ThreadPool(processes=nthreads)
+        try:
+            # map keeps the task order, so the summary doesn't depend on the scheduling
+            return pool.map(func, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def run_iteration(self):
+        """
+        Process all the tasks concurrently, then make the summary.
+        Returns the dict of dataset name to task summary.
+        """
+        self.iteration += 1
+        tasks = self.get_tasks()
+        self.logger.info("Starting iteration {0} with {1} tasks".format(self.iteration, len(tasks)))
+
+        # with a broker, the jobs only get submitted (and recorded in the tasks) when it is
+        # flushed, so the summaries have to wait for that
+        if self.broker is None:
+            results = self.map_tasks(self.process_task, tasks)
+        else:
+            self.map_tasks(lambda task: self.process_task(task, summarize=False), tasks)
+            try:
+                self.broker.flush()
+            except:
+                self.handle_error("the campaign", "submitting the jobs of")
+            results = self.map_tasks(self.summarize_task, tasks)
+
+        # keep only what still needs processing next time
+        self.alive_tasks = dict((key, task) for key, task in self.alive_tasks.items()
+                if not getattr(task, "marked_complete", False))
+
+        total_summary = {}
+        for dsname, summary in results:
+            if summary is not None:
+                total_summary[dsname] = summary
+
+        if self.statsparser_kwargs is not None:
+            try:
+                StatsParser(data=total_summary, **self.statsparser_kwargs).do(show_progress_bar=self.show_progress_bar)
+            except:
+                self.handle_error("the campaign", "making the summary of")
+        return total_summary
+
+    def run(self, niterations=-1):
+        """
+        Loop over iterations (forever, if `niterations` < 0)
+        """
+        iteration = 0
+        while niterations < 0 or iteration < niterations:
+            t0 = time.time()
+            self.run_iteration()
+            iteration += 1
+            if niterations >= 0 and iteration >= niterations:
+                break
+            Utils.interruptible_sleep(max(0, int(self.sleep_seconds - (time.time()-t0))))
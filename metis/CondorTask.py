@@ -1,10 +1,67 @@
 import os
+import json
 import time
+import hashlib
 
 from metis.Constants import Constants
 from metis.Task import Task
+from metis.SummaryStore import atomic_dump
 from metis.File import EventsFile
 import metis.Utils as Utils
+import metis.Executor as Executor
+import metis.LogParser as LogParser
+import metis.Timeline as Timeline
+import metis.StatusServer as StatusServer
+import metis.Profiling as Profiling
+import metis.Metrics as Metrics
+
+COMPLETION_MARKER = "complete.json"
+COMPLETION_SUMMARY = "complete_summary.json"
+
+# jobs with timelines needed to pick the number of chunks per job (see `update_chunks_per_job`)
+MIN_JOBS_FOR_CHUNKING = 5
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+def pack_submit_kwargs(kwargs, chunks_per_job, executable):
+    """
+    Turn the kwargs of `Utils.condor_submit` for one job per output into kwargs for one
+    job per `chunks_per_job` outputs, running the original executable for each of them
+    through `executable` (condor_packed_exe.sh). Jobs keep the classads of their first
+    output, and the indices of all of them in `metis_jobnums`.
+    """
+    kwargs = dict(kwargs)
+    v_arguments, v_selection_pairs = [], []
+    for i in range(0, len(kwargs["arguments"]), chunks_per_job):
+        arguments = [os.path.basename(kwargs["executable"])]
+        for chunk_arguments in kwargs["arguments"][i:i+chunks_per_job]:
+            if len(arguments) > 1: arguments.append("::")
+            arguments.extend(chunk_arguments)
+        v_arguments.append(arguments)
+        if "selection_pairs" in kwargs:
+            pairs = kwargs["selection_pairs"][i:i+chunks_per_job]
+            jobnums = [dict(p).get("jobnum") for p in pairs]
+            v_selection_pairs.append(list(pairs[0]) + [["metis_jobnums", ",".join(map(str, jobnums))]])
+    kwargs["arguments"] = v_arguments
+    if "selection_pairs" in kwargs:
+        kwargs["selection_pairs"] = v_selection_pairs
+    kwargs["inputfiles"] = list(kwargs["inputfiles"]) + [kwargs["executable"]]
+    kwargs["executable"] = executable
+    return kwargs
+
+def get_job_indices(job_dict):
+    """
+    Output indices that a condor job is processing (several for packed jobs)
+    """
+    indices = [int(job_dict["jobnum"])]
+    for index in str(job_dict.get("metis_jobnums", "")).split(","):
+        if index.strip().isdigit() and int(index) not in indices:
+            indices.append(int(index))
+    return indices
 
 class CondorTask(Task):
     def __init__(self, **kwargs):
@@ -32,7 +89,20 @@ class CondorTask(Task):
         :kwarg outdir_name: use custom directory in user's hadoop
         :kwarg output_dir: override output directory
         :kwarg recopy_inputs: force re-copy/prepare inputs (executable, tarfile, ...) every class instantiation
-        """
+        :kwarg use_completion_marker: if the task completed before (with the same kwargs, and the output
+            directory wasn't touched since), skip loading the backup and re-checking outputs (default `True`)
+        :kwarg chunks_per_job: number of outputs that each condor job produces one after another
+            (default 1), to pay the job setup once for several outputs. With "auto", it is picked
+            from the setup time and runtime of the first jobs (see `update_chunks_per_job`)
+        :kwarg max_chunks_per_job: most chunks per job with "auto" (default 20)
+        :kwarg executor: what runs the jobs (an `Executor.Executor`), e.g., `Executor.LocalExecutor()` or
+            a `WorkQueue.WorkQueueServer`, instead of condor (`Executor.CondorExecutor`, the default)
+        """
+        # see `load`
+        self.marked_complete = False
+        self.loaded_backup = False
+        self.use_completion_marker = kwargs.get("use_completion_marker", True)
+
         self.sample = kwargs.get("sample", None)
         self.min_completion_fraction = kwargs.get("min_completion_fraction", 1.0)
         self.open_dataset = kwargs.get("open_dataset", False)
@@ -55,6 +125,10 @@ class CondorTask(Task):
         self.split_within_files = kwargs.get("split_within_files", False)
         self.total_nevents = kwargs.get("total_nevents", -1)
         self.max_jobs = kwargs.get("max_jobs",0)
+        self.chunks_per_job = kwargs.get("chunks_per_job", 1)
+        self.max_chunks_per_job = kwargs.get("max_chunks_per_job", 20)
+        if self.chunks_per_job != "auto" and int(self.chunks_per_job) < 1:
+            raise Exception("chunks_per_job must be a positive number or 'auto'")
         self.snt_dir = kwargs.get("snt_dir",False)
         self.recopy_inputs = kwargs.get("recopy_inputs",False)
 
@@ -84,17 +158,22 @@ class CondorTask(Task):
         self.prepared_inputs = False
         self.job_submission_history = {}
         self.queried_nevents = 0
+        # False while the sample can still grow (see `Sample.is_complete`), i.e., while streaming
+        self.mapped_complete_sample = True
+        # picked once enough jobs finished, with chunks_per_job="auto"
+        self.auto_chunks_per_job = None
 
         # Make a unique name from this task for pickling purposes
         self.unique_name = kwargs.get("unique_name", "{0}_{1}_{2}".format(self.get_task_name(), self.sample.get_datasetname().replace("/", "_").lstrip("_"), self.tag))
 
         # Pass all of the kwargs to the parent class
         super(CondorTask, self).__init__(**kwargs)
+        self.executor = kwargs.get("executor", None) or Executor.CondorExecutor()
 
         self.logger.info("Instantiated task for {0} ({1})".format(self.sample.get_datasetname(),self.tag))
 
         # Can keep calling update_mapping afterwards to re-query input files
-        if not self.read_only:
+        if not self.read_only and not self.marked_complete:
             do_flush = kwargs.get("flush", False)
             self.update_mapping(flush=do_flush)
 
@@ -102,7 +181,72 @@ class CondorTask(Task):
         # Declare which variables we want to backup to avoid recalculation
         return ["io_mapping", "executable_path",
                 "package_path", "prepared_inputs",
-                "job_submission_history", "global_tag", "queried_nevents"]
+                "job_submission_history", "global_tag", "queried_nevents",
+                "mapped_complete_sample", "auto_chunks_per_job"]
+
+    @property
+    def io_mapping(self):
+        self.ensure_loaded()
+        return self._io_mapping
+
+    @io_mapping.setter
+    def io_mapping(self, io_mapping):
+        self._io_mapping = io_mapping
+
+    def load(self):
+        """
+        A task with a valid completion marker doesn't need its backup to say that it's
+        complete or to give its summary, so then the backup is only loaded on demand
+        (e.g., when the io_mapping is needed)
+        """
+        if self.use_completion_marker and not self.open_dataset and self.read_completion_marker():
+            self.marked_complete = True
+            self.logger.debug("Task {0} is marked as complete, not loading the backup".format(self.unique_name))
+            return
+        self.loaded_backup = True
+        super(CondorTask, self).load()
+
+    def ensure_loaded(self):
+        if self.marked_complete and not self.loaded_backup:
+            self.loaded_backup = True
+            super(CondorTask, self).load()
+
+    def get_completion_marker_path(self):
+        return "{0}/{1}".format(self.get_taskdir(), COMPLETION_MARKER)
+
+    def read_completion_marker(self):
+        """
+        Returns the completion marker if there is one and it still applies, i.e., the task
+        has the same configuration and the output directory wasn't modified since, else None
+        """
+        try:
+            with open(self.get_completion_marker_path(), "r") as fhin:
+                marker = json.load(fhin)
+        except (IOError, OSError, ValueError):
+            return None
+        if marker.get("config_digest") != self.get_config_digest():
+            return None
+        if marker.get("output_dir_mtime") != get_mtime(self.output_dir):
+            return None
+        return marker
+
+    def write_completion_marker(self):
+        """
+        Record that the task is complete, along with its summary (which is then
+        returned by `get_task_summary` for as long as the marker is valid)
+        """
+        outputs = sorted(out.get_name() for out in self.get_outputs())
+        atomic_dump(self.get_task_summary(), "{0}/{1}".format(self.get_taskdir(), COMPLETION_SUMMARY))
+        atomic_dump({
+            "config_digest": self.get_config_digest(),
+            "outputs_digest": hashlib.sha1("\n".join(outputs).encode("utf-8")).hexdigest(),
+            "noutputs": len(outputs),
+            "fraction": self.complete(return_fraction=True),
+            "output_dir": self.output_dir,
+            "output_dir_mtime": get_mtime(self.output_dir),
+            "timestamp": time.time(),
+            }, self.get_completion_marker_path())
+        self.marked_complete = True
 
 
     def handle_done_output(self, out):
@@ -114,6 +258,7 @@ class CondorTask(Task):
         self.logger.debug("This output ({0}) exists, skipping the processing".format(out))
 
     def get_job_submission_history(self):
+        self.ensure_loaded()
         return self.job_submission_history
 
     def get_inputs_for_output(self, output):
@@ -131,9 +276,12 @@ class CondorTask(Task):
                     return inps
         return output
 
+    @Profiling.profiled()
     def update_mapping(self, flush=False, override_chunks=[]):
         """
         Given the sample, make the input-output mapping by chunking
+        If the sample can still grow (e.g., a `TaskOutputSample` of a task that is
+        not done yet), only full chunks are mapped, and the rest once it's complete.
         """
 
         # get set of filenames from File objects that have already been mapped
@@ -145,13 +293,15 @@ class CondorTask(Task):
         original_nextidx = nextidx + 0
         # if dataset is "closed" and we already have some inputs, then
         # don't bother doing get_files() again (wastes a DBS query)
-        if (len(already_mapped_inputs) > 0 and not self.open_dataset):
+        sample_complete = self.sample.is_complete()
+        if (len(already_mapped_inputs) > 0 and not self.open_dataset and self.mapped_complete_sample):
             files = []
         else:
             files = [f for f in self.sample.get_files() if f.get_name() not in already_mapped_inputs]
             self.queried_nevents = self.sample.get_nevents()
 
-        flush = (not self.open_dataset) or flush
+        flush = ((not self.open_dataset) and sample_complete) or flush
+        self.mapped_complete_sample = sample_complete
         prefix, suffix = self.output_name.rsplit(".", 1)
         if self.split_within_files:
             if self.total_nevents < 1 or self.events_per_output < 1:
@@ -160,7 +310,7 @@ class CondorTask(Task):
             chunks = [files for _ in range(nchunks)]
             leftoverchunk = []
         else:
-            chunks, leftoverchunk = Utils.file_chunker(files, events_per_output=self.events_per_output, files_per_output=self.files_per_output, MB_per_output=self.MB_per_output, flush=flush)
+            chunks, leftoverchunk = self.chunk_files(files, flush=flush)
             if self.max_jobs > 0:
                 chunks = chunks[:self.max_jobs]
                 leftoverchunk = []
@@ -180,6 +330,12 @@ class CondorTask(Task):
         if (nextidx - original_nextidx > 0):
             self.logger.info("Updated mapping to have {0} more entries".format(nextidx - original_nextidx))
 
+    def chunk_files(self, files, flush=False):
+        """
+        Returns (chunks of files, leftover files) for `update_mapping`
+        """
+        return Utils.file_chunker(files, events_per_output=self.events_per_output, files_per_output=self.files_per_output, MB_per_output=self.MB_per_output, flush=flush)
+
     def flush(self):
         """
         Convenience function
@@ -238,6 +394,13 @@ class CondorTask(Task):
         Return bool for completion, or fraction if
         return_fraction specified as True
         """
+        if self.marked_complete:
+            marker = self.read_completion_marker()
+            if marker:
+                return marker["fraction"] if return_fraction else True
+            # outputs changed since, so check them again
+            self.ensure_loaded()
+            self.marked_complete = False
         self.recache_outputs()
         bools = list(map(lambda output: output.get_status() == Constants.DONE, self.get_outputs()))
         if len(bools) == 0:
@@ -247,7 +410,8 @@ class CondorTask(Task):
         if return_fraction:
             return frac
         else:
-            return frac >= self.min_completion_fraction
+            # while streaming, more outputs are still to come
+            return self.mapped_complete_sample and frac >= self.min_completion_fraction
 
     def try_to_complete(self):
         """
@@ -265,7 +429,7 @@ class CondorTask(Task):
 
         for cjob in self.get_running_condor_jobs():
             cluster_id = cjob["ClusterId"]
-            Utils.condor_rm([cluster_id])
+            self.remove_condor_jobs([cluster_id])
             self.logger.info("Tail condor job {} removed".format(cluster_id))
         files_to_remove = [output.get_name() for output in self.get_uncompleted_outputs()]
         new_mapping = []
@@ -278,6 +442,7 @@ class CondorTask(Task):
             self.logger.info("Tail root file {} removed".format(fname))
         self.io_mapping = new_mapping
 
+    @Profiling.profiled()
     def recache_outputs(self):
         """
         Reset file existence cache value for files that used to exist (maybe we
@@ -299,70 +464,174 @@ class CondorTask(Task):
                     nfiles_reset += 1
         return nfiles_reset
 
-    def run(self, fake=False, optimizer=None):
+    @Profiling.profiled()
+    def run(self, fake=False, optimizer=None, broker=None):
         """
         Main logic for looping through (inputs,output) pairs. In this
         case, this is where we submit, resubmit, etc. to condor
         If fake is True, then we mark the outputs as done and never submit
-        """
-        condor_job_dicts = self.get_running_condor_jobs()
-        condor_job_indices = set([int(rj["jobnum"]) for rj in condor_job_dicts])
+        If `broker` (a `SubmissionBroker`) is given, the jobs to submit are handed to it
+        instead, to be submitted together with those of other tasks (for executors that
+        submit to condor)
+        """
+        condor_job_dicts = self.get_running_condor_jobs(extra_columns=StatusServer.get_extra_columns())
+        StatusServer.publish_jobs(self.unique_name, condor_job_dicts)
+        self.update_job_metrics(condor_job_dicts)
+        # a packed job processes several outputs
+        d_index_to_job = {}
+        for rj in condor_job_dicts:
+            for index in get_job_indices(rj):
+                d_index_to_job[index] = rj
+        condor_job_indices = set(d_index_to_job.keys())
+        self.update_chunks_per_job()
 
         nfiles_reset = self.recache_outputs()
         if nfiles_reset > 0:
             self.logger.info("{0} files may have been deleted".format(nfiles_reset))
 
         to_submit = []
+        # a packed job is handled once per output, but only removed once
+        removed_jobs = set()
 
         # main loop over input-output map
-        for iout, (ins, out) in enumerate(self.io_mapping):
-            if self.max_jobs > 0 and iout >= self.max_jobs:
-                break
-
-            index = out.get_index()  # "merged_ntuple_42.root" --> 42
-            on_condor = index in condor_job_indices
-            done = (out.exists() and not on_condor)
-            if done:
-                self.handle_done_output(out)
-                continue
-
-            if fake:
-                out.set_fake()
-
-            if not on_condor:
-                # Submit and keep a log of condor_ids for each output file that we've submitted
-                to_submit.append({
-                    "ins": ins,
-                    "out": out,
-                    })
-
-            else:
-                this_job_dict = next(rj for rj in condor_job_dicts if int(rj["jobnum"]) == index)
-                action_type = self.handle_condor_job(this_job_dict, out)
+        with Profiling.span("CondorTask.run:outputs", noutputs=len(self.io_mapping)):
+            for iout, (ins, out) in enumerate(self.io_mapping):
+                if self.max_jobs > 0 and iout >= self.max_jobs:
+                    break
+
+                index = out.get_index()  # "merged_ntuple_42.root" --> 42
+                on_condor = index in condor_job_indices
+                done = (out.exists() and not on_condor)
+                if done:
+                    self.handle_done_output(out)
+                    continue
+
+                if fake:
+                    out.set_fake()
+
+                if not on_condor:
+                    # Submit and keep a log of condor_ids for each output file that we've submitted
+                    to_submit.append({
+                        "ins": ins,
+                        "out": out,
+                        })
+
+                else:
+                    this_job_dict = d_index_to_job[index]
+                    action_type = self.handle_condor_job(this_job_dict, out, removed_jobs=removed_jobs)
 
         if to_submit:
             v_ins = [d["ins"] for d in to_submit]
             v_out = [d["out"] for d in to_submit]
+            if broker is not None and self.executor.coalesce_submissions:
+                broker.add(self, v_ins, v_out, fake=fake, optimizer=optimizer)
+                return
             succeeded, cluster_id = self.submit_multiple_condor_jobs(v_ins, v_out, fake=fake, optimizer=optimizer)
-            procids = map(str,range(len(v_out)))
             if succeeded:
-                for out,procid in zip(v_out,procids):
-                    index = out.get_index()  # "merged_ntuple_42.root" --> 42
-                    cid = str(cluster_id).split(".")[0] + "." + procid
-                    if index not in self.job_submission_history:
-                        self.job_submission_history[index] = []
-                    self.job_submission_history[index].append(cid)
-                    ntimes = len(self.job_submission_history[index])
-                    if ntimes <= 1:
-                        self.logger.info("Job for ({0}) submitted to {1}".format(out, cid))
-                    else:
-                        self.logger.info("Job for ({0}) submitted to {1} (for the {2} time)".format(out, cid, Utils.num_to_ordinal_string(ntimes)))
-
-    def handle_condor_job(self, this_job_dict, out, fake=False, remove_running_x_hours=48.0, remove_held_x_hours=5.0):
+                self.record_submissions(self.get_job_outputs(v_out), cluster_id)
+
+    def record_submissions(self, v_out, cluster_id, first_procid=0):
+        """
+        Keep a log of condor_ids for each output file that we've submitted,
+        given the cluster of the jobs and the proc id of the first one.
+        Elements of `v_out` are the output of each job, or the list of outputs
+        of jobs processing several chunks (see `get_job_outputs`)
+        """
+        for procid, outs in enumerate(v_out, first_procid):
+            cid = str(cluster_id).split(".")[0] + "." + str(procid)
+            for out in (outs if type(outs) == list else [outs]):
+                Metrics.JOBS_SUBMITTED.inc(task=self.unique_name)
+                index = out.get_index()  # "merged_ntuple_42.root" --> 42
+                if index not in self.job_submission_history:
+                    self.job_submission_history[index] = []
+                self.job_submission_history[index].append(cid)
+                ntimes = len(self.job_submission_history[index])
+                if ntimes <= 1:
+                    self.logger.info("Job for ({0}) submitted to {1}".format(out, cid))
+                else:
+                    Metrics.JOBS_RESUBMITTED.inc(task=self.unique_name)
+                    self.logger.info("Job for ({0}) submitted to {1} (for the {2} time)".format(out, cid, Utils.num_to_ordinal_string(ntimes)))
+
+    def get_chunks_per_job(self):
+        """
+        Number of outputs that each job produces (see `chunks_per_job`)
+        """
+        if self.chunks_per_job == "auto":
+            return self.auto_chunks_per_job or 1
+        return int(self.chunks_per_job)
+
+    def get_job_outputs(self, v_out):
+        """
+        Group outputs into the outputs of each job: outputs as they are with one chunk
+        per job, else lists of (up to) `get_chunks_per_job()` consecutive outputs
+        """
+        nchunks = self.get_chunks_per_job()
+        if nchunks <= 1:
+            return list(v_out)
+        return [list(v_out[i:i+nchunks]) for i in range(0, len(v_out), nchunks)]
+
+    def update_chunks_per_job(self):
+        """
+        With chunks_per_job="auto", jobs process one chunk until `MIN_JOBS_FOR_CHUNKING` of
+        them have finished. Then the number of chunks per job is picked (once) from their
+        median setup time and runtime (see `Timeline.estimate_chunks_per_job`).
+        """
+        if self.chunks_per_job != "auto" or self.auto_chunks_per_job:
+            return
+        logdir_full = os.path.abspath("{0}/logs/std_logs/".format(self.get_taskdir()))
+        timelines = []
+        for _, out in self.io_mapping:
+            history = self.job_submission_history.get(out.get_index(), [])
+            if not history or out.is_fake() or not out.exists():
+                continue
+            outlog = "{0}/1e.{1}.out".format(logdir_full, history[-1])
+            if not os.path.exists(outlog):
+                continue
+            parsed = LogParser.cached_log_parser(outlog, do_header=True, do_error=False, do_rate=False)
+            parsed = LogParser.get_chunk_log(parsed, out.get_index())
+            timeline = Timeline.get_job_timeline(parsed)
+            if "setup" in timeline and "total" in timeline:
+                timelines.append(timeline)
+            if len(timelines) >= 4*MIN_JOBS_FOR_CHUNKING:
+                break
+        LogParser.commit_digests()
+        if len(timelines) < MIN_JOBS_FOR_CHUNKING:
+            return
+        setup = Timeline.percentile(sorted(tl["setup"] for tl in timelines), 0.5)
+        chunk = Timeline.percentile(sorted(tl["total"]-tl["setup"] for tl in timelines), 0.5)
+        self.auto_chunks_per_job = Timeline.estimate_chunks_per_job(setup, chunk, max_chunks=self.max_chunks_per_job)
+        self.logger.info("Jobs take {0}s to set up and {1}s to run, so jobs will process {2} chunks".format(
+            setup, chunk, self.auto_chunks_per_job))
+
+    def update_job_metrics(self, condor_job_dicts):
+        """
+        Set the per-status job gauges of this task from a condor_q result
+        """
+        counts = dict((status, 0) for status in ["R", "I", "H"])
+        for job in condor_job_dicts:
+            status = job.get("JobStatus", "U")
+            counts[status] = counts.get(status, 0) + 1
+        for status, count in counts.items():
+            Metrics.CONDOR_JOBS.set(count, task=self.unique_name, status=status)
+
+    def remove_condor_job_once(self, cluster_id, removed_jobs=None, fake=False):
+        """
+        Removes the job `cluster_id` ("<cluster>.<proc>") unless it's already in the
+        set `removed_jobs`. Returns True if it was removed now
+        """
+        if removed_jobs is not None:
+            if cluster_id in removed_jobs:
+                return False
+            removed_jobs.add(cluster_id)
+        if not fake: self.remove_condor_jobs([cluster_id])
+        return True
+
+    def handle_condor_job(self, this_job_dict, out, fake=False, remove_running_x_hours=48.0, remove_held_x_hours=5.0, removed_jobs=None):
         """
         takes `out` (File object) and dictionary of condor
         job information returns action_type specifying the type of action taken
-        given the info
+        given the info. Jobs in the set `removed_jobs` aren't removed (or counted)
+        again, and the ones removed now are added to it
         """
         cluster_id = "{}".format(this_job_dict["ClusterId"])
         running = this_job_dict.get("JobStatus", "I") == "R"
@@ -380,8 +649,9 @@ class CondorTask(Task):
 
             if hours_since > remove_running_x_hours:
                 self.logger.debug("Job {0} for ({1}) removed for running for more than a day!".format(cluster_id, out))
-                if not fake: Utils.condor_rm([cluster_id])
                 action_type = "LONG_RUNNING_REMOVED"
+                if self.remove_condor_job_once(cluster_id, removed_jobs, fake=fake):
+                    Metrics.JOBS_REMOVED.inc(task=self.unique_name, reason="long_running")
 
         elif idle:
             self.logger.debug("Job {0} for ({1}) idle for {2:.1f} hrs".format(cluster_id, out, hours_since))
@@ -395,30 +665,39 @@ class CondorTask(Task):
 
             if hours_since > remove_held_x_hours:
                 self.logger.info("Job {0} for ({1}) removed for excessive hold time".format(cluster_id, out))
-                if not fake: Utils.condor_rm([cluster_id])
                 action_type = "HELD_AND_REMOVED"
+                if self.remove_condor_job_once(cluster_id, removed_jobs, fake=fake):
+                    Metrics.JOBS_REMOVED.inc(task=self.unique_name, reason="held")
 
         return action_type
 
-    def process(self, fake=False, optimizer=None):
+    @Profiling.profiled()
+    def process(self, fake=False, optimizer=None, broker=None):
         """
         Prepare inputs
         Execute main logic
         Backup
         """
         self.logger.info("Began processing {0} ({1})".format(self.sample.get_datasetname(),self.tag))
+        self.ensure_loaded()
+        # pick up the new upstream outputs
+        if not self.mapped_complete_sample:
+            self.update_mapping()
         # set up condor input if it's the first time submitting
         if (not self.prepared_inputs) or self.recopy_inputs:
             self.prepare_inputs()
 
 
-        self.run(fake=fake, optimizer=optimizer)
+        self.run(fake=fake, optimizer=optimizer, broker=broker)
 
         self.try_to_complete()
-        if self.complete():
+        is_complete = self.complete()
+        if is_complete:
             self.finalize()
 
         self.backup()
+        if is_complete and self.use_completion_marker:
+            self.write_completion_marker()
 
         self.logger.info("Ended processing {0} ({1})".format(self.sample.get_datasetname(),self.tag))
 
@@ -429,6 +708,7 @@ class CondorTask(Task):
         """
         pass
 
+    @Profiling.profiled()
     def get_running_condor_jobs(self, extra_columns=[]):
         """
         Get list of dictionaries for condor jobs satisfying the
@@ -439,10 +719,38 @@ class CondorTask(Task):
         within a task has a unique job num corresponding to the
         output file index
         """
-        return Utils.condor_q(selection_pairs=[["taskname", self.unique_name]], extra_columns=["jobnum"]+extra_columns, use_python_bindings=True)
+        return self.executor.query(selection_pairs=[["taskname", self.unique_name]], extra_columns=["jobnum","metis_jobnums"]+extra_columns)
 
+    def remove_condor_jobs(self, cluster_ids):
+        return self.executor.remove(cluster_ids)
+
+    @Profiling.profiled()
     def submit_multiple_condor_jobs(self, v_ins, v_out, fake=False, optimizer=None):
+        return self.executor.submit(**self.get_job_submit_kwargs(v_ins, v_out, fake=fake, optimizer=optimizer))
 
+    def get_job_submit_kwargs(self, v_ins, v_out, fake=False, optimizer=None):
+        """
+        Returns the kwargs of `Utils.condor_submit` for the jobs of these (inputs, output),
+        i.e., one job per output, or per `get_chunks_per_job()` outputs (see `get_job_outputs`)
+        """
+        kwargs = self.get_condor_submit_kwargs(v_ins, v_out, fake=fake, optimizer=optimizer)
+        nchunks = self.get_chunks_per_job()
+        if nchunks <= 1:
+            return kwargs
+        packed_executable = os.path.abspath(self.get_metis_base() + "metis/executables/condor_packed_exe.sh")
+        return pack_submit_kwargs(kwargs, nchunks, packed_executable)
+
+    def get_executable_helpers(self):
+        """
+        Files that the metis executables source on the worker node
+        """
+        helper = os.path.abspath(self.get_metis_base() + "metis/executables/metis_stageout.sh")
+        return [helper] if os.path.exists(helper) else []
+
+    def get_condor_submit_kwargs(self, v_ins, v_out, fake=False, optimizer=None):
+        """
+        Returns the kwargs of `Utils.condor_submit` to submit one job per (inputs, output)
+        """
         outdir = self.output_dir
         outname_noext = self.output_name.rsplit(".", 1)[0]
         v_inputs_commasep = [",".join(map(lambda x: x.get_name(), ins)) for ins in v_ins]
@@ -479,8 +787,9 @@ class CondorTask(Task):
         package_full = os.path.abspath(self.package_path)
         input_files = [package_full] if self.tarfile else []
         input_files += self.additional_input_files
+        input_files += self.get_executable_helpers()
         extra = self.kwargs.get("condor_submit_params", {})
-        return Utils.condor_submit(
+        return dict(
                     executable=executable, arguments=v_arguments,
                     inputfiles=input_files, logdir=logdir_full,
                     selection_pairs=v_selection_pairs,
@@ -513,6 +822,7 @@ class CondorTask(Task):
     #            )
 
 
+    @Profiling.profiled()
     def prepare_inputs(self):
 
         # need to take care of executable, tarfile
@@ -535,6 +845,7 @@ class CondorTask(Task):
         """
         return task_summary
 
+    @Profiling.profiled()
     def get_task_summary(self):
         """
         returns a dictionary with mapping and condor job info/history:
@@ -570,6 +881,14 @@ class CondorTask(Task):
         }
         """
 
+        if self.marked_complete and self.read_completion_marker():
+            try:
+                with open("{0}/{1}".format(self.get_taskdir(), COMPLETION_SUMMARY), "r") as fhin:
+                    return json.load(fhin)
+            except (IOError, OSError, ValueError):
+                pass
+        self.ensure_loaded()
+
         # full path to directory with condor log files
         logdir_full = os.path.abspath("{0}/logs/std_logs/".format(self.get_taskdir())) + "/"
 
@@ -0,0 +1,224 @@
+import os
+import sys
+import logging
+import traceback
+from multiprocessing.pool import ThreadPool
+
+from metis.Utils import setup_logger
+import metis.Profiling as Profiling
+
+def get_change_token(task):
+    """
+    Something cheap that changes when the outputs of `task` may have changed
+    (job completions and deletions touch the output directory), or None
+    """
+    output_dir = getattr(task, "output_dir", None)
+    if not output_dir: return None
+    try:
+        return os.stat(output_dir).st_mtime
+    except OSError:
+        return None
+
+class DAG(object):
+    """
+    Tasks with arbitrary dependencies. Each `process()` processes the tasks whose
+    requirements are complete, independent ones concurrently, and the ones on the
+    longest remaining chain of work first. Completion is memoized, and re-checked only
+    when the output directory of a task changes, after the task is processed, or
+    when told to (`invalidate`).
+
+    >>> dag = DAG()
+    >>> dag.add_task(gensim)
+    >>> dag.add_task(raw, requires=[gensim])
+    >>> dag.add_task(aod, requires=[raw])
+    >>> dag.add_task(nano, requires=[aod])
+    >>> dag.add_task(cms4, requires=[aod])
+    >>> while not dag.complete(): dag.process(); time.sleep(600)
+
+    With `streams_from` instead of `requires`, the downstream task doesn't wait for the
+    upstream one to complete, e.g., when it runs on a `TaskOutputSample` of it
+    >>> raw = CMSSWTask(sample=TaskOutputSample(task=gensim, dataset=...), ...)
+    >>> dag.add_task(raw, streams_from=[gensim])
+    """
+
+    def __init__(self, nthreads=4):
+        self.nthreads = max(1, nthreads)
+        self.tasks = []
+        self.requirements = {}
+        self.dependents = {}
+        # requirements that don't block (see `add_dependency`)
+        self.streaming = {}
+        # task -> (change token, complete)
+        self.completion = {}
+
+        self.logger = logging.getLogger(setup_logger())
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __repr__(self):
+        return "{0}({1} tasks)".format(self.__class__.__name__, len(self.tasks))
+
+    def add_task(self, task, requires=[], streams_from=[]):
+        if task not in self.requirements:
+            self.tasks.append(task)
+            self.requirements[task] = []
+            self.dependents[task] = []
+            self.streaming[task] = []
+        for req in requires:
+            self.add_dependency(task, req)
+        for req in streams_from:
+            self.add_dependency(task, req, streaming=True)
+        return task
+
+    def add_dependency(self, task, requirement, streaming=False):
+        """
+        Make `task` require `requirement` (both are added if needed). If `streaming`,
+        `task` consumes the outputs of `requirement` as they complete, so it can be
+        processed before `requirement` is complete (but it still comes after it in
+        the order and in the critical path).
+        """
+        self.add_task(task)
+        self.add_task(requirement)
+        if requirement in self.requirements[task]: return
+        if task is requirement or self.depends_on(requirement, task):
+            raise ValueError("Making {0} require {1} would make a cycle".format(task, requirement))
+        self.requirements[task].append(requirement)
+        self.dependents[requirement].append(task)
+        if streaming:
+            self.streaming[task].append(requirement)
+        # so that `Task.requirements_satisfied` agrees
+        task.set_requirements(self.get_blocking_requirements(task))
+
+    def depends_on(self, task, other):
+        """
+        Whether `task` (indirectly) requires `other`
+        """
+        to_visit = list(self.requirements.get(task, []))
+        seen = set()
+        while to_visit:
+            req = to_visit.pop()
+            if req is other: return True
+            if id(req) in seen: continue
+            seen.add(id(req))
+            to_visit.extend(self.requirements.get(req, []))
+        return False
+
+    def get_tasks(self):
+        """
+        Tasks in topological order (requirements first)
+        """
+        nreqs = dict((task, len(reqs)) for task, reqs in self.requirements.items())
+        order = [task for task in self.tasks if nreqs[task] == 0]
+        for task in order:
+            for dep in self.dependents[task]:
+                nreqs[dep] -= 1
+                if nreqs[dep] == 0:
+                    order.append(dep)
+        return order
+
+    def get_requirements(self, task):
+        return self.requirements[task]
+
+    def get_blocking_requirements(self, task):
+        return [req for req in self.requirements[task] if req not in self.streaming[task]]
+
+    def get_dependents(self, task):
+        return self.dependents[task]
+
+    def invalidate(self, task=None):
+        """
+        Forget the completion state of `task` (or of all tasks)
+        """
+        if task is None:
+            self.completion = {}
+        else:
+            self.completion.pop(task, None)
+
+    def is_complete(self, task):
+        token = get_change_token(task)
+        memo = self.completion.get(task)
+        if memo is None or (token is not None and memo[0] != token):
+            memo = self.completion[task] = (token, bool(task.complete()))
+        return memo[1]
+
+    def complete(self):
+        return all(self.is_complete(task) for task in self.tasks)
+
+    def is_ready(self, task):
+        return (not self.is_complete(task)) and all(self.is_complete(req) for req in self.get_blocking_requirements(task))
+
+    def get_remaining_cost(self, task):
+        """
+        Estimated work left for `task`, as the fraction of outputs not done yet
+        """
+        if self.is_complete(task): return 0.
+        try:
+            return max(1. - task.complete(return_fraction=True), 0.)
+        except TypeError:
+            # complete() of some tasks can't give a fraction
+            return 1.
+
+    def get_critical_path_lengths(self):
+        """
+        Returns {task: remaining cost of the longest chain from `task` to the end of the DAG}
+        """
+        lengths = {}
+        for task in reversed(self.get_tasks()):
+            downstream = [lengths[dep] for dep in self.dependents[task]]
+            lengths[task] = self.get_remaining_cost(task) + max(downstream + [0.])
+        return lengths
+
+    def get_ready_tasks(self):
+        """
+        Tasks that can be processed now, longest remaining chain first
+        """
+        ready = [task for task in self.get_tasks() if self.is_ready(task)]
+        if len(ready) > 1:
+            lengths = self.get_critical_path_lengths()
+            ready = sorted(ready, key=lambda task: -lengths[task])
+        return ready
+
+    def process_task(self, task):
+        """
+        Processes `task`, logging an exception instead of letting it stop the other
+        tasks. Returns the `sys.exc_info()` of the exception, or None
+        """
+        with Profiling.span("DAG.process_task"):
+            try:
+                task.process()
+            except Exception:
+                self.logger.error("Error while processing {0}:\n{1}".format(task, traceback.format_exc()))
+                return sys.exc_info()
+        return None
+
+    def process(self, raise_errors=False):
+        """
+        Process the ready tasks. When tasks complete, their dependents that became
+        ready are processed in the same call. Each task is processed at most once.
+        A task raising doesn't stop the others, but with `raise_errors`, the first
+        exception is raised again after the pass.
+        """
+        processed = set()
+        errors = []
+        while True:
+            ready = [task for task in self.get_ready_tasks() if id(task) not in processed]
+            if not ready: break
+            nthreads = min(self.nthreads, len(ready))
+            if nthreads > 1:
+                pool = ThreadPool(processes=nthreads)
+                try:
+                    results = pool.map(self.process_task, ready, chunksize=1)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                results = [self.process_task(task) for task in ready]
+            errors.extend(exc_info for exc_info in results if exc_info)
+            for task in ready:
+                processed.add(id(task))
+                self.invalidate(task)
+        if raise_errors and errors:
+            exc_type, exc_value, exc_tb = errors[0]
+            raise exc_type, exc_value, exc_tb
+        return len(processed)
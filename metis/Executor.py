@@ -0,0 +1,239 @@
+"""
+Backends that run the jobs of a `CondorTask`. A task submits, queries and removes
+its jobs through its executor (the `executor` kwarg), with the same arguments and
+job dicts as `Utils.condor_submit`, `Utils.condor_q` and `Utils.condor_rm`:
+    submit(**kwargs)                          -> (succeeded, cluster_id)
+    query(selection_pairs, extra_columns)     -> list of job dicts ("ClusterId" as "<cluster>.<proc>",
+                                                 "JobStatus", "EnteredCurrentStatus", the classads, ...)
+    remove(cluster_ids)
+
+- `CondorExecutor` (the default) goes to the condor schedd
+- `LocalExecutor` runs the jobs on this machine, in a bounded pool of processes,
+  e.g., for tests and small productions without a batch system
+- `WorkQueue.WorkQueueServer` hands them to pilots
+"""
+
+import os
+import time
+import errno
+import signal
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+
+import metis.Utils as Utils
+
+class Executor(object):
+
+    # submitting costs a schedd transaction, so a `SubmissionBroker` may group
+    # the submissions of several tasks
+    coalesce_submissions = False
+
+    def submit(self, **kwargs):
+        raise NotImplementedError
+
+    def query(self, selection_pairs=None, extra_columns=[]):
+        raise NotImplementedError
+
+    def remove(self, cluster_ids=[]):
+        raise NotImplementedError
+
+class CondorExecutor(Executor):
+
+    coalesce_submissions = True
+
+    def submit(self, **kwargs):
+        return Utils.condor_submit(**kwargs)
+
+    def query(self, selection_pairs=None, extra_columns=[]):
+        return Utils.condor_q(selection_pairs=selection_pairs, extra_columns=extra_columns, use_python_bindings=True)
+
+    def remove(self, cluster_ids=[]):
+        return Utils.condor_rm(cluster_ids)
+
+def get_job_selection(kwargs):
+    """
+    Per-job (arguments, classads) of `Utils.condor_submit` kwargs
+    """
+    v_arguments = kwargs["arguments"]
+    v_selection_pairs = kwargs.get("selection_pairs", [])
+    if not kwargs.get("multiple", False):
+        v_arguments, v_selection_pairs = [v_arguments], [v_selection_pairs]
+    classads = list(kwargs.get("classads", []))
+    v_classads = []
+    for ijob in range(len(v_arguments)):
+        pairs = list(v_selection_pairs[ijob]) if ijob < len(v_selection_pairs) else []
+        v_classads.append(dict((str(k), str(v)) for k, v in pairs + classads))
+    return [list(map(str, args)) for args in v_arguments], v_classads
+
+def write_job_ad(fname, classads, cluster_id, proc_id):
+    """
+    Job ad like the one condor gives jobs (that the executables read with getjobad)
+    """
+    with open(fname, "w") as fhout:
+        for key, val in list(classads.items()) + [("ClusterId", cluster_id), ("ProcId", proc_id), ("JobStartDate", int(time.time()))]:
+            fhout.write('{0} = "{1}"\n'.format(key, val))
+
+def matches(classads, selection_pairs):
+    return all(classads.get(str(k)) == str(v) for k, v in (selection_pairs or []))
+
+class LocalExecutor(Executor):
+
+    def __init__(self, nproc=None, workdir=None):
+        """
+        Runs jobs on this machine, at most `nproc` (default: number of cores) at a time.
+        Each job runs like a condor job: in a scratch directory (in `workdir`, default
+        /tmp/$USER/metis_local/) with the executable, input files and a job ad, and writes
+        logdir/std_logs/1e.<cluster>.<proc>.out/err. Jobs only live in this process.
+        """
+        self.nproc = nproc or multiprocessing.cpu_count()
+        self.workdir = os.path.abspath(workdir or "/tmp/{0}/metis_local/".format(os.getenv("USER")))
+        self.logger = logging.getLogger(Utils.setup_logger())
+
+        # cluster ids don't clash with condor ones (e.g., in the log file names)
+        self.next_cluster = int(time.time())
+        # id ("<cluster>.<proc>") to job, for the jobs that are queued or running
+        self.jobs = {}
+        self.queue = []
+        self.cond = threading.Condition()
+        self.workers = []
+        self.stopped = False
+
+    def start_workers(self):
+        # call with the lock held
+        self.workers = [w for w in self.workers if w.is_alive()]
+        while len(self.workers) < min(self.nproc, len(self.queue)):
+            worker = threading.Thread(target=self.work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, **kwargs):
+        if kwargs.get("fake", False):
+            return True, -1
+        v_arguments, v_classads = get_job_selection(kwargs)
+        logdir = os.path.abspath(kwargs["logdir"])
+        Utils.do_cmd("mkdir -p {0}/std_logs/".format(logdir))
+        with self.cond:
+            self.next_cluster += 1
+            cluster_id = "local{0}".format(self.next_cluster)
+            for proc_id, (arguments, classads) in enumerate(zip(v_arguments, v_classads)):
+                job = {
+                        "id": "{0}.{1}".format(cluster_id, proc_id),
+                        "executable": os.path.abspath(kwargs["executable"]),
+                        "arguments": arguments,
+                        "inputfiles": [os.path.abspath(fname) for fname in kwargs.get("inputfiles", [])],
+                        "classads": classads,
+                        "logdir": logdir,
+                        "status": "I",
+                        "entered": time.time(),
+                        "process": None,
+                        }
+                self.jobs[job["id"]] = job
+                self.queue.append(job)
+            self.start_workers()
+        return True, cluster_id
+
+    def query(self, selection_pairs=None, extra_columns=[]):
+        jobs = []
+        with self.cond:
+            for job in self.jobs.values():
+                if not matches(job["classads"], selection_pairs):
+                    continue
+                d_job = {
+                        "ClusterId": job["id"],
+                        "ProcId": job["id"].rsplit(".", 1)[1],
+                        "JobStatus": job["status"],
+                        "EnteredCurrentStatus": int(job["entered"]),
+                        "CMD": job["executable"],
+                        "ARGS": " ".join(job["arguments"]),
+                        "HoldReason": "undefined",
+                        }
+                for column in extra_columns:
+                    d_job[column] = job["classads"].get(column, "undefined")
+                jobs.append(d_job)
+        return jobs
+
+    def remove(self, cluster_ids=[]):
+        cluster_ids = [str(cid) for cid in cluster_ids]
+        with self.cond:
+            for jid, job in list(self.jobs.items()):
+                if jid not in cluster_ids and jid.rsplit(".", 1)[0] not in cluster_ids:
+                    continue
+                del self.jobs[jid]
+                if job in self.queue:
+                    self.queue.remove(job)
+                elif job["process"] and job["process"].poll() is None:
+                    # along with what the executable started
+                    try:
+                        os.killpg(job["process"].pid, signal.SIGTERM)
+                    except OSError as ex:
+                        # it exited in the meantime
+                        if ex.errno != errno.ESRCH:
+                            raise
+
+    def wait(self, timeout=None):
+        """
+        Block until all jobs are done (or `timeout` seconds pass). Returns whether they are.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.cond:
+            while self.jobs:
+                remaining = deadline - time.time() if deadline else 1.
+                if remaining <= 0: return False
+                self.cond.wait(min(remaining, 1.))
+        return True
+
+    def stop(self):
+        """
+        Kill the running jobs and forget the queued ones
+        """
+        with self.cond:
+            self.stopped = True
+            self.remove([job["id"] for job in self.jobs.values()])
+            self.cond.notify_all()
+            workers = list(self.workers)
+        # the killed jobs go quickly
+        for worker in workers:
+            worker.join(5.)
+
+    def work(self):
+        while True:
+            with self.cond:
+                if self.stopped or not self.queue:
+                    return
+                job = self.queue.pop(0)
+                job["status"] = "R"
+                job["entered"] = time.time()
+            try:
+                self.run_job(job)
+            except Exception as ex:
+                self.logger.warning("Local job {0} failed to run: {1}".format(job["id"], ex))
+            with self.cond:
+                self.jobs.pop(job["id"], None)
+                self.cond.notify_all()
+
+    def run_job(self, job):
+        Utils.do_cmd("mkdir -p {0}".format(self.workdir))
+        scratch = tempfile.mkdtemp(prefix="job_{0}_".format(job["id"]), dir=self.workdir)
+        try:
+            for fname in [job["executable"]] + job["inputfiles"]:
+                os.symlink(fname, os.path.join(scratch, os.path.basename(fname)))
+            jobad = os.path.join(scratch, ".job.ad")
+            write_job_ad(jobad, job["classads"], *job["id"].rsplit(".", 1))
+            env = dict(os.environ)
+            env.update(_CONDOR_JOB_AD=jobad, _CONDOR_SCRATCH_DIR=scratch)
+            prefix = "{0}/std_logs/1e.{1}".format(job["logdir"], job["id"])
+            with open(prefix + ".out", "w") as fhout, open(prefix + ".err", "w") as fherr:
+                with self.cond:
+                    if job["id"] not in self.jobs:
+                        return
+                    job["process"] = subprocess.Popen(["bash", os.path.basename(job["executable"])] + job["arguments"],
+                            cwd=scratch, env=env, stdout=fhout, stderr=fherr, preexec_fn=os.setsid)
+                job["process"].wait()
+            self.logger.debug("Local job {0} finished with status {1}".format(job["id"], job["process"].returncode))
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
@@ -1,6 +1,7 @@
 import os
 
 from metis.Constants import Constants
+import metis.Profiling as Profiling
 
 def is_data_by_filename(fname):
     """
@@ -93,10 +94,12 @@ class File(object):
         this file if True. Call the recheck() method to re-check.
         """
         if self.file_exists in [None, False]:
+            Profiling.count("stat")
             self.file_exists = os.path.exists(self.name)
         return self.file_exists
 
     def recheck(self):
+        if not self.fake: Profiling.count("stat")
         self.file_exists = self.fake or os.path.exists(self.name)
 
     def set_status(self, status):
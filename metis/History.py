@@ -0,0 +1,96 @@
+"""
+Bounded-size task history time series. A history is a dict of parallel lists,
+keyed by "timestamps" and one key per series (nevents_done, njobs_done, ...),
+as made by `StatsParser.summarize_task()`.
+
+`compact_history` rolls old points up into tiers (raw points for the last
+48h, hourly for the last 30 days, daily before that), so the stored history
+grows by at most one point per day. `downsample_history` picks a fixed
+budget of points for plotting with Largest-Triangle-Three-Buckets (LTTB).
+"""
+
+RAW_WINDOW = 48*3600
+HOURLY_WINDOW = 30*24*3600
+DEFAULT_NPOINTS = 300
+
+def get_series_names(history):
+    return sorted(k for k in history.keys() if k != "timestamps")
+
+def select(history, indices):
+    return dict((k, [v[i] for i in indices]) for k, v in history.items())
+
+def compact_history(history, now=None, raw_window=RAW_WINDOW, hourly_window=HOURLY_WINDOW):
+    """
+    Returns a copy of `history`, sorted by time, with one point per hour for points
+    older than `raw_window` and one point per day for points older than `hourly_window`.
+    The series are cumulative counts, so the rollup of a bucket is its last point.
+    """
+    timestamps = history.get("timestamps", [])
+    if not timestamps: return history
+    if now is None: now = max(timestamps)
+    # drop ragged entries rather than misalign the series
+    npoints = min(len(v) for v in history.values())
+    order = sorted(range(npoints), key=lambda i: timestamps[i])
+
+    def bucket(ts):
+        age = now - ts
+        if age > hourly_window: return ("d", ts//86400)
+        if age > raw_window: return ("h", ts//3600)
+        return ("r", ts)
+
+    # keep the last point of each bucket
+    last_in_bucket = {}
+    for i in order:
+        last_in_bucket[bucket(timestamps[i])] = i
+    indices = sorted(last_in_bucket.values(), key=lambda i: timestamps[i])
+    return select(history, indices)
+
+def lttb(xs, ys, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling (Steinarsson 2013).
+    Returns the sorted indices of the (at most `threshold`) points to keep,
+    always including the first and the last point.
+    """
+    npoints = len(xs)
+    if threshold >= npoints: return list(range(npoints))
+    if threshold < 3: return [0, npoints-1]
+
+    every = 1.0*(npoints-2)/(threshold-2)
+    indices = [0]
+    a = 0
+    for ibucket in range(threshold-2):
+        # average of the next bucket is the third vertex
+        lo_next = int((ibucket+1)*every)+1
+        hi_next = min(int((ibucket+2)*every)+1, npoints)
+        navg = hi_next-lo_next
+        avg_x = 1.0*sum(xs[lo_next:hi_next])/navg
+        avg_y = 1.0*sum(ys[lo_next:hi_next])/navg
+
+        # pick the point in the current bucket with the largest triangle
+        lo = int(ibucket*every)+1
+        hi = int((ibucket+1)*every)+1
+        best_area, best = -1., lo
+        for i in range(lo, hi):
+            area = abs((xs[a]-avg_x)*(ys[i]-ys[a]) - (xs[a]-xs[i])*(avg_y-ys[a]))
+            if area > best_area:
+                best_area, best = area, i
+        indices.append(best)
+        a = best
+    indices.append(npoints-1)
+    return indices
+
+def downsample_history(history, npoints=DEFAULT_NPOINTS):
+    """
+    Returns a copy of `history` with at most `npoints` points. Each series gets an
+    equal share of the budget and the union of the selected points is kept, so
+    features of every series survive.
+    """
+    timestamps = history.get("timestamps", [])
+    if len(timestamps) <= npoints: return history
+    names = get_series_names(history)
+    if not names: return select(history, lttb(timestamps, timestamps, npoints))
+    share = max(npoints // len(names), 3)
+    indices = set()
+    for name in names:
+        indices.update(lttb(timestamps, history[name], share))
+    return select(history, sorted(indices))
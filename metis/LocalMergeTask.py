@@ -1,4 +1,6 @@
 import os
+import shutil
+import multiprocessing
 
 from metis.Task import Task
 from metis.File import File, MutableFile
@@ -7,17 +9,51 @@ import metis.Utils as Utils
 import ROOT as r
 import time
 
+def merge_files(args):
+    """
+    Merge the input file names into the output file name, in the current process
+    (this is what the worker processes of a parallel merge run).
+    Returns the number of inputs that were included.
+    """
+    input_names, output_name, ignore_bad = args
+    fm = r.TFileMerger(len(input_names) > 1)
+    fm.OutputFile(output_name)
+    fm.SetFastMethod(True)
+    fm.SetMaxOpenedFiles(400)
+    fm.SetPrintLevel(0)
+    ngood = 0
+    for name in input_names:
+        ngood += fm.AddFile(name, False)
+    if not ignore_bad and (ngood != len(input_names)):
+        raise RuntimeError("Tried to merge {0} files into {1}, but only {2} of them got included properly".format(len(input_names), output_name, ngood))
+    if not fm.Merge():
+        raise RuntimeError("Failed to merge {0} files into {1}".format(len(input_names), output_name))
+    return ngood
+
+def partition(items, max_size):
+    """
+    Split `items` into the fewest groups of at most `max_size` items, of (almost) equal sizes
+    """
+    ngroups = (len(items)+max_size-1) // max_size
+    return [items[igroup::ngroups] for igroup in range(ngroups)]
+
 class LocalMergeTask(Task):
     def __init__(self, **kwargs):
         """
         Takes a list of input file paths and a single full absolute output filename
         and performs a single merge operation
+        With `nproc` > 1, the inputs are merged as a tree: groups of at most `fan_in` files
+        are merged concurrently (in `nproc` processes) into temporary files in `tmp_dir`
+        (default: a directory next to the output), which are then merged into the output
         """
         self.input_filenames = kwargs.get("input_filenames", [])
         self.output_filename = kwargs.get("output_filename", [])
         self.io_mapping = kwargs.get("io_mapping", [])
         self.ignore_bad = kwargs.get("ignore_bad", False)
         self.show_progress = kwargs.get("show_progress", True)
+        self.nproc = kwargs.get("nproc", 1)
+        self.fan_in = max(2, kwargs.get("fan_in", 50))
+        self.tmp_dir = kwargs.get("tmp_dir", None)
         self.update_mapping()
         super(self.__class__, self).__init__(**kwargs)
 
@@ -40,7 +76,10 @@ class LocalMergeTask(Task):
         done = all(map(lambda x: x.exists(), self.get_outputs()))
         self.logger.info("Begin processing")
         if not done:
-            self.merge_function(self.get_inputs(), self.get_outputs()[0])
+            if self.nproc > 1 and len(self.get_inputs()) > self.fan_in:
+                self.parallel_merge_function(self.get_inputs(), self.get_outputs()[0])
+            else:
+                self.merge_function(self.get_inputs(), self.get_outputs()[0])
         self.logger.info("End processing")
 
     def merge_function(self, inputs, output):
@@ -98,5 +137,44 @@ class LocalMergeTask(Task):
         # ch.Merge(output.get_name(), "fast")
         # self.logger.info("Done merging files into {0}".format(output.get_name()))
 
+    def parallel_merge_function(self, inputs, output):
+        fdir = output.get_basepath()
+        if not os.path.exists(fdir): Utils.do_cmd("mkdir -p {0}".format(fdir))
+        tmp_dir = "{0}/.merge_{1}_{2}/".format(self.tmp_dir or fdir, os.path.basename(output.get_name()), os.getpid())
+        Utils.do_cmd("mkdir -p {0}".format(tmp_dir))
+
+        ntotal = len(inputs)
+        if self.ignore_bad:
+            inputs = [inp for inp in inputs if inp.exists()]
+        names = [inp.get_name() for inp in inputs]
+        sizemb_in = sum(inp.get_filesizeMB() for inp in inputs)
+        self.logger.info("Merging {0} files ({1:.1f}MB) with {2} processes, at most {3} files at a time".format(len(names), sizemb_in, self.nproc, self.fan_in))
+
+        t0 = time.time()
+        pool = multiprocessing.Pool(processes=self.nproc)
+        try:
+            level = 0
+            while len(names) > self.fan_in:
+                level += 1
+                groups = partition(names, self.fan_in)
+                names = ["{0}/level{1}_{2}.root".format(tmp_dir, level, igroup) for igroup in range(len(groups))]
+                ngood = sum(pool.map(merge_files, [(group, name, self.ignore_bad) for group, name in zip(groups, names)], chunksize=1))
+                self.logger.info("Merged level {0} into {1} files ({2} inputs included)".format(level, len(names), ngood))
+            pool.close()
+            merge_files((names, output.get_name(), False))
+        except:
+            pool.terminate()
+            MutableFile(output).rm()
+            raise
+        finally:
+            pool.join()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        t1 = time.time()
+        sizemb = output.get_filesizeMB()
+
+        self.logger.info("Done merging {} of {} files into {} ({:.1f}MB) in {} levels. Took {:.2f} secs @ {:.1f}MB/s ({:.1f}MB/s of inputs)".format(
+            len(inputs), ntotal, output.get_name(), sizemb, level+1, t1-t0, sizemb/(t1-t0), sizemb_in/(t1-t0)))
+
 if __name__ == "__main__":
     pass
@@ -3,15 +3,116 @@ from __future__ import print_function
 import os
 import datetime
 import time
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+DIGEST_NAME = "log_digest.db"
+MAX_OPEN_DIGESTS = 16
+ALL_PARTS = ("error", "header", "rate")
+REPORT_PREFIX = "METIS_JOB_REPORT: "
+CHUNK_PREFIX = "[chunk] ichunk="
+
+def read_job_report(fname_out, chunksize=64*1024, maxsize=4*1024*1024):
+    """
+    Return the JSON job report that the executables print as their last
+    stdout line, or an empty dict if there isn't one. Only the tail of the
+    log is read (growing the window only if the report line is very long).
+    """
+    size = os.path.getsize(fname_out)
+    with open(fname_out, "r") as fhin:
+        while True:
+            start = max(0, size-chunksize)
+            fhin.seek(start)
+            tail = fhin.read()
+            idx = tail.rfind(REPORT_PREFIX)
+            if idx >= 0:
+                line = tail[idx+len(REPORT_PREFIX):].split("\n", 1)[0]
+                try:
+                    return json.loads(line)
+                except ValueError:
+                    return {}
+            if start == 0 or chunksize >= maxsize:
+                return {}
+            # could just be a long report line (e.g., many input files)
+            if "\n" in tail.rstrip("\n"):
+                return {}
+            chunksize *= 4
+
+def is_packed_log(fname_out, headsize=4096):
+    """
+    Whether the log comes from a job running several chunks (see executables/condor_packed_exe.sh),
+    which starts by announcing its first chunk
+    """
+    with open(fname_out, "r") as fhin:
+        return "--- begin chunk " in fhin.read(headsize)
+
+def read_chunk_reports(fname_out):
+    """
+    Return a dict of output index (as a string, like once through JSON) to the job report
+    of each chunk of a packed job. Each chunk prints its own report, followed by the
+    "[chunk]" status line with its index.
+    """
+    reports = {}
+    report = {}
+    with open(fname_out, "r") as fhin:
+        for line in fhin:
+            if line.startswith(REPORT_PREFIX):
+                try:
+                    report = json.loads(line[len(REPORT_PREFIX):])
+                except ValueError:
+                    report = {}
+            elif line.startswith(CHUNK_PREFIX):
+                fields = dict(x.split("=", 1) for x in line.split()[1:] if "=" in x)
+                if report and fields.get("index", "").isdigit():
+                    reports[str(int(fields["index"]))] = report
+                report = {}
+    return reports
+
+def apply_job_report(d_log, report):
+    """
+    Fill a parsed log with what the job report has
+    """
+    d_log["job_report"] = report
+    d_log["args"] = report.get("header", {})
+    d_log["event_rate"] = report.get("event_rate", -1)
+    d_log["timestamps"] = report.get("timestamps", {})
+    d_log["stageout"] = report.get("stageout", [])
+    d_log["site"] = d_log["args"].get("GLIDEIN_CMSSite","")
+    return d_log
+
+def get_chunk_log(d_log, index):
+    """
+    Return the parsed log as seen by output `index`: for a packed job, the report of
+    the chunk that made this output replaces that of the last chunk
+    """
+    report = d_log.get("chunk_reports", {}).get(str(index))
+    if not report:
+        return d_log
+    return apply_job_report(dict(d_log), report)
 
 def log_parser(fname, do_rate=True, do_error=True, do_header=True):
     fname_out = fname.replace(".err", ".out")
     fname_err = fname.replace(".out", ".err")
 
-    d_log = {"args": {}, "dstat": {}}
+    d_log = {"args": {}, "dstat": {}, "timestamps": {}, "stageout": []}
 
     if not os.path.exists(fname_out): return d_log
 
+    # If the job left a structured report, take what we can from it and
+    # only fall back to text parsing for the pieces it doesn't cover
+    report = read_job_report(fname_out)
+    if report:
+        apply_job_report(d_log, report)
+        # a packed job has one report per chunk (see `get_chunk_log`)
+        if is_packed_log(fname_out):
+            d_log["chunk_reports"] = read_chunk_reports(fname_out)
+        do_header = False
+        if d_log["event_rate"] > 0: do_rate = False
+        # the report only knows the exit code of a crash, so the error text still comes from stderr
+        if report.get("exit_codes", {}).get("cmsrun", -1) == 0: do_error = False
+
     inheader = False
     if do_header:
         with open(fname_out, "r") as fhin:
@@ -21,12 +122,27 @@ def log_parser(fname, do_rate=True, do_error=True, do_header=True):
                 if inheader and ":" in line:
                     argname, argval = map(lambda x: x.strip(), line.split(":", 1))
                     d_log["args"][argname] = argval
+                # timestamps printed by the executables outside of the header
+                elif line.startswith("time before copy:") or line.startswith("time at end:"):
+                    key = "stageout_start" if "copy" in line else "end"
+                    try:
+                        d_log["timestamps"][key] = int(line.split(":", 1)[1])
+                    except ValueError:
+                        pass
+                # summary line of each transfer (see executables/metis_stageout.sh)
+                elif line.startswith("[stageout] status="):
+                    fields = dict(x.split("=", 1) for x in line.split()[1:] if "=" in x)
+                    try:
+                        d_log["stageout"].append({"status": int(fields["status"]), "attempts": int(fields["attempts"]),
+                            "seconds": float(fields["seconds"]), "bytes": int(float(fields["MB"])*1048576), "dest": fields["dest"]})
+                    except (KeyError, ValueError):
+                        pass
 
     if not os.path.exists(fname_err): return d_log
 
     error_msg = ""
     error_cat = ""
-    avg_rate = -1
+    avg_rate = d_log.get("event_rate", -1)
 
     inerror = False
     inexception = False
@@ -66,6 +182,145 @@ def log_parser(fname, do_rate=True, do_error=True, do_header=True):
 
     return d_log
 
+class LogDigest(object):
+    """
+    Persistent cache of parsed condor logs, stored as a small SQLite file
+    next to the logs themselves (so one per task). Entries are keyed by the
+    path of the .out log and invalidated whenever the size or mtime of the
+    .out or .err file changes, so logs of finished jobs are only ever parsed once.
+    Each entry remembers which parts (header, error, rate) were parsed, and is only
+    reparsed when a caller asks for a part it doesn't have yet.
+    Writes are committed lazily (every `commit_every` new entries, or on `commit()`).
+    The connection can be shared between threads; all access goes through `self.lock`.
+    """
+
+    def __init__(self, dbname, commit_every=200):
+        self.dbname = dbname
+        self.commit_every = commit_every
+        self.nuncommitted = 0
+        self.nhits = 0
+        self.nmisses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.dbname, timeout=60., check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS logs (
+                                path TEXT PRIMARY KEY,
+                                out_size INTEGER, out_mtime REAL,
+                                err_size INTEGER, err_mtime REAL,
+                                parsed TEXT, parts TEXT)""")
+        # digests written before the parts were tracked always hold the full parse
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(logs)")]
+        if "parts" not in columns:
+            self.conn.execute("ALTER TABLE logs ADD COLUMN parts TEXT DEFAULT '{0}'".format(",".join(ALL_PARTS)))
+        self.conn.commit()
+
+    def get_stamp(self, fname):
+        try:
+            st = os.stat(fname)
+            return st.st_size, st.st_mtime
+        except OSError:
+            return -1, -1.
+
+    def parse(self, fname, do_rate=True, do_error=True, do_header=True):
+        """
+        Return the parse of the log `fname` (.out or .err) with at least the requested parts,
+        only running the text parser if the log is new, has changed, or is missing one of them
+        """
+        fname_out = fname.replace(".err", ".out")
+        fname_err = fname.replace(".out", ".err")
+        out_size, out_mtime = self.get_stamp(fname_out)
+        err_size, err_mtime = self.get_stamp(fname_err)
+        if out_size < 0:
+            # nothing to cache if the job hasn't even returned its logs yet
+            return log_parser(fname, do_rate=do_rate, do_error=do_error, do_header=do_header)
+
+        wanted = set(part for part, do in zip(ALL_PARTS, (do_error, do_header, do_rate)) if do)
+        stamp = (out_size, out_mtime, err_size, err_mtime)
+        with self.lock:
+            row = self.conn.execute("SELECT out_size, out_mtime, err_size, err_mtime, parsed, parts FROM logs WHERE path=?", (fname_out,)).fetchone()
+            if row and tuple(row[:4]) == stamp:
+                parts = set((row[5] or "").split(","))
+                if wanted <= parts:
+                    self.nhits += 1
+                    return json.loads(row[4])
+                # same log, so keep what was parsed before and add the missing parts
+                wanted |= parts
+            self.nmisses += 1
+
+        parsed = log_parser(fname, do_rate=("rate" in wanted), do_error=("error" in wanted), do_header=("header" in wanted))
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO logs VALUES (?,?,?,?,?,?,?)",
+                    (fname_out,) + stamp + (json.dumps(parsed), ",".join(sorted(wanted))))
+            self.nuncommitted += 1
+            if self.nuncommitted >= self.commit_every:
+                self._commit()
+        return parsed
+
+    def _commit(self):
+        if self.nuncommitted:
+            self.conn.commit()
+            self.nuncommitted = 0
+
+    def commit(self):
+        with self.lock:
+            self._commit()
+
+    def close(self):
+        with self.lock:
+            self._commit()
+            self.conn.close()
+
+# Open digests, keyed by (pid, log directory), least recently used first. The pid is part
+# of the key so that forked worker processes never reuse a connection inherited from their
+# parent. Threads share the digests (see `LogDigest.lock`), and at most `MAX_OPEN_DIGESTS`
+# are kept open at once.
+_digests = OrderedDict()
+_digests_lock = threading.Lock()
+
+def get_digest(fname):
+    logdir = os.path.dirname(os.path.abspath(fname))
+    key = (os.getpid(), logdir)
+    evicted = []
+    with _digests_lock:
+        digest = _digests.pop(key, None)
+        if digest is None:
+            digest = LogDigest(os.path.join(logdir, DIGEST_NAME))
+        _digests[key] = digest
+        while len(_digests) > MAX_OPEN_DIGESTS:
+            evicted.append(_digests.popitem(last=False))
+    for old_key, old_digest in evicted:
+        # a digest inherited from a parent process belongs to the parent, so just drop it
+        if old_key[0] != os.getpid(): continue
+        try:
+            old_digest.close()
+        except sqlite3.Error:
+            pass
+    return digest
+
+def cached_log_parser(fname, do_rate=True, do_error=True, do_header=True):
+    """
+    Drop-in replacement for `log_parser` that goes through the per-task `LogDigest`.
+    The result has at least the requested parts (more if an earlier call already parsed them).
+    Falls back to plain text parsing if the digest can't be used (e.g., read-only log area).
+    """
+    try:
+        return get_digest(fname).parse(fname, do_rate=do_rate, do_error=do_error, do_header=do_header)
+    except sqlite3.Error:
+        return log_parser(fname, do_rate=do_rate, do_error=do_error, do_header=do_header)
+
+def commit_digests():
+    """
+    Flush pending digest entries to disk and close the digests of this process
+    (they get reopened on the next use)
+    """
+    with _digests_lock:
+        keys = [key for key in _digests if key[0] == os.getpid()]
+        digests = [_digests.pop(key) for key in keys]
+    for digest in digests:
+        try:
+            digest.close()
+        except sqlite3.Error:
+            pass
+
 # def log_parser_old(fname):
 #     if fname.endswith(".err"):
 #         fname = fname.replace(".err", ".out")
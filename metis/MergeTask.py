@@ -0,0 +1,118 @@
+import os
+import json
+
+from metis.CondorTask import CondorTask
+from metis.Sample import TaskOutputSample
+import metis.Utils as Utils
+
+class MergeTask(CondorTask):
+    def __init__(self, **kwargs):
+
+        """
+        Merge the outputs of another `CondorTask` (e.g., a `CMSSWTask`) into fewer files of
+        about `target_size_GB` each, grouping them by size (see `Utils.file_packer`).
+        The outputs are consumed as they complete (see `TaskOutputSample`), so merging
+        can start before the input task is done.
+
+        :kwarg input_task: the task whose outputs are merged
+        :kwarg target_size_GB: size to aim for, for the merged files (default 4)
+        :kwarg local: merge in this process with `LocalMergeTask` instead of submitting
+            condor jobs (running `condor_hadd.sh`)
+        :kwarg local_nproc: processes per local merge (see `LocalMergeTask`)
+        By default, the merged files go next to the input task outputs (in <output_dir>_merged/),
+        with the same tag and CMSSW release
+        """
+        if "input_task" not in kwargs:
+            raise Exception("Need parameters: input_task")
+        input_task = kwargs["input_task"]
+        self.target_size_GB = kwargs.get("target_size_GB", 4.)
+        self.local = kwargs.get("local", False)
+        self.local_nproc = kwargs.get("local_nproc", 1)
+        self.input_executable = kwargs.get("executable", self.get_metis_base() + "metis/executables/condor_hadd.sh")
+
+        kwargs.setdefault("sample", TaskOutputSample(task=input_task, dataset=input_task.get_sample().get_datasetname()))
+        kwargs.setdefault("output_name", "merged_ntuple.root")
+        kwargs.setdefault("output_dir", input_task.get_outputdir().rstrip("/") + "_merged/")
+        kwargs.setdefault("tag", input_task.tag)
+        kwargs.setdefault("cmssw_version", input_task.cmssw_version)
+        kwargs.setdefault("scram_arch", input_task.scram_arch)
+        kwargs["MB_per_output"] = 1024.*self.target_size_GB
+
+        # Pass all of the kwargs to the parent class
+        super(MergeTask, self).__init__(**kwargs)
+
+    def chunk_files(self, files, flush=False):
+        return Utils.file_packer(files, MB_per_output=self.MB_per_output, flush=flush)
+
+    def run(self, fake=False, optimizer=None, broker=None):
+        if not self.local:
+            return super(MergeTask, self).run(fake=fake, optimizer=optimizer, broker=broker)
+
+        for ins, out in self.io_mapping:
+            if not out.exists() and not fake:
+                # needs ROOT
+                from metis.LocalMergeTask import LocalMergeTask
+                LocalMergeTask(
+                        input_filenames=[inp.get_name() for inp in ins],
+                        output_filename=out.get_name(),
+                        nproc=self.local_nproc,
+                        show_progress=False,
+                        no_load_from_backup=True,
+                        ).process()
+                out.recheck()
+            if fake:
+                out.set_fake()
+            if out.exists():
+                self.handle_done_output(out)
+
+    def finalize(self):
+        self.write_metadata(self.get_metadata())
+
+    def get_metadata(self):
+        """
+        Metadata of the input task (if it wrote a metadata.json), with the jobs
+        remapped to the merged files
+        - ijob_to_inputs: input task outputs in each merged file
+        - ijob_to_miniaod: inputs of the input task in each merged file (if known)
+        - ijob_to_nevents: summed [nevents, effective nevents]
+        """
+        d_metadata = {}
+        fname_input_metadata = self.input_task.get_outputdir() + "/metadata.json"
+        if os.path.exists(fname_input_metadata):
+            with open(fname_input_metadata, "r") as fhin:
+                d_metadata = json.load(fhin)
+        input_ijob_to_nevents = d_metadata.get("ijob_to_nevents", {})
+        input_ijob_to_miniaod = d_metadata.get("ijob_to_miniaod", {})
+
+        d_metadata["ijob_to_inputs"] = {}
+        d_metadata["ijob_to_miniaod"] = {}
+        d_metadata["ijob_to_nevents"] = {}
+        done_nevents = 0
+        for ins, out in self.get_io_mapping():
+            ijob = out.get_index()
+            d_metadata["ijob_to_inputs"][ijob] = [inp.get_name() for inp in ins]
+            d_metadata["ijob_to_miniaod"][ijob] = sum([input_ijob_to_miniaod.get(str(inp.get_index()), []) for inp in ins], [])
+            nevents, nevents_eff = 0, 0
+            for inp in ins:
+                default = [inp.get_nevents(), inp.get_nevents()]
+                inp_nevents, inp_nevents_eff = input_ijob_to_nevents.get(str(inp.get_index()), default)
+                nevents += inp_nevents
+                nevents_eff += inp_nevents_eff
+            d_metadata["ijob_to_nevents"][ijob] = [nevents, nevents_eff]
+            done_nevents += nevents
+        d_metadata["input_dir"] = self.input_task.get_outputdir()
+        d_metadata["taskdir"] = os.path.abspath(self.get_taskdir())
+        d_metadata["tag"] = self.tag
+        d_metadata["dataset"] = self.get_sample().get_datasetname()
+        d_metadata["nevents_merged"] = done_nevents
+        d_metadata["finaldir"] = self.get_outputdir()
+        return d_metadata
+
+    def write_metadata(self, d_metadata):
+        metadata_file = d_metadata["finaldir"] + "/metadata.json"
+        with open(metadata_file, "w") as fhout:
+            json.dump(d_metadata, fhout, sort_keys=True, indent=4)
+        self.logger.info("Dumped metadata to {0}".format(metadata_file))
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,235 @@
+"""
+In-process metrics registry (counters, gauges, histograms) for alerting on
+Metis health, exported in the Prometheus text format (version 0.0.4), either
+    - as a textfile for the node_exporter textfile collector, written at the end of
+      every `StatsParser.do` if METIS_METRICS_FILE is set (or via `write_textfile`)
+    - or on /metrics of the `StatusServer`
+
+Updating a metric is a dict lookup and an addition under a lock, so it can stay on.
+The metrics Metis itself updates are declared at the bottom of this file.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+# in seconds, suited for loop/submission/query latencies
+DEFAULT_BUCKETS = [0.1, 0.5, 1., 2.5, 5., 10., 30., 60., 120., 300., 600., 1800., float("inf")]
+
+def format_value(val):
+    if val == float("inf"): return "+Inf"
+    if val == float("-inf"): return "-Inf"
+    if isinstance(val, float) and val == int(val) and abs(val) < 1e15: return str(int(val))
+    return repr(val)
+
+def escape_label_value(val):
+    return str(val).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(labels):
+    if not labels: return ""
+    return "{" + ",".join('{0}="{1}"'.format(k, escape_label_value(v)) for k, v in labels) + "}"
+
+class Metric(object):
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=[]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def get_key(self, labels):
+        if set(labels.keys()) != set(self.labelnames):
+            raise ValueError("{0} takes labels {1}, got {2}".format(self.name, list(self.labelnames), sorted(labels.keys())))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def get(self, **labels):
+        return self.values.get(self.get_key(labels))
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+
+    def samples(self):
+        """
+        Returns a list of (name, [(label name, label value)], value)
+        """
+        with self.lock:
+            return [(self.name, list(zip(self.labelnames, key)), val) for key, val in sorted(self.values.items())]
+
+    def render(self):
+        lines = [
+                "# HELP {0} {1}".format(self.name, self.documentation.replace("\\", "\\\\").replace("\n", "\\n")),
+                "# TYPE {0} {1}".format(self.name, self.kind),
+                ]
+        for name, labels, val in self.samples():
+            lines.append("{0}{1} {2}".format(name, format_labels(labels), format_value(val)))
+        return "\n".join(lines)
+
+class Counter(Metric):
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only go up")
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def remove(self, **labels):
+        """
+        Drop one label combination (e.g., a task that is gone)
+        """
+        key = self.get_key(labels)
+        with self.lock:
+            self.values.pop(key, None)
+
+class Histogram(Metric):
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=[], buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = sorted(set(buckets) | set([float("inf")]))
+
+    def observe(self, value, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # [count per bucket (not cumulative)..., sum]
+                counts = self.values[key] = [0]*len(self.buckets) + [0.]
+            for ibucket, upper in enumerate(self.buckets):
+                if value <= upper:
+                    counts[ibucket] += 1
+                    break
+            counts[-1] += value
+
+    def get(self, **labels):
+        """
+        Returns {"count", "sum", "buckets": {upper bound: cumulative count}}, or None
+        """
+        counts = self.values.get(self.get_key(labels))
+        if counts is None: return None
+        cumulative, buckets = 0, OrderedDict()
+        for upper, count in zip(self.buckets, counts[:-1]):
+            cumulative += count
+            buckets[upper] = cumulative
+        return {"count": cumulative, "sum": counts[-1], "buckets": buckets}
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, counts in items:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for upper, count in zip(self.buckets, counts[:-1]):
+                cumulative += count
+                samples.append((self.name + "_bucket", labels + [("le", format_value(upper))], cumulative))
+            samples.append((self.name + "_sum", labels, counts[-1]))
+            samples.append((self.name + "_count", labels, cumulative))
+        return samples
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = OrderedDict()
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Add `metric`, or return the already registered one of the same name and type
+        """
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) != type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError("Metric {0} is already registered differently".format(metric.name))
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=[]):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=[]):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=[], buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets=buckets))
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "".join(metric.render() + "\n" for metric in metrics)
+
+    def write_textfile(self, fname):
+        """
+        Write the exposition atomically, as the textfile collector requires
+        """
+        tmpname = "{0}.tmp{1}".format(fname, os.getpid())
+        with open(tmpname, "w") as fhout:
+            fhout.write(self.render())
+        os.rename(tmpname, fname)
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def render():
+    return REGISTRY.render()
+
+def write_textfile(fname=None):
+    """
+    Write all metrics into `fname` (default: $METIS_METRICS_FILE, if set)
+    """
+    fname = fname or os.getenv("METIS_METRICS_FILE", "")
+    if fname:
+        REGISTRY.write_textfile(fname)
+
+LOOP_DURATION = REGISTRY.histogram("metis_loop_duration_seconds",
+        "Wall time of a loop iteration (time between StatsParser.do calls)")
+LAST_LOOP = REGISTRY.gauge("metis_last_loop_timestamp_seconds",
+        "Unix time at which the last loop iteration ended")
+CONDOR_JOBS = REGISTRY.gauge("metis_condor_jobs",
+        "Condor jobs of a task on the schedd, by status (R, I, H, ...)", ["task", "status"])
+JOBS_SUBMITTED = REGISTRY.counter("metis_jobs_submitted_total",
+        "Jobs submitted (including resubmissions)", ["task"])
+JOBS_RESUBMITTED = REGISTRY.counter("metis_jobs_resubmitted_total",
+        "Jobs submitted for an output that was already submitted before", ["task"])
+JOBS_REMOVED = REGISTRY.counter("metis_jobs_removed_total",
+        "Jobs removed by Metis, by reason (long running, held)", ["task", "reason"])
+CONDOR_SUBMIT = REGISTRY.counter("metis_condor_submit_total",
+        "condor_submit calls, by result (success, failure)", ["result"])
+CONDOR_SUBMIT_DURATION = REGISTRY.histogram("metis_condor_submit_duration_seconds",
+        "Latency of condor_submit calls")
+CONDOR_Q_DURATION = REGISTRY.histogram("metis_condor_q_duration_seconds",
+        "Latency of condor_q queries")
+CONDOR_Q_FAILURES = REGISTRY.counter("metis_condor_q_failures_total",
+        "condor_q queries that raised")
+TASK_JOBS = REGISTRY.gauge("metis_task_jobs",
+        "Jobs (outputs) of a task, by state (total, done)", ["dataset", "tag", "state"])
+TASK_EVENTS = REGISTRY.gauge("metis_task_events",
+        "Events of a task, by state (total, done)", ["dataset", "tag", "state"])
+SITE_JOBS = REGISTRY.gauge("metis_site_jobs",
+        "Over the tasks in the last summary, completed jobs and failed attempts per site", ["site", "result"])
@@ -11,7 +11,8 @@ from metis.Sample import DBSSample
 from metis.CMSSWTask import CMSSWTask
 from metis.StatsParser import StatsParser
 from metis.Utils import send_email, interruptible_sleep, cached, from_timestamp, good_sites
-from metis.LogParser import log_parser
+from metis.LogParser import cached_log_parser, commit_digests, get_chunk_log
+import metis.Profiling as Profiling
 from pprint import pprint
 
 import scripts.dis_client as dis
@@ -26,6 +27,7 @@ import urllib
     # path-match="/+store/(data/Run2017[A-Z]/[^/]+/MINIAOD/31Mar2018-.*)"
 
 def get_file_replicas_uncached(dsname, dasgoclient=False):
+    Profiling.count("dis_query")
     if os.getenv("USEDASGOCLIENT", False):
         dasgoclient = True
     if dasgoclient:
@@ -66,6 +68,7 @@ class Optimizer(object):
         """
         pass
 
+    @Profiling.profiled()
     def get_sites(self, task, v_ins, v_out):
 
         replica_info = get_file_replicas(task.get_sample().get_datasetname())
@@ -82,7 +85,7 @@ class Optimizer(object):
             times_run = {}
             for cid in cids:
                 logfname = "{0}/1e.{1}.{2}".format(logdir_full, cid, "out")
-                parsed = log_parser(logfname,do_header=True,do_error=False,do_rate=False)
+                parsed = get_chunk_log(cached_log_parser(logfname,do_header=True,do_error=False,do_rate=False), index)
                 site = parsed.get("site","")
                 if not site: continue
                 already_ran.update(site)
@@ -137,6 +140,8 @@ class Optimizer(object):
 
             raise RuntimeError("No sites to submit to. good_sites = {}, last_run_site = {}".format(good_sites,last_run_site))
             
+        commit_digests()
+
         if len(v_csvsites) != len(v_out):
             raise RuntimeError("Optimizer failed to give desired sites list with length ({}) equal to the jobs ({})".format(len(v_csvsites), len(v_out)))
 
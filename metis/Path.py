@@ -1,10 +1,12 @@
 import logging
 
 from metis.Utils import setup_logger
+from metis.DAG import DAG
 
 class Path(object):
     def __init__(self, tasks):
         self.tasks = tasks
+        self.dag = None
 
         self.logger = logging.getLogger(setup_logger())
 
@@ -28,21 +30,22 @@ class Path(object):
 
     def compute(self):
         """
-        Compute dependencies of this path
-        Very simple right now. For example, loops through
-        task list in pairs and sets latter task requirement
-        to former task
+        Compute dependencies of this path, i.e., a `DAG` where
+        each task requires the previous one. For anything more
+        general than a chain, use a `DAG` directly.
         """
-        for t1, t2 in zip(self.tasks, self.tasks[1:]):
-            t2.set_requirements([t1])
+        if self.dag is None:
+            self.dag = DAG(nthreads=1)
+            for task in self.tasks:
+                self.dag.add_task(task)
+            for t1, t2 in zip(self.tasks, self.tasks[1:]):
+                self.dag.add_dependency(t2, t1)
+        return self.dag
 
     def process(self):
-        # Compute dependencies before running path
-        self.compute()
-
-        for task in self.tasks:
-            if not task.complete():
-                task.process()
+        # Compute dependencies before running path. Exceptions of tasks
+        # propagate, after the other ready tasks are processed
+        self.compute().process(raise_errors=True)
 
     def complete(self):
         """
@@ -0,0 +1,180 @@
+"""
+Lightweight instrumentation for the submission loop.
+
+- `span(name)` (context manager) and `profiled()` (decorator) time the hot paths
+- `count(name)` counts external calls (schedd queries, DIS queries, stats, forks, ...)
+- `end_iteration()` logs a per-iteration report and resets the numbers
+- `enable_trace(fname)` (or the METIS_TRACE_FILE environment variable) additionally
+  records every span and appends them to a Chrome trace-event JSON file at the end of
+  each iteration, to inspect in chrome://tracing or https://ui.perfetto.dev
+
+Spans nest, and the report shows inclusive times, so e.g. "CondorTask.process"
+includes "CondorTask.run", which includes "Utils.condor_q".
+"""
+
+import os
+import json
+import time
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+# events written to a trace file at most
+MAX_TRACE_EVENTS = 500000
+# the trace file is TRACE_HEAD, the events separated by ",\n", and TRACE_TAIL
+TRACE_HEAD = '{"displayTimeUnit": "ms", "traceEvents": [\n'
+TRACE_TAIL = '\n]}\n'
+
+_lock = threading.Lock()
+# serializes the writes to the trace file
+_trace_lock = threading.Lock()
+_state = {
+        "iteration_start": time.time(),
+        "spans": {},      # name -> [calls, total seconds, max seconds]
+        "counters": {},   # name -> count (this iteration)
+        "totals": {},     # name -> count (since the start, for the trace counter tracks)
+        "trace_fname": os.getenv("METIS_TRACE_FILE", ""),
+        "trace_events": [],  # recorded since the last dump
+        "trace_nevents": 0,  # recorded since the trace was enabled
+        "trace_written": None,  # events in the trace file, None until it's started
+        }
+
+def enable_trace(fname):
+    """
+    Record all spans and append them to `fname` (Chrome trace-event JSON, started over)
+    at each `end_iteration`
+    """
+    with _lock:
+        _state["trace_fname"] = fname
+        _state["trace_events"] = []
+        _state["trace_nevents"] = 0
+        _state["trace_written"] = None
+
+def count(name, n=1):
+    with _lock:
+        _state["counters"][name] = _state["counters"].get(name, 0) + n
+        _state["totals"][name] = _state["totals"].get(name, 0) + n
+
+def record_span(name, t0, duration, args=None):
+    with _lock:
+        stats = _state["spans"].get(name)
+        if stats is None:
+            stats = _state["spans"][name] = [0, 0., 0.]
+        stats[0] += 1
+        stats[1] += duration
+        stats[2] = max(stats[2], duration)
+        if _state["trace_fname"] and _state["trace_nevents"] < MAX_TRACE_EVENTS:
+            event = {
+                    "name": name, "cat": "metis", "ph": "X",
+                    "ts": int(t0*1e6), "dur": int(duration*1e6),
+                    "pid": os.getpid(), "tid": threading.current_thread().ident,
+                    }
+            if args: event["args"] = args
+            _state["trace_events"].append(event)
+            _state["trace_nevents"] += 1
+
+@contextmanager
+def span(name, **args):
+    """
+    Time the enclosed block under `name`. Extra kwargs end up in the trace event.
+    """
+    t0 = time.time()
+    try:
+        yield
+    finally:
+        record_span(name, t0, time.time()-t0, args)
+
+def profiled(name=None):
+    """
+    Decorator version of `span`. For methods, the default name is
+    <class of the instance>.<method>, so subclasses show up separately.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            span_name = name
+            if span_name is None:
+                if args and hasattr(args[0], func.__name__):
+                    span_name = "{0}.{1}".format(type(args[0]).__name__, func.__name__)
+                else:
+                    span_name = func.__name__
+            t0 = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_span(span_name, t0, time.time()-t0)
+        return wrapper
+    return decorator
+
+def get_report(reset=False):
+    """
+    Returns {"wall": seconds since the iteration started, "spans": {name: {"calls", "total", "max"}},
+    "counters": {name: count}}
+    """
+    with _lock:
+        now = time.time()
+        report = {
+                "wall": now - _state["iteration_start"],
+                "spans": dict((k, {"calls": v[0], "total": v[1], "max": v[2]}) for k, v in _state["spans"].items()),
+                "counters": dict(_state["counters"]),
+                }
+        if reset:
+            _state["iteration_start"] = now
+            _state["spans"] = {}
+            _state["counters"] = {}
+    return report
+
+def format_report(report):
+    lines = ["Iteration took {0:.1f}s".format(report["wall"])]
+    spans = sorted(report["spans"].items(), key=lambda x: -x[1]["total"])
+    if spans:
+        width = max(len(name) for name, _ in spans)
+        lines.append("  {0:<{w}s} {1:>7s} {2:>9s} {3:>8s} {4:>6s}".format("span", "calls", "total [s]", "max [s]", "% wall", w=width))
+        for name, stats in spans:
+            lines.append("  {0:<{w}s} {1:>7d} {2:>9.2f} {3:>8.2f} {4:>6.1f}".format(
+                name, stats["calls"], stats["total"], stats["max"], 100.*stats["total"]/max(report["wall"], 1e-9), w=width))
+    if report["counters"]:
+        lines.append("  counts: " + ", ".join("{0}={1}".format(k, v) for k, v in sorted(report["counters"].items())))
+    return "\n".join(lines)
+
+def dump_trace():
+    """
+    Append the spans (and counter tracks) recorded since the last dump to the trace file,
+    and forget them. The file is valid trace-event JSON after each dump, and only the
+    new events are written.
+    """
+    with _trace_lock:
+        with _lock:
+            fname = _state["trace_fname"]
+            if not fname: return
+            events, _state["trace_events"] = _state["trace_events"], []
+            nwritten = _state["trace_written"]
+            _state["trace_written"] = (nwritten or 0) + len(events)
+        body = ",\n".join(json.dumps(event) for event in events)
+        if nwritten is None:
+            with open(fname, "w") as fhout:
+                fhout.write(TRACE_HEAD + body + TRACE_TAIL)
+        elif events:
+            # overwrite the tail with the new events and the tail
+            with open(fname, "r+") as fhout:
+                fhout.seek(-len(TRACE_TAIL), os.SEEK_END)
+                fhout.write((",\n" if nwritten else "") + body + TRACE_TAIL)
+
+def end_iteration(logger=None):
+    """
+    Log the report for this iteration (if `logger`), update the trace file (if enabled),
+    and start counting the next iteration. Returns the report.
+    """
+    report = get_report(reset=True)
+    if logger:
+        logger.info("Profiling report\n" + format_report(report))
+    with _lock:
+        if _state["trace_fname"] and _state["trace_nevents"] < MAX_TRACE_EVENTS:
+            ts = int(time.time()*1e6)
+            _state["trace_events"].append({
+                "name": "counts", "ph": "C", "ts": ts, "pid": os.getpid(),
+                "args": dict(_state["totals"]),
+                })
+            _state["trace_nevents"] += 1
+    dump_trace()
+    return report
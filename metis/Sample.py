@@ -13,6 +13,7 @@ import scripts.dis_client as dis
 from metis.Constants import Constants
 from metis.Utils import setup_logger, cached, do_cmd
 from metis.File import FileDBS, EventsFile, ImmutableFile, MutableFile
+import metis.Profiling as Profiling
 
 DIS_CACHE_SECONDS = 5*60
 if os.getenv("NOCACHE"): DIS_CACHE_SECONDS = 0
@@ -50,9 +51,11 @@ class Sample(object):
         return "<{0} dataset={1}>".format(self.__class__.__name__, self.info["dataset"])
 
     # @cached(default_max_age = datetime.timedelta(seconds=DIS_CACHE_SECONDS))
+    @Profiling.profiled()
     def do_dis_query(self, ds, typ="files"):
 
         self.logger.debug("Doing DIS query of type {0} for {1}".format(typ, ds))
+        Profiling.count("dis_query")
 
         rawresponse = dis.query(ds, typ=typ, detail=True)
         response = rawresponse["payload"]
@@ -180,6 +183,13 @@ class Sample(object):
         self.load_from_dis()
         return self.info["gtag"]
 
+    def is_complete(self):
+        """
+        Whether more files can still show up (as opposed to `open_dataset`, this is
+        known by the sample, e.g., for `TaskOutputSample`)
+        """
+        return True
+
 
 
 class DBSSample(Sample):
@@ -221,8 +231,10 @@ class DBSSample(Sample):
         self.info["files"] = fileobjs
         self.info["nevts"] = sum(fo.get_nevents() for fo in fileobjs)
 
+    @Profiling.profiled()
     def load_from_dasgoclient(self):
 
+        Profiling.count("dis_query")
         cmd = "dasgoclient -query 'file dataset={}' -json".format(self.info["dataset"])
         js = json.loads(do_cmd(cmd))
         fileobjs = []
@@ -476,6 +488,36 @@ class DummySample(DirectorySample):
         self.info["files"] = [EventsFile("{}_{}.{}".format(self.dummy_name,i,self.dummy_extension),fake=True,nevents=nevents_per_file) for i in range(self.n_dummy_files)]
         return self.info["files"]
 
+class TaskOutputSample(Sample):
+    """
+    Sample made of the completed outputs of another (upstream) task. It grows as
+    upstream outputs complete, so a `CondorTask` using it maps and submits chunks
+    before the upstream task is done, and flushes the leftover once it is.
+    :kwarg task: the upstream task
+    :kwarg dataset: name of this sample (for naming the downstream task/outputs)
+    """
+
+    def __init__(self, **kwargs):
+        if any(x not in kwargs for x in ["task", "dataset"]):
+            raise Exception("Need parameters: task,dataset")
+        self.task = kwargs["task"]
+
+        # Pass all of the kwargs to the parent class
+        super(TaskOutputSample, self).__init__(**kwargs)
+
+    def get_files(self):
+        return self.task.get_completed_outputs()
+
+    def get_nevents(self):
+        return sum(f.get_nevents() for f in self.get_files())
+
+    def get_globaltag(self):
+        return self.info.get("gtag", None) or getattr(self.task, "global_tag", None) or "dummy_gtag"
+
+    def is_complete(self):
+        return self.task.complete()
+
+
 
 if __name__ == '__main__':
 
@@ -0,0 +1,395 @@
+"""
+A simulated grid, to measure the submission loop at scale without a schedd,
+DIS or hadoop (see scripts/mbench):
+
+- `SimulatedSchedd` is an `Executor` that keeps the jobs in memory. Jobs sit idle,
+  then run for a random duration, and finish with their output written to the
+  storage, fail without output, or get held, on a simulated clock that the driver
+  moves forward (`advance`). Queries and submissions can be given a latency.
+- `SimulatedSample` is a sample with a fixed number of files, counting (and
+  optionally slowing down) its DIS queries like the real ones
+- `SimulatedStorage` is the output area: a local directory where finished jobs
+  write empty outputs, and where some can get lost
+- `run_benchmark` drives a `CondorTask` or `CMSSWTask` over them until it is complete,
+  and returns a report per iteration: loop latency, memory, external call counts
+  (see `Profiling`), and the job/output counts
+"""
+
+import os
+import time
+import random
+import shutil
+import logging
+import tempfile
+
+import metis.Utils as Utils
+import metis.Profiling as Profiling
+from metis.Sample import Sample
+from metis.File import EventsFile
+from metis.CondorTask import CondorTask
+from metis.CMSSWTask import CMSSWTask
+from metis.Executor import Executor, get_job_selection, matches
+
+def get_memory_MB():
+    """
+    Returns (resident, peak resident) memory of this process in MB
+    """
+    import resource
+    # kB on linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    try:
+        with open("/proc/self/statm", "r") as fhin:
+            current = int(fhin.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024.**2
+    except (IOError, OSError, ValueError):
+        current = peak
+    return current, peak
+
+def get_job_outputs(executable, arguments):
+    """
+    Outputs that a job of the metis executables writes, from their arguments
+    (output directory, output name, inputs, index, ...), also for packed jobs
+    """
+    if os.path.basename(executable) == "condor_packed_exe.sh":
+        chunks = [[]]
+        for arg in arguments[1:]:
+            if arg == "::":
+                chunks.append([])
+            else:
+                chunks[-1].append(arg)
+    else:
+        chunks = [arguments]
+    return ["{0}/{1}_{2}.root".format(args[0].rstrip("/"), args[1], args[3]) for args in chunks if len(args) > 3]
+
+class SimulatedStorage(object):
+
+    def __init__(self, basedir, loss_rate=0., seed=None):
+        """
+        Outputs are empty files under `basedir`. Every time the clock moves, a fraction
+        `loss_rate` of them disappears (e.g., a disk died), for the tasks to resubmit.
+        """
+        self.basedir = os.path.abspath(basedir)
+        self.loss_rate = loss_rate
+        self.rng = random.Random(seed)
+        self.stored = set()
+
+    def get_path(self, *parts):
+        return os.path.join(self.basedir, *parts)
+
+    def put(self, fname):
+        dirname = os.path.dirname(fname)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        open(fname, "w").close()
+        self.stored.add(fname)
+
+    def remove(self, fname):
+        if os.path.exists(fname):
+            os.unlink(fname)
+        self.stored.discard(fname)
+
+    def lose_files(self):
+        if self.loss_rate <= 0.:
+            return []
+        lost = [fname for fname in sorted(self.stored) if self.rng.random() < self.loss_rate]
+        for fname in lost:
+            self.remove(fname)
+        return lost
+
+    def cleanup(self):
+        shutil.rmtree(self.basedir, ignore_errors=True)
+        self.stored = set()
+
+class SimulatedSample(Sample):
+
+    def __init__(self, **kwargs):
+        """
+        :kwarg dataset: dataset name
+        :kwarg nfiles: number of files
+        :kwarg nevents_per_file: events in each file (default 1000)
+        :kwarg query_latency: seconds that each DIS query takes (default 0)
+        """
+        self.nfiles = kwargs.get("nfiles", 1)
+        self.nevents_per_file = kwargs.get("nevents_per_file", 1000)
+        self.query_latency = kwargs.get("query_latency", 0.)
+        super(SimulatedSample, self).__init__(**kwargs)
+        if not self.info["gtag"]:
+            self.info["gtag"] = "simulated_gtag"
+
+    @Profiling.profiled()
+    def do_dis_query(self, ds, typ="files"):
+        Profiling.count("dis_query")
+        if self.query_latency > 0:
+            time.sleep(self.query_latency)
+        if typ == "files":
+            dsname = ds.strip("/").replace("/", "_")
+            return [{"name": "/store/simulated/{0}/file_{1}.root".format(dsname, i), "nevents": self.nevents_per_file}
+                    for i in range(1, self.nfiles+1)]
+        return [{"nevents": self.nfiles*self.nevents_per_file, "gtag": self.info["gtag"]}]
+
+    def get_files(self):
+        if not self.info["files"]:
+            self.info["files"] = [EventsFile(f["name"], nevents=f["nevents"], fake=True)
+                                  for f in self.do_dis_query(self.info["dataset"], typ="files")]
+        return self.info["files"]
+
+    def get_nevents(self):
+        if self.info["nevents"] is None:
+            self.info["nevents"] = self.do_dis_query(self.info["dataset"], typ="config")[0]["nevents"]
+        return self.info["nevents"]
+
+    def get_globaltag(self):
+        return self.info["gtag"]
+
+class SimulatedSchedd(Executor):
+
+    def __init__(self, storage, **kwargs):
+        """
+        :kwarg idle_seconds: mean time that jobs wait to start (default 300)
+        :kwarg duration: mean runtime of jobs (of each chunk, for packed jobs) in seconds (default 3600)
+        :kwarg duration_spread: runtimes are uniform within +-`duration_spread` of the mean (default 0.5)
+        :kwarg failure_rate: fraction of jobs that finish without their output (default 0.05)
+        :kwarg hold_rate: fraction of jobs that get held instead of running (default 0.01)
+        :kwarg query_latency: seconds that a query takes (default 0), plus
+            `query_latency_per_job` (default 0) for each job it returns
+        :kwarg submit_latency: seconds that a submission takes (default 0), plus
+            `submit_latency_per_job` (default 0) for each job
+        :kwarg seed: random seed, for reproducible runs
+        """
+        self.storage = storage
+        self.idle_seconds = kwargs.get("idle_seconds", 300.)
+        self.duration = kwargs.get("duration", 3600.)
+        self.duration_spread = kwargs.get("duration_spread", 0.5)
+        self.failure_rate = kwargs.get("failure_rate", 0.05)
+        self.hold_rate = kwargs.get("hold_rate", 0.01)
+        self.query_latency = kwargs.get("query_latency", 0.)
+        self.query_latency_per_job = kwargs.get("query_latency_per_job", 0.)
+        self.submit_latency = kwargs.get("submit_latency", 0.)
+        self.submit_latency_per_job = kwargs.get("submit_latency_per_job", 0.)
+        self.rng = random.Random(kwargs.get("seed", None))
+
+        # simulated seconds since the start
+        self.now = 0.
+        self.next_cluster = 0
+        # id ("<cluster>.<proc>") to job, for the jobs in the queue
+        self.jobs = {}
+        # number of calls and of jobs submitted, finished, ... since the start
+        self.stats = dict((k, 0) for k in ["queries", "submits", "removes", "submitted", "succeeded", "failed", "held", "removed", "lost"])
+
+    def get_time(self, sim_time):
+        """
+        Unix time of a simulated time, which is what condor reports
+        """
+        return time.time() - (self.now - sim_time)
+
+    @Profiling.profiled()
+    def submit(self, **kwargs):
+        if kwargs.get("fake", False):
+            return True, -1
+        Profiling.count("schedd_submit")
+        self.stats["submits"] += 1
+        v_arguments, v_classads = get_job_selection(kwargs)
+        if self.submit_latency > 0 or self.submit_latency_per_job > 0:
+            time.sleep(self.submit_latency + self.submit_latency_per_job*len(v_arguments))
+        self.next_cluster += 1
+        for proc_id, (arguments, classads) in enumerate(zip(v_arguments, v_classads)):
+            outputs = get_job_outputs(kwargs["executable"], arguments)
+            start = self.now + self.rng.expovariate(1./self.idle_seconds) if self.idle_seconds > 0 else self.now
+            duration = self.duration * len(outputs) * self.rng.uniform(1.-self.duration_spread, 1.+self.duration_spread)
+            outcome = self.rng.random()
+            if outcome < self.hold_rate:
+                outcome = "held"
+            elif outcome < self.hold_rate + self.failure_rate:
+                outcome = "failed"
+            else:
+                outcome = "succeeded"
+            job = {
+                    "id": "{0}.{1}".format(self.next_cluster, proc_id),
+                    "executable": kwargs["executable"],
+                    "arguments": arguments,
+                    "classads": classads,
+                    "outputs": outputs,
+                    "status": "I",
+                    "entered": self.now,
+                    "start": start,
+                    "end": start + duration,
+                    "outcome": outcome,
+                    }
+            self.jobs[job["id"]] = job
+            self.stats["submitted"] += 1
+        return True, str(self.next_cluster)
+
+    @Profiling.profiled()
+    def query(self, selection_pairs=None, extra_columns=[]):
+        Profiling.count("schedd_query")
+        self.stats["queries"] += 1
+        jobs = []
+        for job in self.jobs.values():
+            if not matches(job["classads"], selection_pairs):
+                continue
+            d_job = {
+                    "ClusterId": job["id"],
+                    "ProcId": job["id"].rsplit(".", 1)[1],
+                    "JobStatus": job["status"],
+                    "EnteredCurrentStatus": int(self.get_time(job["entered"])),
+                    "CMD": job["executable"],
+                    "ARGS": " ".join(job["arguments"]),
+                    "HoldReason": "Simulated hold" if job["status"] == "H" else "undefined",
+                    }
+            for column in extra_columns:
+                d_job[column] = job["classads"].get(column, "undefined")
+            jobs.append(d_job)
+        if self.query_latency > 0 or self.query_latency_per_job > 0:
+            time.sleep(self.query_latency + self.query_latency_per_job*len(jobs))
+        return jobs
+
+    @Profiling.profiled()
+    def remove(self, cluster_ids=[]):
+        Profiling.count("schedd_remove")
+        self.stats["removes"] += 1
+        cluster_ids = set(str(cid) for cid in cluster_ids)
+        for jid in list(self.jobs.keys()):
+            if jid in cluster_ids or jid.rsplit(".", 1)[0] in cluster_ids:
+                del self.jobs[jid]
+                self.stats["removed"] += 1
+
+    def advance(self, seconds):
+        """
+        Move the clock forward by `seconds`: start the jobs that are due, and finish
+        (write the outputs of) the ones that are done. Returns the outputs that got lost.
+        """
+        self.now += seconds
+        for jid, job in list(self.jobs.items()):
+            if job["status"] == "I" and self.now >= job["start"]:
+                job["status"] = "H" if job["outcome"] == "held" else "R"
+                job["entered"] = job["start"]
+                if job["status"] == "H":
+                    self.stats["held"] += 1
+            if job["status"] == "R" and self.now >= job["end"]:
+                del self.jobs[jid]
+                self.stats[job["outcome"]] += 1
+                if job["outcome"] == "succeeded":
+                    for fname in job["outputs"]:
+                        self.storage.put(fname)
+        lost = self.storage.lose_files()
+        self.stats["lost"] += len(lost)
+        return lost
+
+    def get_counts(self):
+        counts = dict((status, 0) for status in ["I", "R", "H"])
+        for job in self.jobs.values():
+            counts[job["status"]] += 1
+        return counts
+
+def make_task(task_type, noutputs, schedd, storage, workdir, **kwargs):
+    """
+    A `CondorTask` or `CMSSWTask` (with a dummy pset and tarfile) with `noutputs`
+    outputs of a `SimulatedSample`, running on `schedd`. Extra kwargs go to the task.
+    """
+    files_per_output = kwargs.pop("files_per_output", 1)
+    dataset = "/Simulated{0}/Benchmark-v1/MINIAODSIM".format(noutputs)
+    sample = SimulatedSample(dataset=dataset, nfiles=noutputs*files_per_output, query_latency=kwargs.pop("dis_latency", 0.))
+    task_kwargs = dict(
+            sample=sample,
+            files_per_output=files_per_output,
+            output_name="output.root",
+            output_dir=storage.get_path(task_type, sample.get_datasetname().strip("/").replace("/", "_")),
+            tag="bench",
+            cmssw_version="CMSSW_10_2_5",
+            scram_arch="slc6_amd64_gcc700",
+            executor=schedd,
+            )
+    if task_type == "CMSSWTask":
+        pset = os.path.join(workdir, "pset_bench.py")
+        tarfile = os.path.join(workdir, "package_bench.tar.xz")
+        for fname in [pset, tarfile]:
+            if not os.path.exists(fname):
+                open(fname, "w").close()
+        # outputs are empty, so they aren't opened to count events with negative weights
+        task_kwargs.update(pset=pset, tarfile=tarfile, is_tree_output=False)
+        task_class = CMSSWTask
+    elif task_type == "CondorTask":
+        task_class = CondorTask
+    else:
+        raise Exception("Unknown task type: {0}".format(task_type))
+    task_kwargs.update(kwargs)
+    return task_class(**task_kwargs)
+
+def run_benchmark(noutputs=1000, task_type="CondorTask", iteration_seconds=600., max_iterations=500,
+        workdir=None, loss_rate=0., schedd_kwargs={}, task_kwargs={}, callback=None):
+    """
+    Run a task with `noutputs` outputs on a `SimulatedSchedd` (made with `schedd_kwargs`) until
+    it's complete, processing it every `iteration_seconds` of simulated time.
+    Tasks live in `workdir` (a temporary directory by default, removed at the end),
+    which is the working directory for the duration.
+    Returns a list of per-iteration dicts, with "iteration" 0 for making the task:
+        wall, rss_MB, peak_rss_MB: loop latency and memory
+        spans, counters: the `Profiling` report of the iteration
+        done, idle, running, held: outputs done and jobs in the queue, after the iteration
+    If given, `callback` is called with each of them.
+    """
+    logger = logging.getLogger(Utils.setup_logger())
+    cleanup = workdir is None
+    workdir = os.path.abspath(workdir or tempfile.mkdtemp(prefix="metis_bench_"))
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    storage = SimulatedStorage(os.path.join(workdir, "storage"), loss_rate=loss_rate, seed=schedd_kwargs.get("seed", None))
+    schedd = SimulatedSchedd(storage, **schedd_kwargs)
+    cwd = os.getcwd()
+    reports = []
+
+    def record(iteration, task):
+        # right after the iteration, so that the wall time is the loop latency
+        report = Profiling.get_report(reset=True)
+        report["rss_MB"], report["peak_rss_MB"] = get_memory_MB()
+        report["iteration"] = iteration
+        report["sim_hours"] = schedd.now / 3600.
+        report["done"] = len(task.get_completed_outputs())
+        report["noutputs"] = len(task.get_outputs())
+        counts = schedd.get_counts()
+        report["idle"], report["running"], report["held"] = counts["I"], counts["R"], counts["H"]
+        reports.append(report)
+        if callback:
+            callback(report)
+        return report
+
+    try:
+        os.chdir(workdir)
+        Profiling.get_report(reset=True)
+        task = make_task(task_type, noutputs, schedd, storage, workdir, **dict(task_kwargs))
+        record(0, task)
+        for iteration in range(1, max_iterations+1):
+            Profiling.get_report(reset=True)
+            task.process()
+            record(iteration, task)
+            if task.complete():
+                break
+            schedd.advance(iteration_seconds)
+        else:
+            logger.warning("Benchmark task didn't complete in {0} iterations".format(max_iterations))
+    finally:
+        os.chdir(cwd)
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return reports
+
+def summarize_benchmark(reports):
+    """
+    Totals over the iterations of `run_benchmark` (besides making the task)
+    """
+    loops = [r for r in reports if r["iteration"] > 0] or reports
+    walls = sorted(r["wall"] for r in loops)
+    counters = {}
+    for report in loops:
+        for name, value in report["counters"].items():
+            counters[name] = counters.get(name, 0) + value
+    return {
+            "iterations": len(loops),
+            "complete": bool(reports) and reports[-1]["done"] == reports[-1]["noutputs"] > 0,
+            "sim_hours": reports[-1]["sim_hours"] if reports else 0.,
+            "setup_wall": reports[0]["wall"] if reports else 0.,
+            "total_wall": sum(walls),
+            "mean_wall": sum(walls)/max(len(walls), 1),
+            "max_wall": walls[-1] if walls else 0.,
+            "peak_rss_MB": max(r["peak_rss_MB"] for r in reports) if reports else 0.,
+            "counters": counters,
+            }
@@ -4,20 +4,297 @@ import os
 import sys
 import time
 import logging
+import shutil
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+import cPickle as pickle
 from pprint import pprint
 
 import metis.LogParser as LogParser
+import metis.History as History
+import metis.Timeline as Timeline
+import metis.StatusServer as StatusServer
+import metis.Profiling as Profiling
+import metis.Metrics as Metrics
+from metis.SummaryStore import SummaryStore, task_key, get_digest, atomic_dump
 import metis.Utils as Utils
 
+# The phase timelines only use an evenly spaced sample of the done jobs of each task, so that
+# big tasks don't reconstruct and aggregate all of them (compare `MIN_JOBS_FOR_CHUNKING` in CondorTask).
+# The number of done jobs per site still counts all of them.
+MAX_TIMELINE_JOBS = 50
+
 def merge_histories(hold, hnew):
+    """
+    Append the new history points to the old ones, and roll up old points
+    (see `History.compact_history`) so the stored history stays bounded
+    """
     if not hold: return hnew
     for key in hnew.keys():
         hnew[key] = hold.get(key,[]) + hnew[key]
-    return hnew
+    return History.compact_history(hnew)
+
+def summarize_task(dsname, tasksummary, timestamp, make_plots=False, custom_event_rate_parser=None):
+    """
+    Turn the raw summary of a single task (from `get_task_summary()`) into
+    the dashboard-level summary dict (general info, bad jobs, history point)
+    """
+    sample = tasksummary["jobs"]
+    outnevents = 0
+    queriednevents = tasksummary["queried_nevents"]
+    task_type = tasksummary.get("task_type", "Task")
+    is_cmssw = "CMSSW" in task_type
+    logs_to_plot = []
+    bad_jobs = {}
+    njobs = len(sample.keys())
+    njobsdone = 0
+    event_rates = []
+    done_logs = []
+    completed_sites = {}
+    # iouts = sample.keys() if not show_progress_bar else tqdm(sample.keys(), position=1)
+    iouts = sample.keys()
+    for iout in iouts:
+        job = sample[iout]
+
+        condor_jobs = job["condor_jobs"]
+        # if not len(condor_jobs): continue
+
+        is_done  = job["output_exists"] and not job["is_on_condor"]
+
+        if is_done:
+            outnevents += job["output"][1]
+            parsed = {}
+            if len(condor_jobs):
+                errlog = condor_jobs[-1]["logfile_err"]
+                parsed = LogParser.cached_log_parser(errlog,do_header=True,do_error=False,do_rate=is_cmssw)
+                parsed = LogParser.get_chunk_log(parsed, iout)
+                if custom_event_rate_parser:
+                    rate = custom_event_rate_parser(errlog)
+                    if rate > 0.:
+                        event_rates.append(rate)
+                elif is_cmssw:
+                    rate = parsed.get("event_rate",-1)
+                    if rate > 0.:
+                        event_rates.append(rate)
+                site = parsed.get("site","") or "unknown"
+                completed_sites[site] = completed_sites.get(site, 0) + 1
+                done_logs.append((iout, errlog))
+            njobsdone += 1
+            continue
+
+        retries = max(0, len(condor_jobs)-1)
+        inputs = job["inputs"]
+        innames, innevents = zip(*inputs)
+        nevents = sum(innevents)
+
+        last_error = ""
+        last_log = ""
+        last_sites = []
+        if retries < 1: continue
+
+        parsed = {}
+        for ijob in range(len(condor_jobs)-1):
+            outlog = condor_jobs[ijob]["logfile_out"]
+            errlog = condor_jobs[ijob]["logfile_err"]
+            logs_to_plot.append(outlog)
+            parsed = LogParser.cached_log_parser(errlog,do_header=True,do_error=True,do_rate=False)
+            parsed = LogParser.get_chunk_log(parsed, iout)
+            site = parsed.get("site","")
+            last_sites.append(site if site else "")
+        last_error = parsed.get("inferred_error","")
+        # probably slow, but guarantees there's no weird \x01 characters in the string
+        last_error = "".join(filter(lambda char: char in string.printable, last_error))
+        last_log = outlog
+        bad_jobs[iout] = {
+                "retries":retries,
+                "inputs":len(inputs),
+                "events":nevents,
+                "last_error": last_error,
+                "last_log": last_log,
+                "last_sites": last_sites,
+                }
+
+    event_rate = -1
+    if len(event_rates) > 0:
+        # faux median
+        event_rate = round(sorted(event_rates)[len(event_rates)//2],1)
+
+
+    plot_paths = []
+    if logs_to_plot and make_plots:
+
+        to_plot_json = {fname:LogParser.log_parser(fname)["dstat"] for fname in logs_to_plot}
+
+        if to_plot_json:
+            # CPU
+            import Plotter as plotter
+            plot_paths.append(plotter.plot_2DHist(to_plot_json, dsname, ("epoch","usr"), xtitle="norm. job time", ytitle="usr CPU", title="user CPU vs norm. job time", nbins=50, normx=True, colorbar=True))
+            plot_paths.append(plotter.plot_2DHist(to_plot_json, dsname, ("epoch","sys"), xtitle="norm. job time", ytitle="sys CPU", title="system CPU vs norm. job time", nbins=50, normx=True, colorbar=True))
+            plot_paths.append(plotter.plot_2DHist(to_plot_json, dsname, ("epoch","idl"), xtitle="norm. job time", ytitle="idle CPU", title="idle CPU vs norm. job time", nbins=50, normx=True, colorbar=True))
+            # # I/O
+            plot_paths.append(plotter.plot_2DHist(to_plot_json, dsname, ("epoch","writ"), xtitle="norm. job time", ytitle="Disk write", title="disk write (MB/s) vs norm. job time", nbins=50, normx=True, scaley=0.125e-6, colorbar=True))
+            plot_paths.append(plotter.plot_2DHist(to_plot_json, dsname, ("epoch","read"), xtitle="norm. job time", ytitle="Disk read", title="disk read (MB/s) vs norm. job time", nbins=50, normx=True, scaley=0.125e-6, colorbar=True))
+            # # Network
+            plot_paths.append(plotter.plot_2DHist(to_plot_json, dsname, ("epoch","send"), xtitle="norm. job time", ytitle="network send", title="network send (MB/s) vs norm. job time", nbins=50, normx=True, scaley=1e-6, colorbar=True))
+            plot_paths.append(plotter.plot_2DHist(to_plot_json, dsname, ("epoch","recv"), xtitle="norm. job time", ytitle="network receive", title="network receive (MB/s) vs norm. job time", nbins=50, normx=True, scaley=1e-6, colorbar=True))
+            # # Memory
+            plot_paths.append(plotter.plot_2DHist(to_plot_json, dsname, ("epoch","used"), xtitle="norm. job time", ytitle="used mem.", title="used memory [GB] vs norm. job time", nbins=50, normx=True, scaley=1e-9, colorbar=True))
+            plot_paths.append(plotter.plot_2DHist(to_plot_json, dsname, ("epoch","buff"), xtitle="norm. job time", ytitle="buff", title="buff [GB] vs norm. job time", nbins=50, normx=True, scaley=1e-9, colorbar=True))
+            plot_paths = [pp for pp in plot_paths if pp]
+
+    d_task = {}
+    d_task["general"] = tasksummary.copy()
+    del d_task["general"]["jobs"]
+    if "task_type" in d_task["general"]: del d_task["general"]["task_type"]
+    d_task["general"].update({
+            "dataset": dsname,
+            "nevents_total": queriednevents,
+            "nevents_done": outnevents,
+            "njobs_total": njobs,
+            "njobs_done": njobsdone,
+            "event_rate": event_rate,
+            "status": "running",
+            "type": task_type,
+    })
+    timelines = []
+    timeline_sites = []
+    step = max(1, -(-len(done_logs) // MAX_TIMELINE_JOBS))
+    for iout, errlog in sorted(done_logs)[::step]:
+        parsed = LogParser.cached_log_parser(errlog,do_header=True,do_error=False,do_rate=is_cmssw)
+        parsed = LogParser.get_chunk_log(parsed, iout)
+        timeline = Timeline.get_job_timeline(parsed)
+        if timeline:
+            timelines.append(timeline)
+            timeline_sites.append(parsed.get("site","") or parsed.get("args",{}).get("GLIDEIN_CMSSite",""))
+    d_task["timeline"] = Timeline.summarize_timelines(timelines, timeline_sites)
+    d_task["completed_sites"] = completed_sites
+    d_task["bad"] = {
+            "plots": plot_paths,
+            "jobs_not_done": bad_jobs,
+            "missing_events": max(queriednevents-outnevents,0),
+    }
+    d_task["history"] = {
+            "timestamps": [timestamp], # round to latest 5 minute mark
+            "nevents_total": [d_task["general"]["nevents_total"]],
+            "nevents_done": [d_task["general"]["nevents_done"]],
+            "njobs_total": [d_task["general"]["njobs_total"]],
+            "njobs_done": [d_task["general"]["njobs_done"]],
+    }
+    return d_task
+
+def update_metrics(tasks):
+    """
+    Set the per-task progress and per-site gauges from a list of web task summaries
+    """
+    for gauge in [Metrics.TASK_JOBS, Metrics.TASK_EVENTS, Metrics.SITE_JOBS]:
+        gauge.clear()
+    site_counts = {}
+    for task in tasks:
+        general = task["general"]
+        labels = {"dataset": general["dataset"], "tag": general["tag"]}
+        for state in ["total", "done"]:
+            Metrics.TASK_JOBS.set(general["njobs_{0}".format(state)], state=state, **labels)
+            Metrics.TASK_EVENTS.set(general["nevents_{0}".format(state)], state=state, **labels)
+        for site, ncompleted in task.get("completed_sites", {}).items():
+            site_counts[(site, "completed")] = site_counts.get((site, "completed"), 0) + ncompleted
+        for job in task["bad"]["jobs_not_done"].values():
+            for site in job["last_sites"]:
+                site = site or "unknown"
+                site_counts[(site, "failed")] = site_counts.get((site, "failed"), 0) + 1
+    for (site, result), count in site_counts.items():
+        Metrics.SITE_JOBS.set(count, site=site, result=result)
+
+def get_web_index(index):
+    """
+    Dashboard index (general info of every task) from a `SummaryStore` index
+    """
+    web_index = {"version": index["version"], "last_updated": index["last_updated"], "tasks": []}
+    for key, entry in sorted(index["tasks"].items()):
+        if "general" not in entry: continue
+        web_index["tasks"].append({"id": key, "general": entry["general"], "digest": entry.get("web_digest")})
+    return web_index
+
+def split_web_task(task, history_points=History.DEFAULT_NPOINTS):
+    """
+    Split a stored web task summary into the dashboard's details and history shards.
+    The stored histories keep all rolled-up points, but the plots only need a fixed budget.
+    """
+    history = History.downsample_history(task.get("history", {}), history_points)
+    details = dict((k, v) for k, v in task.items() if k != "history")
+    return details, history
+
+# Filled in by `StatsParser.do` right before the pool is created, so that forked
+# workers inherit it. This way `custom_event_rate_parser` needn't be picklable.
+_pool_state = {}
+
+def _summarize_task_worker(dsname):
+    state = _pool_state
+    d_task = summarize_task(dsname, state["summaries"][dsname], state["timestamp"],
+            make_plots=state["make_plots"], custom_event_rate_parser=state["custom_event_rate_parser"])
+    LogParser.commit_digests()
+    return d_task
+
+def _summarize_pickled_tasks(infile, outfile):
+    """
+    Entry point of the summary workers started by `summarize_tasks_in_subprocesses`
+    """
+    with open(infile, "rb") as fhin:
+        state = pickle.load(fhin)
+    d_tasks = {}
+    for dsname, summary in state["summaries"].items():
+        d_tasks[dsname] = summarize_task(dsname, summary, state["timestamp"], make_plots=state["make_plots"])
+    LogParser.commit_digests()
+    with open(outfile, "wb") as fhout:
+        pickle.dump(d_tasks, fhout, pickle.HIGHEST_PROTOCOL)
+
+def summarize_tasks_in_subprocesses(summaries, timestamp, make_plots=False, nproc=2):
+    """
+    Returns the web task summaries of the raw `summaries`, in the order of their keys,
+    made by `nproc` fresh python processes instead of forked ones. Unlike a fork, a fresh
+    process doesn't inherit locks held by other threads of this one, so this is safe with
+    threads running. The inputs and results go through pickle files.
+    """
+    dsnames = list(summaries.keys())
+    tmpdir = tempfile.mkdtemp(prefix="metis_summary_")
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([p for p in sys.path if p] + [env.get("PYTHONPATH", "")])
+    procs = []
+    try:
+        for iproc in range(nproc):
+            infile = os.path.join(tmpdir, "input_{0}.pkl".format(iproc))
+            outfile = os.path.join(tmpdir, "output_{0}.pkl".format(iproc))
+            with open(infile, "wb") as fhout:
+                pickle.dump({"summaries": dict((dsname, summaries[dsname]) for dsname in dsnames[iproc::nproc]),
+                    "timestamp": timestamp, "make_plots": make_plots}, fhout, pickle.HIGHEST_PROTOCOL)
+            cmd = "import metis.StatsParser as sp; sp._summarize_pickled_tasks({0!r}, {1!r})".format(infile, outfile)
+            procs.append((subprocess.Popen([sys.executable, "-c", cmd], env=env), outfile))
+        d_tasks = {}
+        for proc, outfile in procs:
+            if proc.wait() != 0:
+                raise RuntimeError("Summary worker failed with exit code {0}".format(proc.returncode))
+            with open(outfile, "rb") as fhin:
+                d_tasks.update(pickle.load(fhin))
+        return [d_tasks[dsname] for dsname in dsnames]
+    finally:
+        for proc, _ in procs:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+        shutil.rmtree(tmpdir, ignore_errors=True)
 
 class StatsParser(object):
 
-    def __init__(self, data = {}, summary_fname="summary.json", webdir="~/public_html/dump/metis_test/", do_history=True, make_plots=False):
+    def __init__(self, data = {}, summary_fname="summary.json", webdir="~/public_html/dump/metis_test/", do_history=True, make_plots=False, write_web_summary=False, history_points=History.DEFAULT_NPOINTS):
+        """
+        Per-task summaries are stored as shards in a `SummaryStore` in the "summaries/"
+        directory next to `summary_fname`. The monolithic `summary_fname` is only read
+        as a fallback. The dashboard gets an index plus per-task detail and history
+        shards (see `make_dashboard`), with histories downsampled to `history_points`
+        points each. If `write_web_summary`, the legacy monolithic web_summary.json is
+        also assembled from the shards.
+        """
         self.data = data
         self.summary_fname = summary_fname
         self.webdir = webdir
@@ -25,203 +302,207 @@ class StatsParser(object):
         self.do_history = do_history
         self.logger = logging.getLogger(Utils.setup_logger())
         self.make_plots = make_plots
+        self.write_web_summary = write_web_summary
+        self.history_points = history_points
+        self.store = SummaryStore(os.path.join(os.path.dirname(self.summary_fname), "summaries"))
 
         if not self.data:
-            with Utils.locked_open(self.summary_fname,"r") as fhin:
-                self.data = json.load(fhin)
+            if self.store.exists():
+                entries = self.store.read_index()["tasks"]
+                self.data = dict((entries[key]["dataset"], shard) for key, shard in self.store.load_all("raw", entries.keys()).items())
+            else:
+                with Utils.locked_open(self.summary_fname,"r") as fhin:
+                    self.data = json.load(fhin)
 
-    def do(self, custom_event_rate_parser=None, no_write=False, show_progress_bar=True):
-
-        self.logger.info("Making summary for dashboard")
+    def import_legacy_summaries(self):
+        """
+        One-time migration of the monolithic summary JSONs into the store,
+        so that existing task histories and other instances' tasks survive
+        """
+        if self.store.exists(): return
+        raw, web = {}, []
+        for fname in [self.summary_fname, self.SUMMARY_NAME]:
+            if not os.path.exists(fname): continue
+            with Utils.locked_open(fname, "r") as fhin:
+                try:
+                    data = json.load(fhin)
+                except ValueError:
+                    continue
+            if fname == self.SUMMARY_NAME: web = data.get("tasks", [])
+            else: raw = data
+        if raw or web:
+            self.logger.info("Importing {0} tasks from legacy summary files".format(max(len(raw), len(web))))
+            self.store.update(raw=raw, web=web)
 
+    @Profiling.profiled()
+    def summarize_tasks(self, summaries, timestamp, custom_event_rate_parser=None, show_progress_bar=True, nproc=1):
+        """
+        Returns the list of web task summaries for the raw `summaries` (see `do`).
+        With `nproc` > 1, the tasks are summarized in a forked process pool. Forking next to
+        other threads (e.g., a `StatusServer`, `CampaignRunner` or executor workers) can
+        deadlock the children, so then fresh worker processes are started instead (see
+        `summarize_tasks_in_subprocesses`). These can't call a `custom_event_rate_parser`,
+        so with both threads and a custom parser, the tasks are summarized in this process.
+        """
         if show_progress_bar:
             from tqdm import tqdm
 
-        oldsummary = {}
-        if os.path.isfile(self.summary_fname):
-            with Utils.locked_open(self.summary_fname,"r") as fhin:
-                oldsummary = json.load(fhin)
-        if not no_write:
-            with Utils.locked_open(self.summary_fname,"w") as fhdump:
-                oldsummary.update(self.data)
-                json.dump(oldsummary, fhdump)
+        tasks = []
+        dsnames = list(summaries.keys())
+        if nproc < 0:
+            nproc = multiprocessing.cpu_count()
+        nproc = min(nproc, len(dsnames))
+        use_subprocesses = False
+        if nproc > 1 and threading.active_count() > 1:
+            if custom_event_rate_parser:
+                self.logger.warning("Other threads are running and a custom event rate parser is used, "
+                        "so summarizing {0} tasks in this process instead of {1}".format(len(dsnames), nproc))
+                nproc = 1
+            else:
+                use_subprocesses = True
+        if use_subprocesses:
+            tasks = summarize_tasks_in_subprocesses(summaries, timestamp, make_plots=self.make_plots, nproc=nproc)
+        elif nproc > 1:
+            _pool_state.update({
+                "summaries": summaries,
+                "timestamp": timestamp,
+                "make_plots": self.make_plots,
+                "custom_event_rate_parser": custom_event_rate_parser,
+                })
+            pool = multiprocessing.Pool(processes=nproc)
+            try:
+                # imap keeps the input order, so the merged output is deterministic
+                results = pool.imap(_summarize_task_worker, dsnames, chunksize=1)
+                if show_progress_bar:
+                    results = tqdm(results, total=len(dsnames), ncols=75)
+                tasks = list(results)
+            except BaseException:
+                # don't wait for the outstanding tasks
+                pool.terminate()
+                pool.join()
+                raise
+            else:
+                pool.close()
+                pool.join()
+            finally:
+                _pool_state.clear()
+        else:
+            if show_progress_bar:
+                dsnames = tqdm(dsnames, ncols=75)
+            for dsname in dsnames:
+                tasks.append(summarize_task(dsname, summaries[dsname], timestamp,
+                    make_plots=self.make_plots, custom_event_rate_parser=custom_event_rate_parser))
 
-        summaries = self.data.copy()
+        LogParser.commit_digests()
+        return tasks
 
-        tasks = []
+    def do(self, custom_event_rate_parser=None, no_write=False, show_progress_bar=True, nproc=1):
+        """
+        Make the dashboard summary. If `nproc` > 1 (or -1 for all cores), the per-task
+        summaries (log parsing, bad job analysis, plots) are made in a process pool.
+        Unless `no_write`, this also ends the loop iteration as far as `Profiling` is
+        concerned, i.e., the timing report of the iteration gets logged.
+        """
+
+        self.logger.info("Making summary for dashboard")
+
+        summaries = self.data.copy()
         # 5 minute quantization
         timestamp = int(time.time()/300)*300
-        # dsnames = summaries.keys() if not show_progress_bar else tqdm(summaries.keys(), position=0)
-        dsnames = summaries.keys() if not show_progress_bar else tqdm(summaries.keys(),ncols=75)
-        for dsname in dsnames:
-
-            tasksummary = summaries[dsname]
-            sample = summaries[dsname]["jobs"]
-            outnevents = 0
-            queriednevents = summaries[dsname]["queried_nevents"]
-            task_type = summaries[dsname].get("task_type", "Task")
-            is_cmssw = "CMSSW" in task_type
-            logs_to_plot = []
-            bad_jobs = {}
-            njobs = len(sample.keys())
-            njobsdone = 0
-            event_rates = []
-            # iouts = sample.keys() if not show_progress_bar else tqdm(sample.keys(), position=1)
-            iouts = sample.keys()
-            for iout in iouts:
-                job = sample[iout]
-
-                condor_jobs = job["condor_jobs"]
-                # if not len(condor_jobs): continue
-
-                is_done  = job["output_exists"] and not job["is_on_condor"]
-
-                if is_done:
-                    outnevents += job["output"][1]
-                    parsed = {}
-                    if len(condor_jobs):
-                        if custom_event_rate_parser:
-                            errlog = condor_jobs[-1]["logfile_err"]
-                            rate = custom_event_rate_parser(errlog)
-                            if rate > 0.:
-                                event_rates.append(rate)
-                        elif is_cmssw and len(condor_jobs) > 0:
-                            errlog = condor_jobs[-1]["logfile_err"]
-                            parsed = LogParser.log_parser(errlog,do_header=False,do_error=False,do_rate=True)
-                            rate = parsed.get("event_rate",-1)
-                            if rate > 0.:
-                                event_rates.append(rate)
-                    njobsdone += 1
-                    continue
+        tasks = self.summarize_tasks(summaries, timestamp, custom_event_rate_parser=custom_event_rate_parser,
+                show_progress_bar=show_progress_bar, nproc=nproc)
 
-                retries = max(0, len(condor_jobs)-1)
-                inputs = job["inputs"]
-                innames, innevents = zip(*inputs)
-                nevents = sum(innevents)
-
-                last_error = ""
-                last_log = ""
-                last_sites = []
-                if retries < 1: continue
-
-                parsed = {}
-                for ijob in range(len(condor_jobs)-1):
-                    outlog = condor_jobs[ijob]["logfile_out"]
-                    errlog = condor_jobs[ijob]["logfile_err"]
-                    logs_to_plot.append(outlog)
-                    parsed = LogParser.log_parser(errlog,do_header=True,do_error=True,do_rate=False)
-                    site = parsed.get("site","")
-                    last_sites.append(site if site else "")
-                last_error = parsed.get("inferred_error","")
-                # probably slow, but guarantees there's no weird \x01 characters in the string
-                last_error = "".join(filter(lambda char: char in string.printable, last_error))
-                last_log = outlog
-                bad_jobs[iout] = {
-                        "retries":retries,
-                        "inputs":len(inputs),
-                        "events":nevents,
-                        "last_error": last_error,
-                        "last_log": last_log,
-                        "last_sites": last_sites,
-                        }
-
-            event_rate = -1
-            if len(event_rates) > 0:
-                # faux median
-                event_rate = round(sorted(event_rates)[len(event_rates)//2],1)
-                
-
-            plot_paths = []
-            if logs_to_plot and self.make_plots:
-
-                to_plot_json = {fname:LogParser.log_parser(fname)["dstat"] for fname in logs_to_plot}
-
-                if to_plot_json:
-                    # CPU
-                    import Plotter as plotter
-                    plot_paths.append(plotter.plot_2DHist(to_plot_json, dsname, ("epoch","usr"), xtitle="norm. job time", ytitle="usr CPU", title="user CPU vs norm. job time", nbins=50, normx=True, colorbar=True))
-                    plot_paths.append(plotter.plot_2DHist(to_plot_json, dsname, ("epoch","sys"), xtitle="norm. job time", ytitle="sys CPU", title="system CPU vs norm. job time", nbins=50, normx=True, colorbar=True))
-                    plot_paths.append(plotter.plot_2DHist(to_plot_json, dsname, ("epoch","idl"), xtitle="norm. job time", ytitle="idle CPU", title="idle CPU vs norm. job time", nbins=50, normx=True, colorbar=True))
-                    # # I/O
-                    plot_paths.append(plotter.plot_2DHist(to_plot_json, dsname, ("epoch","writ"), xtitle="norm. job time", ytitle="Disk write", title="disk write (MB/s) vs norm. job time", nbins=50, normx=True, scaley=0.125e-6, colorbar=True))
-                    plot_paths.append(plotter.plot_2DHist(to_plot_json, dsname, ("epoch","read"), xtitle="norm. job time", ytitle="Disk read", title="disk read (MB/s) vs norm. job time", nbins=50, normx=True, scaley=0.125e-6, colorbar=True))
-                    # # Network
-                    plot_paths.append(plotter.plot_2DHist(to_plot_json, dsname, ("epoch","send"), xtitle="norm. job time", ytitle="network send", title="network send (MB/s) vs norm. job time", nbins=50, normx=True, scaley=1e-6, colorbar=True))
-                    plot_paths.append(plotter.plot_2DHist(to_plot_json, dsname, ("epoch","recv"), xtitle="norm. job time", ytitle="network receive", title="network receive (MB/s) vs norm. job time", nbins=50, normx=True, scaley=1e-6, colorbar=True))
-                    # # Memory
-                    plot_paths.append(plotter.plot_2DHist(to_plot_json, dsname, ("epoch","used"), xtitle="norm. job time", ytitle="used mem.", title="used memory [GB] vs norm. job time", nbins=50, normx=True, scaley=1e-9, colorbar=True))
-                    plot_paths.append(plotter.plot_2DHist(to_plot_json, dsname, ("epoch","buff"), xtitle="norm. job time", ytitle="buff", title="buff [GB] vs norm. job time", nbins=50, normx=True, scaley=1e-9, colorbar=True))
-                    plot_paths = [pp for pp in plot_paths if pp]
-
-            d_task = {}
-            d_task["general"] = tasksummary.copy()
-            del d_task["general"]["jobs"]
-            if "task_type" in d_task["general"]: del d_task["general"]["task_type"]
-            d_task["general"].update({
-                    "dataset": dsname,
-                    "nevents_total": queriednevents,
-                    "nevents_done": outnevents,
-                    "njobs_total": njobs,
-                    "njobs_done": njobsdone,
-                    "event_rate": event_rate,
-                    "status": "running",
-                    "type": task_type,
-            })
-            d_task["bad"] = {
-                    "plots": plot_paths,
-                    "jobs_not_done": bad_jobs,
-                    "missing_events": max(queriednevents-outnevents,0),
-            }
-            d_task["history"] = {
-                    "timestamps": [timestamp], # round to latest 5 minute mark
-                    "nevents_total": [d_task["general"]["nevents_total"]],
-                    "nevents_done": [d_task["general"]["nevents_done"]],
-                    "njobs_total": [d_task["general"]["njobs_total"]],
-                    "njobs_done": [d_task["general"]["njobs_done"]],
-            }
-            tasks.append(d_task)
+        update_metrics(tasks)
 
         d_web_summary = {
                 "tasks": tasks,
                 "last_updated": time.time(),
                 }
-        # open the current json and add any tasks that are already in there
-        # but which are not in the current set of tasks (so that we don't nuke
-        # the summaries for multiple instances of metis running on different
-        # datasets)
-        if os.path.exists(self.SUMMARY_NAME):
-            with Utils.locked_open(self.SUMMARY_NAME, 'r') as fhin:
-                try:
-                    data_in = json.load(fhin)
-                    all_datasets = [(t["general"]["dataset"],t["general"]["tag"]) for t in tasks]
-                    for task in data_in.get("tasks",[]):
-                        if (task["general"]["dataset"],task["general"]["tag"]) not in all_datasets:
-                            d_web_summary["tasks"].append(task)
-                        else:
-                            old_history = task.get("history",{})
-                            new_task = [t for t in tasks if ((t["general"]["dataset"] == task["general"]["dataset"]) and (t["general"]["tag"] == task["general"]["tag"]))][0]
-                            new_history = new_task.get("history", {})
-                            if self.do_history:
-                                new_task["history"] = merge_histories(old_history, new_history)
-                except ValueError:
-                    # if we fail to decode JSON, 
-                    # could be because the summary file is just empty
-                    pass
 
         if not no_write:
-            self.make_dashboard(d_web_summary)
+            self.import_legacy_summaries()
+
+        # Only tasks whose content changed (or that haven't been refreshed in a while)
+        # get their shards rewritten, and only their old history is loaded for merging.
+        # Tasks from other metis instances live in their own shards and are left alone.
+        index = self.store.read_index()
+        changed_raw = {}
+        for dsname, summary in self.data.items():
+            key = task_key(dsname, summary.get("tag", ""))
+            if self.store.is_stale(index, "raw", key, get_digest(summary)):
+                changed_raw[dsname] = summary
+        changed_web = []
+        for task in tasks:
+            key = task_key(task["general"]["dataset"], task["general"]["tag"])
+            if not self.store.is_stale(index, "web", key, get_digest(task, ignore_keys=["history"])):
+                continue
+            if self.do_history:
+                old_history = self.store.load("web", key).get("history", {})
+                task["history"] = merge_histories(old_history, task["history"])
+            changed_web.append(task)
+
+        if not no_write:
+            with Profiling.span("StatsParser.store_update", ntasks=len(changed_web)):
+                index = self.store.update(raw=changed_raw, web=changed_web)
+            self.logger.info("Wrote summaries for {0} of {1} tasks".format(len(changed_web), len(tasks)))
+            # with no webdir, the dashboard is only served by the `StatusServer` (if any)
+            if self.webdir:
+                self.make_dashboard(index, changed_web)
+
+                relpath = self.webdir.split("public_html/")[1]
+                url = "http://{0}/~{1}/{2}".format(os.uname()[1],os.getenv("USER"),relpath)
+                self.logger.info("Updated dashboard at {0}".format(url))
+            StatusServer.notify()
+            report = Profiling.end_iteration(self.logger)
+            Metrics.LOOP_DURATION.observe(report["wall"])
+            Metrics.LAST_LOOP.set(time.time())
+            Metrics.write_textfile()
+
+        return d_web_summary
+
+    @Profiling.profiled()
+    def make_dashboard(self, index, changed_web=[]):
+        """
+        Write the dashboard data into the web directory: data/index.json with the
+        general info of every task, and data/tasks/<key>.json (everything but the
+        history) and data/history/<key>.json shards, which the dashboard only fetches
+        when needed. Only shards of changed tasks (or missing ones) are written, and
+        data/version.json is bumped last so that pollers see a consistent state.
+        """
+        datadir = os.path.join(os.path.expanduser(self.webdir), "data")
+        changed = dict((task_key(t["general"]["dataset"], t["general"]["tag"]), t) for t in changed_web)
+        datafiles = []
+        web_index = get_web_index(index)
+        legacy_tasks = []
+        for entry in web_index["tasks"]:
+            key = entry["id"]
+            need_shard = (key in changed) or not os.path.exists(os.path.join(datadir, "tasks", "{0}.json".format(key)))
+            if not need_shard and not self.write_web_summary: continue
+            details, history = split_web_task(changed.get(key) or self.store.load("web", key), self.history_points)
+            if need_shard:
+                datafiles.append(("tasks/{0}.json".format(key), details))
+                datafiles.append(("history/{0}.json".format(key), history))
+            if self.write_web_summary:
+                legacy_tasks.append(dict(details, history=history))
 
-            relpath = self.webdir.split("public_html/")[1]
-            url = "http://{0}/~{1}/{2}".format(os.uname()[1],os.getenv("USER"),relpath)
-            self.logger.info("Updated dashboard at {0}".format(url))
-                    
-    def make_dashboard(self, d_web_summary):
+        old_version = -1
+        try:
+            with open(os.path.join(datadir, "version.json"), "r") as fhin:
+                old_version = json.load(fhin).get("version", -1)
+        except (IOError, OSError, ValueError):
+            pass
+        # leave index/version alone if nothing changed, so that the web server can answer polls with 304s
+        if datafiles or old_version != index["version"]:
+            datafiles.append(("index.json", web_index))
+            datafiles.append(("version.json", {"version": index["version"], "last_updated": index["last_updated"]}))
 
-        with Utils.locked_open(self.SUMMARY_NAME, 'w') as fhout:
-            json.dump(d_web_summary, fhout, sort_keys = True, indent = 4, separators=(',',': '))
-            # fhout.write(json.dumps(d_web_summary, sort_keys = True, indent = 4, separators=(',',': '), cls=CustomEncoder))
+        jsonfile = None
+        if self.write_web_summary:
+            # written atomically, so the dashboard/msummary never see a partial file
+            atomic_dump({"tasks": legacy_tasks, "last_updated": index["last_updated"]}, self.SUMMARY_NAME)
+            jsonfile = self.SUMMARY_NAME
 
-        Utils.update_dashboard(webdir=self.webdir, jsonfile=self.SUMMARY_NAME)
+        Utils.update_dashboard(webdir=self.webdir, jsonfile=jsonfile, datafiles=datafiles)
         
 
 if __name__ == "__main__": 
@@ -0,0 +1,346 @@
+"""
+Optional embedded HTTP server for live monitoring, as an alternative to
+copying the dashboard into ~/public_html after every `StatsParser.do` and to
+`mchirp` (which does its own full condor_q). It binds to localhost by default
+and serves
+    /                  the dashboard (static files from dashboard/)
+    /data/...          the dashboard index/shards, straight from the `SummaryStore`
+    /chirp             live job info (chirp classads) of the running jobs, as published
+                       by `CondorTask.run` from the condor_q it does anyway
+    /chirpdata.js      the same, for dashboard/chirptable.html
+    /events            server-sent events whenever the summaries or jobs change
+    /metrics           the `Metrics` of this process, in the Prometheus text format
+
+Usage, in the script that loops over tasks,
+    StatusServer.start_server(port=8080)
+or standalone (no chirp data, since there are no tasks in that process)
+    python -m metis.StatusServer --port 8080 --summaries summaries
+Remote access goes through an ssh tunnel, e.g., `ssh -L 8080:localhost:8080 host`.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import gzip
+import socket
+import hashlib
+import logging
+import argparse
+import threading
+import mimetypes
+from io import BytesIO
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse
+except ImportError:
+    # python3 compatibility
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse
+
+import metis.Utils as Utils
+import metis.Metrics as Metrics
+from metis.SummaryStore import SummaryStore
+
+# condor_q columns needed for the chirp table, on top of what CondorTask already asks for
+CHIRP_COLUMNS = [
+        "taskname", "tag", "metis_retries", "MATCH_EXP_JOB_Site", "ChirpMetisStatus",
+        "ChirpMetisExpectedNevents", "ChirpCMSSWWriteBytes", "ChirpCMSSWReadBytes",
+        "ChirpCMSSWLastUpdate", "ChirpCMSSWEvents", "ChirpCMSSWEventRate",
+        "ChirpCMSSWElapsed", "ChirpCMSSWReadTimeMsecs",
+        ]
+
+# the running server (at most one per process), see `start_server`
+_server = None
+
+def is_running():
+    return _server is not None
+
+def get_extra_columns():
+    """
+    Extra condor_q columns to ask for, only if there's a server to show them
+    """
+    return CHIRP_COLUMNS if is_running() else []
+
+def publish_jobs(taskname, job_dicts):
+    """
+    Called with the condor job dicts of a task every time they are queried
+    """
+    if _server: _server.set_jobs(taskname, job_dicts)
+
+def notify():
+    """
+    Tell the event stream listeners that something (e.g., the summaries) changed
+    """
+    if _server: _server.notify()
+
+def start_server(**kwargs):
+    """
+    Start the server in a background thread (kwargs go to `StatusServer`),
+    or return the one that is already running
+    """
+    global _server
+    if not _server:
+        _server = StatusServer(**kwargs)
+        _server.start()
+    return _server
+
+def stop_server():
+    global _server
+    if _server:
+        _server.stop()
+        _server = None
+
+def to_float(val, default=0.):
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return default
+
+def format_time(timestamp):
+    if timestamp is None: return None
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+def get_chirp_record(job, now=None):
+    """
+    Turn a condor job dict (with `CHIRP_COLUMNS`) into a row of the chirp table,
+    with the same derived columns as `mchirp`
+    """
+    if now is None: now = time.time()
+    events = int(to_float(job.get("ChirpCMSSWEvents"), 0))
+    expected = int(to_float(job.get("ChirpMetisExpectedNevents"), -1))
+    rate = round(to_float(job.get("ChirpCMSSWEventRate")), 1)
+    read_gb = round(to_float(job.get("ChirpCMSSWReadBytes"))/1.0e9, 1)
+    read_seconds = round(to_float(job.get("ChirpCMSSWReadTimeMsecs"))/1.0e3, 1)
+    elapsed = to_float(job.get("ChirpCMSSWElapsed"), None)
+    last_update = to_float(job.get("ChirpCMSSWLastUpdate"), None)
+    eta = now + (expected-events)/rate if (rate > 0 and expected > 0) else now
+    return {
+            "condorid": str(job.get("ClusterId", "")),
+            "taskname": str(job.get("taskname", "")).split("Task_", 1)[-1].split("_CMS4", 1)[0],
+            "tag": job.get("tag", ""),
+            "jobnum": int(to_float(job.get("jobnum"), -1)),
+            "metis_retries": int(to_float(job.get("metis_retries"), 0)),
+            "site": job.get("MATCH_EXP_JOB_Site", ""),
+            "ChirpMetisStatus": str(job.get("ChirpMetisStatus", "")).split("(", 1)[-1].rsplit(")", 1)[0],
+            "ChirpCMSSWLastUpdate": format_time(last_update),
+            "ChirpCMSSWElapsed": format_time(now+elapsed if elapsed is not None else None),
+            "ChirpCMSSWEvents": events,
+            "ChirpMetisExpectedNevents": expected,
+            "ChirpCMSSWEventRate": rate,
+            "ChirpCMSSWReadGB": read_gb,
+            "ChirpCMSSWReadMBps": round(read_gb*1.0e3/read_seconds, 1) if read_seconds > 0 else 0.,
+            "ChirpCMSSWWriteGB": round(to_float(job.get("ChirpCMSSWWriteBytes"))/1.0e9, 1),
+            "ChirpCMSSWProgress": round(100.*events/expected, 1) if expected > 0 else 0.,
+            "ChirpCMSSWETA": format_time(eta),
+            }
+
+class StatusRequestHandler(BaseHTTPRequestHandler):
+
+    server_version = "MetisStatus/1.0"
+    protocol_version = "HTTP/1.0"
+
+    def log_message(self, fmt, *args):
+        self.server.status.logger.debug("StatusServer: " + fmt % args)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/events":
+            return self.send_events()
+        try:
+            body, content_type = self.server.status.get_content(path)
+        except KeyError:
+            return self.send_error(404)
+        self.send_body(body, content_type)
+
+    def send_body(self, body, content_type):
+        etag = '"{0}"'.format(hashlib.sha1(body).hexdigest())
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        status = self.server.status
+        last = None
+        try:
+            while not status.stopped:
+                state = status.wait_for_change(last)
+                if state == last:
+                    self.wfile.write(b": keepalive\n\n")
+                else:
+                    self.wfile.write("event: update\ndata: {0}\n\n".format(json.dumps(state)).encode("utf-8"))
+                    last = state
+                self.wfile.flush()
+        except (IOError, socket.error):
+            # client went away
+            pass
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # clients going away (e.g., closing an event stream) aren't worth a traceback
+        if isinstance(sys.exc_info()[1], (IOError, socket.error)): return
+        HTTPServer.handle_error(self, request, client_address)
+
+class StatusServer(object):
+
+    def __init__(self, port=8080, host="localhost", summary_dir="summaries", dashboard_dir=None, history_points=None, keepalive=15.):
+        """
+        `port` 0 picks a free port (see `url`). `summary_dir` is the `SummaryStore`
+        written by `StatsParser` (by default, "summaries/" next to summary.json).
+        """
+        self.host = host
+        self.port = port
+        self.store = SummaryStore(summary_dir)
+        self.dashboard_dir = os.path.abspath(dashboard_dir or os.path.join(Utils.metis_base(), "dashboard"))
+        self.history_points = history_points
+        self.keepalive = keepalive
+        self.logger = logging.getLogger(Utils.setup_logger())
+        self.stopped = False
+
+        self._jobs = {}
+        self._jobs_version = 0
+        self._index_mtime = None
+        self._version = 0
+        self._cond = threading.Condition()
+        self._httpd = None
+        self._thread = None
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer((self.host, self.port), StatusRequestHandler)
+        self._httpd.status = self
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        self.logger.info("Status server running at {0}".format(self.url()))
+
+    def stop(self):
+        self.stopped = True
+        self.notify()
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def url(self):
+        return "http://{0}:{1}/".format(self.host, self.port)
+
+    def set_jobs(self, taskname, job_dicts):
+        with self._cond:
+            self._jobs[taskname] = list(job_dicts)
+            self._jobs_version += 1
+            self._cond.notify_all()
+
+    def notify(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def get_state(self):
+        # the summaries can be updated by another process, so look at the index itself
+        mtime = os.path.getmtime(self.store.index_path) if self.store.exists() else None
+        if mtime != self._index_mtime:
+            self._index_mtime = mtime
+            self._version = self.store.read_index()["version"]
+        return {"version": self._version, "jobs": self._jobs_version}
+
+    def wait_for_change(self, last, timeout=None):
+        """
+        Block until the state differs from `last` or `timeout` (default `keepalive`) seconds pass
+        """
+        deadline = time.time() + (timeout if timeout is not None else self.keepalive)
+        with self._cond:
+            while True:
+                state = self.get_state()
+                remaining = deadline - time.time()
+                if state != last or remaining <= 0 or self.stopped:
+                    return state
+                self._cond.wait(min(remaining, 2.))
+
+    def get_chirp_records(self):
+        with self._cond:
+            jobs = [job for job_dicts in self._jobs.values() for job in job_dicts]
+        now = time.time()
+        return [get_chirp_record(job, now) for job in jobs if job.get("JobStatus") == "R"]
+
+    def get_data(self, relpath):
+        """
+        Same content as the data/ files written by `StatsParser.make_dashboard`
+        """
+        import metis.StatsParser as StatsParser
+        if relpath in ["version.json", "index.json"]:
+            index = self.store.read_index()
+            if relpath == "version.json":
+                return {"version": index["version"], "last_updated": index["last_updated"]}
+            return StatsParser.get_web_index(index)
+        kind, _, fname = relpath.partition("/")
+        if kind in ["tasks", "history"] and fname.endswith(".json") and "/" not in fname:
+            task = self.store.load("web", fname[:-len(".json")])
+            if task:
+                kwargs = {"history_points": self.history_points} if self.history_points else {}
+                details, history = StatsParser.split_web_task(task, **kwargs)
+                return details if kind == "tasks" else history
+        raise KeyError(relpath)
+
+    def get_content(self, path):
+        """
+        Returns (body, content type) for a request path, or raises KeyError
+        """
+        if path in ["/chirp", "/chirp.json"]:
+            return json.dumps(self.get_chirp_records()).encode("utf-8"), "application/json"
+        if path == "/metrics":
+            return Metrics.render().encode("utf-8"), Metrics.CONTENT_TYPE
+        if path == "/chirpdata.js":
+            return "var tableData = {0};".format(json.dumps(self.get_chirp_records())).encode("utf-8"), "application/javascript"
+        if path.startswith("/data/"):
+            relpath = path[len("/data/"):]
+            compress = relpath.endswith(".gz")
+            if compress: relpath = relpath[:-len(".gz")]
+            body = json.dumps(self.get_data(relpath), separators=(',',':')).encode("utf-8")
+            if not compress:
+                return body, "application/json"
+            buff = BytesIO()
+            with gzip.GzipFile(filename="", mode="wb", fileobj=buff, mtime=0) as fhgz:
+                fhgz.write(body)
+            return buff.getvalue(), "application/gzip"
+        if path == "/": path = "/index.html"
+        fname = os.path.normpath(os.path.join(self.dashboard_dir, path.lstrip("/")))
+        if not fname.startswith(self.dashboard_dir + os.sep) or not os.path.isfile(fname):
+            raise KeyError(path)
+        with open(fname, "rb") as fhin:
+            return fhin.read(), mimetypes.guess_type(fname)[0] or "application/octet-stream"
+
+if __name__ == "__main__": # pragma: no cover
+
+    parser = argparse.ArgumentParser(description="serve the metis dashboard from a summary store")
+    parser.add_argument("-p", "--port", help="port", default=8080, type=int)
+    parser.add_argument("-H", "--host", help="interface to bind to", default="localhost")
+    parser.add_argument("-s", "--summaries", help="summary store directory", default="summaries")
+    args = parser.parse_args()
+
+    server = start_server(port=args.port, host=args.host, summary_dir=args.summaries)
+    print("Serving on {0} (ctrl-c to stop)".format(server.url()))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop_server()
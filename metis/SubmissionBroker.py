@@ -0,0 +1,143 @@
+"""
+Gather the jobs that tasks want to submit during an iteration, and submit them
+together, in as few clusters (condor_submit calls) as possible. Without it, each
+task with something to (re)submit costs one condor_submit fork and one schedd
+transaction, even for a couple of jobs.
+
+    broker = SubmissionBroker()
+    for task in tasks:
+        task.process(broker=broker)
+    broker.flush()
+
+(or `CampaignRunner(..., broker=SubmissionBroker())`). Jobs of different tasks go
+in the same cluster when the cluster-wide submit parameters (executable content,
+memory, container, ...) agree. The rest (arguments, classads, input files and log
+paths) is set per job, and the proc ids are mapped back to the submission history
+of each task.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+import traceback
+
+import metis.Utils as Utils
+import metis.Profiling as Profiling
+
+# kwargs of `Utils.condor_submit` that are set per job rather than per cluster
+PER_JOB_KWARGS = ["arguments", "selection_pairs", "inputfiles", "logdir", "job_lines", "multiple", "fake"]
+
+def get_file_digest(fname):
+    """
+    Executables are copied into each task directory, so they are compared by content
+    """
+    try:
+        with open(fname, "rb") as fhin:
+            return hashlib.sha1(fhin.read()).hexdigest()
+    except IOError:
+        return fname
+
+class SubmissionBroker(object):
+
+    def __init__(self, max_jobs_per_cluster=1000):
+        self.max_jobs_per_cluster = max(1, max_jobs_per_cluster)
+        # list of (task, submit kwargs, outputs of each job)
+        self.batches = []
+        self.lock = threading.Lock()
+
+        self.logger = logging.getLogger(Utils.setup_logger())
+
+    def __len__(self):
+        return sum(len(outs) for _, _, outs in self.batches)
+
+    def add(self, task, v_ins, v_out, fake=False, optimizer=None):
+        """
+        Queue the jobs of `task` for the (inputs, output) pairs in `v_ins` and `v_out`
+        """
+        kwargs = task.get_job_submit_kwargs(v_ins, v_out, fake=fake, optimizer=optimizer)
+        with self.lock:
+            self.batches.append((task, kwargs, task.get_job_outputs(v_out)))
+
+    def get_group_key(self, kwargs):
+        common = [(k, kwargs[k]) for k in sorted(kwargs.keys()) if k not in PER_JOB_KWARGS + ["executable"]]
+        return (get_file_digest(kwargs["executable"]), kwargs.get("fake", False), repr(common))
+
+    def get_clusters(self, batches):
+        """
+        Group batches into lists of batches that can be submitted as one cluster,
+        keeping batches whole, and the order within a group
+        """
+        groups = {}
+        order = []
+        for batch in batches:
+            key = self.get_group_key(batch[1])
+            if key not in groups:
+                groups[key] = []
+                order.append(key)
+            groups[key].append(batch)
+        clusters = []
+        for key in order:
+            cluster, njobs = [], 0
+            for batch in groups[key]:
+                if cluster and njobs + len(batch[2]) > self.max_jobs_per_cluster:
+                    clusters.append(cluster)
+                    cluster, njobs = [], 0
+                cluster.append(batch)
+                njobs += len(batch[2])
+            clusters.append(cluster)
+        return clusters
+
+    def get_merged_kwargs(self, cluster):
+        """
+        Submit kwargs for one cluster made of the jobs of several batches
+        """
+        kwargs = dict(cluster[0][1])
+        if len(cluster) == 1:
+            return kwargs
+        kwargs["arguments"], kwargs["selection_pairs"], kwargs["job_lines"] = [], [], []
+        timestamp = Utils.get_timestamp()
+        for _, batch_kwargs, outs in cluster:
+            logdir = batch_kwargs["logdir"]
+            job_lines = "\n".join([
+                "transfer_input_files={0}".format(",".join(batch_kwargs["inputfiles"])),
+                "log={0}/{1}.log".format(logdir, timestamp),
+                "output={0}/std_logs/1e.$(Cluster).$(Process).out".format(logdir),
+                "error={0}/std_logs/1e.$(Cluster).$(Process).err".format(logdir),
+                ])
+            kwargs["arguments"].extend(batch_kwargs["arguments"])
+            kwargs["selection_pairs"].extend(batch_kwargs.get("selection_pairs", [[] for _ in outs]))
+            kwargs["job_lines"].extend([job_lines for _ in outs])
+            if not batch_kwargs.get("fake", False) and not os.path.isdir(logdir + "/std_logs/"):
+                os.makedirs(logdir + "/std_logs/")
+        return kwargs
+
+    @Profiling.profiled()
+    def flush(self):
+        """
+        Submit all the queued jobs and record them in the tasks (which are backed up again).
+        Returns the number of jobs submitted.
+        """
+        with self.lock:
+            batches, self.batches = self.batches, []
+        if not batches: return 0
+
+        nsubmitted = 0
+        clusters = self.get_clusters(batches)
+        for cluster in clusters:
+            try:
+                succeeded, cluster_id = Utils.condor_submit(**self.get_merged_kwargs(cluster))
+            except:
+                self.logger.error("Error while submitting jobs for {0}:\n{1}".format(
+                    ", ".join(str(task) for task, _, _ in cluster), traceback.format_exc()))
+                continue
+            if not succeeded:
+                continue
+            first_procid = 0
+            for task, _, outs in cluster:
+                task.record_submissions(outs, cluster_id, first_procid=first_procid)
+                task.backup()
+                first_procid += len(outs)
+                nsubmitted += len(outs)
+        self.logger.info("Submitted {0} jobs of {1} tasks in {2} clusters".format(nsubmitted, len(set(id(b[0]) for b in batches)), len(clusters)))
+        return nsubmitted
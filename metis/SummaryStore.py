@@ -0,0 +1,209 @@
+"""
+Per-task summary shards plus a small index, replacing the monolithic
+summary.json/web_summary.json files. Each task gets its own "raw" shard
+(output of `get_task_summary()`) and "web" shard (output of
+`StatsParser.summarize_task()`), written atomically (temp file + rename), so
+readers never need a lock and concurrent Metis instances only contend on the
+small index, and only for the tasks they actually changed.
+
+Layout under `basedir`:
+    index.json          {"version", "last_updated", "tasks": {key: entry}}
+    index.lock          flock'd while the index is read-modified-written
+    raw/<key>.json
+    web/<key>.json
+"""
+
+import os
+import json
+import time
+import fcntl
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+INDEX_NAME = "index.json"
+KINDS = ["raw", "web"]
+
+def task_key(dataset, tag=""):
+    """
+    Filesystem-safe, unique shard name for a (dataset, tag) pair
+    """
+    name = "{0}_{1}".format(dataset.strip("/").replace("/", "_"), tag)
+    name = "".join(c if (c.isalnum() or c in "-_.") else "_" for c in name)[:150]
+    return "{0}_{1}".format(name, hashlib.sha1("{0}|{1}".format(dataset, tag).encode("utf-8")).hexdigest()[:8])
+
+def get_digest(obj, ignore_keys=[]):
+    """
+    Content hash of a JSON-able dict, skipping top-level keys in `ignore_keys`
+    """
+    if ignore_keys:
+        obj = dict((k, v) for k, v in obj.items() if k not in ignore_keys)
+    return hashlib.sha1(json.dumps(obj, sort_keys=True).encode("utf-8")).hexdigest()
+
+def atomic_dump(obj, fname, **kwargs):
+    """
+    json.dump `obj` into a temporary file next to `fname` and rename it into
+    place, so readers see either the old or the new file, never a partial one
+    """
+    dirname = os.path.dirname(os.path.abspath(fname))
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".tmp_", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as fhout:
+            json.dump(obj, fhout, **kwargs)
+        os.chmod(tmpname, 0o644)
+        os.rename(tmpname, fname)
+    except:
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+        raise
+
+def find_path(name):
+    """
+    Where the scripts find `name`: under $METIS_BASE if it's there, else relative
+    to the current directory. None if it's in neither
+    """
+    for path in [os.path.join(os.getenv("METIS_BASE", ""), name), name]:
+        if os.path.exists(path):
+            return path
+    return None
+
+def find_store(basedir="summaries"):
+    """
+    The existing `SummaryStore` in `basedir`, looked up like `find_path`, or None
+    """
+    for path in [os.path.join(os.getenv("METIS_BASE", ""), basedir), basedir]:
+        store = SummaryStore(path)
+        if store.exists():
+            return store
+    return None
+
+class SummaryStore(object):
+
+    def __init__(self, basedir="summaries", refresh_every=3600):
+        """
+        `refresh_every` (seconds) is how long an unchanged task can go without
+        its web shard being rewritten (which is what extends its history)
+        """
+        self.basedir = basedir
+        self.refresh_every = refresh_every
+        self.index_path = os.path.join(basedir, INDEX_NAME)
+        self.lock_path = os.path.join(basedir, "index.lock")
+
+    def exists(self):
+        return os.path.exists(self.index_path)
+
+    def shard_path(self, kind, key):
+        return os.path.join(self.basedir, kind, "{0}.json".format(key))
+
+    def make_dirs(self):
+        for kind in KINDS:
+            dirname = os.path.join(self.basedir, kind)
+            if not os.path.isdir(dirname):
+                try:
+                    os.makedirs(dirname)
+                except OSError:
+                    # somebody else made it in the meantime
+                    pass
+
+    @contextmanager
+    def locked(self):
+        self.make_dirs()
+        with open(self.lock_path, "a") as fhlock:
+            fcntl.flock(fhlock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fhlock, fcntl.LOCK_UN)
+
+    def read_index(self):
+        index = {"version": 0, "last_updated": 0, "tasks": {}}
+        if self.exists():
+            try:
+                with open(self.index_path, "r") as fhin:
+                    index.update(json.load(fhin))
+            except ValueError:
+                pass
+        return index
+
+    def load(self, kind, key):
+        """
+        Load a single shard, or {} if there is none
+        """
+        try:
+            with open(self.shard_path(kind, key), "r") as fhin:
+                return json.load(fhin)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def load_all(self, kind, keys=None):
+        """
+        Returns {key: shard} for all tasks in the index (or just `keys`)
+        """
+        if keys is None:
+            keys = self.read_index()["tasks"].keys()
+        shards = {}
+        for key in keys:
+            shard = self.load(kind, key)
+            if shard: shards[key] = shard
+        return shards
+
+    def is_stale(self, index, kind, key, digest):
+        """
+        Whether a shard with content `digest` needs to be (re)written, given the current index
+        """
+        entry = index["tasks"].get(key, {})
+        if entry.get("{0}_digest".format(kind)) != digest: return True
+        return (time.time() - entry.get("{0}_updated".format(kind), 0)) > self.refresh_every
+
+    def update(self, raw={}, web=[]):
+        """
+        Write shards for tasks and register them in the index. `raw` is a dict
+        of dataset name to raw task summary and `web` a list of web task summaries.
+        Callers should only pass tasks that changed (see `is_stale`).
+        Returns the new index.
+        """
+        self.make_dirs()
+        now = time.time()
+        entries = {}
+        for dsname, summary in raw.items():
+            key = task_key(dsname, summary.get("tag", ""))
+            atomic_dump(summary, self.shard_path("raw", key))
+            entries.setdefault(key, {"dataset": dsname, "tag": summary.get("tag", "")}).update({
+                "raw_digest": get_digest(summary),
+                "raw_updated": now,
+                })
+        for task in web:
+            general = task["general"]
+            key = task_key(general["dataset"], general["tag"])
+            atomic_dump(task, self.shard_path("web", key))
+            entries.setdefault(key, {"dataset": general["dataset"], "tag": general["tag"]}).update({
+                "general": general,
+                "web_digest": get_digest(task, ignore_keys=["history"]),
+                "web_updated": now,
+                })
+
+        with self.locked():
+            index = self.read_index()
+            if entries:
+                for key, entry in entries.items():
+                    index["tasks"].setdefault(key, {}).update(entry)
+                index["version"] += 1
+                index["last_updated"] = now
+                atomic_dump(index, self.index_path)
+        return index
+
+    def remove(self, keys):
+        """
+        Drop tasks from the index and delete their shards
+        """
+        with self.locked():
+            index = self.read_index()
+            for key in keys:
+                index["tasks"].pop(key, None)
+                for kind in KINDS:
+                    if os.path.exists(self.shard_path(kind, key)):
+                        os.unlink(self.shard_path(kind, key))
+            index["version"] += 1
+            index["last_updated"] = time.time()
+            atomic_dump(index, self.index_path)
+        return index
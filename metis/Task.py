@@ -1,9 +1,23 @@
 import os
 import traceback
 import logging
+import hashlib
 import cPickle as pickle
 
 from metis.Utils import setup_logger, do_cmd, metis_base
+import metis.Profiling as Profiling
+
+# kwargs that don't change what a task produces
+VOLATILE_KWARGS = ["flush", "recopy_inputs", "no_load_from_backup", "executor"]
+
+def get_config_digest(task_name, kwargs):
+    """
+    Content hash of a task configuration (class name and constructor kwargs).
+    Values are hashed by their repr, so kwargs with an unstable repr
+    (e.g., lambdas) give a different digest every time.
+    """
+    buff = task_name + "|" + "|".join("{0}={1!r}".format(k, kwargs[k]) for k in sorted(kwargs.keys()) if k not in VOLATILE_KWARGS)
+    return hashlib.sha1(buff.encode("utf-8")).hexdigest()
 
 class Task(object):
 
@@ -68,6 +82,9 @@ class Task(object):
             buff += sample.get_datasetname()
         return "%0.2X" % abs(hash(buff))
 
+    def get_config_digest(self):
+        return get_config_digest(self.get_task_name(), self.kwargs)
+
     def info_to_backup(self):
         """
         Up to subclasses to overload this and declare what
@@ -75,6 +92,7 @@ class Task(object):
         """
         return []
 
+    @Profiling.profiled()
     def backup(self):
         """
         Back up registered (in self.info_to_backup()) variables
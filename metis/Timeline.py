@@ -0,0 +1,107 @@
+"""
+Reconstruct per-job phase timelines (queue, setup, cmsRun, validation, stageout)
+from parsed condor logs (see `LogParser.log_parser`), and aggregate them into
+percentiles per task and per site.
+"""
+
+from __future__ import print_function
+
+import math
+
+PHASES = ["queue", "setup", "cmsrun", "validation", "stageout", "total"]
+
+def to_int(val, default=-1):
+    try:
+        return int(float(val))
+    except (TypeError, ValueError):
+        return default
+
+def get_job_timeline(parsed):
+    """
+    Takes a parsed log and returns a dict of phase name to duration in seconds,
+    only for the phases that can be reconstructed from what the job printed.
+    Jobs with a job report have all phases. Older logs only have the start time
+    (header), "time before copy" and "time at end", so they only yield stageout and total.
+    """
+    args = parsed.get("args", {})
+    ts = dict(parsed.get("timestamps", {}))
+    if "start" not in ts: ts["start"] = to_int(args.get("time"))
+    ts = dict((k, to_int(v)) for k, v in ts.items())
+    ts = dict((k, v) for k, v in ts.items() if v > 0)
+
+    qdate = to_int(args.get("QDate"))
+    job_start = to_int(args.get("JobStartDate"), ts.get("start", -1))
+
+    def delta(first, second):
+        if first in ts and second in ts and ts[second] >= ts[first]:
+            return ts[second] - ts[first]
+        return None
+
+    timeline = {
+            "setup": delta("start", "setup_end"),
+            "cmsrun": delta("cmsrun_start", "cmsrun_end"),
+            "validation": delta("cmsrun_end", "validation_end"),
+            "stageout": delta("stageout_start", "stageout_end") if "stageout_end" in ts else delta("stageout_start", "end"),
+            "total": delta("start", "end"),
+            }
+    if qdate > 0 and job_start >= qdate:
+        timeline["queue"] = job_start - qdate
+    return dict((k, v) for k, v in timeline.items() if v is not None)
+
+def percentile(sorted_vals, frac):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not sorted_vals: return -1
+    idx = int(round(frac*(len(sorted_vals)-1)))
+    return sorted_vals[min(max(idx, 0), len(sorted_vals)-1)]
+
+def aggregate_timelines(timelines):
+    """
+    Takes a list of job timelines (from `get_job_timeline`) and returns
+    {phase: {"n", "mean", "p10", "p50", "p90", "max"}} for every phase seen
+    """
+    d_agg = {}
+    for phase in PHASES:
+        vals = sorted([tl[phase] for tl in timelines if phase in tl])
+        if not vals: continue
+        d_agg[phase] = {
+                "n": len(vals),
+                "mean": round(1.0*sum(vals)/len(vals), 1),
+                "p10": percentile(vals, 0.10),
+                "p50": percentile(vals, 0.50),
+                "p90": percentile(vals, 0.90),
+                "max": vals[-1],
+                }
+    return d_agg
+
+def summarize_timelines(timelines, sites):
+    """
+    Aggregate a list of job timelines for a task, overall and per site
+    (`sites` is a list of the same length with the site for each job)
+    """
+    by_site = {}
+    for tl, site in zip(timelines, sites):
+        by_site.setdefault(site or "unknown", []).append(tl)
+    return {
+            "phases": aggregate_timelines(timelines),
+            "sites": dict((site, aggregate_timelines(tls)) for site, tls in by_site.items()),
+            }
+
+def estimate_chunks_per_job(setup_seconds, chunk_seconds, max_setup_fraction=0.1, max_job_seconds=8*3600, max_chunks=20):
+    """
+    Number of chunks (outputs) for one job to process one after another, so that
+    the setup (paid once per job) is at most `max_setup_fraction` of the job,
+    without making jobs longer than `max_job_seconds` or `max_chunks` chunks
+    """
+    if setup_seconds <= 0: return 1
+    chunk_seconds = max(chunk_seconds, 1)
+    nchunks = int(math.ceil(setup_seconds*(1.-max_setup_fraction)/(max_setup_fraction*chunk_seconds)))
+    nchunks = min(nchunks, int((max_job_seconds-setup_seconds)/chunk_seconds), max_chunks)
+    return max(nchunks, 1)
+
+def format_duration(secs):
+    if secs < 0: return "-"
+    if secs < 120: return "{0}s".format(int(secs))
+    if secs < 2*3600: return "{0:.1f}m".format(secs/60.)
+    return "{0:.1f}h".format(secs/3600.)
@@ -6,12 +6,66 @@ from __future__ import print_function
 """
 
 import os
+import time
 import glob
 import tarfile
-import tempfile
-import commands
+import subprocess
+import collections
+import multiprocessing
+import multiprocessing.pool
+from distutils.spawn import find_executable
 from fnmatch import fnmatch
 
+# size of the independently compressed blocks of xz/zstd tarballs
+BLOCK_MB = 32
+
+def get_compress_command(algo, level=None):
+    """
+    Command compressing stdin to stdout, for `compress_parallel`
+    (level None is the default of the tool, as is a negative one for xz)
+    """
+    if algo == "xz":
+        return ["xz", "-c"] + (["-{0}".format(level)] if level is not None and int(level) >= 0 else [])
+    if algo == "zstd":
+        return ["zstd", "-c", "-q"] + (["-{0}".format(level)] if level is not None else [])
+    raise Exception("Unknown compression: {0}".format(algo))
+
+def compress_block(command, block):
+    proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate(block)
+    if proc.returncode != 0:
+        raise Exception("{0} failed: {1}".format(" ".join(command), err))
+    return out
+
+def compress_parallel(src, dest, command, nthreads=None, block_MB=BLOCK_MB):
+    """
+    Compress `src` into `dest` by splitting it into blocks of `block_MB` and compressing them
+    concurrently with `command` (see `get_compress_command`) on `nthreads` (default: all) cores.
+    The compressed blocks are written one after another as independent streams, which xz and
+    zstd decompress as one (so `tar xf` works as usual). At most 2*`nthreads` blocks are in memory.
+    `dest` only appears once all the blocks are compressed.
+    """
+    nthreads = nthreads or multiprocessing.cpu_count()
+    block_size = max(int(block_MB*1024*1024), 1)
+    pool = multiprocessing.pool.ThreadPool(nthreads)
+    pending = collections.deque()
+    tmpname = dest + ".tmp"
+    try:
+        with open(src, "rb") as fhin, open(tmpname, "wb") as fhout:
+            while True:
+                block = fhin.read(block_size)
+                if block:
+                    pending.append(pool.apply_async(compress_block, (command, block)))
+                if pending and (not block or len(pending) >= 2*nthreads):
+                    fhout.write(pending.popleft().get())
+                if not block and not pending:
+                    break
+        os.rename(tmpname, dest)
+    finally:
+        pool.terminate()
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+
 class UserTarball(object):
     """
         _UserTarball_
@@ -23,19 +77,35 @@ class UserTarball(object):
             Also adds user specified files in the right place.
     """
 
-    def __init__(self, name=None, mode='w:gz', logger=None, override_cmssw_base=None, exclude_root_files=False, exclude_patterns=[], extra_paths=[],use_bz2=False,use_xz=False,xz_level=None):
+    def __init__(self, name=None, mode='w:gz', logger=None, override_cmssw_base=None, exclude_root_files=False, exclude_patterns=[], extra_paths=[],use_bz2=False,use_xz=False,xz_level=None,
+            use_zstd=False,zstd_level=None,nthreads=None,block_MB=BLOCK_MB):
         # XXX NOTE: if using bz2, need to uncompress with `tar xf blah`, note no z to have tar auto-detect
         if use_bz2: mode = "w:bz2"
         # self.logger = logger
-        # When using xz, open uncompressed output for writing "w|", and then we will
-        # hijack list from tarfile object to overwrite with an xz file
-        if use_xz: mode = "w:"
+        # With xz or zstd, write an uncompressed tarball next to the output, and then
+        # compress it in blocks on several cores (see `compress_parallel`)
+        # zstd tarballs need zstd where they are extracted (the executables pipe them through it)
+        if use_zstd and not find_executable("zstd"):
+            print("zstd is not available, so using xz instead")
+            use_zstd, use_xz = False, True
+        self.compression = "zstd" if use_zstd else ("xz" if use_xz else None)
         self.use_xz = use_xz
-        self.xz_level = xz_level or 3
+        self.xz_level = int(xz_level) if xz_level is not None else 3
+        self.zstd_level = int(zstd_level) if zstd_level is not None else None
+        self.nthreads = nthreads or multiprocessing.cpu_count()
+        self.block_MB = block_MB
         self.name = name
         self.CMSSW_BASE = override_cmssw_base if override_cmssw_base else os.getenv("CMSSW_BASE", "")
+        # seconds spent tarring and compressing (see `writeContent`)
+        self.timings = {}
+        self.t0 = time.time()
         # self.logger.debug("Making tarball in %s" % name)
-        self.tarfile = tarfile.open(name=name, mode=mode, dereference=True)
+        if self.compression:
+            self.tarname = "{0}.tmp{1}".format(name, os.getpid())
+            self.tarfile = tarfile.open(name=self.tarname, mode="w:", dereference=True)
+        else:
+            self.tarname = name
+            self.tarfile = tarfile.open(name=name, mode=mode, dereference=True)
         self.exclude_root_files = exclude_root_files
         self.exclude_patterns = exclude_patterns
         self.extra_paths = extra_paths
@@ -111,34 +181,40 @@ class UserTarball(object):
         members = self.tarfile.getmembers()
         self.content = [(int(x.size), x.name) for x in members]
 
-        if self.use_xz:
+        if self.compression:
             # flush the original (uncompressed) tarfile
             self.tarfile.close()
-            f = tempfile.NamedTemporaryFile(delete=False)
-            for obj in members:
-                f.write(obj.name+"\n")
-            # flush buffer since file hasn't closed
-            f.flush()
-            if self.xz_level >= 0:
-                level_str = "XZ_OPT=-{level}".format(level=self.xz_level)
-            else:
-                level_str = ""
-            # --no-recursion because tarfile will report a folder and the files inside (which would result in duplicates)
-            # -C to switch to cmssw base before tarring (paths are relative to that)
-            # -h to follow symlinks
-            cmd = "{level_str} tar cJf {name} -C $CMSSW_BASE -h --no-recursion --files-from={filelist}".format(level_str=level_str,name=self.name,filelist=f.name)
-            print("Running:",cmd)
-            stat, out = commands.getstatusoutput(cmd)
-            f.close()
+            t1 = time.time()
+            level = self.zstd_level if self.compression == "zstd" else self.xz_level
+            command = get_compress_command(self.compression, level)
+            print("Compressing with {0} in blocks of {1}MB on {2} threads".format(" ".join(command), self.block_MB, self.nthreads))
+            try:
+                compress_parallel(self.tarname, self.name, command, nthreads=self.nthreads, block_MB=self.block_MB)
+                self.timings["uncompressed_MB"] = os.path.getsize(self.tarname) / 1024.**2
+            finally:
+                os.unlink(self.tarname)
+            self.timings["tar"] = t1 - self.t0
+            self.timings["compress"] = time.time() - t1
+
 
+    def discard(self):
+        """
+        Remove the temporary uncompressed tarball (with xz or zstd), if it's still
+        there, e.g., when adding the files failed. Does nothing after `close`
+        """
+        if self.compression and os.path.exists(self.tarname):
+            self.tarfile.close()
+            os.unlink(self.tarname)
 
     def close(self):
         """
         Calculate the checkum and close
         """
         self.writeContent()
-        if not self.use_xz:
-            return self.tarfile.close()
+        if not self.compression:
+            ret = self.tarfile.close()
+            self.timings["tar"] = time.time() - self.t0
+            return ret
 
     def checkdirectory(self, dir_): # pragma: no cover
         # checking for infinite symbolic link loop
@@ -175,9 +251,12 @@ class UserTarball(object):
 
 if __name__ == "__main__":
 
-    # xz_level is -6 by default (in tar executable), but -3 is a good working point
+    # xz_level is -6 by default (in the xz executable), but -3 is a good working point
     # so that is the default in this script
     ut = UserTarball(name="blah.tar.xz", use_xz=True)
-    ut.addFiles()
-    ut.close()
+    try:
+        ut.addFiles()
+        ut.close()
+    finally:
+        ut.discard()
     print(ut)
@@ -19,9 +19,15 @@ import logging
 import datetime
 import shelve
 import fcntl
+import gzip
+import tempfile
+import shutil
 from collections import Counter
 from contextlib import contextmanager
 
+import metis.Profiling as Profiling
+import metis.Metrics as Metrics
+
 # http://uaf-10.t2.ucsd.edu/~namin/dump/badsites.html
 good_sites = set([
 
@@ -63,25 +69,28 @@ class cached(object): # pragma: no cover
     @cached(default_max_age = datetime.timedelta(seconds=5*60))
     """
     def __init__(self, *args, **kwargs):
-        self.cached_function_responses = {}
         self.default_max_age = kwargs.get("default_max_age", datetime.timedelta(seconds=0))
         self.cache_file = kwargs.get("filename", "cache.shelf")
 
     def __call__(self, func):
         def inner(*args, **kwargs):
-            lockfd = open(self.cache_file + ".lock", "a")
-            self.cached_function_responses = shelve.open(self.cache_file)
-            fcntl.flock(lockfd, fcntl.LOCK_EX)
-            max_age = kwargs.get('max_age', self.default_max_age)
-            funcname = func.__name__
-            key = "|".join([str(funcname), str(args), str(kwargs)])
-            if not max_age or key not in self.cached_function_responses or (datetime.datetime.now() - self.cached_function_responses[key]['fetch_time'] > max_age):
-                if 'max_age' in kwargs: del kwargs['max_age']
-                res = func(*args, **kwargs)
-                self.cached_function_responses[key] = {'data': res, 'fetch_time': datetime.datetime.now()}
-            to_ret = self.cached_function_responses[key]['data']
-            self.cached_function_responses.close()
-            fcntl.flock(lockfd, fcntl.LOCK_UN)
+            # lock before opening the shelf, and keep it local, since tasks may be
+            # processed by several threads (see `CampaignRunner`), each with its own lock fd
+            with open(self.cache_file + ".lock", "a") as lockfd:
+                fcntl.flock(lockfd, fcntl.LOCK_EX)
+                responses = shelve.open(self.cache_file)
+                try:
+                    max_age = kwargs.get('max_age', self.default_max_age)
+                    funcname = func.__name__
+                    key = "|".join([str(funcname), str(args), str(kwargs)])
+                    if not max_age or key not in responses or (datetime.datetime.now() - responses[key]['fetch_time'] > max_age):
+                        if 'max_age' in kwargs: del kwargs['max_age']
+                        res = func(*args, **kwargs)
+                        responses[key] = {'data': res, 'fetch_time': datetime.datetime.now()}
+                    to_ret = responses[key]['data']
+                finally:
+                    responses.close()
+                    fcntl.flock(lockfd, fcntl.LOCK_UN)
             return to_ret
         return inner
 
@@ -124,6 +133,7 @@ def do_cmd(cmd, returnStatus=False, dryRun=False):
         print("dry run: {}".format(cmd))
         status, out = 1, ""
     else:
+        Profiling.count("fork")
         status, out = commands.getstatusoutput(cmd)
     if returnStatus: return status, out
     else: return out
@@ -222,6 +232,7 @@ def setup_logger(logger_name="logger_metis"): # pragma: no cover
     logger.addHandler(ch)
     return logger_name
 
+@Profiling.profiled("Utils.condor_q")
 def condor_q(selection_pairs=None, user="$USER", cluster_id="", extra_columns=[], schedd=None,do_long=False,use_python_bindings=False,extra_constraint=""):
     """
     Return list of dicts with items for each of the columns
@@ -234,6 +245,9 @@ def condor_q(selection_pairs=None, user="$USER", cluster_id="", extra_columns=[]
     - If `use_python_bindings` and htcondor is importable, use those for a speedup. Note the caveats below.
     """
 
+    Profiling.count("schedd_query")
+    t0 = time.time()
+
     # These are the condor_q -l row names
     columns = ["ClusterId", "ProcId", "JobStatus", "EnteredCurrentStatus", "CMD", "ARGS", "Out", "Err", "HoldReason"]
     columns.extend(extra_columns)
@@ -274,6 +288,7 @@ def condor_q(selection_pairs=None, user="$USER", cluster_id="", extra_columns=[]
                 jobs.append(tmp)
         except RuntimeError as e:
             # Most likely "Timeout when waiting for remote host". Re-raise so we catch later.
+            Metrics.CONDOR_Q_FAILURES.inc()
             raise Exception("Condor querying error -- timeout when waiting for remote host.")
 
 
@@ -295,6 +310,7 @@ def condor_q(selection_pairs=None, user="$USER", cluster_id="", extra_columns=[]
             tmp["ClusterId"] = "{}.{}".format(tmp["ClusterId"],tmp["ProcId"])
             jobs.append(tmp)
 
+    Metrics.CONDOR_Q_DURATION.observe(time.time()-t0)
     return jobs
 
 def condor_rm(cluster_ids=[]): # pragma: no cover
@@ -307,13 +323,15 @@ def condor_rm(cluster_ids=[]): # pragma: no cover
 def condor_release(): # pragma: no cover
     do_cmd("condor_release {0}".format(os.getenv("USER")))
 
+@Profiling.profiled("Utils.condor_submit")
 def condor_submit(**kwargs): # pragma: no cover
     """
     Takes in various keyword arguments to submit a condor job.
     Returns (succeeded:bool, cluster_id:str)
     fake=True kwarg returns (True, -1)
     multiple=True will let `arguments` and `selection_pairs` be lists (of lists)
-    and will queue up one job for each element
+    and will queue up one job for each element. `job_lines` (a list of strings,
+    one per job) then adds submit commands for each job (overriding the common ones)
     """
 
     if kwargs.get("fake",False):
@@ -416,11 +434,16 @@ when_to_transfer_output = ON_EXIT
         template += '+{0}="{1}"\n'.format(*ad)
     do_extra = len(params["extra"]) == len(params["arguments"])
     if queue_multiple:
+        job_lines = kwargs.get("job_lines", [])
+        if job_lines and len(job_lines) != len(params["arguments"]):
+            raise RuntimeError("Job lines must match argument list in length")
         template += "\n"
         for ijob,args in enumerate(params["arguments"]):
             template += "arguments={0}\n".format(args)
             if do_extra:
                 template += "{0}\n".format(params["extra"][ijob])
+            if job_lines:
+                template += "{0}\n".format(job_lines[ijob])
             template += "queue\n"
             template += "\n"
     else:
@@ -438,14 +461,18 @@ when_to_transfer_output = ON_EXIT
     schedd = kwargs.get("schedd","") # see note in condor_q about `schedd`
     if schedd:
         extra_cli += " -name {} ".format(schedd)
+    t0 = time.time()
     out = do_cmd("mkdir -p {0}/std_logs/  ; condor_submit {1}/submit.cmd {2}".format(params["logdir"],exe_dir,extra_cli))
+    Metrics.CONDOR_SUBMIT_DURATION.observe(time.time()-t0)
 
     succeeded = False
     cluster_id = -1
     if "job(s) submitted to cluster" in out:
         succeeded = True
         cluster_id = out.split("submitted to cluster ")[-1].split(".",1)[0].strip()
+        Metrics.CONDOR_SUBMIT.inc(result="success")
     else:
+        Metrics.CONDOR_SUBMIT.inc(result="failure")
         raise RuntimeError("Couldn't submit job to cluster because:\n----\n{0}\n----".format(out))
 
     return succeeded, cluster_id
@@ -483,23 +510,122 @@ def file_chunker(files, files_per_output=-1, events_per_output=-1, MB_per_output
     # be empty if flushed
     return chunks, chunk
 
+def file_packer(files, MB_per_output, flush=False, min_fill=0.9):
+    """
+    Packs a list of File objects into chunks of at most MB_per_output
+    (first fit decreasing), regardless of their order. Files bigger than
+    MB_per_output get a chunk of their own. Unless flush=True, chunks
+    filled below min_fill*MB_per_output are returned as leftover files, to
+    be packed again once more files show up
+    """
+    bins = []
+    sizes = dict((id(f), f.get_filesizeMB()) for f in files)
+    for f in sorted(files, key=lambda x: -sizes[id(x)]):
+        for b in bins:
+            if b[0] + sizes[id(f)] <= MB_per_output:
+                b[0] += sizes[id(f)]
+                b[1].append(f)
+                break
+        else:
+            bins.append([sizes[id(f)], [f]])
+    # keep the original order within and across chunks
+    position = dict((id(f), i) for i, f in enumerate(files))
+    chunks, leftover = [], []
+    for size, chunk in bins:
+        chunk = sorted(chunk, key=lambda x: position[id(x)])
+        if flush or size >= min_fill*MB_per_output:
+            chunks.append(chunk)
+        else:
+            leftover.extend(chunk)
+    chunks = sorted(chunks, key=lambda x: position[id(x[0])])
+    leftover = sorted(leftover, key=lambda x: position[id(x)])
+    return chunks, leftover
+
 def make_tarball(fname, **kwargs): # pragma: no cover
     from UserTarball import UserTarball
     ut = UserTarball(name=fname, **kwargs)
-    ut.addFiles()
-    ut.close()
+    try:
+        ut.addFiles()
+        ut.close()
+    finally:
+        ut.discard()
     return os.path.abspath(fname)
 
-def update_dashboard(webdir=None, jsonfile=None): # pragma: no cover
+def write_dashboard_json(obj, fname):
+    """
+    Atomically write `obj` as compact JSON into `fname` and a pre-gzipped
+    copy into `fname`.gz (which the dashboard fetches and decompresses itself)
+    """
+    dirname = os.path.dirname(fname)
+    if not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            pass
+    content = json.dumps(obj, separators=(',',':'))
+    for name, is_gz in [(fname, False), (fname+".gz", True)]:
+        fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".tmp_")
+        with os.fdopen(fd, "wb") as fhout:
+            if is_gz:
+                # fixed mtime, so identical content gives identical files (and ETags)
+                with gzip.GzipFile(filename="", mode="wb", fileobj=fhout, mtime=0) as fhgz:
+                    fhgz.write(content.encode("utf-8"))
+            else:
+                fhout.write(content.encode("utf-8"))
+        os.chmod(tmpname, 0o644)
+        os.rename(tmpname, name)
+
+# webdir -> version stamp of the dashboard files installed there (see `install_dashboard`)
+_installed_dashboards = {}
+
+def get_dashboard_stamp(srcdir):
+    """
+    Version stamp of the dashboard sources: their names and modification times
+    """
+    stamp = []
+    for root, _, fnames in os.walk(srcdir):
+        for fname in fnames:
+            path = os.path.join(root, fname)
+            stamp.append((os.path.relpath(path, srcdir), os.path.getmtime(path)))
+    return tuple(sorted(stamp))
+
+def install_dashboard(srcdir, webdir):
+    """
+    Copy the dashboard files in `srcdir` into `webdir`, if this process didn't install
+    this version there yet, and then only the ones that are newer than the copies
+    """
+    stamp = get_dashboard_stamp(srcdir)
+    if _installed_dashboards.get(webdir) == stamp:
+        return False
+    for relpath, mtime in stamp:
+        dest = os.path.join(webdir, relpath)
+        if os.path.exists(dest) and os.path.getmtime(dest) >= mtime:
+            continue
+        if not os.path.isdir(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+        shutil.copy2(os.path.join(srcdir, relpath), dest)
+    _installed_dashboards[webdir] = stamp
+    return True
+
+def update_dashboard(webdir=None, jsonfile=None, datafiles=[]): # pragma: no cover
+    """
+    Install/refresh the dashboard in `webdir`. `datafiles` is a list of
+    (path relative to `webdir`/data/, object) pairs, written in that order
+    (so shards should come before the index that points to them).
+    """
     if not webdir:
         raise Exception("Um, we need a web directory, dude.")
+    mb = metis_base()
     if not os.path.exists(os.path.expanduser(webdir)):
-        mb = metis_base()
         do_cmd("mkdir -p {}/plots/".format(webdir), dryRun=False)
-        do_cmd("cp -rp {}/dashboard/* {}/".format(mb,webdir), dryRun=False)
+    install_dashboard(os.path.join(mb, "dashboard"), os.path.expanduser(webdir))
     if jsonfile and os.path.exists(jsonfile):
         do_cmd("cp {} {}/".format(jsonfile, webdir), dryRun=False)
+    if os.path.isdir("plots") and os.listdir("plots"):
         do_cmd("cp plots/* {}/plots/".format(webdir), dryRun=False)
+    datadir = os.path.join(os.path.expanduser(webdir), "data")
+    for relpath, obj in datafiles:
+        write_dashboard_json(obj, os.path.join(datadir, relpath))
 
 def hsv_to_rgb(h, s, v): # pragma: no cover
     """
@@ -0,0 +1,392 @@
+"""
+Pull-based execution of task jobs, for jobs so short that condor negotiation and
+matchmaking take longer than the jobs themselves. A few long-lived pilots (condor
+jobs, or local processes) pull the jobs (work units) from a queue served over HTTP
+by the process that loops over the tasks, run them with the usual executable and
+arguments, and report back.
+
+    queue = WorkQueue.start_server(port=8090)
+    task = CMSSWTask(..., executor=queue)
+    queue.start_local_pilots(4)    # or queue.submit_pilots(50), see below
+
+Tasks then submit to the queue instead of to condor, and see their jobs as
+`condor_q`-like dicts (it is an `Executor.Executor`), so the task state (submission
+history, logs in logs/std_logs/1e.<id>.out/err, ...) is the same as with condor.
+Pilots lease units for `lease_seconds` and renew the lease while the unit runs:
+units of lost pilots go back to the queue when their lease expires (at most
+`max_attempts` times).
+
+The server listens on localhost by default. Condor pilots (`submit_pilots`, running
+executables/metis_pilot.py) need to reach it from the worker nodes, so they need a server
+bound to an address they can reach (e.g., host="0.0.0.0"), on a network you trust.
+Every request must carry the random token of the server (`token`, in an X-Metis-Token
+header), which the pilots get in their environment (METIS_WQ_TOKEN), so that nobody
+else can take units, fetch files, or write logs.
+
+The pilots talk JSON over HTTP POST
+    /lease      {"pilot": name} -> {"unit": {...}, "lease": id, "lease_seconds": N}, or {} if idle
+    /heartbeat  {"lease": id} -> {"ok": false} if the unit was removed or given to another pilot
+    /done       {"lease": id, "status": exit code, "stdout": ..., "stderr": ...}
+                (logs beyond MAX_LOG_HEAD+MAX_LOG_TAIL bytes are cut in the middle)
+and fetch the executable and input files with GET /file?path=...
+(GET /status gives the number of units in each state).
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import uuid
+import hmac
+import binascii
+import socket
+import logging
+import threading
+import subprocess
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    # python3 compatibility
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+
+import metis.Utils as Utils
+from metis.Executor import Executor, get_job_selection, matches
+from metis.StatusServer import ThreadingHTTPServer
+
+IDLE = "I"
+RUNNING = "R"
+
+TOKEN_HEADER = "X-Metis-Token"
+# POST bodies are bigger than this only if a pilot misbehaves
+MAX_PAYLOAD = 16*1024*1024
+# the logs written for a unit keep the beginning (header) and the end (job report),
+# as the pilots do (see executables/metis_pilot.py)
+MAX_LOG_HEAD = 256*1024
+MAX_LOG_TAIL = 2*1024*1024
+
+# the running server (at most one per process), see `start_server`
+_server = None
+
+def start_server(**kwargs):
+    """
+    Start the queue in a background thread (kwargs go to `WorkQueueServer`),
+    or return the one that is already running
+    """
+    global _server
+    if not _server:
+        _server = WorkQueueServer(**kwargs)
+        _server.start()
+    return _server
+
+def stop_server():
+    global _server
+    if _server:
+        _server.stop()
+        _server = None
+
+def get_pilot_path():
+    return os.path.join(Utils.metis_base(), "metis/executables/metis_pilot.py")
+
+def truncate_log(text):
+    if len(text) <= MAX_LOG_HEAD + MAX_LOG_TAIL:
+        return text
+    return text[:MAX_LOG_HEAD] + "\n[workqueue] ... skipped ...\n" + text[-MAX_LOG_TAIL:]
+
+class WorkQueueRequestHandler(BaseHTTPRequestHandler):
+
+    server_version = "MetisWorkQueue/1.0"
+    protocol_version = "HTTP/1.0"
+
+    def log_message(self, fmt, *args):
+        self.server.queue.logger.debug("WorkQueue: " + fmt % args)
+
+    def send_json(self, obj, code=200):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def is_authorized(self):
+        token = self.headers.get(TOKEN_HEADER, "")
+        if hmac.compare_digest(str(token), str(self.server.queue.token)):
+            return True
+        self.send_error(403)
+        return False
+
+    def do_GET(self):
+        if not self.is_authorized(): return
+        url = urlparse(self.path)
+        queue = self.server.queue
+        if url.path == "/status":
+            return self.send_json(queue.get_counts())
+        if url.path == "/file":
+            fname = parse_qs(url.query).get("path", [""])[0]
+            if not queue.is_served_file(fname) or not os.path.isfile(fname):
+                return self.send_error(404)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(os.path.getsize(fname)))
+            self.end_headers()
+            with open(fname, "rb") as fhin:
+                while True:
+                    block = fhin.read(1024*1024)
+                    if not block: break
+                    self.wfile.write(block)
+            return
+        self.send_error(404)
+
+    def do_POST(self):
+        if not self.is_authorized(): return
+        queue = self.server.queue
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length > MAX_PAYLOAD:
+                return self.send_error(413)
+            payload = json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+        except ValueError:
+            return self.send_error(400)
+        path = urlparse(self.path).path
+        if path == "/lease":
+            return self.send_json(queue.lease(payload.get("pilot", self.client_address[0])))
+        if path == "/heartbeat":
+            return self.send_json({"ok": queue.heartbeat(payload.get("lease"))})
+        if path == "/done":
+            return self.send_json({"ok": queue.done(payload.get("lease"), payload.get("status", -1),
+                payload.get("stdout", ""), payload.get("stderr", ""))})
+        self.send_error(404)
+
+class WorkQueueServer(Executor):
+
+    def __init__(self, port=0, host="localhost", lease_seconds=300., max_attempts=3, token=None):
+        """
+        `port` 0 picks a free port (see `url`). Only local pilots can reach the default
+        `host`: for pilots running elsewhere, bind to "0.0.0.0" (the url then has the host name).
+        `token` is what the pilots need to send along with each request (random by default).
+        """
+        self.host = host
+        self.token = token or binascii.hexlify(os.urandom(16)).decode("ascii")
+        self.port = port
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.logger = logging.getLogger(Utils.setup_logger())
+
+        # cluster ids don't clash with condor ones (e.g., in the log file names)
+        self.next_cluster = int(time.time())
+        # id ("<cluster>.<proc>") to unit
+        self.units = {}
+        # lease id to unit id
+        self.leases = {}
+        self.served_files = set()
+        self.pilots = []
+        self.lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer((self.host, self.port), WorkQueueRequestHandler)
+        self._httpd.queue = self
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        self.logger.info("Work queue running at {0}".format(self.url()))
+
+    def stop(self):
+        self.stop_local_pilots()
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def url(self, host=None):
+        if not host:
+            host = self.host if self.host not in ["0.0.0.0", ""] else socket.getfqdn()
+        return "http://{0}:{1}/".format(host, self.port)
+
+    def submit(self, **kwargs):
+        """
+        Same kwargs as `Utils.condor_submit` (one unit per job). Returns (succeeded, cluster_id).
+        """
+        if kwargs.get("fake", False):
+            return True, -1
+        v_arguments, v_classads = get_job_selection(kwargs)
+        executable = os.path.abspath(kwargs["executable"])
+        inputfiles = [os.path.abspath(fname) for fname in kwargs.get("inputfiles", [])]
+        logdir = os.path.abspath(kwargs["logdir"])
+        Utils.do_cmd("mkdir -p {0}/std_logs/".format(logdir))
+        with self.lock:
+            self.next_cluster += 1
+            cluster_id = "wq{0}".format(self.next_cluster)
+            for procid, (arguments, classads) in enumerate(zip(v_arguments, v_classads)):
+                cid = "{0}.{1}".format(cluster_id, procid)
+                self.units[cid] = {
+                        "id": cid,
+                        "executable": executable,
+                        "arguments": arguments,
+                        "inputfiles": inputfiles,
+                        "classads": classads,
+                        "logdir": logdir,
+                        "status": IDLE,
+                        "entered": time.time(),
+                        "attempts": 0,
+                        "lease": None,
+                        }
+            self.served_files.update(inputfiles + [executable])
+        self.logger.debug("Queued {0} units in {1}".format(len(v_arguments), cluster_id))
+        return True, cluster_id
+
+    def query(self, selection_pairs=None, extra_columns=[]):
+        """
+        Queued and running units matching the `selection_pairs`, as `Utils.condor_q` job dicts
+        """
+        self.expire_leases()
+        jobs = []
+        with self.lock:
+            for unit in self.units.values():
+                if not matches(unit["classads"], selection_pairs):
+                    continue
+                job = {
+                        "ClusterId": unit["id"],
+                        "ProcId": unit["id"].rsplit(".", 1)[1],
+                        "JobStatus": unit["status"],
+                        "EnteredCurrentStatus": int(unit["entered"]),
+                        "CMD": unit["executable"],
+                        "ARGS": " ".join(unit["arguments"]),
+                        "HoldReason": "undefined",
+                        }
+                for column in extra_columns:
+                    job[column] = unit["classads"].get(column, "undefined")
+                jobs.append(job)
+        return jobs
+
+    def remove(self, cluster_ids=[]):
+        """
+        Remove units (by "<cluster>.<proc>", or whole clusters). Pilots running them
+        are told at their next heartbeat.
+        """
+        cluster_ids = [str(cid) for cid in cluster_ids]
+        with self.lock:
+            for uid in list(self.units.keys()):
+                if uid in cluster_ids or uid.rsplit(".", 1)[0] in cluster_ids:
+                    self.finish(self.units[uid], -1, "", "Removed from the work queue\n")
+
+    def finish(self, unit, status, stdout, stderr):
+        """
+        Take a unit out of the queue and write its logs where condor would have
+        (call with the lock held)
+        """
+        del self.units[unit["id"]]
+        self.leases.pop(unit["lease"], None)
+        prefix = "{0}/std_logs/1e.{1}".format(unit["logdir"], unit["id"])
+        try:
+            with open(prefix + ".out", "w") as fhout:
+                fhout.write(stdout)
+            with open(prefix + ".err", "w") as fhout:
+                fhout.write(stderr)
+        except (IOError, OSError):
+            self.logger.warning("Couldn't write the logs of unit {0}".format(unit["id"]))
+
+    def expire_leases(self):
+        """
+        Put the units of pilots that stopped renewing their lease back in the queue
+        """
+        now = time.time()
+        with self.lock:
+            for unit in list(self.units.values()):
+                if unit["status"] != RUNNING or unit["lease_expires"] > now:
+                    continue
+                self.leases.pop(unit["lease"], None)
+                if unit["attempts"] >= self.max_attempts:
+                    self.logger.info("Unit {0} lost {1} times, giving up".format(unit["id"], unit["attempts"]))
+                    self.finish(unit, -1, "", "Lease of the unit expired {0} times\n".format(unit["attempts"]))
+                    continue
+                self.logger.debug("Lease of unit {0} ({1}) expired, requeueing".format(unit["id"], unit["pilot"]))
+                unit.update(status=IDLE, entered=now, lease=None)
+
+    def lease(self, pilot):
+        self.expire_leases()
+        with self.lock:
+            idle = [unit for unit in self.units.values() if unit["status"] == IDLE]
+            if not idle:
+                return {}
+            # oldest first
+            unit = min(idle, key=lambda u: (u["entered"], u["id"]))
+            lease = uuid.uuid4().hex
+            unit.update(status=RUNNING, entered=time.time(), lease=lease, pilot=pilot,
+                    lease_expires=time.time()+self.lease_seconds, attempts=unit["attempts"]+1)
+            self.leases[lease] = unit["id"]
+            to_send = dict((k, unit[k]) for k in ["id", "executable", "arguments", "inputfiles", "classads"])
+        return {"unit": to_send, "lease": lease, "lease_seconds": self.lease_seconds}
+
+    def heartbeat(self, lease):
+        with self.lock:
+            uid = self.leases.get(lease)
+            if uid is None:
+                return False
+            self.units[uid]["lease_expires"] = time.time() + self.lease_seconds
+        return True
+
+    def done(self, lease, status, stdout, stderr):
+        with self.lock:
+            uid = self.leases.get(lease)
+            if uid is None:
+                return False
+            self.finish(self.units[uid], status, truncate_log(stdout), truncate_log(stderr))
+        return True
+
+    def is_served_file(self, fname):
+        with self.lock:
+            return fname in self.served_files
+
+    def get_counts(self):
+        with self.lock:
+            statuses = [unit["status"] for unit in self.units.values()]
+        return {"idle": statuses.count(IDLE), "running": statuses.count(RUNNING), "pilots": len(self.pilots)}
+
+    def submit_pilots(self, npilots, host=None, idle_timeout=600, **kwargs):
+        """
+        Submit `npilots` condor jobs running the pilot against this queue (`host` is the
+        name they reach it by, if not `self.host`). kwargs go to `Utils.condor_submit`.
+        """
+        logdir = kwargs.pop("logdir", os.path.abspath("pilots/"))
+        url = self.url(host=host)
+        # through the job environment, so that the token isn't in the arguments of the jobs
+        env_line = 'environment = "METIS_WQ_TOKEN={0}"'.format(self.token)
+        job_lines = kwargs.pop("job_lines", None) or ["" for _ in range(npilots)]
+        return Utils.condor_submit(
+                executable=get_pilot_path(),
+                arguments=[[url, "--idle-timeout", idle_timeout] for _ in range(npilots)],
+                job_lines=[(line + "\n" + env_line).strip() for line in job_lines],
+                inputfiles=[], logdir=logdir, multiple=True,
+                selection_pairs=[[["metis_pilot", url]] for _ in range(npilots)],
+                **kwargs)
+
+    def start_local_pilots(self, npilots, workdir=None, idle_timeout=600):
+        """
+        Run `npilots` pilots as local processes (stopped along with the queue)
+        """
+        workdir = os.path.abspath(workdir or "pilots/")
+        # through the environment, so that the token doesn't show up in the process list
+        env = dict(os.environ)
+        env["METIS_WQ_TOKEN"] = self.token
+        for ipilot in range(npilots):
+            pilot_dir = "{0}/pilot_{1}_{2}/".format(workdir, os.getpid(), len(self.pilots))
+            Utils.do_cmd("mkdir -p {0}".format(pilot_dir))
+            with open(pilot_dir + "pilot.log", "w") as fhlog:
+                self.pilots.append(subprocess.Popen(
+                    [sys.executable, get_pilot_path(), self.url(), "--idle-timeout", str(idle_timeout), "--workdir", pilot_dir],
+                    stdout=fhlog, stderr=subprocess.STDOUT, env=env))
+        return self.pilots
+
+    def stop_local_pilots(self):
+        for pilot in self.pilots:
+            if pilot.poll() is None:
+                pilot.terminate()
+                pilot.wait()
+        self.pilots = []
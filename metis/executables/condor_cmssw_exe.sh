@@ -18,6 +18,10 @@ OUTPUTNAME=$(echo $OUTPUTNAME | sed 's/\.root//')
 
 export SCRAM_ARCH=${SCRAMARCH}
 
+# Phase timestamps, exit codes, etc. that end up in the job report (see job_report)
+export METIS_JOBDIR=$(pwd)
+export METIS_T_START=$(date +%s)
+
 function getjobad {
     grep -i "^$1" "$_CONDOR_JOB_AD" | cut -d= -f2- | xargs echo
 }
@@ -65,61 +69,204 @@ function edit_pset {
         echo "except: pass" >> pset.py
     fi
 }
-function stageout {
-    COPY_SRC=$1
-    COPY_DEST=$2
-    retries=0
-    COPY_STATUS=1
-    until [ $retries -ge 3 ]
-    do
-        echo "Stageout attempt $((retries+1)): env -i X509_USER_PROXY=${X509_USER_PROXY} gfal-copy -p -f -t 7200 --verbose --checksum ADLER32 ${COPY_SRC} ${COPY_DEST}"
-        env -i X509_USER_PROXY=${X509_USER_PROXY} gfal-copy -p -f -t 7200 --verbose --checksum ADLER32 ${COPY_SRC} ${COPY_DEST}
-        COPY_STATUS=$?
-        if [ $COPY_STATUS -ne 0 ]; then
-            echo "Failed stageout attempt $((retries+1))"
-        else
-            echo "Successful stageout with $retries retries"
-            break
+function build_cmssw_area {
+    # scram project + package + build in ./$CMSSWVERSION, leaving us in it
+    eval `scramv1 project CMSSW $CMSSWVERSION`
+    cd $CMSSWVERSION
+    eval `scramv1 runtime -sh`
+    [ -e ../$PSET ] && mv ../$PSET pset.py
+    if [ -e ../${tarfile} ]; then
+        mv ../${tarfile} ${tarfile};
+        untar xf ${tarfile};
+    fi
+    scram b
+    [ -e package.tar.gz ] && untar xf package.tar.gz
+    # Needed or else cmssw can't find libmcfm_[xyz].so
+    # export LD_LIBRARY_PATH=${LD_LIBRARY_PATH}:${CMSSW_BASE}/src/JHUGenMELA/MELA/data/${SCRAM_ARCH}
+    # This is nicer than above. both work, and both have scary but benign warnings/printouts
+    cp ${CMSSW_BASE}/src/JHUGenMELA/MELA/data/${SCRAM_ARCH}/*.so ${CMSSW_BASE}/lib/${SCRAM_ARCH}/
+    # "Needed" to get rid of benign warnings/printouts
+    export ROOT_INCLUDE_PATH=${ROOT_INCLUDE_PATH}:${CMSSW_BASE}/src/JHUGenMELA/MELA/interface
+}
+function evict_cmssw_cache {
+    # Keep the CMSSW_CACHE_MAX most recently used areas of the cache (by the mtime
+    # of their .complete, touched by each job using them). Areas being built, or in
+    # use by a job (which holds a shared lock on them), are skipped.
+    local nkeep=${CMSSW_CACHE_MAX}
+    for complete in $(ls -t ${CMSSW_CACHE}/*/.complete 2> /dev/null); do
+        if [ $nkeep -gt 0 ]; then
+            nkeep=$((nkeep-1))
+            continue
         fi
-        retries=$[$retries+1]
-        echo "Sleeping for 30m"
-        sleep 30m
+        local old=$(dirname $complete)
+        exec 7> ${old}.build.lock || continue
+        exec 8> ${old}.lock || { exec 7>&-; continue; }
+        if flock -n -x 7 && flock -n -x 8; then
+            echo "[cmssw cache] evicting ${old}"
+            rm -rf ${old}
+        fi
+        exec 8>&- 7>&-
     done
-    if [ $COPY_STATUS -ne 0 ]; then
-        echo "Removing output file because gfal-copy crashed with code $COPY_STATUS"
-        env -i X509_USER_PROXY=${X509_USER_PROXY} gfal-rm --verbose ${COPY_DEST}
-        REMOVE_STATUS=$?
-        if [ $REMOVE_STATUS -ne 0 ]; then
-            echo "Uhh, gfal-copy crashed and then the gfal-rm also crashed with code $REMOVE_STATUS"
-            echo "You probably have a corrupt file sitting on hadoop now."
-            exit 1
+}
+function setup_cmssw_cache {
+    # Reuse a CMSSW area built by a previous job on this node, keyed by
+    # (CMSSW version, SCRAM_ARCH, tarball hash), or build it there for the next jobs.
+    # The first job builds it under an exclusive lock, so concurrent jobs wait for it
+    # instead of building it too. Jobs then work in their own ./$CMSSWVERSION, with
+    # symlinks to the (read-only from then on) shared area, so outputs don't collide,
+    # and hold a shared lock on it until they exit, so that it's not evicted under them.
+    # Returns non-zero (to fall back to a per-job area) if anything goes wrong.
+    command -v flock > /dev/null || return 1
+    local t0=$(date +%s)
+    local tarhash=notar
+    [ -e ${tarfile} ] && tarhash=$(md5sum ${tarfile} | cut -c1-12)
+    local key=${CMSSWVERSION}_${SCRAMARCH}_${tarhash}
+    local area=${CMSSW_CACHE}/${key}
+    local status=hit
+    mkdir -p ${CMSSW_CACHE} || return 1
+    if [ ! -e ${area}/.complete ]; then
+        exec 9> ${area}.build.lock
+        flock -w 3600 9 || { exec 9>&-; return 1; }
+        if [ ! -e ${area}/.complete ]; then
+            status=miss
+            rm -rf ${area}
+            mkdir -p ${area}
+            cp ${tarfile} ${area}/ 2> /dev/null
+            ( cd ${area} && PSET=none build_cmssw_area ) && [ -d ${area}/${CMSSWVERSION}/lib ] || {
+                rm -rf ${area}; flock -u 9; exec 9>&-; return 1; }
+            echo $(( $(date +%s) - t0 )) > ${area}/.build_seconds
+            touch ${area}/.complete
         fi
+        flock -u 9
+        exec 9>&-
+    fi
+    # fd 9 stays open (with the shared lock) for the rest of the job
+    exec 9> ${area}.lock
+    flock -s -w 3600 9 || { exec 9>&-; return 1; }
+    # evicted in the meantime
+    [ -e ${area}/.complete ] || { exec 9>&-; return 1; }
+    touch ${area}/.complete
+    evict_cmssw_cache
+    mkdir -p $CMSSWVERSION
+    cd ${area}/${CMSSWVERSION}
+    eval `scramv1 runtime -sh`
+    cd - > /dev/null
+    cd $CMSSWVERSION
+    for f in ${area}/${CMSSWVERSION}/* ${area}/${CMSSWVERSION}/.SCRAM; do
+        ln -s $f .
+    done
+    mv ../$PSET pset.py
+    export ROOT_INCLUDE_PATH=${ROOT_INCLUDE_PATH}:${CMSSW_BASE}/src/JHUGenMELA/MELA/interface
+    local seconds=$(( $(date +%s) - t0 ))
+    local build_seconds=$(cat ${area}/.build_seconds 2> /dev/null || echo -1)
+    header_line CMSSW_CACHE "$status"
+    if [ "$status" == "hit" ]; then
+        echo "[cmssw cache] reused ${area}: setup took ${seconds}s instead of ${build_seconds}s (saved $((build_seconds-seconds))s)"
+    else
+        echo "[cmssw cache] built ${area} in ${build_seconds}s"
     fi
 }
+function untar {
+    # untar OPTIONS FILE (e.g., untar xf package.tar.gz): tar that also reads zstd
+    # tarballs (see UserTarball), which older versions of tar don't recognize
+    if [ "$(head -c 4 $2 | od -An -tx1 | tr -d ' \n')" == "28b52ffd" ]; then
+        zstd -dcq $2 | tar $1 -
+    else
+        tar $1 $2
+    fi
+}
+function header_line {
+    # Print a "key: value" header line, and also keep it for the job report
+    echo "$1: $2"
+    echo "$1: $2" >> ${METIS_JOBDIR}/metis_header.txt
+}
+function job_report {
+    # Compact machine-readable summary of the job, which metis/LogParser.py reads
+    # from the tail of the stdout log instead of parsing the text above.
+    # Runs as an EXIT trap, so it is always the last thing printed.
+    export METIS_EXIT_CODE=$?
+    export METIS_T_END=$(date +%s)
+    PYTHON=$(command -v python || command -v python3)
+    [ -z "$PYTHON" ] && return
+    $PYTHON - << 'EOL'
+import os, re, json
+def num(key, default=-1, typ=int):
+    try: return typ(float(os.environ.get(key, "")))
+    except ValueError: return default
+jobdir = os.environ.get("METIS_JOBDIR", ".")
+header = {}
+if os.path.exists(jobdir+"/metis_header.txt"):
+    for line in open(jobdir+"/metis_header.txt"):
+        if ":" in line:
+            key, val = line.split(":", 1)
+            header[key.strip()] = val.strip()
+fjr = ""
+if os.path.exists(jobdir+"/FrameworkJobReport.xml"):
+    fjr = open(jobdir+"/FrameworkJobReport.xml").read()
+def fjr_metric(name):
+    match = re.search('Name="%s" Value="([^"]*)"' % name, fjr)
+    try: return float(match.group(1)) if match else -1
+    except ValueError: return -1
+event_rate = fjr_metric("EventThroughput")
+peak_rss = fjr_metric("PeakValueRss")
+if peak_rss < 0 and num("METIS_PEAK_RSS_KB") > 0:
+    peak_rss = num("METIS_PEAK_RSS_KB")/1024.
+error = re.search('<FrameworkError ExitStatus="([^"]*)" Type="([^"]*)"', fjr)
+report = {
+    "version": 1,
+    "site": header.get("GLIDEIN_CMSSite", ""),
+    "hostname": header.get("hostname", ""),
+    "header": header,
+    "timestamps": dict((key, num("METIS_T_"+key.upper())) for key in
+        ["start", "setup_end", "cmsrun_start", "cmsrun_end", "validation_end", "stageout_start", "stageout_end", "end"]),
+    "exit_codes": dict((key, num("METIS_"+key.upper()+"_STATUS")) for key in ["cmsrun", "validation", "stageout"]),
+    "nevents": {"expected": num("METIS_EXPECTEDNEVTS"), "output": num("METIS_NEVENTS_OUT"), "negative": num("METIS_NEVENTS_NEG")},
+    "event_rate": event_rate,
+    "peak_rss_mb": peak_rss,
+    "fatal_exception": {"exit_status": error.group(1), "type": error.group(2)} if error else {},
+}
+report["exit_codes"]["job"] = num("METIS_EXIT_CODE")
+report["stageout"] = []
+if os.path.exists(jobdir+"/metis_stageout.txt"):
+    for line in open(jobdir+"/metis_stageout.txt"):
+        parts = line.split()
+        if len(parts) != 5: continue
+        report["stageout"].append({"status": int(parts[0]), "attempts": int(parts[1]),
+            "seconds": float(parts[2]), "bytes": int(parts[3]), "dest": parts[4]})
+print("METIS_JOB_REPORT: " + json.dumps(report, sort_keys=True))
+EOL
+}
+# stageout and stageout_many (retries with backoff, fallback endpoints)
+source ${METIS_JOBDIR}/metis_stageout.sh
+
+trap job_report EXIT
 
 setup_chirp
 
 echo -e "\n--- begin header output ---\n" #                     <----- section division
-echo "OUTPUTDIR: $OUTPUTDIR"
-echo "OUTPUTNAME: $OUTPUTNAME"
-echo "INPUTFILENAMES: $INPUTFILENAMES"
-echo "IFILE: $IFILE"
-echo "PSET: $PSET"
-echo "CMSSWVERSION: $CMSSWVERSION"
-echo "SCRAMARCH: $SCRAMARCH"
-echo "NEVTS: $NEVTS"
-echo "EXPECTEDNEVTS: $EXPECTEDNEVTS"
-echo "OTHEROUTPUTS: $OTHEROUTPUTS"
-echo "PSETARGS: $PSETARGS"
+header_line OUTPUTDIR "$OUTPUTDIR"
+header_line OUTPUTNAME "$OUTPUTNAME"
+header_line INPUTFILENAMES "$INPUTFILENAMES"
+header_line IFILE "$IFILE"
+header_line PSET "$PSET"
+header_line CMSSWVERSION "$CMSSWVERSION"
+header_line SCRAMARCH "$SCRAMARCH"
+header_line NEVTS "$NEVTS"
+header_line EXPECTEDNEVTS "$EXPECTEDNEVTS"
+header_line OTHEROUTPUTS "$OTHEROUTPUTS"
+header_line PSETARGS "$PSETARGS"
 # echo  CLASSAD: $(cat "$_CONDOR_JOB_AD")
 
-echo "GLIDEIN_CMSSite: $GLIDEIN_CMSSite"
-echo "hostname: $(hostname)"
-echo "uname -a: $(uname -a)"
-echo "time: $(date +%s)"
-echo "args: $@"
-echo "tag: $(getjobad tag)"
-echo "taskname: $(getjobad taskname)"
+header_line GLIDEIN_CMSSite "$GLIDEIN_CMSSite"
+header_line hostname "$(hostname)"
+header_line "uname -a" "$(uname -a)"
+header_line time "$METIS_T_START"
+header_line QDate "$(getjobad QDate)"
+header_line JobStartDate "$(getjobad JobStartDate)"
+header_line args "$*"
+header_line tag "$(getjobad tag)"
+header_line taskname "$(getjobad taskname)"
+export METIS_EXPECTEDNEVTS=$EXPECTEDNEVTS
 
 echo -e "\n--- end header output ---\n" #                       <----- section division
 
@@ -143,9 +290,16 @@ fi
 # a tarball made outside of the full CMSSW directory, and must be handled
 # differently
 tarfile=package.tar.gz
-if [ ! -z $(tar -tf ${tarfile} | head -n 1 | grep "^CMSSW") ]; then
+# node-local cache of CMSSW areas (see setup_cmssw_cache), if the metis_cmssw_cache job ad is set
+# (to a directory, or to 1 for the default one), or for the chunks of a job (see condor_packed_exe.sh).
+# It keeps the $METIS_CMSSW_CACHE_MAX (default 4) most recently used areas
+CMSSW_CACHE=$(getjobad metis_cmssw_cache)
+CMSSW_CACHE_MAX=${METIS_CMSSW_CACHE_MAX:-4}
+[ -z "$CMSSW_CACHE" ] && CMSSW_CACHE=$METIS_CMSSW_CACHE
+[ "$CMSSW_CACHE" == "1" ] && CMSSW_CACHE=${METIS_CMSSW_CACHE_DIR:-/tmp/metis_cmssw_cache_$(id -u)}
+if [ ! -z $(untar -tf ${tarfile} | head -n 1 | grep "^CMSSW") ]; then
     echo "this is a full cmssw tar file"
-    tar xf ${tarfile}
+    untar xf ${tarfile}
     cd $CMSSWVERSION
     echo $PWD
     echo "Running ProjectRename"
@@ -154,30 +308,19 @@ if [ ! -z $(tar -tf ${tarfile} | head -n 1 | grep "^CMSSW") ]; then
     eval `scramv1 runtime -sh`
     mv ../$PSET pset.py
     mv ../${tarfile} .
+elif [ -n "$CMSSW_CACHE" ] && setup_cmssw_cache; then
+    echo "this is a selective cmssw tar file, set up from the node-local cache"
 else
     echo "this is a selective cmssw tar file"
-    eval `scramv1 project CMSSW $CMSSWVERSION`
-    cd $CMSSWVERSION
-    eval `scramv1 runtime -sh`
-    mv ../$PSET pset.py
-    if [ -e ../${tarfile} ]; then
-        mv ../${tarfile} ${tarfile};
-        tar xf ${tarfile};
-    fi
-    scram b
-    [ -e package.tar.gz ] && tar xf package.tar.gz
-    # Needed or else cmssw can't find libmcfm_[xyz].so
-    # export LD_LIBRARY_PATH=${LD_LIBRARY_PATH}:${CMSSW_BASE}/src/JHUGenMELA/MELA/data/${SCRAM_ARCH}
-    # This is nicer than above. both work, and both have scary but benign warnings/printouts
-    cp ${CMSSW_BASE}/src/JHUGenMELA/MELA/data/${SCRAM_ARCH}/*.so ${CMSSW_BASE}/lib/${SCRAM_ARCH}/
-    # "Needed" to get rid of benign warnings/printouts
-    export ROOT_INCLUDE_PATH=${ROOT_INCLUDE_PATH}:${CMSSW_BASE}/src/JHUGenMELA/MELA/interface
+    build_cmssw_area
 fi
 
 # # logging every 45 seconds gives ~100kb log file/3 hours
 # dstat -cdngytlmrs --float --nocolor -T --output dsout.csv 180 >& /dev/null &
 
 
+export METIS_T_SETUP_END=$(date +%s)
+
 echo "before running: ls -lrth"
 ls -lrth
 
@@ -189,8 +332,17 @@ chirp ChirpMetisStatus "before_cmsRun"
 
 edit_pset
 
-cmsRun pset.py ${PSETARGS}
-CMSRUN_STATUS=$?
+export METIS_T_CMSRUN_START=$(date +%s)
+if [ -x /usr/bin/time ]; then
+    /usr/bin/time -f "%M" -o ${METIS_JOBDIR}/peak_rss.txt cmsRun -j ${METIS_JOBDIR}/FrameworkJobReport.xml pset.py ${PSETARGS}
+    CMSRUN_STATUS=$?
+    export METIS_PEAK_RSS_KB=$(tail -n 1 ${METIS_JOBDIR}/peak_rss.txt 2>/dev/null)
+else
+    cmsRun -j ${METIS_JOBDIR}/FrameworkJobReport.xml pset.py ${PSETARGS}
+    CMSRUN_STATUS=$?
+fi
+export METIS_T_CMSRUN_END=$(date +%s)
+export METIS_CMSRUN_STATUS=$CMSRUN_STATUS
 
 chirp ChirpMetisStatus "after_cmsRun"
 
@@ -204,61 +356,99 @@ if [[ $CMSRUN_STATUS != 0 ]]; then
 fi
 
 
-if [ -z "$(getjobad metis_dontchecktree)" ]; then
-
-    # Add some metadata
-    # Right now, total/negative event counts, but obviously extensible
-    python << EOL
-import ROOT as r
-fin = r.TFile("${OUTPUTNAME}.root","update")
-t = fin.Get("Events")
-t.GetUserInfo().Clear()
-nevts = t.GetEntries()
-nevts_neg = nevts - t.GetEntries("genps_weight > 0")
-evts = r.TParameter(int)("nevts", nevts)
-evts_neg = r.TParameter(int)("nevts_neg", nevts_neg)
-print "Writing metadata. Nevents = {0} ({1} negative)".format(nevts, nevts_neg)
-t.GetUserInfo().Add(evts)
-t.GetUserInfo().Add(evts_neg)
-t.Write("",r.TObject.kOverwrite)
-t.GetUserInfo().Print()
-EOL
-
-    # Rigorous sweeproot which checks ALL branches for ALL events.
-    # If GetEntry() returns -1, then there was an I/O problem, so we will delete it
-    # Special consideration to ignore stupid CMSSW errors and old root versions
+# Validation of the output, depending on the metis_validation job ad
+#   none:    nothing (also if metis_dontchecktree is set)
+#   entries: write the metadata and check the number of entries
+#   sampled: entries + read back every 10th basket of every branch
+#   baskets: entries + read back all baskets of all branches (default)
+#   full:    entries + read every event (GetEntry), i.e., the old sweeproot
+VALIDATION=$(getjobad metis_validation)
+[ -z "$VALIDATION" ] && VALIDATION=baskets
+[ -n "$(getjobad metis_dontchecktree)" ] && VALIDATION=none
+header_line VALIDATION "$VALIDATION"
+
+if [ "$VALIDATION" != "none" ]; then
+
+    # Add some metadata (right now, total/negative event counts, but obviously extensible)
+    # and validate the output, opening it once.
+    # Reading baskets decompresses them without deserializing the events, so it catches I/O
+    # problems at a fraction of the cost of GetEntry(). Special consideration to ignore
+    # stupid CMSSW errors and old root versions
     python << EOL
 import ROOT as r
 import os
+import time
 import traceback
+level = "${VALIDATION}"
+t0 = time.time()
 foundBad = False
+nbaskets = 0
+def get_branches(branches):
+    for branch in branches:
+        yield branch
+        for sub in get_branches(branch.GetListOfBranches()):
+            yield sub
 try:
-    f1 = r.TFile("${OUTPUTNAME}.root")
-    t = f1.Get("Events")
+    fin = r.TFile("${OUTPUTNAME}.root","update")
+    t = fin.Get("Events")
+    t.GetUserInfo().Clear()
     nevts = t.GetEntries()
+    nevts_neg = nevts - t.GetEntries("genps_weight > 0")
+    evts = r.TParameter(int)("nevts", nevts)
+    evts_neg = r.TParameter(int)("nevts_neg", nevts_neg)
+    print("Writing metadata. Nevents = {0} ({1} negative)".format(nevts, nevts_neg))
+    with open("${METIS_JOBDIR}/metis_nevents.txt", "w") as fhout:
+        fhout.write("{0} {1}\n".format(nevts, nevts_neg))
+    t.GetUserInfo().Add(evts)
+    t.GetUserInfo().Add(evts_neg)
+    t.Write("",r.TObject.kOverwrite)
+    t.GetUserInfo().Print()
+
     expectednevts = ${EXPECTEDNEVTS}
-    print "[RSR] ntuple has %i events and expected %i" % (t.GetEntries(), expectednevts)
-    if int(expectednevts) > 0 and int(t.GetEntries()) != int(expectednevts):
-        print "[RSR] nevents mismatch"
+    print("[RSR] ntuple has %i events and expected %i" % (nevts, expectednevts))
+    if int(expectednevts) > 0 and int(nevts) != int(expectednevts):
+        print("[RSR] nevents mismatch")
         foundBad = True
-    if not "root/5.3" in r.__file__:
+    if not foundBad and level in ["baskets", "sampled"]:
+        step = 10 if level == "sampled" else 1
+        for branch in get_branches(t.GetListOfBranches()):
+            nbranch = branch.GetWriteBasket()
+            for ibasket in sorted(set(list(range(0, nbranch, step)) + [nbranch-1])):
+                if ibasket < 0: continue
+                nbaskets += 1
+                if not branch.GetBasket(ibasket):
+                    foundBad = True
+                    print("[RSR] found bad basket %i of branch %s" % (ibasket, branch.GetName()))
+                    break
+            branch.DropBaskets("all")
+            if foundBad: break
+    if not foundBad and level == "full" and not "root/5.3" in r.__file__:
         for i in range(0,t.GetEntries(),1):
             if t.GetEntry(i) < 0:
                 foundBad = True
-                print "[RSR] found bad event %i" % i
+                print("[RSR] found bad event %i" % i)
                 break
+    fin.Close()
 except Exception as ex:
     msg = traceback.format_exc()
     if "EDProductGetter" not in msg:
         foundBad = True
+        print(msg)
+print("[RSR] validation ({0}, {1} baskets read) took {2:.1f}s".format(level, nbaskets, time.time()-t0))
 if foundBad:
-    print "[RSR] removing output file because it does not deserve to live"
+    print("[RSR] removing output file because it does not deserve to live")
     os.system("rm ${OUTPUTNAME}.root")
-else: print "[RSR] passed the rigorous sweeproot"
+else: print("[RSR] passed the validation")
 EOL
 
-    if [ "$?" != "0" ]; then
-        echo "Removing output file because sweeproot crashed with exit code $?"
+    RSR_STATUS=$?
+    [ -e ${OUTPUTNAME}.root ] && export METIS_VALIDATION_STATUS=$RSR_STATUS || export METIS_VALIDATION_STATUS=1
+    [ -e ${METIS_JOBDIR}/metis_nevents.txt ] && read METIS_NEVENTS_OUT METIS_NEVENTS_NEG < ${METIS_JOBDIR}/metis_nevents.txt
+    export METIS_NEVENTS_OUT METIS_NEVENTS_NEG
+    export METIS_T_VALIDATION_END=$(date +%s)
+
+    if [ "$RSR_STATUS" != "0" ]; then
+        echo "Removing output file because sweeproot crashed with exit code $RSR_STATUS"
         rm ${OUTPUTNAME}.root
         exit 1
     fi
@@ -278,21 +468,31 @@ if [ ! -e "$OUTPUTNAME.root" ]; then
     exit 1
 fi
 
-echo "time before copy: $(date +%s)"
+export METIS_T_STAGEOUT_START=$(date +%s)
+echo "time before copy: $METIS_T_STAGEOUT_START"
 chirp ChirpMetisStatus "before_copy"
 
 COPY_SRC="file://`pwd`/${OUTPUTNAME}.root"
 COPY_DEST="gsiftp://gftp.t2.ucsd.edu${OUTPUTDIR}/${OUTPUTNAME}_${IFILE}.root"
-stageout $COPY_SRC $COPY_DEST
+COPY_PAIRS="$COPY_SRC $COPY_DEST"
 
 for OTHEROUTPUT in $(echo "$OTHEROUTPUTS" | sed -n 1'p' | tr ',' '\n'); do
     [ -e ${OTHEROUTPUT} ] && {
         NOROOT=$(echo $OTHEROUTPUT | sed 's/\.root//')
         COPY_SRC="file://`pwd`/${NOROOT}.root"
         COPY_DEST="gsiftp://gftp.t2.ucsd.edu${OUTPUTDIR}/${NOROOT}_${IFILE}.root"
-        stageout $COPY_SRC $COPY_DEST
+        COPY_PAIRS="$COPY_PAIRS $COPY_SRC $COPY_DEST"
     }
 done
+# all outputs at the same time
+stageout_many $COPY_PAIRS
+export METIS_T_STAGEOUT_END=$(date +%s)
+if [ "${METIS_STAGEOUT_LEFTOVER:-0}" -ne 0 ]; then
+    echo "Stageout failed and the partial files could not be removed:"
+    cat ${METIS_JOBDIR}/metis_stageout_leftovers.txt
+    echo "You probably have a corrupt file sitting on hadoop now."
+    exit 1
+fi
 
 echo -e "\n--- end copying output ---\n" #                      <----- section division
 
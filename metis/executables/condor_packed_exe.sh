@@ -0,0 +1,70 @@
+#!/bin/bash
+
+# Runs several chunks (outputs) of a task in one condor job, one after another, so that
+# the per-job overhead (matching, transferring the inputs, setting up CMSSW) is paid once
+# for all of them (see `chunks_per_job` in CondorTask).
+#
+#   condor_packed_exe.sh EXECUTABLE ARGS_1 :: ARGS_2 :: ...
+#
+# EXECUTABLE (shipped with the job) runs with the arguments of each chunk in turn, in its own
+# directory with links to the job inputs, so it behaves as in a job of its own (and stages out
+# its output as soon as it's done). A failed chunk doesn't stop the next ones: the task only
+# resubmits the outputs that are missing. Each chunk prints a "[chunk]" status line, also
+# appended to metis_chunks.txt as "ichunk index status seconds". The line follows the job report
+# of the chunk, so metis/LogParser.py can tell which output each report belongs to.
+
+JOBDIR=$(pwd)
+INNER=$1
+shift
+
+function getjobad {
+    grep -i "^$1" "$_CONDOR_JOB_AD" | cut -d= -f2- | xargs echo
+}
+
+# Unless the job uses a node-wide cache, the CMSSW area built for the first chunk
+# is kept in the job directory for the next ones (see condor_cmssw_exe.sh)
+if [ -z "$(getjobad metis_cmssw_cache)" ]; then
+    export METIS_CMSSW_CACHE=${JOBDIR}/metis_cmssw_cache
+fi
+
+function run_chunk {
+    # run_chunk ICHUNK ARGS...
+    local ichunk=$1
+    shift
+    local chunkdir=${JOBDIR}/metis_chunk_${ichunk}
+    mkdir -p $chunkdir
+    for f in ${JOBDIR}/*; do
+        [ -f "$f" ] || continue
+        [[ "$(basename $f)" == _condor_* ]] && continue
+        [[ "$(basename $f)" == metis_chunks.txt ]] && continue
+        ln -s $f $chunkdir/
+    done
+    local t0=$(date +%s)
+    echo -e "\n--- begin chunk ${ichunk} ---\n" #                   <----- section division
+    ( cd $chunkdir && bash ${JOBDIR}/${INNER} "$@" )
+    local status=$?
+    echo -e "\n--- end chunk ${ichunk} ---\n" #                     <----- section division
+    local seconds=$(( $(date +%s) - t0 ))
+    # 4th argument of the executables is the output index
+    echo "[chunk] ichunk=${ichunk} index=$4 status=${status} seconds=${seconds}"
+    echo "${ichunk} $4 ${status} ${seconds}" >> ${JOBDIR}/metis_chunks.txt
+    # the output is staged out already
+    rm -rf $chunkdir
+    return $status
+}
+
+ichunk=0
+nfailed=0
+args=()
+for arg in "$@" "::"; do
+    if [ "$arg" == "::" ]; then
+        ichunk=$((ichunk+1))
+        run_chunk $ichunk "${args[@]}" || nfailed=$((nfailed+1))
+        args=()
+    else
+        args+=("$arg")
+    fi
+done
+
+echo "[chunk] ran ${ichunk} chunks, ${nfailed} failed"
+[ $nfailed -eq 0 ]
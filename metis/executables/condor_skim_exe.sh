@@ -10,18 +10,103 @@ SCRAMARCH=$6
 # Make sure OUTPUTNAME doesn't have .root since we add it manually
 OUTPUTNAME=$(echo $OUTPUTNAME | sed 's/\.root//')
 
+# Phase timestamps, exit codes, etc. that end up in the job report (see job_report)
+export METIS_JOBDIR=$(pwd)
+export METIS_T_START=$(date +%s)
+
+function getjobad {
+    grep -i "^$1" "$_CONDOR_JOB_AD" | cut -d= -f2- | xargs echo
+}
+function untar {
+    # untar OPTIONS FILE (e.g., untar xf package.tar.gz): tar that also reads zstd
+    # tarballs (see UserTarball), which older versions of tar don't recognize
+    if [ "$(head -c 4 $2 | od -An -tx1 | tr -d ' \n')" == "28b52ffd" ]; then
+        zstd -dcq $2 | tar $1 -
+    else
+        tar $1 $2
+    fi
+}
+function header_line {
+    # Print a "key: value" header line, and also keep it for the job report
+    echo "$1: $2"
+    echo "$1: $2" >> ${METIS_JOBDIR}/metis_header.txt
+}
+function job_report {
+    # Compact machine-readable summary of the job, which metis/LogParser.py reads
+    # from the tail of the stdout log instead of parsing the text above.
+    # Runs as an EXIT trap, so it is always the last thing printed.
+    export METIS_EXIT_CODE=$?
+    export METIS_T_END=$(date +%s)
+    PYTHON=$(command -v python || command -v python3)
+    [ -z "$PYTHON" ] && return
+    $PYTHON - << 'EOL'
+import os, re, json
+def num(key, default=-1, typ=int):
+    try: return typ(float(os.environ.get(key, "")))
+    except ValueError: return default
+jobdir = os.environ.get("METIS_JOBDIR", ".")
+header = {}
+if os.path.exists(jobdir+"/metis_header.txt"):
+    for line in open(jobdir+"/metis_header.txt"):
+        if ":" in line:
+            key, val = line.split(":", 1)
+            header[key.strip()] = val.strip()
+fjr = ""
+if os.path.exists(jobdir+"/FrameworkJobReport.xml"):
+    fjr = open(jobdir+"/FrameworkJobReport.xml").read()
+def fjr_metric(name):
+    match = re.search('Name="%s" Value="([^"]*)"' % name, fjr)
+    try: return float(match.group(1)) if match else -1
+    except ValueError: return -1
+event_rate = fjr_metric("EventThroughput")
+peak_rss = fjr_metric("PeakValueRss")
+if peak_rss < 0 and num("METIS_PEAK_RSS_KB") > 0:
+    peak_rss = num("METIS_PEAK_RSS_KB")/1024.
+error = re.search('<FrameworkError ExitStatus="([^"]*)" Type="([^"]*)"', fjr)
+report = {
+    "version": 1,
+    "site": header.get("GLIDEIN_CMSSite", ""),
+    "hostname": header.get("hostname", ""),
+    "header": header,
+    "timestamps": dict((key, num("METIS_T_"+key.upper())) for key in
+        ["start", "setup_end", "cmsrun_start", "cmsrun_end", "validation_end", "stageout_start", "stageout_end", "end"]),
+    "exit_codes": dict((key, num("METIS_"+key.upper()+"_STATUS")) for key in ["cmsrun", "validation", "stageout"]),
+    "nevents": {"expected": num("METIS_EXPECTEDNEVTS"), "output": num("METIS_NEVENTS_OUT"), "negative": num("METIS_NEVENTS_NEG")},
+    "event_rate": event_rate,
+    "peak_rss_mb": peak_rss,
+    "fatal_exception": {"exit_status": error.group(1), "type": error.group(2)} if error else {},
+}
+report["exit_codes"]["job"] = num("METIS_EXIT_CODE")
+report["stageout"] = []
+if os.path.exists(jobdir+"/metis_stageout.txt"):
+    for line in open(jobdir+"/metis_stageout.txt"):
+        parts = line.split()
+        if len(parts) != 5: continue
+        report["stageout"].append({"status": int(parts[0]), "attempts": int(parts[1]),
+            "seconds": float(parts[2]), "bytes": int(parts[3]), "dest": parts[4]})
+print("METIS_JOB_REPORT: " + json.dumps(report, sort_keys=True))
+EOL
+}
+# stageout and stageout_many (retries with backoff, fallback endpoints)
+source ${METIS_JOBDIR}/metis_stageout.sh
+
+trap job_report EXIT
+
 echo -e "\n--- begin header output ---\n" #                     <----- section division
-echo "OUTPUTDIR: $OUTPUTDIR"
-echo "OUTPUTNAME: $OUTPUTNAME"
-echo "INPUTFILENAMES: $INPUTFILENAMES"
-echo "IFILE: $IFILE"
-echo "CMSSWVERSION: $CMSSWVERSION"
-echo "SCRAMARCH: $SCRAMARCH"
-
-echo "hostname: $(hostname)"
-echo "uname -a: $(uname -a)"
-echo "time: $(date +%s)"
-echo "args: $@"
+header_line OUTPUTDIR "$OUTPUTDIR"
+header_line OUTPUTNAME "$OUTPUTNAME"
+header_line INPUTFILENAMES "$INPUTFILENAMES"
+header_line IFILE "$IFILE"
+header_line CMSSWVERSION "$CMSSWVERSION"
+header_line SCRAMARCH "$SCRAMARCH"
+
+header_line GLIDEIN_CMSSite "$GLIDEIN_CMSSite"
+header_line hostname "$(hostname)"
+header_line "uname -a" "$(uname -a)"
+header_line time "$METIS_T_START"
+header_line QDate "$(getjobad QDate)"
+header_line JobStartDate "$(getjobad JobStartDate)"
+header_line args "$*"
 
 echo -e "\n--- end header output ---\n" #                       <----- section division
 
@@ -33,12 +118,14 @@ eval `scramv1 project CMSSW $CMSSWVERSION`
 cd $CMSSWVERSION
 eval `scramv1 runtime -sh`
 mv ../package.tar.gz package.tar.gz
-tar xf package.tar.gz
+untar xf package.tar.gz
 
 # logging every 60 seconds gives ~100kb log file/3 hours
 dstat -cdngytlmrs --float --nocolor -T --output dsout.csv 60 >& /dev/null &
 
 
+export METIS_T_SETUP_END=$(date +%s)
+
 echo "before running: ls -lrth"
 ls -lrth 
 
@@ -48,9 +135,13 @@ echo Executing: skim.py -t Events \
     -c 'SumSSS(hyp_ll_p4.pt()>25 && hyp_lt_p4.pt()>25 && abs(hyp_p4.M()-91)<15 && hyp_ll_id==-hyp_lt_id)>= 1 && SumSSS(pfjets_p4.pt()>30)<=1' \
     $(echo "$INPUTFILENAMES" | sed -n 1'p' | tr ',' ' ')
 
+# the skim is the payload here, so it fills the cmsrun slots of the job report
+export METIS_T_CMSRUN_START=$(date +%s)
 python skim.py -t Events \
     -c 'SumSSS(hyp_ll_p4.pt()>25 && hyp_lt_p4.pt()>25 && abs(hyp_p4.M()-91)<15 && hyp_ll_id==-hyp_lt_id)>= 1 && SumSSS(pfjets_p4.pt()>30)<=1' \
     $(echo "$INPUTFILENAMES" | sed -n 1'p' | tr ',' ' ')
+export METIS_CMSRUN_STATUS=$?
+export METIS_T_CMSRUN_END=$(date +%s)
 
 # Rigorous sweeproot which checks ALL branches for ALL events.
 # If GetEntry() returns -1, then there was an I/O problem, so we will delete it
@@ -63,6 +154,8 @@ try:
     f1 = r.TFile("${OUTPUTNAME}.root")
     t = f1.Get("Events")
     nevts = t.GetEntries()
+    with open("${METIS_JOBDIR}/metis_nevents.txt", "w") as fhout:
+        fhout.write("{0} 0\n".format(nevts))
     for i in range(0,t.GetEntries(),1):
         if t.GetEntry(i) < 0:
             foundBad = True
@@ -75,6 +168,10 @@ if foundBad:
     os.system("rm ${OUTPUTNAME}.root")
 else: print "[RSR] passed the rigorous sweeproot"
 EOL
+[ -e ${OUTPUTNAME}.root ] && export METIS_VALIDATION_STATUS=0 || export METIS_VALIDATION_STATUS=1
+[ -e ${METIS_JOBDIR}/metis_nevents.txt ] && read METIS_NEVENTS_OUT METIS_NEVENTS_NEG < ${METIS_JOBDIR}/metis_nevents.txt
+export METIS_NEVENTS_OUT METIS_NEVENTS_NEG
+export METIS_T_VALIDATION_END=$(date +%s)
 
 echo -e "\n--- end running ---\n" #                             <----- section division
 
@@ -83,7 +180,9 @@ ls -lrth
 
 echo -e "\n--- begin copying output ---\n" #                    <----- section division
 echo "Sending output file $OUTPUTNAME.root"
-gfal-copy -p -f -t 4200 --verbose file://`pwd`/${OUTPUTNAME}.root gsiftp://gftp.t2.ucsd.edu${OUTPUTDIR}/${OUTPUTNAME}_${IFILE}.root --checksum ADLER32
+export METIS_T_STAGEOUT_START=$(date +%s)
+stageout file://`pwd`/${OUTPUTNAME}.root gsiftp://gftp.t2.ucsd.edu${OUTPUTDIR}/${OUTPUTNAME}_${IFILE}.root
+export METIS_T_STAGEOUT_END=$(date +%s)
 echo -e "\n--- end copying output ---\n" #                      <----- section division
 
 echo -e "\n--- begin dstat output ---\n" #                      <----- section division
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+Pilot for the metis work queue (see metis/WorkQueue.py): leases units from the
+queue at URL, one at a time, and runs them like condor would (the executable and
+input files in a fresh directory, with the arguments and a job ad made of the
+classads of the unit), renewing the lease while the unit runs. It exits after
+being idle for --idle-timeout seconds. Only needs the python standard library.
+Every request carries the token of the queue (--token, or $METIS_WQ_TOKEN).
+
+    METIS_WQ_TOKEN=TOKEN metis_pilot.py URL [--idle-timeout 600] [--workdir .]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import signal
+import shutil
+import socket
+import argparse
+import subprocess
+try:
+    from urllib2 import urlopen, Request, URLError
+    from urllib import quote
+except ImportError:
+    # python3 compatibility
+    from urllib.request import urlopen, Request
+    from urllib.error import URLError
+    from urllib.parse import quote
+
+# the logs sent back keep the beginning (header) and the end (job report) of long outputs
+MAX_HEAD = 256*1024
+MAX_TAIL = 2*1024*1024
+
+TOKEN_HEADER = "X-Metis-Token"
+# set from the command line (see `main`)
+token = ""
+
+def post(url, path, payload):
+    req = Request(url.rstrip("/") + path, json.dumps(payload).encode("utf-8"),
+            {"Content-Type": "application/json", TOKEN_HEADER: token})
+    return json.loads(urlopen(req, timeout=60).read().decode("utf-8"))
+
+def fetch(url, fname, dest):
+    req = Request("{0}/file?path={1}".format(url.rstrip("/"), quote(fname)), headers={TOKEN_HEADER: token})
+    fhin = urlopen(req, timeout=600)
+    with open(dest, "wb") as fhout:
+        shutil.copyfileobj(fhin, fhout)
+
+def read_log(fname):
+    size = os.path.getsize(fname)
+    with open(fname, "rb") as fhin:
+        if size <= MAX_HEAD + MAX_TAIL:
+            return fhin.read().decode("utf-8", "replace")
+        head = fhin.read(MAX_HEAD)
+        fhin.seek(size-MAX_TAIL)
+        tail = fhin.read()
+    return (head + b"\n[pilot] ... skipped ...\n" + tail).decode("utf-8", "replace")
+
+def run_unit(url, lease, workdir):
+    unit = lease["unit"]
+    unitdir = os.path.join(workdir, "unit_{0}".format(unit["id"]))
+    os.makedirs(unitdir)
+    try:
+        for fname in [unit["executable"]] + unit["inputfiles"]:
+            fetch(url, fname, os.path.join(unitdir, os.path.basename(fname)))
+        jobad = os.path.join(unitdir, ".job.ad")
+        with open(jobad, "w") as fhout:
+            cluster, proc = unit["id"].rsplit(".", 1)
+            for key, val in list(unit["classads"].items()) + [("ClusterId", cluster), ("ProcId", proc), ("JobStartDate", int(time.time()))]:
+                fhout.write('{0} = "{1}"\n'.format(key, val))
+        env = dict(os.environ)
+        env.update(_CONDOR_JOB_AD=jobad, _CONDOR_SCRATCH_DIR=unitdir)
+        fout, ferr = os.path.join(unitdir, "_condor_stdout"), os.path.join(unitdir, "_condor_stderr")
+        with open(fout, "w") as fhout, open(ferr, "w") as fherr:
+            proc = subprocess.Popen(["bash", os.path.basename(unit["executable"])] + unit["arguments"],
+                    cwd=unitdir, env=env, stdout=fhout, stderr=fherr, preexec_fn=os.setsid)
+            period = max(lease["lease_seconds"]/3., 0.1)
+            last_beat = time.time()
+            while proc.poll() is None:
+                time.sleep(min(period, 1.))
+                if time.time() - last_beat < period:
+                    continue
+                last_beat = time.time()
+                try:
+                    if not post(url, "/heartbeat", {"lease": lease["lease"]})["ok"]:
+                        print("[pilot] unit {0} was removed or reassigned, killing it".format(unit["id"]))
+                        os.killpg(proc.pid, signal.SIGKILL)
+                        proc.wait()
+                        return
+                except (URLError, socket.error, ValueError) as ex:
+                    print("[pilot] heartbeat failed: {0}".format(ex))
+        status = proc.returncode
+        post(url, "/done", {"lease": lease["lease"], "status": status, "stdout": read_log(fout), "stderr": read_log(ferr)})
+        print("[pilot] unit {0} finished with status {1}".format(unit["id"], status))
+    finally:
+        shutil.rmtree(unitdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="run units of a metis work queue")
+    parser.add_argument("url", help="url of the work queue")
+    parser.add_argument("--idle-timeout", help="exit after being idle for this many seconds", default=600, type=float)
+    parser.add_argument("--poll", help="seconds between lease requests while idle", default=2, type=float)
+    parser.add_argument("--workdir", help="where to run the units", default=".")
+    parser.add_argument("--token", help="token of the work queue (default: $METIS_WQ_TOKEN)", default=os.getenv("METIS_WQ_TOKEN", ""))
+    args = parser.parse_args()
+
+    global token
+    token = args.token
+
+    name = "{0}:{1}".format(socket.gethostname(), os.getpid())
+    workdir = os.path.abspath(args.workdir)
+    last_work = time.time()
+    nunits = 0
+    while time.time() - last_work < args.idle_timeout:
+        try:
+            lease = post(args.url, "/lease", {"pilot": name})
+        except (URLError, socket.error, ValueError) as ex:
+            print("[pilot] couldn't reach the queue: {0}".format(ex))
+            lease = {}
+        if not lease.get("unit"):
+            time.sleep(args.poll)
+            continue
+        try:
+            run_unit(args.url, lease, workdir)
+        except (URLError, socket.error, ValueError) as ex:
+            # the lease expires and the unit goes back to the queue
+            print("[pilot] unit {0} failed to run: {1}".format(lease["unit"].get("id"), ex))
+        nunits += 1
+        last_work = time.time()
+    print("[pilot] idle for {0}s after {1} units, exiting".format(args.idle_timeout, nunits))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/bin/bash
+
+# Stageout helpers shared by the job executables, which source this file
+# (it is shipped along with them, see CondorTask.get_condor_submit_kwargs).
+#
+#   stageout SRC DEST                 copy one file, with retries and fallback endpoints
+#   stageout_many SRC1 DEST1 SRC2 ... copy several files concurrently
+#
+# Failed attempts are retried after an exponential backoff with jitter
+# (instead of a fixed long sleep, which holds the slot idle), trying each endpoint in turn.
+# Settings, from the environment or else from the metis_stageout_* job ads:
+#   STAGEOUT_RETRIES        rounds over the endpoints (default 4)
+#   STAGEOUT_BACKOFF        base backoff in seconds, doubled every round (default 30)
+#   STAGEOUT_BACKOFF_MAX    cap of the backoff in seconds (default 600)
+#   STAGEOUT_ENDPOINTS      comma-separated fallback endpoints (e.g., "davs://redirector.t2.ucsd.edu:1095"),
+#                           which replace the scheme and host of DEST after the original one
+#   STAGEOUT_TIMEOUT        gfal-copy timeout in seconds (default 7200)
+# Each transfer appends "status attempts seconds bytes dest" to $METIS_JOBDIR/metis_stageout.txt
+# for the job report, and prints a "[stageout]" summary line.
+# If a transfer fails for good and a partial file could not be removed, its destination is
+# appended to $METIS_JOBDIR/metis_stageout_leftovers.txt and METIS_STAGEOUT_LEFTOVER=1 is exported,
+# so that the executable can fail the job instead of leaving a corrupt file behind.
+# Without gfal-copy (e.g., to test locally), file:// destinations are copied with cp.
+
+function stageout_setting {
+    # stageout_setting NAME DEFAULT
+    local val=${!1}
+    if [ -z "$val" ] && [ -n "$_CONDOR_JOB_AD" ] && [ -e "$_CONDOR_JOB_AD" ]; then
+        val=$(grep -i "^metis_$1 " "$_CONDOR_JOB_AD" | cut -d= -f2- | xargs echo)
+    fi
+    echo ${val:-$2}
+}
+
+function stageout_backoff_seconds {
+    # stageout_backoff_seconds ROUND: base*2^ROUND (capped), plus up to 50% jitter
+    # so that jobs failing together don't retry together
+    local base=$(stageout_setting STAGEOUT_BACKOFF 30)
+    local cap=$(stageout_setting STAGEOUT_BACKOFF_MAX 600)
+    local delay=$(( base * (1 << $1) ))
+    [ $delay -gt $cap ] && delay=$cap
+    echo $(( delay + (delay > 0 ? RANDOM % (delay/2 + 1) : 0) ))
+}
+
+function stageout_destinations {
+    # the original destination, then the same path on each fallback endpoint
+    echo $1
+    local path=$(echo $1 | sed -E 's|^[a-zA-Z0-9]+://[^/]*||')
+    for endpoint in $(stageout_setting STAGEOUT_ENDPOINTS "" | tr ',' ' '); do
+        [[ "$endpoint" == */ ]] && [[ "$endpoint" != *:// ]] && endpoint=${endpoint%/}
+        echo ${endpoint}${path}
+    done
+}
+
+function stageout_transfer {
+    if command -v gfal-copy > /dev/null; then
+        env -i X509_USER_PROXY=${X509_USER_PROXY} gfal-copy -p -f -t $(stageout_setting STAGEOUT_TIMEOUT 7200) --verbose --checksum ADLER32 $1 $2
+    elif [[ "$1" == file://* ]] && [[ "$2" == file://* ]]; then
+        mkdir -p $(dirname ${2#file://}) && cp ${1#file://} ${2#file://}
+    else
+        echo "[stageout] No gfal-copy to copy to $2"
+        return 1
+    fi
+}
+
+function stageout_remove {
+    if command -v gfal-rm > /dev/null; then
+        env -i X509_USER_PROXY=${X509_USER_PROXY} gfal-rm --verbose $1
+    elif [[ "$1" == file://* ]]; then
+        rm -f ${1#file://}
+    fi
+}
+
+function stageout {
+    local COPY_SRC=$1
+    local COPY_DEST=$2
+    local retries=$(stageout_setting STAGEOUT_RETRIES 4)
+    local nbytes=$(stat -c %s ${COPY_SRC#file://} 2> /dev/null || echo 0)
+    local t0=$(date +%s.%N)
+    local attempts=0
+    local round=0
+    local dest=""
+    local leftovers=""
+    COPY_STATUS=1
+    while [ $round -lt $retries ] && [ $COPY_STATUS -ne 0 ]; do
+        if [ $round -gt 0 ]; then
+            local delay=$(stageout_backoff_seconds $((round-1)))
+            echo "[stageout] Sleeping for ${delay}s before round $((round+1))"
+            sleep $delay
+        fi
+        for dest in $(stageout_destinations $COPY_DEST); do
+            attempts=$((attempts+1))
+            echo "Stageout attempt ${attempts}: ${COPY_SRC} ${dest}"
+            stageout_transfer ${COPY_SRC} ${dest}
+            COPY_STATUS=$?
+            if [ $COPY_STATUS -eq 0 ]; then
+                break
+            fi
+            echo "Failed stageout attempt ${attempts} with code $COPY_STATUS"
+            # don't leave a partial file behind
+            leftovers=$(echo $leftovers | tr ' ' '\n' | grep -vxF "${dest}" | xargs echo)
+            stageout_remove ${dest} > /dev/null 2>&1
+            REMOVE_STATUS=$?
+            if [ $REMOVE_STATUS -ne 0 ]; then
+                echo "Failed to remove ${dest} with code $REMOVE_STATUS"
+                leftovers="$leftovers ${dest}"
+            fi
+        done
+        round=$((round+1))
+    done
+    local seconds=$(echo "$(date +%s.%N) $t0" | awk '{printf "%.1f", $1-$2}')
+    local rate=$(echo "$nbytes $seconds" | awk '{printf "%.1f", ($2 > 0 ? $1/1048576./$2 : 0)}')
+    [ $COPY_STATUS -ne 0 ] && dest=$COPY_DEST
+    echo "[stageout] status=${COPY_STATUS} attempts=${attempts} seconds=${seconds} MB=$(echo $nbytes | awk '{printf "%.1f", $1/1048576.}') rate=${rate}MB/s dest=${dest}"
+    echo "${COPY_STATUS} ${attempts} ${seconds} ${nbytes} ${dest}" >> ${METIS_JOBDIR:-.}/metis_stageout.txt
+    if [ $COPY_STATUS -ne 0 ] && [ -n "$leftovers" ]; then
+        echo "[stageout] Partial files could not be removed:${leftovers}"
+        echo $leftovers | tr ' ' '\n' >> ${METIS_JOBDIR:-.}/metis_stageout_leftovers.txt
+        export METIS_STAGEOUT_LEFTOVER=1
+    fi
+    # the first failure wins
+    [ "${METIS_STAGEOUT_STATUS:-0}" -eq 0 ] && export METIS_STAGEOUT_STATUS=$COPY_STATUS
+    return $COPY_STATUS
+}
+
+function stageout_many {
+    # stageout_many SRC1 DEST1 SRC2 DEST2 ...: concurrent transfers, returns the number of failures
+    local pids=""
+    while [ $# -ge 2 ]; do
+        stageout $1 $2 &
+        pids="$pids $!"
+        shift 2
+    done
+    local nfailed=0
+    for pid in $pids; do
+        wait $pid || nfailed=$((nfailed+1))
+    done
+    # the transfers ran in subshells, so their statuses didn't make it here
+    if [ $nfailed -ne 0 ]; then
+        export METIS_STAGEOUT_STATUS=1
+    else
+        export METIS_STAGEOUT_STATUS=${METIS_STAGEOUT_STATUS:-0}
+    fi
+    [ -s ${METIS_JOBDIR:-.}/metis_stageout_leftovers.txt ] && export METIS_STAGEOUT_LEFTOVER=1
+    return $nfailed
+}
@@ -0,0 +1,110 @@
+import unittest
+import os
+import time
+import logging
+
+from metis.CampaignRunner import CampaignRunner
+from metis.Sample import Sample
+from metis.StatsParser import StatsParser
+import metis.Utils as Utils
+
+class SleepyTask(object):
+
+    ninstances = 0
+
+    def __init__(self, dataset, sleep=0.3, fail=False, nprocess=1):
+        SleepyTask.ninstances += 1
+        self.nprocess = nprocess
+        self.marked_complete = False
+        self.sample = Sample(dataset=dataset)
+        self.sleep = sleep
+        self.fail = fail
+        self.nprocessed = 0
+
+    def get_sample(self):
+        return self.sample
+
+    def complete(self):
+        return self.marked_complete
+
+    def process(self, fake=False):
+        time.sleep(self.sleep)
+        if self.fail:
+            raise RuntimeError("failed on purpose")
+        self.nprocessed += 1
+        self.marked_complete = self.nprocessed >= self.nprocess
+
+    def get_task_summary(self):
+        return {"jobs": {}, "queried_nevents": 0, "tag": "v1", "task_type": "Task", "nprocessed": self.nprocessed}
+
+class CampaignRunnerTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger("logger_metis").disabled = True
+        self.basedir = "/tmp/{0}/metis/campaignrunner_test/".format(os.getenv("USER"))
+        Utils.do_cmd("rm -rf {0} ; mkdir -p {0}".format(self.basedir))
+
+    def get_runner(self, tasks, **kwargs):
+        return CampaignRunner(tasks=tasks, send_emails=False, show_progress_bar=False,
+                statsparser_kwargs=dict(summary_fname=self.basedir+"summary.json", webdir=None), **kwargs)
+
+    def test_concurrent(self):
+        tasks = [SleepyTask("/Sleepy/{0}/MINIAODSIM".format(i)) for i in range(6)]
+        runner = self.get_runner(tasks, nthreads=6)
+        t0 = time.time()
+        total_summary = runner.run_iteration()
+        # about as long as the slowest task, not the sum of all of them
+        self.assertTrue(time.time()-t0 < 6*0.3*0.75)
+        self.assertEqual(sorted(total_summary.keys()), sorted(t.get_sample().get_datasetname() for t in tasks))
+        self.assertTrue(all(t.nprocessed == 1 for t in tasks))
+
+        # one summary for all the tasks
+        data = StatsParser(summary_fname=self.basedir+"summary.json", webdir=None).data
+        self.assertEqual(len(data), 6)
+
+    def test_failures_are_isolated(self):
+        tasks = [SleepyTask("/Good/A/MINIAODSIM", sleep=0.01), SleepyTask("/Bad/A/MINIAODSIM", sleep=0.01, fail=True)]
+        runner = self.get_runner(tasks, nthreads=2)
+        total_summary = runner.run_iteration()
+        self.assertEqual(total_summary["/Good/A/MINIAODSIM"]["nprocessed"], 1)
+        self.assertEqual(total_summary["/Bad/A/MINIAODSIM"]["nprocessed"], 0)
+
+    def test_summary_after_broker_flush(self):
+        class FakeBroker(object):
+            def __init__(self, tasks):
+                self.tasks = tasks
+            def flush(self):
+                # stands in for recording the submitted jobs in the tasks
+                for task in self.tasks:
+                    task.nprocessed += 10
+        tasks = [SleepyTask("/Brokered/{0}/MINIAODSIM".format(i), sleep=0.) for i in range(2)]
+        runner = self.get_runner(tasks, nthreads=2, broker=FakeBroker(tasks))
+        total_summary = runner.run_iteration()
+        self.assertEqual([total_summary[t.get_sample().get_datasetname()]["nprocessed"] for t in tasks], [11, 11])
+
+    def test_get_tasks(self):
+        calls = []
+        def get_tasks():
+            calls.append(1)
+            return [SleepyTask("/A/B/MINIAODSIM", sleep=0.)]
+        runner = CampaignRunner(get_tasks=get_tasks, sleep_seconds=0, statsparser_kwargs=None, send_emails=False)
+        runner.run(niterations=2)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(runner.iteration, 2)
+
+    def test_keep_alive(self):
+        def get_tasks():
+            return [
+                    (SleepyTask, dict(dataset="/Quick/A/MINIAODSIM", sleep=0.)),
+                    (SleepyTask, dict(dataset="/Slow/A/MINIAODSIM", sleep=0., nprocess=3)),
+                    ]
+        runner = CampaignRunner(get_tasks=get_tasks, sleep_seconds=0, statsparser_kwargs=None, send_emails=False)
+        ninstances = SleepyTask.ninstances
+        runner.run(niterations=2)
+        # the complete task is re-made every time, the incomplete one only once
+        self.assertEqual(SleepyTask.ninstances-ninstances, 2+1)
+        self.assertEqual(runner.run_iteration()["/Slow/A/MINIAODSIM"]["nprocessed"], 3)
+        self.assertEqual(runner.alive_tasks, {})
+
+if __name__ == "__main__":
+    unittest.main()
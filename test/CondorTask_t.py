@@ -4,10 +4,32 @@ import time
 import logging
 import glob
 
+import json
+import subprocess
+
 import metis.Utils as Utils
-from metis.Sample import DirectorySample
-from metis.CondorTask import CondorTask
-from metis.File import File
+from scratch import ScratchDir
+from metis.Sample import DirectorySample, TaskOutputSample
+from metis.CondorTask import CondorTask, get_job_indices
+from metis.LogParser import REPORT_PREFIX
+from metis.File import File, EventsFile
+import metis.Executor as Executor
+import metis.Metrics as Metrics
+
+class UpstreamTask(object):
+    """
+    Stands in for a task whose outputs complete over time
+    """
+
+    def __init__(self, nfiles):
+        self.outputs = [EventsFile("/tmp/upstream/output_{0}.root".format(i), fake=True, nevents=10) for i in range(1,nfiles+1)]
+        self.ndone = 0
+
+    def get_completed_outputs(self):
+        return self.outputs[:self.ndone]
+
+    def complete(self):
+        return self.ndone == len(self.outputs)
 
 
 class CondorTaskTest(unittest.TestCase):
@@ -21,6 +43,7 @@ class CondorTaskTest(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         super(CondorTaskTest, cls).setUpClass()
+        cls.scratch = ScratchDir()
 
         # make a test directory and touch some root files and executable there
         basedir = "/tmp/{0}/metis/condortask_test/".format(os.getenv("USER"))
@@ -58,6 +81,11 @@ class CondorTaskTest(unittest.TestCase):
 
         # self.__class__.is_set_up = True
 
+    @classmethod
+    def tearDownClass(cls):
+        cls.scratch.leave()
+        super(CondorTaskTest, cls).tearDownClass()
+
     def test_inputs(self):
         self.assertEqual( len(self.dummy.get_inputs(flatten=True)) , self.nfiles )
 
@@ -152,6 +180,154 @@ class CondorTaskTest(unittest.TestCase):
         dummy.process()
         self.assertEqual(dummy.complete(), True)
 
+    def test_completion_marker(self):
+        basedir = "/tmp/{0}/metis/condortask_testmarker/".format(os.getenv("USER"))
+        outdir = basedir + "outputs/"
+        Utils.do_cmd("rm -rf {0} ; mkdir -p {1}".format(basedir, outdir))
+        for i in range(1,self.nfiles+1):
+            Utils.do_cmd("touch {0}/input_{1}.root".format(basedir, i))
+        Utils.do_cmd("echo hello > {0}/executable.sh".format(basedir))
+        kwargs = dict(
+                sample = DirectorySample(
+                    location = basedir,
+                    globber = "*.root",
+                    dataset = "/testmarker/testmarker/TEST",
+                    ),
+                files_per_output = self.files_per_job,
+                cmssw_version = self.cmssw,
+                tag = "vmarker",
+                output_dir = outdir,
+                executable = "{0}/executable.sh".format(basedir),
+                )
+
+        task = CondorTask(**kwargs)
+        Utils.do_cmd("rm -rf {0}".format(task.get_taskdir()))
+        task = CondorTask(**kwargs)
+        self.assertEqual(task.marked_complete, False)
+        # first pass "submits", second pass sees the (fake) outputs
+        task.process(fake=True)
+        task.process(fake=True)
+        self.assertEqual(task.marked_complete, True)
+        summary = task.get_task_summary()
+
+        # a new instance doesn't need the backup or the outputs
+        task = CondorTask(**kwargs)
+        self.assertEqual(task.marked_complete, True)
+        self.assertEqual(task.loaded_backup, False)
+        self.assertEqual(task.complete(), True)
+        self.assertEqual(task.get_task_summary()["jobs"].keys(), summary["jobs"].keys())
+        self.assertEqual(task.loaded_backup, False)
+        # but loads it when needed
+        self.assertEqual(len(task.get_outputs()), (self.nfiles+1)//self.files_per_job)
+        self.assertEqual(task.loaded_backup, True)
+
+        # a different configuration or a modified output directory invalidate the marker
+        self.assertEqual(CondorTask(min_completion_fraction=0.5, **kwargs).marked_complete, False)
+        time.sleep(0.01)
+        Utils.do_cmd("touch {0}/output_1.root".format(outdir))
+        self.assertEqual(CondorTask(**kwargs).marked_complete, False)
+
+    def test_streaming(self):
+        upstream = UpstreamTask(self.nfiles)
+        upstream.ndone = 5
+        dummy = CondorTask(
+                sample = TaskOutputSample(task=upstream, dataset="/teststream/teststream/TEST"),
+                open_dataset = False,
+                files_per_output = self.files_per_job,
+                cmssw_version = self.cmssw,
+                tag = "vstream",
+                no_load_from_backup = True,
+                )
+        # full chunks are mapped while upstream is running, but not the leftover
+        self.assertEqual(len(dummy.get_outputs()), 5//self.files_per_job)
+        self.assertEqual(dummy.mapped_complete_sample, False)
+        self.assertEqual(dummy.complete(), False)
+
+        upstream.ndone = self.nfiles
+        dummy.update_mapping()
+        self.assertEqual(len(dummy.get_outputs()), (self.nfiles+1)//self.files_per_job)
+        self.assertEqual(len(dummy.get_inputs(flatten=True)), self.nfiles)
+        self.assertEqual(dummy.mapped_complete_sample, True)
+
+    def make_chunked_task(self, tag, **kwargs):
+        basedir = "/tmp/{0}/metis/condortask_testchunks/".format(os.getenv("USER"))
+        Utils.do_cmd("rm -rf {0} ; mkdir -p {0}/outputs/".format(basedir))
+        for i in range(1,self.nfiles+1):
+            Utils.do_cmd("touch {0}/input_{1}.root".format(basedir, i))
+        Utils.do_cmd("echo hello > {0}/executable.sh".format(basedir))
+        return CondorTask(
+                sample = DirectorySample(
+                    location = basedir,
+                    globber = "*.root",
+                    dataset = "/testchunks/testchunks/TEST",
+                    ),
+                files_per_output = 1,
+                cmssw_version = self.cmssw,
+                tag = tag,
+                output_dir = basedir + "/outputs/",
+                no_load_from_backup = True,
+                executable = "{0}/executable.sh".format(basedir),
+                **kwargs
+                )
+
+    def test_chunks_per_job(self):
+        dummy = self.make_chunked_task("vchunks", chunks_per_job=3)
+        dummy.prepare_inputs()
+        outs = dummy.get_outputs()
+        kwargs = dummy.get_job_submit_kwargs(dummy.get_inputs(), outs, fake=True)
+        self.assertTrue(kwargs["executable"].endswith("condor_packed_exe.sh"))
+        self.assertTrue(dummy.executable_path in kwargs["inputfiles"])
+        self.assertEqual(len(kwargs["arguments"]), 3)
+        self.assertEqual(kwargs["arguments"][0][0], "executable.sh")
+        self.assertEqual(kwargs["arguments"][0].count("::"), 2)
+        self.assertEqual(kwargs["arguments"][-1].count("::"), 0)
+        self.assertEqual(dict(kwargs["selection_pairs"][1])["metis_jobnums"], "4,5,6")
+        self.assertEqual(get_job_indices({"jobnum": "4", "metis_jobnums": "4,5,6"}), [4, 5, 6])
+        self.assertEqual(get_job_indices({"jobnum": "4", "metis_jobnums": "undefined"}), [4])
+
+        # one condor job id for the outputs of each job
+        dummy.run(fake=True)
+        history = dummy.get_job_submission_history()
+        self.assertEqual([history[i] for i in range(1,self.nfiles+1)], [["-1.0"]]*3 + [["-1.1"]]*3 + [["-1.2"]])
+
+    def test_auto_chunks_per_job(self):
+        dummy = self.make_chunked_task("vautochunks", chunks_per_job="auto")
+        dummy.prepare_inputs()
+        self.assertEqual(dummy.get_chunks_per_job(), 1)
+        dummy.run(fake=True)
+        # pretend the jobs ran: 300s setup for 60s of processing
+        logdir = dummy.get_taskdir() + "/logs/std_logs/"
+        Utils.do_cmd("mkdir -p {0}".format(logdir))
+        for index, cids in dummy.get_job_submission_history().items():
+            report = {"timestamps": {"start": 1000, "setup_end": 1300, "end": 1360}}
+            with open("{0}/1e.{1}.out".format(logdir, cids[-1]), "w") as fhout:
+                fhout.write(REPORT_PREFIX + json.dumps(report) + "\n")
+            Utils.do_cmd("touch {0}/output_{1}.root".format(dummy.get_outputdir(), index))
+        for out in dummy.get_outputs():
+            out.unset_fake()
+            out.recheck()
+        dummy.update_chunks_per_job()
+        self.assertEqual(dummy.get_chunks_per_job(), 20)
+
+    def test_packed_executable(self):
+        basedir = "/tmp/{0}/metis/condortask_testpacked/".format(os.getenv("USER"))
+        Utils.do_cmd("rm -rf {0} ; mkdir -p {0}".format(basedir))
+        # fails for output 2, and checks that it can see the job inputs
+        with open(basedir + "/inner.sh", "w") as fhout:
+            fhout.write("[ -e input.txt ] || exit 3\n[ $4 == 2 ] && exit 2\necho $1 $2 $4 > ../out_$4.txt\n")
+        Utils.do_cmd("touch {0}/input.txt".format(basedir))
+        packed = os.path.abspath(os.path.join(os.path.dirname(__file__), "../metis/executables/condor_packed_exe.sh"))
+        proc = subprocess.Popen(["bash", packed, "inner.sh", "dir", "name", "in1", "1", "::", "dir", "name", "in2", "2", "::", "dir", "name", "in3", "3"],
+                cwd=basedir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out, _ = proc.communicate()
+        self.assertNotEqual(proc.returncode, 0)
+        self.assertTrue("ran 3 chunks, 1 failed" in out.decode("utf-8"))
+        with open(basedir + "/out_3.txt") as fhin:
+            self.assertEqual(fhin.read().strip(), "dir name 3")
+        with open(basedir + "/metis_chunks.txt") as fhin:
+            self.assertEqual([line.split()[:3] for line in fhin], [["1","1","0"], ["2","2","2"], ["3","3","0"]])
+        self.assertEqual(glob.glob(basedir + "/metis_chunk_*"), [])
+
     def test_condor_handler(self):
 
         epsilon_hours = 0.1
@@ -187,6 +363,35 @@ class CondorTaskTest(unittest.TestCase):
 
 
 
+    def test_packed_job_removed_once(self):
+        class HeldExecutor(Executor.Executor):
+            def __init__(self):
+                self.removed = []
+            def query(self, selection_pairs=None, extra_columns=[]):
+                # one job processing outputs 1-3, held for a day
+                return [{"ClusterId": "123.0", "ProcId": "0", "JobStatus": "H", "EnteredCurrentStatus": time.time()-86400,
+                         "jobnum": "1", "metis_jobnums": "1,2,3"}]
+            def remove(self, cluster_ids=[]):
+                self.removed.extend(cluster_ids)
+            def submit(self, **kwargs):
+                return True, -1
+        executor = HeldExecutor()
+        basedir = "/tmp/{0}/metis/condortask_test/".format(os.getenv("USER"))
+        task = CondorTask(
+                sample = DirectorySample(location=basedir, globber="*.root", dataset="/test/testpacked/TEST"),
+                files_per_output = 1,
+                cmssw_version = self.cmssw,
+                tag = self.tag,
+                executable = "{0}/executable.sh".format(basedir),
+                no_load_from_backup = True,
+                executor = executor,
+                )
+        task.prepare_inputs()
+        nremoved = Metrics.JOBS_REMOVED.get(task=task.unique_name, reason="held") or 0
+        task.run()
+        self.assertEqual(executor.removed, ["123.0"])
+        self.assertEqual(Metrics.JOBS_REMOVED.get(task=task.unique_name, reason="held") - nremoved, 1)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,136 @@
+import unittest
+import time
+import logging
+
+from metis.DAG import DAG
+from metis.Task import Task
+
+class StepTask(Task):
+    """
+    Completes after `nsteps` calls to process()
+    """
+
+    def __init__(self, **kwargs):
+        self.nsteps = kwargs.get("nsteps", 1)
+        self.sleep = kwargs.get("sleep", 0.)
+        self.nprocessed = 0
+        self.ncomplete_calls = 0
+        self.started = None
+        self.log = kwargs.get("log", [])
+        super(StepTask, self).__init__(no_load_from_backup=True, **kwargs)
+
+    def process(self):
+        self.started = time.time()
+        self.log.append(self.name)
+        time.sleep(self.sleep)
+        if self.nsteps < 0:
+            raise RuntimeError("failed on purpose")
+        self.nprocessed += 1
+
+    def complete(self, return_fraction=False):
+        self.ncomplete_calls += 1
+        frac = min(1., 1.*self.nprocessed/self.nsteps) if self.nsteps > 0 else 0.
+        return frac if return_fraction else frac >= 1.
+
+class DAGTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger("logger_metis").disabled = True
+
+    def test_order_and_cycles(self):
+        a, b, c, d = [StepTask(name=name) for name in "abcd"]
+        dag = DAG()
+        dag.add_task(d, requires=[b, c])
+        dag.add_task(b, requires=[a])
+        dag.add_task(c, requires=[a])
+        order = dag.get_tasks()
+        self.assertEqual(order[0], a)
+        self.assertEqual(order[-1], d)
+        self.assertEqual(d.get_requirements(), [b, c])
+        self.assertTrue(dag.depends_on(d, a))
+        self.assertRaises(ValueError, dag.add_dependency, a, d)
+
+    def test_process_diamond(self):
+        log = []
+        a, b, c, d = [StepTask(name=name, log=log) for name in "abcd"]
+        dag = DAG()
+        dag.add_task(b, requires=[a])
+        dag.add_task(c, requires=[a])
+        dag.add_task(d, requires=[b, c])
+        # dependents that become ready are processed in the same pass
+        self.assertEqual(dag.process(), 4)
+        self.assertTrue(dag.complete())
+        self.assertEqual(log[0], "a")
+        self.assertEqual(log[-1], "d")
+
+    def test_concurrent_branches(self):
+        tasks = [StepTask(name=str(i), sleep=0.2) for i in range(4)]
+        dag = DAG(nthreads=4)
+        for task in tasks:
+            dag.add_task(task)
+        t0 = time.time()
+        dag.process()
+        self.assertTrue(time.time()-t0 < 4*0.2*0.75)
+
+    def test_memoized_completion(self):
+        a = StepTask(name="a")
+        b = StepTask(name="b", nsteps=5)
+        dag = DAG()
+        dag.add_task(b, requires=[a])
+        dag.process()
+        ncalls = a.ncomplete_calls
+        for _ in range(5):
+            dag.is_ready(b)
+        self.assertEqual(a.ncomplete_calls, ncalls)
+        # until told otherwise
+        dag.invalidate(a)
+        dag.is_ready(b)
+        self.assertEqual(a.ncomplete_calls, ncalls+1)
+
+    def test_critical_path(self):
+        log = []
+        # long chain: x1 -> x2 -> x3, short one: y
+        x1, x2, x3 = [StepTask(name=name, log=log, nsteps=2) for name in ["x1", "x2", "x3"]]
+        y = StepTask(name="y", log=log, nsteps=2)
+        dag = DAG(nthreads=1)
+        dag.add_task(y)
+        dag.add_task(x2, requires=[x1])
+        dag.add_task(x3, requires=[x2])
+        lengths = dag.get_critical_path_lengths()
+        self.assertEqual(lengths[x1], 3.)
+        self.assertEqual(lengths[y], 1.)
+        self.assertEqual(dag.get_ready_tasks(), [x1, y])
+
+    def test_streaming(self):
+        up = StepTask(name="up", nsteps=3)
+        down = StepTask(name="down", nsteps=3)
+        dag = DAG(nthreads=1)
+        dag.add_task(down, streams_from=[up])
+        # down doesn't wait for up, but is still after it
+        self.assertEqual(dag.get_tasks(), [up, down])
+        self.assertEqual(down.get_requirements(), [])
+        self.assertEqual(dag.get_ready_tasks(), [up, down])
+        dag.process()
+        self.assertEqual((up.nprocessed, down.nprocessed), (1, 1))
+
+    def test_failures_are_isolated(self):
+        bad = StepTask(name="bad", nsteps=-1)
+        good = StepTask(name="good")
+        dag = DAG()
+        dag.add_task(bad)
+        dag.add_task(good)
+        dag.process()
+        self.assertTrue(dag.is_complete(good))
+        self.assertFalse(dag.is_complete(bad))
+
+    def test_raise_errors(self):
+        bad = StepTask(name="bad", nsteps=-1)
+        good = StepTask(name="good")
+        dag = DAG(nthreads=2)
+        dag.add_task(bad)
+        dag.add_task(good)
+        self.assertRaises(RuntimeError, dag.process, raise_errors=True)
+        self.assertEqual(good.nprocessed, 1)
+
+if __name__ == "__main__":
+    unittest.main()
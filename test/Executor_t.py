@@ -0,0 +1,67 @@
+import unittest
+import os
+import time
+import logging
+
+import metis.Utils as Utils
+from scratch import ScratchDir
+from metis.Executor import LocalExecutor, get_job_selection
+
+class LocalExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger("logger_metis").disabled = True
+        self.scratch = ScratchDir()
+        self.addCleanup(self.scratch.leave)
+        self.basedir = self.scratch.path + "/"
+        Utils.do_cmd("mkdir -p {0}/logs/".format(self.basedir))
+        with open(self.basedir + "/executable.sh", "w") as fhout:
+            fhout.write("#!/bin/bash\necho jobnum=$(grep -i '^jobnum' $_CONDOR_JOB_AD | cut -d= -f2- | xargs echo) $(cat input.txt)\nsleep $1\n")
+        with open(self.basedir + "/input.txt", "w") as fhout:
+            fhout.write("from the input\n")
+        self.executor = LocalExecutor(nproc=1, workdir=self.basedir + "/scratch/")
+
+    def tearDown(self):
+        self.executor.stop()
+
+    def submit(self, durations):
+        return self.executor.submit(
+                executable=self.basedir + "/executable.sh",
+                arguments=[[duration] for duration in durations],
+                inputfiles=[self.basedir + "/input.txt"], logdir=self.basedir + "/logs/", multiple=True,
+                selection_pairs=[[["taskname", "test"], ["jobnum", i]] for i in range(len(durations))],
+                )
+
+    def test_job_selection(self):
+        arguments, classads = get_job_selection({"arguments": [1, "a"], "selection_pairs": [["jobnum", 3]], "classads": [["tag", "v1"]]})
+        self.assertEqual(arguments, [["1", "a"]])
+        self.assertEqual(classads, [{"jobnum": "3", "tag": "v1"}])
+
+    def test_pool(self):
+        _, cluster_id = self.submit([0, 0])
+        self.assertEqual(self.executor.wait(timeout=30), True)
+        self.assertEqual(self.executor.query(), [])
+        with open("{0}/logs/std_logs/1e.{1}.1.out".format(self.basedir, cluster_id)) as fhin:
+            self.assertEqual(fhin.read().strip(), "jobnum=1 from the input")
+        self.assertEqual(os.listdir(self.basedir + "/scratch/"), [])
+
+    def test_query_and_remove(self):
+        _, cluster_id = self.submit([30, 30, 30])
+        time.sleep(0.5)
+        # one at a time
+        jobs = self.executor.query(selection_pairs=[["taskname", "test"]], extra_columns=["jobnum"])
+        self.assertEqual(sorted((job["jobnum"], job["JobStatus"]) for job in jobs), [("0", "R"), ("1", "I"), ("2", "I")])
+        self.assertEqual(jobs[0]["ClusterId"].split(".")[0], cluster_id)
+        self.assertEqual(self.executor.query(selection_pairs=[["taskname", "other"]]), [])
+
+        t0 = time.time()
+        self.executor.remove(["{0}.0".format(cluster_id), "{0}.2".format(cluster_id)])
+        time.sleep(0.5)
+        jobs = self.executor.query(extra_columns=["jobnum"])
+        self.assertEqual([(job["jobnum"], job["JobStatus"]) for job in jobs], [("1", "R")])
+        self.executor.remove([cluster_id])
+        self.assertEqual(self.executor.wait(timeout=10), True)
+        self.assertTrue(time.time() - t0 < 10)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import random
+
+import metis.History as History
+from metis.StatsParser import merge_histories
+
+class HistoryTest(unittest.TestCase):
+
+    def make_history(self, timestamps):
+        return {
+                "timestamps": list(timestamps),
+                "njobs_done": [i for i in range(len(timestamps))],
+                "njobs_total": [100 for _ in timestamps],
+                }
+
+    def test_compact_tiers(self):
+        now = 100*86400
+        # 5 minute points for the last 60 days
+        timestamps = list(range(now-60*86400+300, now+1, 300))
+        history = History.compact_history(self.make_history(timestamps), now=now)
+        ts = history["timestamps"]
+        self.assertEqual(ts, sorted(ts))
+        self.assertEqual(len(ts), len(history["njobs_done"]))
+        nraw = len([t for t in ts if now-t <= History.RAW_WINDOW])
+        nhourly = len([t for t in ts if History.RAW_WINDOW < now-t <= History.HOURLY_WINDOW])
+        ndaily = len([t for t in ts if now-t > History.HOURLY_WINDOW])
+        self.assertEqual(nraw, 48*12+1)
+        self.assertTrue(abs(nhourly - 28*24) <= 1)
+        self.assertTrue(abs(ndaily - 30) <= 1)
+        # cumulative series keep the last value of each bucket
+        self.assertEqual(history["njobs_done"][-1], len(timestamps)-1)
+
+    def test_compact_is_stable(self):
+        now = 10*86400
+        history = History.compact_history(self.make_history(range(300, now+1, 300)), now=now)
+        again = History.compact_history(history, now=now)
+        self.assertEqual(history, again)
+
+    def test_compact_dedupes_and_sorts(self):
+        history = {"timestamps": [600, 300, 600], "njobs_done": [2, 1, 3]}
+        history = History.compact_history(history)
+        self.assertEqual(history, {"timestamps": [300, 600], "njobs_done": [1, 3]})
+
+    def test_lttb(self):
+        random.seed(42)
+        xs = list(range(1000))
+        ys = [random.random() for _ in xs]
+        ys[500] = 10.
+        indices = History.lttb(xs, ys, 50)
+        self.assertEqual(len(indices), 50)
+        self.assertEqual(indices, sorted(indices))
+        self.assertEqual(indices[0], 0)
+        self.assertEqual(indices[-1], 999)
+        # spikes survive
+        self.assertIn(500, indices)
+        self.assertEqual(History.lttb(xs[:10], ys[:10], 50), list(range(10)))
+
+    def test_downsample(self):
+        history = self.make_history(range(0, 5000*300, 300))
+        small = History.downsample_history(history, 100)
+        self.assertTrue(len(small["timestamps"]) <= 100)
+        self.assertEqual(set(small.keys()), set(history.keys()))
+        self.assertEqual(small["timestamps"][0], 0)
+        self.assertEqual(small["njobs_done"][-1], 4999)
+        self.assertEqual(History.downsample_history(small, 100), small)
+
+    def test_merge_histories_bounded(self):
+        history = {}
+        # four months of updates every two hours
+        for ts in range(0, 120*86400, 7200):
+            history = merge_histories(history, {"timestamps": [ts], "njobs_done": [ts//7200]})
+        self.assertTrue(len(history["timestamps"]) <= 24+30*12+91)
+        self.assertEqual(history["njobs_done"][-1], 120*12-1)
+
+if __name__ == "__main__":
+    unittest.main()
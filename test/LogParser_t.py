@@ -2,6 +2,7 @@ import unittest
 import os
 import datetime
 import time
+import json
 
 import metis.LogParser as LogParser
 import metis.Utils as Utils
@@ -141,6 +142,133 @@ TimeReport> Time report complete in 10366.8 seconds
     def test_log_parser_rate(self):
         self.assertEqual(abs(self.parsed["event_rate"]-1.99825) < 1e-6, True)
 
+    def test_stageout_lines(self):
+        basedir = os.path.dirname(self.outlog)
+        outlog = "{0}/test_stageout.out".format(basedir)
+        with open(outlog, "w") as fhout:
+            fhout.write("[stageout] status=0 attempts=2 seconds=4.0 MB=2.0 rate=0.5MB/s dest=gsiftp://host/out_1.root\n")
+        parsed = LogParser.log_parser(outlog)
+        self.assertEqual(parsed["stageout"], [{"status": 0, "attempts": 2, "seconds": 4.0, "bytes": 2*1048576, "dest": "gsiftp://host/out_1.root"}])
+
+    def test_job_report(self):
+        basedir = os.path.dirname(self.outlog)
+        outlog = "{0}/test_report.out".format(basedir)
+        errlog = "{0}/test_report.err".format(basedir)
+        report = {
+                "header": {"GLIDEIN_CMSSite": "T2_US_Caltech", "time": "1500438186"},
+                "event_rate": 3.5,
+                "exit_codes": {"cmsrun": 0, "validation": 0, "stageout": 0, "job": 0},
+                }
+        with open(outlog, "w") as fhout:
+            fhout.write("--- begin header output ---\nGLIDEIN_CMSSite: T2_US_UCSD\n--- end header output ---\n")
+            fhout.write("{0}{1}\n".format(LogParser.REPORT_PREFIX, json.dumps(report)))
+        # stderr disagrees with the report, to make sure it isn't read
+        with open(errlog, "w") as fhout:
+            fhout.write(" Event Throughput: 1.0 ev/s\n")
+
+        self.assertEqual(LogParser.read_job_report(outlog), report)
+        parsed = LogParser.log_parser(errlog)
+        self.assertEqual(parsed["site"], "T2_US_Caltech")
+        self.assertEqual(parsed["args"]["time"], "1500438186")
+        self.assertEqual(parsed["event_rate"], 3.5)
+        self.assertEqual(parsed["inferred_error"], "")
+
+        # without a report, we go back to the text
+        self.assertEqual(LogParser.read_job_report(self.outlog), {})
+
+    def test_packed_job_reports(self):
+        basedir = os.path.dirname(self.outlog)
+        outlog = "{0}/test_packed.out".format(basedir)
+        reports = [{"header": {"GLIDEIN_CMSSite": "T2_US_UCSD", "IFILE": str(index)},
+                    "timestamps": {"start": 1000*index, "end": 1000*index+60*index}} for index in [4, 7]]
+        with open(outlog, "w") as fhout:
+            for ichunk, (index, report) in enumerate(zip([4, 7], reports), 1):
+                fhout.write("\n--- begin chunk {0} ---\n\n".format(ichunk))
+                fhout.write("{0}{1}\n".format(LogParser.REPORT_PREFIX, json.dumps(report)))
+                fhout.write("\n--- end chunk {0} ---\n\n".format(ichunk))
+                fhout.write("[chunk] ichunk={0} index={1} status=0 seconds=60\n".format(ichunk, index))
+            fhout.write("[chunk] ran 2 chunks, 0 failed\n")
+
+        parsed = LogParser.log_parser(outlog)
+        self.assertEqual(sorted(parsed["chunk_reports"].keys()), ["4", "7"])
+        # each output sees the report of its own chunk, and unknown ones the last report
+        self.assertEqual(LogParser.get_chunk_log(parsed, 4)["timestamps"], reports[0]["timestamps"])
+        self.assertEqual(LogParser.get_chunk_log(parsed, "7")["args"]["IFILE"], "7")
+        self.assertEqual(LogParser.get_chunk_log(parsed, 5)["timestamps"], reports[1]["timestamps"])
+        # also after a round trip through the digest
+        parsed = LogParser.cached_log_parser(outlog)
+        self.assertEqual(LogParser.get_chunk_log(parsed, 4)["args"]["IFILE"], "4")
+        LogParser.commit_digests()
+
+    def test_log_digest(self):
+        dbname = "{0}/{1}".format(os.path.dirname(self.outlog), LogParser.DIGEST_NAME)
+        Utils.do_cmd("rm -f {0}".format(dbname))
+        digest = LogParser.LogDigest(dbname)
+
+        # first parse is a miss, second one comes out of the digest
+        parsed = digest.parse(self.errlog)
+        self.assertEqual(parsed["site"], self.parsed["site"])
+        self.assertEqual(parsed["inferred_error"], self.parsed["inferred_error"])
+        parsed = digest.parse(self.outlog)
+        self.assertEqual(parsed["args"], self.parsed["args"])
+        self.assertEqual((digest.nhits, digest.nmisses), (1, 1))
+
+        # entries survive across instances once committed
+        digest.close()
+        digest = LogParser.LogDigest(dbname)
+        digest.parse(self.errlog)
+        self.assertEqual((digest.nhits, digest.nmisses), (1, 0))
+
+        # a changed log gets reparsed
+        with open(self.outlog, "r") as fhin:
+            content = fhin.read()
+        with open(self.outlog, "w") as fhout:
+            fhout.write(content.replace("T2_US_UCSD", "T2_US_MIT"))
+        parsed = digest.parse(self.errlog)
+        self.assertEqual(parsed["site"], "T2_US_MIT")
+        self.assertEqual(digest.nmisses, 1)
+        with open(self.outlog, "w") as fhout:
+            fhout.write(content)
+        digest.close()
+
+    def test_cached_log_parser(self):
+        parsed = LogParser.cached_log_parser(self.errlog, do_header=False, do_error=False, do_rate=True)
+        self.assertEqual(abs(parsed["event_rate"]-1.99825) < 1e-6, True)
+        LogParser.commit_digests()
+
+    def test_log_digest_parts(self):
+        dbname = "{0}/{1}".format(os.path.dirname(self.outlog), LogParser.DIGEST_NAME)
+        Utils.do_cmd("rm -f {0}".format(dbname))
+        digest = LogParser.LogDigest(dbname)
+
+        # only the requested parts get parsed, and asking for more reparses the log once
+        parsed = digest.parse(self.errlog, do_header=True, do_error=False, do_rate=False)
+        self.assertEqual(parsed["site"], self.parsed["site"])
+        self.assertEqual(parsed["event_rate"], -1)
+        parsed = digest.parse(self.errlog, do_header=False, do_error=False, do_rate=True)
+        self.assertEqual(abs(parsed["event_rate"]-1.99825) < 1e-6, True)
+        self.assertEqual(parsed["site"], self.parsed["site"])
+        digest.parse(self.errlog, do_header=True, do_error=False, do_rate=True)
+        self.assertEqual((digest.nhits, digest.nmisses), (1, 2))
+        digest.close()
+
+    def test_digests_across_threads(self):
+        import threading
+        LogParser.commit_digests()
+        results = []
+        def parse():
+            results.append(LogParser.cached_log_parser(self.errlog, do_header=True, do_error=False, do_rate=False)["site"])
+        threads = [threading.Thread(target=parse) for _ in range(4)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEqual(results, [self.parsed["site"]]*4)
+
+        # the digests are shared between threads, so any thread can commit and close them
+        thread = threading.Thread(target=LogParser.commit_digests)
+        thread.start()
+        thread.join()
+        self.assertEqual([key for key in LogParser._digests if key[0] == os.getpid()], [])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import os
+import json
+import logging
+
+import metis.Utils as Utils
+from scratch import ScratchDir
+from metis.Sample import DirectorySample
+from metis.CondorTask import CondorTask
+from metis.MergeTask import MergeTask
+
+class MergeTaskTest(unittest.TestCase):
+
+    # in KB, for output_1.root, output_2.root, ...
+    sizes = [6, 5, 4, 3, 2, 1]
+
+    def setUp(self):
+        logging.getLogger("logger_metis").disabled = True
+        self.scratch = ScratchDir()
+        self.addCleanup(self.scratch.leave)
+        self.basedir = self.scratch.path + "/"
+        Utils.do_cmd("mkdir -p {0}/outputs/ {0}/merged/".format(self.basedir))
+        for i, size in enumerate(self.sizes, 1):
+            Utils.do_cmd("touch {0}/input_{1}.root".format(self.basedir, i))
+            with open("{0}/outputs/output_{1}.root".format(self.basedir, i), "w") as fhout:
+                fhout.write("x"*(1024*size))
+        Utils.do_cmd("echo hello > {0}/executable.sh".format(self.basedir))
+
+        self.input_task = CondorTask(
+                sample = DirectorySample(
+                    location = self.basedir,
+                    globber = "input_*.root",
+                    dataset = "/testmerge/testmerge/TEST",
+                    ),
+                files_per_output = 1,
+                cmssw_version = "CMSSW_8_0_21",
+                tag = "vmerge",
+                output_dir = self.basedir + "/outputs/",
+                no_load_from_backup = True,
+                executable = "{0}/executable.sh".format(self.basedir),
+                )
+        # the outputs are there already
+        self.input_task.process(fake=True)
+
+    def make_task(self, **kwargs):
+        return MergeTask(
+                input_task = self.input_task,
+                # 10.24KB
+                target_size_GB = 1e-5,
+                output_dir = self.basedir + "/merged/",
+                no_load_from_backup = True,
+                executable = "{0}/executable.sh".format(self.basedir),
+                **kwargs
+                )
+
+    def test_grouping(self):
+        task = self.make_task()
+        groups = [[inp.get_index() for inp in ins] for ins in task.get_inputs()]
+        self.assertEqual(groups, [[1, 3], [2, 4, 5], [6]])
+
+        metadata = task.get_metadata()
+        self.assertEqual(sorted(metadata["ijob_to_inputs"].keys()), [1, 2, 3])
+        self.assertTrue(metadata["ijob_to_inputs"][1][0].endswith("output_1.root"))
+
+    def test_local(self):
+        task = self.make_task(local=True)
+        task.process(fake=True)
+        self.assertEqual(task.complete(), True)
+        with open(self.basedir + "/merged/metadata.json", "r") as fhin:
+            metadata = json.load(fhin)
+        self.assertEqual(len(metadata["ijob_to_nevents"]), 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+import os
+
+import metis.Metrics as Metrics
+from metis.StatsParser import update_metrics
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Metrics.Registry()
+
+    def test_counter_and_gauge(self):
+        counter = self.registry.counter("test_submitted_total", "Submitted jobs", ["task"])
+        counter.inc(task="a")
+        counter.inc(3, task="a")
+        counter.inc(task='b"\\')
+        self.assertEqual(counter.get(task="a"), 4)
+        self.assertRaises(ValueError, counter.inc, -1, task="a")
+        self.assertRaises(ValueError, counter.inc, site="a")
+
+        gauge = self.registry.gauge("test_jobs", "Jobs", ["status"])
+        gauge.set(5, status="R")
+        gauge.dec(status="R")
+        gauge.set(2.5, status="I")
+        gauge.remove(status="I")
+
+        text = self.registry.render()
+        self.assertIn("# TYPE test_submitted_total counter\n", text)
+        self.assertIn('test_submitted_total{task="a"} 4\n', text)
+        self.assertIn('test_submitted_total{task="b\\"\\\\"} 1\n', text)
+        self.assertIn('test_jobs{status="R"} 4\n', text)
+        self.assertNotIn('status="I"', text)
+
+        # registering again returns the same metric, but not with another type
+        self.assertTrue(self.registry.counter("test_submitted_total", "", ["task"]) is counter)
+        self.assertRaises(ValueError, self.registry.gauge, "test_submitted_total", "", ["task"])
+
+    def test_histogram(self):
+        hist = self.registry.histogram("test_latency_seconds", "Latency", buckets=[1., 10.])
+        for val in [0.5, 2., 3., 20.]:
+            hist.observe(val)
+        summary = hist.get()
+        self.assertEqual(summary["count"], 4)
+        self.assertEqual(summary["sum"], 25.5)
+        self.assertEqual(list(summary["buckets"].values()), [1, 3, 4])
+        text = self.registry.render()
+        self.assertIn('test_latency_seconds_bucket{le="1"} 1\n', text)
+        self.assertIn('test_latency_seconds_bucket{le="+Inf"} 4\n', text)
+        self.assertIn('test_latency_seconds_sum 25.5\n', text)
+        self.assertIn('test_latency_seconds_count 4\n', text)
+
+    def test_textfile(self):
+        basedir = "/tmp/{0}/metis/metrics_test/".format(os.getenv("USER"))
+        if not os.path.isdir(basedir):
+            os.makedirs(basedir)
+        self.registry.counter("test_total", "Test").inc()
+        fname = basedir + "metis.prom"
+        self.registry.write_textfile(fname)
+        with open(fname, "r") as fhin:
+            self.assertEqual(fhin.read(), self.registry.render())
+
+    def test_update_metrics(self):
+        tasks = [{
+            "general": {"dataset": "/A/B/C", "tag": "v1", "njobs_total": 10, "njobs_done": 4, "nevents_total": 100, "nevents_done": 40},
+            "completed_sites": {"T2_US_UCSD": 4},
+            "bad": {"jobs_not_done": {"5": {"last_sites": ["T2_US_UCSD", ""]}}},
+            }]
+        update_metrics(tasks)
+        self.assertEqual(Metrics.TASK_JOBS.get(dataset="/A/B/C", tag="v1", state="done"), 4)
+        self.assertEqual(Metrics.TASK_EVENTS.get(dataset="/A/B/C", tag="v1", state="total"), 100)
+        self.assertEqual(Metrics.SITE_JOBS.get(site="T2_US_UCSD", result="completed"), 4)
+        self.assertEqual(Metrics.SITE_JOBS.get(site="T2_US_UCSD", result="failed"), 1)
+        self.assertEqual(Metrics.SITE_JOBS.get(site="unknown", result="failed"), 1)
+        # tasks that are gone don't linger
+        update_metrics([])
+        self.assertEqual(Metrics.TASK_JOBS.get(dataset="/A/B/C", tag="v1", state="done"), None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,16 @@
 import unittest
+import logging
 
 from metis.Path import Path
 from metis.Constants import Constants
 from metis.Task import Task
+from scratch import ScratchDir
 
 class PathTest(unittest.TestCase):
+    def setUp(self):
+        self.scratch = ScratchDir()
+        self.addCleanup(self.scratch.leave)
+
     def test_get_tasks(self):
         t1 = Task()
         p1 = Path([t1])
@@ -29,6 +35,19 @@ class PathTest(unittest.TestCase):
         p1 = Path([t1,t2])
         self.assertEqual(p1.complete_list(), [True,True])
 
+    def test_process_raises(self):
+        class BadTask(Task):
+            def process(self):
+                raise ValueError("failed on purpose")
+            def complete(self, return_fraction=False):
+                return 0. if return_fraction else False
+        logging.getLogger("logger_metis").disabled = True
+        self.addCleanup(setattr, logging.getLogger("logger_metis"), "disabled", False)
+        t1 = BadTask(foo=1)
+        t2 = Task(bar=2)
+        p1 = Path([t1,t2])
+        self.assertRaises(ValueError, p1.process)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import os
+import json
+import logging
+
+import metis.Profiling as Profiling
+from metis.File import File
+
+class Dummy(object):
+
+    @Profiling.profiled()
+    def work(self, x):
+        return 2*x
+
+class ProfilingTest(unittest.TestCase):
+
+    def setUp(self):
+        Profiling.get_report(reset=True)
+        self.basedir = "/tmp/{0}/metis/profiling_test/".format(os.getenv("USER"))
+        if not os.path.isdir(self.basedir):
+            os.makedirs(self.basedir)
+
+    def tearDown(self):
+        Profiling.enable_trace("")
+
+    def test_spans_and_counters(self):
+        with Profiling.span("outer"):
+            for i in range(3):
+                with Profiling.span("inner"):
+                    Profiling.count("stat", 2)
+        self.assertEqual(Dummy().work(2), 4)
+
+        report = Profiling.get_report(reset=True)
+        self.assertEqual(report["spans"]["outer"]["calls"], 1)
+        self.assertEqual(report["spans"]["inner"]["calls"], 3)
+        self.assertEqual(report["spans"]["Dummy.work"]["calls"], 1)
+        self.assertTrue(report["spans"]["outer"]["total"] >= report["spans"]["inner"]["total"])
+        self.assertEqual(report["counters"], {"stat": 6})
+        self.assertTrue("inner" in Profiling.format_report(report))
+
+        # reset starts a new iteration
+        self.assertEqual(Profiling.get_report()["spans"], {})
+
+    def test_span_survives_exceptions(self):
+        def fail():
+            with Profiling.span("failing"):
+                raise ValueError()
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(Profiling.get_report()["spans"]["failing"]["calls"], 1)
+
+    def test_file_stats_counted(self):
+        f = File(self.basedir + "doesnotexist.root")
+        f.exists()
+        f.recheck()
+        self.assertEqual(Profiling.get_report()["counters"]["stat"], 2)
+
+    def test_trace(self):
+        fname = self.basedir + "trace.json"
+        Profiling.enable_trace(fname)
+        with Profiling.span("traced", task="foo"):
+            Profiling.count("fork")
+        logger = logging.getLogger("profiling_test")
+        logger.disabled = True
+        report = Profiling.end_iteration(logger)
+        self.assertEqual(report["spans"]["traced"]["calls"], 1)
+
+        with open(fname, "r") as fhin:
+            events = json.load(fhin)["traceEvents"]
+        spans = [e for e in events if e["ph"] == "X" and e["name"] == "traced"]
+        self.assertEqual(len(spans), 1)
+        self.assertEqual(spans[0]["args"], {"task": "foo"})
+        counters = [e for e in events if e["ph"] == "C"]
+        self.assertTrue(counters[-1]["args"]["fork"] >= 1)
+
+        # the next iterations append their events, and the dumped ones are forgotten
+        self.assertEqual(Profiling._state["trace_events"], [])
+        Profiling.end_iteration(logger)
+        with Profiling.span("traced_again"):
+            pass
+        Profiling.end_iteration(logger)
+        with open(fname, "r") as fhin:
+            events = json.load(fhin)["traceEvents"]
+        self.assertEqual([e["name"] for e in events if e["ph"] == "X"], ["traced", "traced_again"])
+        self.assertEqual(len([e for e in events if e["ph"] == "C"]), 3)
+        self.assertEqual(Profiling._state["trace_events"], [])
+
+        # enabling it again starts a new file
+        Profiling.enable_trace(fname)
+        Profiling.end_iteration(logger)
+        with open(fname, "r") as fhin:
+            self.assertEqual([e["ph"] for e in json.load(fhin)["traceEvents"]], ["C"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+import os
+import logging
+
+import metis.Utils as Utils
+from metis.Simulator import SimulatedSchedd, SimulatedStorage, SimulatedSample, get_job_outputs, run_benchmark, summarize_benchmark
+
+class SimulatorTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger("logger_metis").disabled = True
+        self.basedir = "/tmp/{0}/metis/simulator_test/".format(os.getenv("USER"))
+        Utils.do_cmd("rm -rf {0} ; mkdir -p {0}".format(self.basedir))
+
+    def tearDown(self):
+        logging.getLogger("logger_metis").disabled = False
+
+    def test_job_outputs(self):
+        self.assertEqual(get_job_outputs("executable.sh", ["/out/", "output", "in.root", "3", "CMSSW_X"]), ["/out/output_3.root"])
+        packed = ["executable.sh", "/out", "output", "a.root", "1", "::", "/out", "output", "b.root", "2"]
+        self.assertEqual(get_job_outputs("condor_packed_exe.sh", packed), ["/out/output_1.root", "/out/output_2.root"])
+
+    def test_sample(self):
+        sample = SimulatedSample(dataset="/A/B/C", nfiles=5, nevents_per_file=10)
+        self.assertEqual(len(sample.get_files()), 5)
+        self.assertEqual(sample.get_nevents(), 50)
+        self.assertEqual(sample.get_files()[0].exists(), True)
+
+    def test_schedd(self):
+        storage = SimulatedStorage(self.basedir + "/storage/")
+        schedd = SimulatedSchedd(storage, idle_seconds=0., duration=100., duration_spread=0., failure_rate=0., hold_rate=0., seed=1)
+        outdir = storage.get_path("task")
+        schedd.submit(executable="executable.sh", multiple=True, logdir=self.basedir,
+                arguments=[[outdir, "output", "in.root", i] for i in range(1, 4)],
+                selection_pairs=[[["taskname", "task"], ["jobnum", i]] for i in range(1, 4)])
+        jobs = schedd.query(selection_pairs=[["taskname", "task"]], extra_columns=["jobnum"])
+        self.assertEqual(sorted((job["jobnum"], job["JobStatus"]) for job in jobs), [("1", "I"), ("2", "I"), ("3", "I")])
+
+        schedd.advance(50.)
+        self.assertEqual(schedd.get_counts(), {"I": 0, "R": 3, "H": 0})
+        schedd.remove([jobs[0]["ClusterId"]])
+        schedd.advance(100.)
+        self.assertEqual(schedd.query(), [])
+        self.assertEqual(len(os.listdir(outdir)), 2)
+        self.assertEqual(schedd.stats["succeeded"], 2)
+        self.assertEqual(schedd.stats["removed"], 1)
+
+    def test_benchmark(self):
+        for task_type in ["CondorTask", "CMSSWTask"]:
+            reports = run_benchmark(noutputs=20, task_type=task_type, workdir=self.basedir + task_type,
+                    schedd_kwargs=dict(failure_rate=0.2, hold_rate=0.1, seed=2), task_kwargs=dict(chunks_per_job=2))
+            summary = summarize_benchmark(reports)
+            self.assertEqual(summary["complete"], True)
+            # one query per iteration, and one more for the summary of the complete task
+            self.assertEqual(summary["counters"]["schedd_query"], summary["iterations"] + 1)
+            self.assertGreater(summary["counters"]["schedd_remove"], 0)
+            self.assertEqual(reports[1]["idle"], 10)
+            self.assertEqual(reports[-1]["done"], 20)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+import os
+import subprocess
+
+import metis.Utils as Utils
+
+HELPER = os.path.abspath(os.path.join(os.path.dirname(__file__), "../metis/executables/metis_stageout.sh"))
+
+def run_helper(commands, **env):
+    """
+    Source the stageout helper in bash, run `commands`, and return (exit code, stdout)
+    """
+    full_env = dict(os.environ)
+    full_env.update(env)
+    proc = subprocess.Popen(["bash", "-c", "source {0}; {1}".format(HELPER, commands)],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=full_env)
+    out, _ = proc.communicate()
+    return proc.returncode, out.decode("utf-8")
+
+@unittest.skipIf(Utils.do_cmd("command -v gfal-copy"), "Only testable without gfal-copy")
+class StageoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = "/tmp/{0}/metis/stageout_test/".format(os.getenv("USER"))
+        Utils.do_cmd("rm -rf {0} ; mkdir -p {0}/job/".format(self.basedir))
+        for name in ["output", "other"]:
+            with open("{0}/job/{1}.root".format(self.basedir, name), "w") as fhout:
+                fhout.write("x"*1000)
+
+    def read_transfers(self):
+        with open(self.basedir + "/job/metis_stageout.txt") as fhin:
+            return [line.split() for line in fhin]
+
+    def test_fallback_endpoint(self):
+        # the original endpoint can't be reached, the fallback (a local directory here) can
+        status, out = run_helper(
+                "stageout file://{0}/job/output.root gsiftp://nowhere{0}/out/output_1.root".format(self.basedir),
+                METIS_JOBDIR=self.basedir+"/job/", STAGEOUT_ENDPOINTS="file://", STAGEOUT_BACKOFF="0")
+        self.assertEqual(status, 0)
+        self.assertTrue(os.path.exists(self.basedir + "/out/output_1.root"))
+        self.assertTrue("[stageout] status=0 attempts=2" in out)
+        transfer = self.read_transfers()[0]
+        self.assertEqual(transfer[0:2], ["0", "2"])
+        self.assertEqual(transfer[3], "1000")
+
+    def test_failure(self):
+        status, out = run_helper(
+                "stageout file://{0}/job/output.root gsiftp://nowhere{0}/out/output_1.root; echo status $METIS_STAGEOUT_STATUS".format(self.basedir),
+                METIS_JOBDIR=self.basedir+"/job/", STAGEOUT_RETRIES="3", STAGEOUT_BACKOFF="0")
+        self.assertTrue("attempts=3" in out)
+        self.assertTrue("status 1" in out)
+
+    def test_leftover(self):
+        # a failed transfer whose partial file can't be removed is recorded, also from stageout_many
+        failing = "function stageout_transfer { return 5; }; function stageout_remove { return 3; };"
+        status, out = run_helper(
+                failing + "stageout_many file://{0}/job/output.root file://{0}/out/output_1.root; echo failed $? leftover $METIS_STAGEOUT_LEFTOVER".format(self.basedir),
+                METIS_JOBDIR=self.basedir+"/job/", STAGEOUT_RETRIES="2", STAGEOUT_BACKOFF="0")
+        self.assertTrue("failed 1 " in out)
+        self.assertTrue("leftover 1\n" in out)
+        with open(self.basedir + "/job/metis_stageout_leftovers.txt") as fhin:
+            self.assertEqual(fhin.read().split(), ["file://{0}/out/output_1.root".format(self.basedir)])
+
+        # nothing is left over when the remove works
+        Utils.do_cmd("rm -f {0}/job/metis_stageout_leftovers.txt".format(self.basedir))
+        status, out = run_helper(
+                "function stageout_transfer { return 5; }; " +
+                "stageout file://{0}/job/output.root file://{0}/out/output_1.root; echo leftover=$METIS_STAGEOUT_LEFTOVER".format(self.basedir),
+                METIS_JOBDIR=self.basedir+"/job/", STAGEOUT_RETRIES="1", STAGEOUT_BACKOFF="0")
+        self.assertTrue("leftover=\n" in out)
+        self.assertFalse(os.path.exists(self.basedir + "/job/metis_stageout_leftovers.txt"))
+
+    def test_many(self):
+        status, out = run_helper(
+                "stageout_many file://{0}/job/output.root file://{0}/out/output_1.root file://{0}/job/other.root file://{0}/out/other_1.root; echo status $METIS_STAGEOUT_STATUS".format(self.basedir),
+                METIS_JOBDIR=self.basedir+"/job/")
+        self.assertEqual(status, 0)
+        self.assertTrue("status 0" in out)
+        self.assertEqual(len(self.read_transfers()), 2)
+        self.assertTrue(os.path.exists(self.basedir + "/out/other_1.root"))
+
+    def test_backoff(self):
+        _, out = run_helper("stageout_backoff_seconds 0; stageout_backoff_seconds 2; stageout_backoff_seconds 20",
+                STAGEOUT_BACKOFF="10", STAGEOUT_BACKOFF_MAX="100")
+        first, third, capped = map(int, out.split())
+        self.assertTrue(10 <= first <= 15)
+        self.assertTrue(40 <= third <= 60)
+        self.assertTrue(100 <= capped <= 150)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+import unittest
+import os
+import logging
+import json
+import gzip
+import threading
+
+import metis.Utils as Utils
+import metis.StatsParser as StatsParser_module
+from metis.StatsParser import StatsParser
+
+class StatsParserTest(unittest.TestCase):
+
+    summaries = None
+
+    @classmethod
+    def setUpClass(cls):
+        super(StatsParserTest, cls).setUpClass()
+
+        logging.getLogger("logger_metis").disabled = True
+
+        # make a few fake task summaries, each with a done job and a job
+        # that failed once, with logs to go along with them
+        basedir = "/tmp/{0}/metis/statsparser_test/".format(os.getenv("USER"))
+        Utils.do_cmd("mkdir -p {0}".format(basedir))
+        cls.summaries = {}
+        for itask in range(4):
+            dsname = "/Test{0}/Test/MINIAODSIM".format(itask)
+            jobs = {}
+            for ijob, (output_exists, nlogs) in enumerate([(True, 1), (False, 2)]):
+                condor_jobs = []
+                for ilog in range(nlogs):
+                    prefix = "{0}/1e.{1}{2}{3}.0".format(basedir, itask, ijob, ilog)
+                    with open(prefix+".out", "w") as fhout:
+                        fhout.write("--- begin header output ---\nGLIDEIN_CMSSite: T2_US_Site{0}\n--- end header output ---\n".format(ilog))
+                    with open(prefix+".err", "w") as fhout:
+                        fhout.write(" Event Throughput: {0} ev/s\n".format(1.5+itask))
+                    condor_jobs.append({"cluster_id": "{0}{1}{2}.0".format(itask,ijob,ilog), "logfile_out": prefix+".out", "logfile_err": prefix+".err"})
+                jobs[ijob+1] = {
+                        "output": ["output_{0}.root".format(ijob+1), 100],
+                        "output_exists": output_exists,
+                        "inputs": [["input_{0}.root".format(ijob+1), 100]],
+                        "condor_jobs": condor_jobs,
+                        "current_job": {},
+                        "is_on_condor": False,
+                        }
+            cls.summaries[dsname] = {
+                    "jobs": jobs,
+                    "queried_nevents": 200,
+                    "open_dataset": False,
+                    "output_dir": basedir,
+                    "tag": "vtest",
+                    "task_type": "CMSSWTask",
+                    }
+
+    def get_tasks(self, **kwargs):
+        sp = StatsParser(data=self.summaries, summary_fname="/tmp/{0}/metis/statsparser_test/summary.json".format(os.getenv("USER")))
+        return sp.do(no_write=True, show_progress_bar=False, **kwargs)["tasks"]
+
+    def test_serial(self):
+        tasks = self.get_tasks()
+        self.assertEqual(len(tasks), 4)
+        for task in tasks:
+            self.assertEqual(task["general"]["njobs_done"], 1)
+            self.assertEqual(task["general"]["nevents_done"], 100)
+            self.assertEqual(task["bad"]["jobs_not_done"][2]["retries"], 1)
+            self.assertEqual(task["bad"]["jobs_not_done"][2]["last_sites"], ["T2_US_Site0"])
+
+    def test_parallel_matches_serial(self):
+        serial = self.get_tasks()
+        parallel = self.get_tasks(nproc=3)
+        strip = lambda tasks: [(t["general"], t["bad"]) for t in tasks]
+        self.assertEqual(strip(serial), strip(parallel))
+
+    def test_parallel_custom_event_rate_parser(self):
+        # lambdas can't be pickled, but they still work in the pool
+        tasks = self.get_tasks(nproc=2, custom_event_rate_parser=lambda fname: 42.)
+        self.assertEqual([t["general"]["event_rate"] for t in tasks], [42.]*4)
+
+    def test_no_fork_with_threads(self):
+        serial = self.get_tasks()
+        stop = threading.Event()
+        thread = threading.Thread(target=stop.wait)
+        thread.start()
+        pool = StatsParser_module.multiprocessing.Pool
+        in_subprocesses = StatsParser_module.summarize_tasks_in_subprocesses
+        calls = []
+        def no_pool(*args, **kwargs):
+            raise Exception("Forked with another thread running")
+        def counting_subprocesses(*args, **kwargs):
+            calls.append(kwargs["nproc"])
+            return in_subprocesses(*args, **kwargs)
+        StatsParser_module.multiprocessing.Pool = no_pool
+        StatsParser_module.summarize_tasks_in_subprocesses = counting_subprocesses
+        try:
+            parallel = self.get_tasks(nproc=3)
+            # fresh processes can't run the custom parser, so that stays in this process
+            custom = self.get_tasks(nproc=3, custom_event_rate_parser=lambda fname: 42.)
+        finally:
+            StatsParser_module.multiprocessing.Pool = pool
+            StatsParser_module.summarize_tasks_in_subprocesses = in_subprocesses
+            stop.set()
+            thread.join()
+        strip = lambda tasks: [(t["general"], t["bad"]) for t in tasks]
+        self.assertEqual(strip(serial), strip(parallel))
+        self.assertEqual(calls, [3])
+        self.assertEqual([t["general"]["event_rate"] for t in custom], [42.]*4)
+
+    def test_timeline_sample(self):
+        # more done jobs than go into the timelines
+        njobs = StatsParser_module.MAX_TIMELINE_JOBS + 10
+        jobs = self.summaries["/Test0/Test/MINIAODSIM"]["jobs"]
+        summary = dict(self.summaries["/Test0/Test/MINIAODSIM"], jobs=dict((i, jobs[1]) for i in range(1, njobs+1)))
+        calls = []
+        get_job_timeline = StatsParser_module.Timeline.get_job_timeline
+        def counting_timeline(parsed):
+            calls.append(parsed)
+            return {"total": 60}
+        StatsParser_module.Timeline.get_job_timeline = counting_timeline
+        try:
+            task = StatsParser_module.summarize_task("/Test0/Test/MINIAODSIM", summary, 0)
+        finally:
+            StatsParser_module.Timeline.get_job_timeline = get_job_timeline
+        # every other done job makes a timeline, but all of them count for their site
+        self.assertEqual(len(calls), njobs//2)
+        self.assertEqual(task["timeline"]["sites"]["T2_US_Site0"]["total"]["n"], njobs//2)
+        self.assertEqual(task["completed_sites"], {"T2_US_Site0": njobs})
+        StatsParser_module.update_metrics([task])
+        self.assertEqual(StatsParser_module.Metrics.SITE_JOBS.get(site="T2_US_Site0", result="completed"), njobs)
+
+    def test_incremental_write(self):
+        basedir = "/tmp/{0}/metis/statsparser_test/store/".format(os.getenv("USER"))
+        Utils.do_cmd("rm -rf {0} ; mkdir -p {0}".format(basedir))
+        def run():
+            sp = StatsParser(data=self.summaries, summary_fname=basedir+"summary.json", webdir=basedir+"public_html/dump", write_web_summary=False)
+            sp.do(show_progress_bar=False)
+            return sp.store.read_index()
+        index = run()
+        self.assertEqual(len(index["tasks"]), 4)
+        self.assertEqual(index["version"], 1)
+
+        # dashboard data: an index plus (pre-gzipped) per-task shards
+        datadir = basedir+"public_html/dump/data/"
+        with open(datadir+"index.json") as fhin:
+            web_index = json.load(fhin)
+        with gzip.open(datadir+"index.json.gz") as fhin:
+            self.assertEqual(json.loads(fhin.read().decode("utf-8")), web_index)
+        self.assertEqual(len(web_index["tasks"]), 4)
+        for task in web_index["tasks"]:
+            self.assertIn("njobs_done", task["general"])
+            with open(datadir+"tasks/{0}.json".format(task["id"])) as fhin:
+                self.assertNotIn("history", json.load(fhin))
+            self.assertTrue(os.path.exists(datadir+"history/{0}.json.gz".format(task["id"])))
+        version_mtime = os.path.getmtime(datadir+"version.json")
+
+        # nothing changed, so nothing gets rewritten
+        index = run()
+        self.assertEqual(index["version"], 1)
+        self.assertEqual(os.path.getmtime(datadir+"version.json"), version_mtime)
+        # the raw summaries can be read back from the shards
+        sp = StatsParser(summary_fname=basedir+"summary.json")
+        self.assertEqual(sorted(sp.data.keys()), sorted(self.summaries.keys()))
+
+if __name__ == "__main__":
+    unittest.main()
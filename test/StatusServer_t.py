@@ -0,0 +1,114 @@
+import unittest
+import os
+import json
+import gzip
+import time
+import logging
+from io import BytesIO
+try:
+    from urllib2 import urlopen, Request, HTTPError
+    from httplib import HTTPConnection
+except ImportError:
+    from urllib.request import urlopen, Request
+    from urllib.error import HTTPError
+    from http.client import HTTPConnection
+
+import metis.Utils as Utils
+import metis.StatusServer as StatusServer
+import metis.Metrics as Metrics
+from metis.SummaryStore import SummaryStore, task_key
+
+class StatusServerTest(unittest.TestCase):
+
+    server = None
+
+    @classmethod
+    def setUpClass(cls):
+        super(StatusServerTest, cls).setUpClass()
+        logging.getLogger("logger_metis").disabled = True
+
+        basedir = "/tmp/{0}/metis/statusserver_test/".format(os.getenv("USER"))
+        Utils.do_cmd("rm -rf {0} ; mkdir -p {0}".format(basedir))
+        cls.store = SummaryStore(os.path.join(basedir, "summaries"))
+        cls.store.update(web=[{
+            "general": {"dataset": "/A/B/C", "tag": "v1", "njobs_done": 1, "njobs_total": 2},
+            "bad": {"jobs_not_done": {}},
+            "history": {"timestamps": [0, 300], "njobs_done": [0, 1]},
+            }])
+        dashboard_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dashboard")
+        cls.server = StatusServer.start_server(port=0, summary_dir=cls.store.basedir, dashboard_dir=dashboard_dir, keepalive=0.5)
+
+    @classmethod
+    def tearDownClass(cls):
+        StatusServer.stop_server()
+
+    def get(self, path, headers={}):
+        return urlopen(Request(self.server.url()+path.lstrip("/"), headers=headers), timeout=5)
+
+    def test_static(self):
+        self.assertIn(b"main.js", self.get("/").read())
+        with self.assertRaises(HTTPError) as ctx:
+            self.get("/../metis/Utils.py")
+        self.assertEqual(ctx.exception.code, 404)
+
+    def test_data(self):
+        index = json.loads(self.get("/data/index.json").read().decode("utf-8"))
+        key = task_key("/A/B/C", "v1")
+        self.assertEqual([t["id"] for t in index["tasks"]], [key])
+        gz = self.get("/data/index.json.gz").read()
+        self.assertEqual(json.loads(gzip.GzipFile(fileobj=BytesIO(gz)).read().decode("utf-8")), index)
+        details = json.loads(self.get("/data/tasks/{0}.json".format(key)).read().decode("utf-8"))
+        self.assertNotIn("history", details)
+        history = json.loads(self.get("/data/history/{0}.json".format(key)).read().decode("utf-8"))
+        self.assertEqual(history["njobs_done"], [0, 1])
+        with self.assertRaises(HTTPError):
+            self.get("/data/tasks/nonexistent.json")
+
+    def test_etag(self):
+        resp = self.get("/data/version.json")
+        etag = resp.info().get("ETag")
+        with self.assertRaises(HTTPError) as ctx:
+            self.get("/data/version.json", headers={"If-None-Match": etag})
+        self.assertEqual(ctx.exception.code, 304)
+
+    def test_chirp(self):
+        self.assertTrue("ChirpCMSSWEvents" in StatusServer.get_extra_columns())
+        StatusServer.publish_jobs("CMS4_A_B_C_v1", [
+            {"ClusterId": "1.0", "JobStatus": "R", "jobnum": "3", "ChirpCMSSWEvents": "50",
+                "ChirpMetisExpectedNevents": "100", "ChirpCMSSWEventRate": "10", "MATCH_EXP_JOB_Site": "T2_US_UCSD"},
+            {"ClusterId": "1.1", "JobStatus": "I", "jobnum": "4"},
+            ])
+        records = json.loads(self.get("/chirp").read().decode("utf-8"))
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["condorid"], "1.0")
+        self.assertEqual(records[0]["jobnum"], 3)
+        self.assertEqual(records[0]["ChirpCMSSWProgress"], 50.)
+        self.assertEqual(records[0]["site"], "T2_US_UCSD")
+        self.assertTrue(self.get("/chirpdata.js").read().startswith(b"var tableData = "))
+
+    def test_metrics(self):
+        Metrics.CONDOR_SUBMIT.inc(result="success")
+        resp = self.get("/metrics")
+        self.assertTrue(resp.info().get("Content-Type").startswith("text/plain"))
+        self.assertIn(b'metis_condor_submit_total{result="success"}', resp.read())
+
+    def test_events(self):
+        # urllib2 buffers streamed bodies, so read the stream line by line from the connection
+        conn = HTTPConnection(self.server.host, self.server.port, timeout=5)
+        conn.request("GET", "/events")
+        resp = conn.getresponse()
+        self.assertEqual(resp.getheader("Content-Type"), "text/event-stream")
+        self.assertEqual(resp.fp.readline().strip(), b"event: update")
+        state = json.loads(resp.fp.readline().decode("utf-8").split(":", 1)[1])
+        self.assertEqual(state["version"], self.store.read_index()["version"])
+        # a change in the store gets pushed
+        time.sleep(0.01)
+        self.store.update(web=[{"general": {"dataset": "/D/E/F", "tag": "v1"}, "history": {}}])
+        while True:
+            line = resp.fp.readline().strip()
+            if line.startswith(b"data:"): break
+        self.assertEqual(json.loads(line.decode("utf-8").split(":", 1)[1])["version"], state["version"]+1)
+        conn.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+import os
+import logging
+
+import metis.Utils as Utils
+from scratch import ScratchDir
+from metis.Sample import DirectorySample
+from metis.CondorTask import CondorTask
+from metis.SubmissionBroker import SubmissionBroker
+
+class SubmissionBrokerTest(unittest.TestCase):
+
+    nfiles = 3
+
+    def setUp(self):
+        logging.getLogger("logger_metis").disabled = True
+        self.scratch = ScratchDir()
+        self.addCleanup(self.scratch.leave)
+        self.basedir = self.scratch.path + "/"
+        for i in range(1,self.nfiles+1):
+            Utils.do_cmd("touch {0}/input_{1}.root".format(self.basedir, i))
+        Utils.do_cmd("echo hello > {0}/executable.sh".format(self.basedir))
+
+    def make_task(self, tag):
+        return CondorTask(
+                sample = DirectorySample(
+                    location = self.basedir,
+                    globber = "*.root",
+                    dataset = "/testbroker/testbroker/TEST",
+                    ),
+                files_per_output = 1,
+                cmssw_version = "CMSSW_8_0_21",
+                tag = tag,
+                no_load_from_backup = True,
+                executable = "{0}/executable.sh".format(self.basedir),
+                )
+
+    def test_coalescing(self):
+        tasks = [self.make_task("vbroker1"), self.make_task("vbroker2")]
+        broker = SubmissionBroker()
+        for task in tasks:
+            task.process(fake=True, broker=broker)
+            # nothing submitted yet
+            self.assertEqual(task.job_submission_history, {})
+        self.assertEqual(len(broker), 2*self.nfiles)
+
+        # same executable (content), so one cluster with per-job input files and logs
+        clusters = broker.get_clusters(broker.batches)
+        self.assertEqual(len(clusters), 1)
+        kwargs = broker.get_merged_kwargs(clusters[0])
+        self.assertEqual(len(kwargs["arguments"]), 2*self.nfiles)
+        self.assertEqual(len(kwargs["job_lines"]), 2*self.nfiles)
+        self.assertTrue(tasks[1].get_taskdir() in kwargs["job_lines"][-1])
+
+        self.assertEqual(broker.flush(), 2*self.nfiles)
+        self.assertEqual(len(broker), 0)
+        # proc ids continue from one task to the next
+        self.assertEqual(sorted(sum(tasks[0].job_submission_history.values(), [])), ["-1.0", "-1.1", "-1.2"])
+        self.assertEqual(sorted(sum(tasks[1].job_submission_history.values(), [])), ["-1.3", "-1.4", "-1.5"])
+
+    def test_split_clusters(self):
+        tasks = [self.make_task("vbroker3"), self.make_task("vbroker4")]
+        broker = SubmissionBroker(max_jobs_per_cluster=self.nfiles)
+        for task in tasks:
+            task.process(fake=True, broker=broker)
+        self.assertEqual(len(broker.get_clusters(broker.batches)), 2)
+        broker.flush()
+        self.assertEqual(sorted(sum(tasks[1].job_submission_history.values(), [])), ["-1.0", "-1.1", "-1.2"])
+
+if __name__ == "__main__":
+    unittest.main()
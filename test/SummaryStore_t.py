@@ -0,0 +1,105 @@
+import unittest
+import os
+import json
+
+import metis.Utils as Utils
+from metis.SummaryStore import SummaryStore, task_key, get_digest, atomic_dump, find_path, find_store
+
+class SummaryStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = "/tmp/{0}/metis/summarystore_test/".format(os.getenv("USER"))
+        Utils.do_cmd("rm -rf {0} ; mkdir -p {0}".format(self.basedir))
+        self.store = SummaryStore(os.path.join(self.basedir, "summaries"))
+
+    def make_task(self, dsname, ndone, tag="v1"):
+        return {
+                "general": {"dataset": dsname, "tag": tag, "njobs_done": ndone, "njobs_total": 10},
+                "bad": {"jobs_not_done": {}},
+                "history": {"timestamps": [ndone], "njobs_done": [ndone]},
+                }
+
+    def test_find_store(self):
+        old_base, old_cwd = os.environ.get("METIS_BASE"), os.getcwd()
+        def restore():
+            os.chdir(old_cwd)
+            if old_base is None: os.environ.pop("METIS_BASE", None)
+            else: os.environ["METIS_BASE"] = old_base
+        self.addCleanup(restore)
+        os.environ.pop("METIS_BASE", None)
+        os.chdir(self.basedir)
+        self.assertEqual(find_store(), None)
+        self.assertEqual(find_path("summaries"), None)
+        self.store.update(web=[self.make_task("/A/B/C", 1)])
+        # from the current directory without METIS_BASE, else from METIS_BASE
+        self.assertEqual(find_store().basedir, "summaries")
+        self.assertEqual(find_path("summaries"), "summaries")
+        os.chdir("/")
+        self.assertEqual(find_store(), None)
+        os.environ["METIS_BASE"] = self.basedir
+        self.assertEqual(os.path.realpath(find_store().basedir), os.path.realpath(self.store.basedir))
+
+    def test_task_key(self):
+        key = task_key("/Test/Run2017-v1/MINIAOD", "v1")
+        self.assertTrue(key.startswith("Test_Run2017-v1_MINIAOD_v1_"))
+        self.assertNotEqual(key, task_key("/Test/Run2017-v1/MINIAOD", "v2"))
+        self.assertNotIn("/", task_key("/a b/c*d/e", "v1"))
+
+    def test_digest_ignores_history(self):
+        t1 = self.make_task("/A/B/C", 1)
+        t2 = self.make_task("/A/B/C", 1)
+        t2["history"]["timestamps"].append(5)
+        self.assertEqual(get_digest(t1, ignore_keys=["history"]), get_digest(t2, ignore_keys=["history"]))
+        self.assertNotEqual(get_digest(t1), get_digest(t2))
+
+    def test_atomic_dump(self):
+        fname = os.path.join(self.basedir, "test.json")
+        atomic_dump({"a": 1}, fname)
+        atomic_dump({"a": 2}, fname)
+        with open(fname) as fhin:
+            self.assertEqual(json.load(fhin), {"a": 2})
+        self.assertEqual([f for f in os.listdir(self.basedir) if f.startswith(".tmp")], [])
+
+    def test_update_and_load(self):
+        self.assertFalse(self.store.exists())
+        task = self.make_task("/A/B/C", 1)
+        index = self.store.update(raw={"/A/B/C": {"tag": "v1", "jobs": {}}}, web=[task])
+        self.assertTrue(self.store.exists())
+        self.assertEqual(index["version"], 1)
+        key = task_key("/A/B/C", "v1")
+        entry = index["tasks"][key]
+        self.assertEqual(entry["dataset"], "/A/B/C")
+        self.assertEqual(entry["general"]["njobs_done"], 1)
+        self.assertEqual(self.store.load("web", key), task)
+        self.assertEqual(self.store.load("raw", key), {"tag": "v1", "jobs": {}})
+        self.assertEqual(self.store.load("web", "nonexistent"), {})
+
+        # a second writer only touches its own task
+        other = SummaryStore(self.store.basedir)
+        other.update(web=[self.make_task("/D/E/F", 3)])
+        index = self.store.read_index()
+        self.assertEqual(index["version"], 2)
+        self.assertEqual(len(index["tasks"]), 2)
+        self.assertEqual(len(self.store.load_all("web")), 2)
+
+    def test_is_stale(self):
+        task = self.make_task("/A/B/C", 1)
+        key = task_key("/A/B/C", "v1")
+        digest = get_digest(task, ignore_keys=["history"])
+        self.assertTrue(self.store.is_stale(self.store.read_index(), "web", key, digest))
+        index = self.store.update(web=[task])
+        self.assertFalse(self.store.is_stale(index, "web", key, digest))
+        self.assertTrue(self.store.is_stale(index, "web", key, get_digest(self.make_task("/A/B/C", 2), ignore_keys=["history"])))
+        self.store.refresh_every = -1
+        self.assertTrue(self.store.is_stale(index, "web", key, digest))
+
+    def test_remove(self):
+        self.store.update(raw={"/A/B/C": {"tag": "v1"}}, web=[self.make_task("/A/B/C", 1), self.make_task("/D/E/F", 1)])
+        key = task_key("/A/B/C", "v1")
+        index = self.store.remove([key])
+        self.assertEqual(list(index["tasks"].keys()), [task_key("/D/E/F", "v1")])
+        self.assertFalse(os.path.exists(self.store.shard_path("web", key)))
+        self.assertFalse(os.path.exists(self.store.shard_path("raw", key)))
+
+if __name__ == "__main__":
+    unittest.main()
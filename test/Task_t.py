@@ -4,9 +4,14 @@ import os
 from metis.File import File
 from metis.Task import Task
 from metis.Constants import Constants
+from scratch import ScratchDir
 
 class TaskTest(unittest.TestCase):
 
+    def setUp(self):
+        self.scratch = ScratchDir()
+        self.addCleanup(self.scratch.leave)
+
     def test_task_initialized(self):
         t1 = Task()
 
@@ -0,0 +1,62 @@
+import unittest
+
+import metis.Timeline as Timeline
+
+class TimelineTest(unittest.TestCase):
+
+    def test_job_timeline_from_report(self):
+        parsed = {
+                "args": {"QDate": "900", "JobStartDate": "1000", "time": "1000"},
+                "timestamps": {
+                    "start": 1000, "setup_end": 1060,
+                    "cmsrun_start": 1070, "cmsrun_end": 4670,
+                    "validation_end": 4700,
+                    "stageout_start": 4700, "stageout_end": 4760,
+                    "end": 4765,
+                    },
+                }
+        tl = Timeline.get_job_timeline(parsed)
+        self.assertEqual(tl, {
+            "queue": 100, "setup": 60, "cmsrun": 3600,
+            "validation": 30, "stageout": 60, "total": 3765,
+            })
+
+    def test_job_timeline_from_text(self):
+        # old logs only have the header time, time before copy, and time at end
+        parsed = {
+                "args": {"time": "1000"},
+                "timestamps": {"stageout_start": 4000, "end": 4100},
+                }
+        tl = Timeline.get_job_timeline(parsed)
+        self.assertEqual(tl, {"stageout": 100, "total": 3100})
+
+    def test_job_timeline_missing(self):
+        self.assertEqual(Timeline.get_job_timeline({}), {})
+        parsed = {"args": {"time": "1000"}, "timestamps": {"end": -1, "cmsrun_start": 2000, "cmsrun_end": 1500}}
+        self.assertEqual(Timeline.get_job_timeline(parsed), {})
+
+    def test_estimate_chunks_per_job(self):
+        # 10% setup overhead at most
+        self.assertEqual(Timeline.estimate_chunks_per_job(60, 60), 9)
+        self.assertEqual(Timeline.estimate_chunks_per_job(60, 3600), 1)
+        self.assertEqual(Timeline.estimate_chunks_per_job(-1, 60), 1)
+        self.assertEqual(Timeline.estimate_chunks_per_job(600, 10), 20)
+        # but not beyond the job length
+        self.assertEqual(Timeline.estimate_chunks_per_job(600, 600, max_job_seconds=3600), 5)
+
+    def test_summarize(self):
+        timelines = [{"cmsrun": v, "total": v+10} for v in range(1,101)]
+        sites = ["T2_US_UCSD"]*50 + ["T2_US_MIT"]*49 + [""]
+        summary = Timeline.summarize_timelines(timelines, sites)
+        d_cmsrun = summary["phases"]["cmsrun"]
+        self.assertEqual(d_cmsrun["n"], 100)
+        self.assertEqual(d_cmsrun["max"], 100)
+        self.assertEqual(d_cmsrun["p10"], 11)
+        self.assertEqual(d_cmsrun["p90"], 90)
+        self.assertEqual(d_cmsrun["mean"], 50.5)
+        self.assertEqual(sorted(summary["sites"].keys()), ["T2_US_MIT", "T2_US_UCSD", "unknown"])
+        self.assertEqual(summary["sites"]["T2_US_UCSD"]["cmsrun"]["n"], 50)
+        self.assertNotIn("queue", summary["phases"])
+
+if __name__ == "__main__":
+    unittest.main()
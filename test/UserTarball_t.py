@@ -1,5 +1,6 @@
 import unittest
 import os
+from distutils.spawn import find_executable
 
 import metis.UserTarball as UserTarball
 import metis.Utils as Utils
@@ -19,5 +20,58 @@ class UserTarballTest(unittest.TestCase):
 
         self.assertEqual(Utils.do_cmd("tar xzOf {0}".format(tarname)).strip(), "check")
 
+    def make_compressed_tar(self, **kwargs):
+        basedir = "/tmp/{0}/metis/tar_test/".format(os.getenv("USER"))
+        tarname = "{0}/test.tar.xz".format(basedir)
+        textname = "{0}/test_big.txt".format(basedir)
+
+        Utils.do_cmd("mkdir -p {0} ; rm -f {1}".format(basedir, tarname))
+        with open(textname, "w") as fhout:
+            for i in range(20000):
+                fhout.write("line {0}\n".format(i))
+
+        # blocks of ~50kB, so that the ~200kB tar is compressed as several streams
+        ut = UserTarball.UserTarball(name=tarname, block_MB=0.05, nthreads=3, **kwargs)
+        ut.tarfile.add(textname, "test_big.txt")
+        ut.close()
+        self.assertEqual(os.path.exists(ut.tarname), False)
+        self.assertGreater(ut.timings["uncompressed_MB"], 0.15)
+        return tarname
+
+    def test_make_tar_xz(self):
+        tarname = self.make_compressed_tar(use_xz=True)
+        # several xz streams, one after another
+        with open(tarname, "rb") as fhin:
+            self.assertGreater(fhin.read().count(b"\xfd7zXZ\x00"), 1)
+        out = Utils.do_cmd("tar xOf {0} test_big.txt".format(tarname)).splitlines()
+        self.assertEqual(out[0], "line 0")
+        self.assertEqual(len(out), 20000)
+
+    @unittest.skipIf(not find_executable("zstd"), "zstd is not available")
+    def test_make_tar_zstd(self):
+        tarname = self.make_compressed_tar(use_zstd=True)
+        self.assertEqual(len(Utils.do_cmd("zstd -dcq {0} | tar xOf - test_big.txt".format(tarname)).splitlines()), 20000)
+
+    def test_failed_compression(self):
+        basedir = "/tmp/{0}/metis/tar_test_failed/".format(os.getenv("USER"))
+        Utils.do_cmd("rm -rf {0} ; mkdir -p {0}".format(basedir))
+        with open(basedir + "test.tar", "w") as fhout:
+            fhout.write("x"*1000)
+        self.assertRaises(Exception, UserTarball.compress_parallel,
+                basedir + "test.tar", basedir + "test.tar.xz", ["false"], nthreads=2, block_MB=0.0001)
+        self.assertEqual(sorted(os.listdir(basedir)), ["test.tar"])
+
+    def test_failed_add_files(self):
+        basedir = "/tmp/{0}/metis/tar_test_failed/".format(os.getenv("USER"))
+        Utils.do_cmd("rm -rf {0} ; mkdir -p {0}".format(basedir))
+        # no CMSSW area to take the files from
+        self.assertRaises(Exception, Utils.make_tarball, basedir + "test.tar.xz", use_xz=True, override_cmssw_base="/nonexistent")
+        self.assertEqual(os.listdir(basedir), [])
+
+    def test_compress_command(self):
+        self.assertEqual(UserTarball.get_compress_command("xz", 9), ["xz", "-c", "-9"])
+        self.assertEqual(UserTarball.get_compress_command("xz", -1), ["xz", "-c"])
+        self.assertEqual(UserTarball.get_compress_command("zstd"), ["zstd", "-c", "-q"])
+
 if __name__ == "__main__":
     unittest.main()
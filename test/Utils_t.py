@@ -36,6 +36,22 @@ class UtilsTest(unittest.TestCase):
         chunks, leftoverchunk = Utils.file_chunker(files, files_per_output=4, flush=False)
         self.assertEqual((len(chunks),len(leftoverchunk)) , (1,2))
 
+    def test_file_packer(self):
+        files = []
+        for i,size in enumerate([600,500,400,300,200,100,2500],1):
+            f = EventsFile("blah{0}.root".format(i))
+            f.get_filesizeMB = (lambda size: lambda: size)(size)
+            files.append(f)
+
+        chunks, leftoverchunk = Utils.file_packer(files, MB_per_output=1000, flush=True)
+        names = [[f.get_name() for f in chunk] for chunk in chunks]
+        self.assertEqual(names, [["blah1.root","blah3.root"], ["blah2.root","blah4.root","blah5.root"], ["blah6.root"], ["blah7.root"]])
+        self.assertEqual(leftoverchunk, [])
+
+        # the underfilled chunk waits for more files
+        chunks, leftoverchunk = Utils.file_packer(files, MB_per_output=1000, flush=False)
+        self.assertEqual((len(chunks),len(leftoverchunk)) , (3,1))
+
 
     def test_condor_submit_fake(self):
         self.assertEqual
@@ -104,6 +120,18 @@ class UtilsTest(unittest.TestCase):
         self.assertEqual(template.count("arguments"),3)
         self.assertEqual(template.count("queue"),3)
 
+    def test_condor_submit_template_job_lines(self):
+        template = Utils.condor_submit(
+                executable="blah.sh",inputfiles=["common.tar.gz"],
+                arguments=[[1,2],[3,4]],
+                job_lines=["transfer_input_files=a.tar.gz", "transfer_input_files=b.tar.gz"],
+                logdir="./",
+                return_template=True,
+                multiple=True,
+            )
+        self.assertEqual(template.count("transfer_input_files"),3)
+        self.assertTrue(template.index("b.tar.gz") < template.rindex("queue"))
+
     @unittest.skipIf(os.getenv("FAST"), "Skipped due to impatience")
     @unittest.skipIf("uaf-" not in os.uname()[1], "Condor only testable on UAF")
     def test_condor_submission_output_local(self):
@@ -257,6 +285,25 @@ ls -l
         self.assertEqual(abs(Utils.get_timestamp() - timestamp) < 2, True)
         self.assertEqual(int(Utils.from_timestamp(now.strftime("%s")).strftime("%s")), timestamp)
 
+    def test_install_dashboard(self):
+        basedir = "/tmp/{0}/metis/dashboard_test/".format(os.getenv("USER"))
+        srcdir, webdir = basedir + "src", basedir + "web"
+        Utils.do_cmd("rm -rf {0} ; mkdir -p {1}/images {2}".format(basedir, srcdir, webdir))
+        for fname in ["index.html", "images/logo.png"]:
+            with open(os.path.join(srcdir, fname), "w") as fhout:
+                fhout.write("v1")
+        self.assertEqual(Utils.install_dashboard(srcdir, webdir), True)
+        with open(webdir + "/images/logo.png") as fhin:
+            self.assertEqual(fhin.read(), "v1")
+        # nothing changed, so nothing to do
+        self.assertEqual(Utils.install_dashboard(srcdir, webdir), False)
+        with open(srcdir + "/index.html", "w") as fhout:
+            fhout.write("v2")
+        os.utime(srcdir + "/index.html", (time.time()+10, time.time()+10))
+        self.assertEqual(Utils.install_dashboard(srcdir, webdir), True)
+        with open(webdir + "/index.html") as fhin:
+            self.assertEqual(fhin.read(), "v2")
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -0,0 +1,160 @@
+import unittest
+import os
+import json
+import time
+import logging
+
+import metis.Utils as Utils
+from scratch import ScratchDir
+import metis.WorkQueue as WorkQueue
+from metis.Sample import DirectorySample
+from metis.CondorTask import CondorTask
+
+try:
+    from urllib2 import urlopen, Request, HTTPError
+except ImportError:
+    from urllib.request import urlopen, Request
+    from urllib.error import HTTPError
+
+def post(url, path, payload, token=None):
+    headers = {"Content-Type": "application/json"}
+    if token is not None:
+        headers[WorkQueue.TOKEN_HEADER] = token
+    req = Request(url.rstrip("/") + path, json.dumps(payload).encode("utf-8"), headers)
+    return json.loads(urlopen(req, timeout=10).read().decode("utf-8"))
+
+class WorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger("logger_metis").disabled = True
+        self.scratch = ScratchDir()
+        self.addCleanup(self.scratch.leave)
+        self.basedir = self.scratch.path + "/"
+        Utils.do_cmd("mkdir -p {0}/logs/ {0}/outputs/".format(self.basedir))
+        # writes the output like the real executables would stage it out
+        with open(self.basedir + "/executable.sh", "w") as fhout:
+            fhout.write("#!/bin/bash\necho tag=$(grep -i '^tag' $_CONDOR_JOB_AD | cut -d= -f2- | xargs echo)\ntouch ${1}/${2}_${4}.root\n")
+        self.queue = WorkQueue.WorkQueueServer(lease_seconds=10.)
+        self.queue.start()
+
+    def tearDown(self):
+        self.queue.stop()
+
+    def submit(self, njobs):
+        return self.queue.submit(
+                executable=self.basedir + "/executable.sh",
+                arguments=[[self.basedir, "output", "in", i] for i in range(njobs)],
+                inputfiles=[], logdir=self.basedir + "/logs/", multiple=True,
+                selection_pairs=[[["taskname", "test"], ["jobnum", i]] for i in range(njobs)],
+                )
+
+    def test_lease_and_done(self):
+        _, cluster_id = self.submit(2)
+        jobs = self.queue.query(selection_pairs=[["taskname", "test"]], extra_columns=["jobnum"])
+        self.assertEqual(sorted(job["jobnum"] for job in jobs), ["0", "1"])
+        self.assertEqual(set(job["JobStatus"] for job in jobs), set(["I"]))
+        self.assertEqual(self.queue.query(selection_pairs=[["taskname", "other"]]), [])
+
+        url = self.queue.url()
+        lease = post(url, "/lease", {"pilot": "test"}, self.queue.token)
+        self.assertEqual(lease["unit"]["id"], "{0}.0".format(cluster_id))
+        self.assertEqual(lease["unit"]["classads"]["jobnum"], "0")
+        self.assertEqual(post(url, "/heartbeat", {"lease": lease["lease"]}, self.queue.token)["ok"], True)
+        self.assertEqual(self.queue.get_counts()["running"], 1)
+
+        self.assertEqual(post(url, "/done", {"lease": lease["lease"], "status": 0, "stdout": "hello\n", "stderr": ""}, self.queue.token)["ok"], True)
+        with open("{0}/logs/std_logs/1e.{1}.0.out".format(self.basedir, cluster_id)) as fhin:
+            self.assertEqual(fhin.read(), "hello\n")
+        # done units leave the queue, and their leases are over
+        self.assertEqual(len(self.queue.query()), 1)
+        self.assertEqual(post(url, "/heartbeat", {"lease": lease["lease"]}, self.queue.token)["ok"], False)
+
+        self.queue.remove([cluster_id])
+        self.assertEqual(self.queue.query(), [])
+        self.assertEqual(post(url, "/lease", {"pilot": "test"}, self.queue.token), {})
+
+    def test_token(self):
+        self.submit(1)
+        url = self.queue.url()
+        for token in [None, "wrong"]:
+            with self.assertRaises(HTTPError) as context:
+                post(url, "/lease", {"pilot": "intruder"}, token)
+            self.assertEqual(context.exception.code, 403)
+        with self.assertRaises(HTTPError) as context:
+            urlopen(url.rstrip("/") + "/status", timeout=10)
+        self.assertEqual(context.exception.code, 403)
+        # nothing was handed out
+        self.assertEqual(self.queue.get_counts()["idle"], 1)
+        req = Request(url.rstrip("/") + "/status", headers={WorkQueue.TOKEN_HEADER: self.queue.token})
+        self.assertEqual(json.loads(urlopen(req, timeout=10).read().decode("utf-8"))["idle"], 1)
+
+    def test_log_truncation(self):
+        _, cluster_id = self.submit(1)
+        lease = self.queue.lease("test")
+        stdout = "h"*WorkQueue.MAX_LOG_HEAD + "x"*WorkQueue.MAX_LOG_TAIL + "t"*WorkQueue.MAX_LOG_TAIL
+        self.assertEqual(self.queue.done(lease["lease"], 0, stdout, ""), True)
+        with open("{0}/logs/std_logs/1e.{1}.0.out".format(self.basedir, cluster_id)) as fhin:
+            written = fhin.read()
+        self.assertTrue(len(written) < WorkQueue.MAX_LOG_HEAD + WorkQueue.MAX_LOG_TAIL + 100)
+        self.assertTrue(written.startswith("h"*WorkQueue.MAX_LOG_HEAD + "\n"))
+        self.assertTrue(written.endswith("t"*WorkQueue.MAX_LOG_TAIL))
+
+    def test_lease_expiry(self):
+        self.queue.lease_seconds = 0.1
+        self.queue.max_attempts = 2
+        _, cluster_id = self.submit(1)
+        for attempt in range(2):
+            self.assertTrue(self.queue.lease("lost pilot")["unit"])
+            self.assertEqual(self.queue.query()[0]["JobStatus"], "R")
+            time.sleep(0.2)
+        # back in the queue after the first expiry, and given up on after the second
+        self.assertEqual(self.queue.query(), [])
+        with open("{0}/logs/std_logs/1e.{1}.0.err".format(self.basedir, cluster_id)) as fhin:
+            self.assertTrue("expired 2 times" in fhin.read())
+
+    def test_pilot_survives_failed_unit(self):
+        # the executable of the first unit can't be fetched
+        self.queue.submit(executable=self.basedir + "/missing.sh", arguments=[[]],
+                inputfiles=[], logdir=self.basedir + "/logs/", multiple=True)
+        self.submit(1)
+        pilot, = self.queue.start_local_pilots(1, workdir=self.basedir + "/pilots/", idle_timeout=30)
+        t0 = time.time()
+        while not os.path.exists(self.basedir + "/output_0.root") and time.time() - t0 < 30:
+            time.sleep(0.2)
+        self.assertTrue(os.path.exists(self.basedir + "/output_0.root"))
+        self.assertEqual(pilot.poll(), None)
+
+    def test_submit_pilots_token(self):
+        template = self.queue.submit_pilots(2, return_template=True)
+        self.assertEqual(template.count('environment = "METIS_WQ_TOKEN={0}"'.format(self.queue.token)), 2)
+        self.assertFalse(any(self.queue.token in line for line in template.splitlines() if line.startswith("arguments")))
+
+    def test_task_with_local_pilots(self):
+        for i in range(1,5):
+            Utils.do_cmd("touch {0}/input_{1}.root".format(self.basedir, i))
+        task = CondorTask(
+                sample = DirectorySample(location=self.basedir, globber="input_*.root", dataset="/testwq/testwq/TEST"),
+                files_per_output = 1,
+                cmssw_version = "CMSSW_8_0_21",
+                tag = "vwq",
+                output_dir = self.basedir + "/outputs/",
+                executable = self.basedir + "/executable.sh",
+                no_load_from_backup = True,
+                executor = self.queue,
+                )
+        self.queue.start_local_pilots(2, workdir=self.basedir + "/pilots/", idle_timeout=30)
+        t0 = time.time()
+        while not task.complete() and time.time() - t0 < 60:
+            task.process()
+            time.sleep(0.5)
+        self.assertEqual(task.complete(), True)
+
+        history = task.get_job_submission_history()
+        self.assertEqual(len(history), 4)
+        cid = history[1][-1]
+        self.assertTrue(cid.startswith("wq"))
+        with open("{0}/logs/std_logs/1e.{1}.out".format(task.get_taskdir(), cid)) as fhin:
+            self.assertEqual(fhin.read().strip(), "tag=vwq")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+import os
+import shutil
+import tempfile
+
+import metis.Utils as Utils
+
+class ScratchDir(object):
+    """
+    Tasks keep their state under ./tasks/, so tests that make tasks run from a fresh
+    temporary directory (`path`) instead of the checkout. METIS_BASE keeps pointing at
+    the checkout, for the executables. `leave()` goes back and deletes the directory.
+    """
+
+    def __init__(self, prefix="metis_test_"):
+        self.cwd = os.getcwd()
+        self.metis_base = os.environ.get("METIS_BASE")
+        os.environ["METIS_BASE"] = os.path.abspath(Utils.metis_base())
+        self.path = tempfile.mkdtemp(prefix=prefix)
+        os.chdir(self.path)
+
+    def leave(self):
+        os.chdir(self.cwd)
+        if self.metis_base is None:
+            os.environ.pop("METIS_BASE", None)
+        else:
+            os.environ["METIS_BASE"] = self.metis_base
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -6,12 +6,17 @@ from metis.CombinerTask import CombinerTask
 from metis.Utils import do_cmd
 from metis.Path import Path
 from metis.File import File
+from scratch import ScratchDir
 
 from pprint import pprint
 
 
 class CombinerWorkflowTest(unittest.TestCase):
 
+    def setUp(self):
+        self.scratch = ScratchDir()
+        self.addCleanup(self.scratch.leave)
+
     def test_workflow(self):
 
         step0 = []
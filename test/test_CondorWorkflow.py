@@ -5,8 +5,10 @@ import logging
 import glob
 
 import metis.Utils as Utils
+from scratch import ScratchDir
 from metis.Sample import DirectorySample
 from metis.CondorTask import CondorTask
+from metis.Executor import LocalExecutor
 from metis.File import File
 
 
@@ -61,6 +63,50 @@ class CondorWorkflowTest(unittest.TestCase):
         self.assertEquals(is_complete, True)
         self.assertEqual(njobs, len(glob.glob(dummy.get_outputdir()+"/*")))
 
+    @unittest.skipIf(Utils.do_cmd("command -v gfal-copy"), "Only testable without gfal-copy")
+    def test_local(self):
+        """
+        Same as above, with the jobs running as local processes
+        (and copying the outputs with cp instead of gfal-copy)
+        """
+
+        njobs = 3
+        scratch = ScratchDir()
+        self.addCleanup(scratch.leave)
+        basedir = scratch.path + "/"
+        for i in range(1,njobs+1):
+            Utils.do_cmd("touch {0}/input_{1}.root".format(basedir, i))
+
+        logging.getLogger("logger_metis").disabled = True
+        executor = LocalExecutor(nproc=2, workdir=basedir+"/scratch/")
+        dummy = CondorTask(
+                sample = DirectorySample(
+                    location = basedir,
+                    globber = "*.root",
+                    dataset = "/test/test/TEST",
+                    ),
+                open_dataset = False,
+                files_per_output = 1,
+                cmssw_version = "CMSSW_8_0_21",
+                executable = Utils.metis_base()+"metis/executables/condor_test_exe.sh",
+                tag = "vlocal",
+                output_dir = basedir + "/outputs/",
+                condor_submit_params = {"classads": [["metis_STAGEOUT_ENDPOINTS", "file://"], ["metis_STAGEOUT_BACKOFF", 0]]},
+                no_load_from_backup = True,
+                executor = executor,
+                )
+
+        dummy.process()
+        self.assertEqual(len(dummy.get_running_condor_jobs()), njobs)
+        self.assertEqual(executor.wait(timeout=60), True)
+        dummy.process()
+
+        self.assertEqual(dummy.complete(), True)
+        self.assertEqual(njobs, len(glob.glob(dummy.get_outputdir()+"/*")))
+        cluster_id = dummy.get_job_submission_history()[1][-1]
+        with open("{0}/logs/std_logs/1e.{1}.out".format(dummy.get_taskdir(), cluster_id)) as fhin:
+            self.assertTrue("IFILE: 1" in fhin.read())
+
 if __name__ == "__main__":
     unittest.main()
 
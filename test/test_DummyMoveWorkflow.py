@@ -6,10 +6,15 @@ from metis.DummyTask import DummyMoveTask
 from metis.Path import Path
 from metis.File import File, MutableFile
 from metis.Utils import do_cmd
+from scratch import ScratchDir
 
 
 class DummyMoveWorkflowTest(unittest.TestCase):
 
+    def setUp(self):
+        self.scratch = ScratchDir()
+        self.addCleanup(self.scratch.leave)
+
     def test_workflow(self):
 
         basepath = "/tmp/{}/metis/".format(os.getenv("USER"))
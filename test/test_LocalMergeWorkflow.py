@@ -44,5 +44,36 @@ class LocalMergeWorkflowTest(unittest.TestCase):
 
         self.assertEqual( task.get_outputs()[0].exists(), True )
 
+    @unittest.skipIf(os.getenv("FAST"), "Skipped due to impatience")
+    @unittest.skipIf("uaf-" not in os.uname()[1], "ROOT only on UAF")
+    def test_parallel_merge(self):
+
+        import ROOT as r
+
+        basepath = "/tmp/{}/metis/localmerge_parallel/".format(os.getenv("USER"))
+        MutableFile(basepath).touch()
+        do_cmd("rm -rf {}/*.root {}/.merge_*".format(basepath,basepath))
+
+        for i in range(0,10):
+            f = r.TFile("{}/in_{}.root".format(basepath,i),"RECREATE")
+            h = r.TH1F("h","h",1,0,1)
+            h.Fill(0.5)
+            h.Write()
+            f.Close()
+
+        task = LocalMergeTask(
+                input_filenames=glob.glob(basepath+"/in_*.root"),
+                output_filename=basepath+"/out.root",
+                nproc=2,
+                fan_in=3,
+                )
+
+        task.process()
+
+        self.assertEqual( task.get_outputs()[0].exists(), True )
+        self.assertEqual( glob.glob(basepath+"/.merge_*"), [] )
+        f = r.TFile(basepath+"/out.root")
+        self.assertEqual( f.Get("h").GetEntries(), 10 )
+
 if __name__ == "__main__":
     unittest.main()